@@ -7,6 +7,7 @@ import pandas as pd
 import time as _t
 import datetime as _dt
 from modules.auth import safe_email_to_schoolid
+from modules import storage
 
 ROOT = Path(__file__).parent / 'saved_exams_storage'
 ROOT.mkdir(parents=True, exist_ok=True)
@@ -45,15 +46,12 @@ def render_accounts_summary_sheet():
                 if not exam_dir.exists():
                     # some metadata entries may be stored at root; try nested keys
                     continue
-                # prefer raw_data.pkl then data.pkl
+                # prefer raw_data then data (columnar or legacy .pkl)
                 df = None
                 for fname in ('raw_data.pkl', 'data.pkl'):
-                    p = exam_dir / fname
-                    if p.exists():
-                        try:
-                            df = pd.read_pickle(str(p))
-                        except Exception:
-                            df = None
+                    p = storage.local_frame_path(exam_dir / fname)
+                    if p:
+                        df = storage.read_frame_file(p)
                         break
                 if df is None:
                     continue
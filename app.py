@@ -116,6 +116,7 @@ except Exception:
     # give a clearer error message at runtime
     raise ImportError("Streamlit is required to run this application. Install it with: pip install streamlit")
 import pandas as pd
+import numpy as np
 import json, os, time, re, unicodedata
 from io import StringIO, BytesIO
 from reportlab.lib import colors
@@ -130,6 +131,11 @@ try:
     from modules import storage
 except Exception:
     storage = None
+# Process-wide cache of saved exam payloads shared by all sessions
+from modules import exam_store
+# Vectorized grade/points/totals/ranks for marksheet generation
+from utils import marksheet as marksheet_engine
+from utils.grading import GradingScheme
 
 # Import persistence functions from saved_exams page
 # Use central storage adapter to determine storage dir and operations.
@@ -203,9 +209,9 @@ def save_exam_to_disk(exam_id, exam_metadata, exam_data, exam_raw_data, exam_con
                 if storage is not None:
                     try:
                         if isinstance(exam_data, pd.DataFrame):
-                            storage.write_pickle(f"{exam_id}/data.pkl", exam_data)
+                            storage.write_frame(f"{exam_id}/data.pkl", exam_data)
                         if isinstance(exam_raw_data, pd.DataFrame):
-                            storage.write_pickle(f"{exam_id}/raw_data.pkl", exam_raw_data)
+                            storage.write_frame(f"{exam_id}/raw_data.pkl", exam_raw_data)
                         try:
                             storage.write_json(f"{exam_id}/config.json", exam_config)
                         except Exception:
@@ -233,29 +239,32 @@ def save_exam_to_disk(exam_id, exam_metadata, exam_data, exam_raw_data, exam_con
 
         if db_ok:
             try:
-                # metadata
-                try:
-                    _db.save_exam_metadata(sid, exam_id, exam_metadata)
-                except Exception:
-                    pass
-                # pickles and config
+                # serialize first so the transaction only holds the connection for the writes:
+                # frames (columnar when pyarrow is available) and config
+                files = []
+                exts = storage.FRAME_EXTS.values() if storage is not None else ('.feather', '.parquet', '.pkl')
+                for stem, frame in (('data', exam_data), ('raw_data', exam_raw_data)):
+                    if not isinstance(frame, pd.DataFrame):
+                        continue
+                    if storage is not None:
+                        payload, ext = storage.dumps_frame(frame)
+                        mimetype = storage.FRAME_MIMETYPES[ext]
+                    else:
+                        from io import BytesIO
+                        buf = BytesIO()
+                        frame.to_pickle(buf)
+                        payload, ext, mimetype = buf.getvalue(), '.pkl', 'application/octet-stream'
+                    # a frame Arrow can't hold falls back to .pkl: drop the copy in the other format
+                    files.append((stem + ext, payload, mimetype, [stem + e for e in exts if e != ext]))
                 try:
-                    from io import BytesIO
-                    if isinstance(exam_data, pd.DataFrame):
-                        b = BytesIO()
-                        exam_data.to_pickle(b)
-                        _db.save_exam_file(sid, exam_id, 'data.pkl', b.getvalue(), mimetype='application/octet-stream')
-                    if isinstance(exam_raw_data, pd.DataFrame):
-                        b = BytesIO()
-                        exam_raw_data.to_pickle(b)
-                        _db.save_exam_file(sid, exam_id, 'raw_data.pkl', b.getvalue(), mimetype='application/octet-stream')
-                    try:
-                        cfgb = json.dumps(exam_config, ensure_ascii=False).encode('utf-8')
-                        _db.save_exam_file(sid, exam_id, 'config.json', cfgb, mimetype='application/json')
-                    except Exception:
-                        pass
+                    files.append(('config.json', json.dumps(exam_config, ensure_ascii=False).encode('utf-8'), 'application/json', []))
                 except Exception:
                     pass
+                # metadata + files in one transaction
+                with _db.session():
+                    _db.save_exam_metadata(sid, exam_id, exam_metadata)
+                    for fname, payload, mimetype, stale in files:
+                        _db.save_exam_file(sid, exam_id, fname, payload, mimetype=mimetype, supersedes=stale)
             except Exception:
                 pass
         else:
@@ -278,7 +287,10 @@ def save_exam_to_disk(exam_id, exam_metadata, exam_data, exam_raw_data, exam_con
                             fb.upload_blob(METADATA_FILE, f"{base_blob_prefix}/exams_metadata.json")
                         except Exception:
                             pass
-                        for fname in ('data.pkl', 'raw_data.pkl', 'config.json'):
+                        fnames = ['data.pkl', 'raw_data.pkl']
+                        if storage is not None:
+                            fnames = storage.frame_keys('data.pkl') + storage.frame_keys('raw_data.pkl')
+                        for fname in fnames + ['config.json']:
                             lp = os.path.join(STORAGE_DIR, exam_id, fname)
                             try:
                                 # If adapter is in use, download remote file into the local cache path
@@ -299,13 +311,23 @@ def save_exam_to_disk(exam_id, exam_metadata, exam_data, exam_raw_data, exam_con
             except Exception:
                 pass
 
+        # Publish the saved payloads to the shared exam store so other sessions
+        # pick up the new version without re-reading storage, and point this
+        # session's exam index at it.
+        try:
+            exam_store.put(sid, exam_id, data=exam_data, raw=exam_raw_data, config=exam_config,
+                           version=exam_store.content_version(exam_metadata))
+            exam_store.register(st.session_state, exam_id, exam_metadata)
+        except Exception:
+            pass
+
         return True
     except Exception as e:
         st.error(f"Error saving exam to disk: {e}")
         return False
 
 def load_all_exams_from_disk():
-    """Load all saved exams from disk into session state"""
+    """Load saved exam metadata into session state and attach the shared exam store"""
     try:
         # Try DB-first, then fall back to local storage
         db_ok = False
@@ -345,85 +367,14 @@ def load_all_exams_from_disk():
             except Exception:
                 all_metadata = {}
 
-        # Build saved_exams list from metadata
-        for exam_id, metadata in all_metadata.items():
-            st.session_state.saved_exams.append(metadata)
-
-        # Setup caches
-        st.session_state.saved_exam_data = {}
-        st.session_state.saved_exam_raw_data = {}
-        st.session_state.saved_exam_configs = {}
-
-        # Load data for all exams (try DB files first, else storage adapter)
-        for exam_id in list(all_metadata.keys()):
-            try:
-                loaded = False
-                # DB-backed files
-                if db_ok:
-                    try:
-                        files = _db.get_exam_files(exam_id)
-                        for fname, data, mimetype in files:
-                            if fname == 'data.pkl':
-                                try:
-                                    from io import BytesIO
-                                    st.session_state.saved_exam_data[exam_id] = pd.read_pickle(BytesIO(data))
-                                    loaded = True
-                                except Exception:
-                                    pass
-                            elif fname == 'raw_data.pkl':
-                                try:
-                                    from io import BytesIO
-                                    st.session_state.saved_exam_raw_data[exam_id] = pd.read_pickle(BytesIO(data))
-                                    loaded = True
-                                except Exception:
-                                    pass
-                            elif fname == 'config.json':
-                                try:
-                                    st.session_state.saved_exam_configs[exam_id] = json.loads(data.decode('utf-8'))
-                                    loaded = True
-                                except Exception:
-                                    pass
-                    except Exception:
-                        loaded = False
-
-                if not loaded:
-                    # Use storage adapter to load pickles/config (will prefer remote)
-                    try:
-                        if storage is not None:
-                            d = storage.read_pickle(f"{exam_id}/data.pkl")
-                            if d is not None:
-                                st.session_state.saved_exam_data[exam_id] = d
-                                loaded = True
-                            rd = storage.read_pickle(f"{exam_id}/raw_data.pkl")
-                            if rd is not None:
-                                st.session_state.saved_exam_raw_data[exam_id] = rd
-                                loaded = True
-                            cfg = storage.read_json(f"{exam_id}/config.json")
-                            if cfg is not None:
-                                st.session_state.saved_exam_configs[exam_id] = cfg
-                                loaded = True
-                        else:
-                            exam_dir = os.path.join(STORAGE_DIR, exam_id)
-                            if not os.path.exists(exam_dir):
-                                continue
-                            data_path = os.path.join(exam_dir, 'data.pkl')
-                            raw_data_path = os.path.join(exam_dir, 'raw_data.pkl')
-                            config_path = os.path.join(exam_dir, 'config.json')
-                            if os.path.exists(data_path):
-                                st.session_state.saved_exam_data[exam_id] = pd.read_pickle(data_path)
-                                loaded = True
-                            if os.path.exists(raw_data_path):
-                                st.session_state.saved_exam_raw_data[exam_id] = pd.read_pickle(raw_data_path)
-                                loaded = True
-                            if os.path.exists(config_path):
-                                with open(config_path, 'r', encoding='utf-8') as f:
-                                    st.session_state.saved_exam_configs[exam_id] = json.load(f)
-                                    loaded = True
-                    except Exception:
-                        # best-effort; continue to next exam
-                        pass
-            except Exception:
-                continue
+        # Build saved_exams from metadata and point the saved_exam_* session keys
+        # at the process-wide exam store; payloads are fetched by id on first use
+        # and shared by every session of the school.
+        try:
+            sid = auth.get_current_school_id() or 'global'
+        except Exception:
+            sid = 'global'
+        exam_store.attach_session(st.session_state, sid, all_metadata, storage_dir=STORAGE_DIR)
     except Exception as e:
         st.error(f"Error loading exams from disk: {e}")
 
@@ -888,49 +839,25 @@ def save_config(cfg):
         except Exception:
             pass
 
+def grading_scheme(grading_system=None):
+    """Compiled grading for the current marksheet config (strict grading and
+    per-subject overrides included); ``grading_system`` replaces the default table."""
+    return GradingScheme.from_config(st.session_state.cfg, grading_system)
+
 def get_grade(percentage, grading_system, subject_name=None):
     """Convert percentage to grade based on grading system.
     If subject_name is provided, checks if it should use strict grading."""
-    if pd.isna(percentage) or percentage == '':
-        return ''
-    
-    # Check if this subject uses strict grading
-    if subject_name and st.session_state.cfg.get('strict_grading_enabled', False):
-        strict_subjects = st.session_state.cfg.get('strict_grading_subjects', [])
-        if subject_name in strict_subjects:
-            grading_system = st.session_state.cfg.get('strict_grading_system', grading_system)
-    
-    try:
-        pct = float(percentage)
-        for grade_rule in grading_system:
-            # Swap min and max: use max as lower bound, min as upper bound
-            if grade_rule['max'] <= pct <= grade_rule['min']:
-                return grade_rule['grade']
-        return ''
-    except (ValueError, TypeError):
-        return ''
+    return grading_scheme(grading_system).grade(percentage, subject_name)
 
 def get_points(percentage, grading_system, subject_name=None):
     """Convert percentage to points based on grading system.
     If subject_name is provided, checks if it should use strict grading."""
-    if pd.isna(percentage) or percentage == '':
-        return 0
-    
-    # Check if this subject uses strict grading
-    if subject_name and st.session_state.cfg.get('strict_grading_enabled', False):
-        strict_subjects = st.session_state.cfg.get('strict_grading_subjects', [])
-        if subject_name in strict_subjects:
-            grading_system = st.session_state.cfg.get('strict_grading_system', grading_system)
-    
-    try:
-        pct = float(percentage)
-        for grade_rule in grading_system:
-            # Swap min and max: use max as lower bound, min as upper bound
-            if grade_rule['max'] <= pct <= grade_rule['min']:
-                return int(grade_rule.get('points', 0))
-        return 0
-    except (ValueError, TypeError):
-        return 0
+    return grading_scheme(grading_system).points(percentage, subject_name)
+
+def grade_bands_for(subject_name, grading_system):
+    """Compiled grade bands used for ``subject_name`` (the strict grading system
+    when strict grading applies to it, as in get_grade/get_points)."""
+    return grading_scheme(grading_system).bands_for(subject_name)
 
 # Session initialization
 if "cfg" not in st.session_state:
@@ -1084,7 +1011,6 @@ def build_export_from_raw(raw_df: pd.DataFrame) -> tuple:
         elif col_lower in ['stream','class','form','stream/class']:
             marksheet['Class'] = df_full[col]
 
-    numeric_cols_for_total = []
     subject_cols_order = []
     combined_parts = set()
     for _, parts in combined_list:
@@ -1097,9 +1023,16 @@ def build_export_from_raw(raw_df: pd.DataFrame) -> tuple:
     grading_enabled = st.session_state.cfg.get('grading_enabled', False)
     grading_system = st.session_state.cfg.get('grading_system', [])
 
-    # Track all percentage values for points calculation
-    all_subject_percentages = []
-    all_subject_names = []  # Track subject names for points calculation
+    grading_on = bool(grading_enabled and grading_system)
+
+    def bands_for(subject):
+        return grade_bands_for(subject, grading_system) if grading_on else None
+
+    # Percentages (students x counted subjects) and the grading of each column
+    counted_pcts = []
+    counted_bands = []
+    # Numeric value shown in each formatted cell, reused for the Totals/Means footer
+    display_values = {}
 
     for subj in subject_cols:
         try:
@@ -1107,26 +1040,17 @@ def build_export_from_raw(raw_df: pd.DataFrame) -> tuple:
         except Exception:
             scores = pd.Series([pd.NA]*len(df_full))
         out_of = float(st.session_state.cfg.get(f'out_{subj}', 100))
-        pct = (scores / out_of) * 100
+        pct = (pd.to_numeric(scores, errors='coerce').astype(float) / out_of) * 100
         
         if subj not in combined_parts:
             # Format with subject-specific grading
-            def format_pct_for_subject(pct_value, subject=subj):
-                if pd.notna(pct_value):
-                    pct_int = int(round(pct_value))
-                    if grading_enabled and grading_system:
-                        grade = get_grade(pct_int, grading_system, subject)
-                        return f"{pct_int} {grade}" if grade else str(pct_int)
-                    return str(pct_int)
-                return ''
-            
-            marksheet[subj] = pct.apply(format_pct_for_subject).astype(object)
+            marksheet[subj] = marksheet_engine.format_cells(pct.to_numpy(), bands_for(subj))
+            display_values[subj] = np.abs(np.round(pct.to_numpy(dtype=float)))
             
             # Only add to totals if not excluded
             if subj not in excluded_subjects:
-                numeric_cols_for_total.append((subj, pct.fillna(0)))
-                all_subject_percentages.append(pct)  # Track for points
-                all_subject_names.append(subj)  # Track subject name
+                counted_pcts.append(pct.to_numpy(dtype=float))
+                counted_bands.append(bands_for(subj))
         else:
             marksheet[subj] = scores.fillna('').astype(object)
         subject_cols_order.append(subj)
@@ -1140,97 +1064,34 @@ def build_export_from_raw(raw_df: pd.DataFrame) -> tuple:
                 except Exception:
                     scores = pd.Series([pd.NA]*len(df_full))
                 marksheet[p] = scores.fillna('').astype(object)
-        total_raw = pd.Series([0]*len(df_full), dtype=float)
+        total_raw = np.zeros(len(df_full), dtype=float)
         total_out_of = 0.0
         for p in parts:
-            scores = pd.to_numeric(df_full.get(p, pd.Series([pd.NA]*len(df_full))), errors='coerce').fillna(0)
-            total_raw = total_raw + scores
+            scores = pd.to_numeric(df_full.get(p, pd.Series([pd.NA]*len(df_full))), errors='coerce')
+            total_raw = total_raw + np.nan_to_num(scores.to_numpy(dtype=float), nan=0.0)
             total_out_of += float(st.session_state.cfg.get(f'out_{p}', 100))
-        combined_pct = (total_raw / total_out_of) * 100 if total_out_of > 0 else pd.Series([pd.NA]*len(df_full))
+        combined_pct = (total_raw / total_out_of) * 100 if total_out_of > 0 else np.full(len(df_full), np.nan)
         combined_header_map = st.session_state.cfg.get('combined_headers', {})
         combined_col_name = combined_header_map.get(cname, f"{cname}_Combined%")
         
         # Format combined subject with its name
-        def format_combined_pct(pct_value, combined_name=cname):
-            if pd.notna(pct_value):
-                pct_int = int(round(pct_value))
-                if grading_enabled and grading_system:
-                    grade = get_grade(pct_int, grading_system, combined_name)
-                    return f"{pct_int} {grade}" if grade else str(pct_int)
-                return str(pct_int)
-            return ''
-        
-        marksheet[combined_col_name] = combined_pct.apply(format_combined_pct).astype(object)
+        marksheet[combined_col_name] = marksheet_engine.format_cells(combined_pct, bands_for(cname))
+        display_values[combined_col_name] = np.abs(np.round(np.asarray(combined_pct, dtype=float)))
         combined_display_cols.append(combined_col_name)
         
         # Only add to totals if not excluded
         if cname not in excluded_subjects:
-            numeric_cols_for_total.append((combined_col_name, combined_pct.fillna(0)))
-            all_subject_percentages.append(combined_pct)  # Track for points
-            all_subject_names.append(cname)  # Track combined subject name
+            counted_pcts.append(combined_pct)
+            counted_bands.append(bands_for(cname))
 
-    # Check if we should exclude lowest grade per student
+    # Totals, means and points as whole-matrix operations; with exclude_lowest_grade
+    # each student's lowest counted subject is dropped.
     exclude_lowest = st.session_state.cfg.get('exclude_lowest_grade', False)
-    
-    # Calculate totals and points
-    if exclude_lowest and numeric_cols_for_total:
-        # For each student, exclude their lowest scoring subject
-        total_numeric = pd.Series([0.0] * len(df_full))
-        points_series = pd.Series([0] * len(df_full), dtype=int) if (grading_enabled and grading_system) else None
-        
-        for idx in range(len(df_full)):
-            # Get all subject scores for this student
-            subject_scores = []
-            for col_name, pct_series in numeric_cols_for_total:
-                score = pct_series.iloc[idx]
-                if pd.notna(score):
-                    subject_scores.append((col_name, score))
-            
-            # Sort by score and exclude the lowest (if there's a tie, picks the first one)
-            if len(subject_scores) > 1:
-                subject_scores.sort(key=lambda x: x[1])  # Stable sort: ties keep original order
-                subject_scores = subject_scores[1:]  # Remove the lowest scoring subject
-            
-            # Sum the remaining scores
-            student_total = sum(score for _, score in subject_scores)
-            total_numeric.iloc[idx] = student_total
-            
-            # Calculate points for remaining subjects
-            if points_series is not None:
-                student_points = 0
-                for col_name, score in subject_scores:
-                    # Find the subject name from our tracking lists
-                    for i, (tracked_col, _) in enumerate(numeric_cols_for_total):
-                        if tracked_col == col_name and i < len(all_subject_names):
-                            subj_name = all_subject_names[i]
-                            student_points += get_points(score, grading_system, subj_name)
-                            break
-                points_series.iloc[idx] = student_points
-        
-        # Calculate mean based on number of subjects counted (all subjects - 1)
-        n_counted = max(1, len(numeric_cols_for_total) - 1) if len(numeric_cols_for_total) > 1 else 1
-        mean_numeric = total_numeric / n_counted
-    else:
-        # Normal calculation (include all subjects)
-        total_numeric = None
-        for _, s in numeric_cols_for_total:
-            if total_numeric is None:
-                total_numeric = s.copy()
-            else:
-                total_numeric = total_numeric + s.fillna(0)
-        if total_numeric is None:
-            total_numeric = pd.Series([pd.NA] * len(df_full))
-        n_single = max(1, len([col for col, _ in numeric_cols_for_total]))
-        mean_numeric = (total_numeric / n_single)
-        
-        # Calculate Points column (sum of points for all subjects)
-        if grading_enabled and grading_system and all_subject_percentages:
-            points_series = pd.Series([0] * len(marksheet), dtype=int)
-            for pct_col, subj_name in zip(all_subject_percentages, all_subject_names):
-                subject_points = pct_col.apply(lambda x: get_points(x, grading_system, subj_name))
-                points_series = points_series + subject_points
-        else:
-            points_series = None
+    pct_matrix = np.column_stack(counted_pcts) if counted_pcts else np.empty((len(df_full), 0))
+    total_arr, mean_arr, points_arr = marksheet_engine.totals(
+        pct_matrix, counted_bands if grading_on else None, drop_lowest=1 if exclude_lowest else 0)
+    total_numeric = pd.Series(total_arr)
+    mean_numeric = pd.Series(mean_arr)
     
     def fmt_total(x):
         return int(round(x)) if pd.notna(x) else ''
@@ -1238,9 +1099,10 @@ def build_export_from_raw(raw_df: pd.DataFrame) -> tuple:
         return f"{x:.2f}" if pd.notna(x) else ''
     marksheet['Total'] = total_numeric.apply(fmt_total).astype(object)
     marksheet['Mean'] = mean_numeric.apply(fmt_mean).astype(object)
+    display_values['Total'] = np.abs(np.round(total_arr))
     
-    if points_series is not None:
-        marksheet['Points'] = points_series.astype(object)
+    if points_arr is not None:
+        marksheet['Points'] = pd.Series(points_arr).astype(object)
         # Empty for Totals/Means rows
         marksheet.loc[marksheet['Name'].isin(['Totals', 'Means']), 'Points'] = ''
     else:
@@ -1253,42 +1115,20 @@ def build_export_from_raw(raw_df: pd.DataFrame) -> tuple:
     )
     # Determine ranking metric: Totals (default) or Points
     ranking_basis = st.session_state.cfg.get('ranking_basis', 'Totals')
-    metric_series = None
-    if ranking_basis == 'Points' and 'Points' in marksheet.columns:
-        try:
-            metric_series = pd.to_numeric(marksheet['Points'].replace('', pd.NA), errors='coerce')
-        except Exception:
-            metric_series = None
-    if metric_series is None:
-        metric_series = total_numeric
+    metric_series = total_numeric
+    if ranking_basis == 'Points' and points_arr is not None:
+        metric_series = pd.Series(points_arr, dtype=float)
 
-    try:
-        ranks_numeric = pd.Series([pd.NA] * len(marksheet))
-        valid_metric = metric_series[valid_student_mask]
-        ranks_numeric[valid_student_mask] = valid_metric.rank(method='min', ascending=False, na_option='bottom')
-    except TypeError:
-        ranks_numeric = pd.Series([pd.NA] * len(marksheet))
-        valid_metric = metric_series[valid_student_mask]
-        ranks_numeric[valid_student_mask] = valid_metric.rank(method='min', ascending=False)
-    marksheet['Rank'] = ranks_numeric.apply(lambda x: int(x) if pd.notna(x) else '').astype(object)
+    def fmt_rank(r):
+        return pd.Series([int(x) if pd.notna(x) else '' for x in r], dtype=object)
+
+    marksheet['Rank'] = fmt_rank(marksheet_engine.rank_desc(metric_series, valid_student_mask))
 
     # Calculate Stream Rank (rank within each class/stream)
-    marksheet['S/Rank'] = ''
     if 'Class' in marksheet.columns:
-        # Group by Class and calculate rank within each group
-        for class_val in marksheet['Class'].unique():
-            if pd.isna(class_val) or str(class_val).strip() in ['', 'Totals', 'Means']:
-                continue
-            class_mask = (marksheet['Class'] == class_val) & valid_student_mask
-            if class_mask.any():
-                # Use same metric for stream ranking
-                class_totals = metric_series[class_mask]
-                try:
-                    class_ranks = class_totals.rank(method='min', ascending=False, na_option='bottom')
-                except TypeError:
-                    class_ranks = class_totals.rank(method='min', ascending=False)
-                # Assign ranks to the class_mask positions
-                marksheet.loc[class_mask, 'S/Rank'] = class_ranks.apply(lambda x: int(x) if pd.notna(x) else '').astype(object)
+        class_keys = marksheet['Class'].where(
+            ~marksheet['Class'].astype(str).str.strip().isin(['', 'Totals', 'Means']))
+        marksheet['S/Rank'] = fmt_rank(marksheet_engine.rank_desc(metric_series, valid_student_mask, groups=class_keys))
     else:
         # If no Class column, Stream Rank is same as overall Rank
         marksheet['S/Rank'] = marksheet['Rank']
@@ -1337,14 +1177,18 @@ def build_export_from_raw(raw_df: pd.DataFrame) -> tuple:
         if col in ('Rank','Name','Adm No','S/Rank','Points'):
             continue
         # Extract numeric values from columns (handle grades like "85 A")
-        try:
-            # First try to extract numbers from strings (handles "85 A" format)
-            col_str = marksheet[col].astype(str).str.strip()
-            # Extract first numeric value from each cell
-            col_numeric = col_str.str.extract(r'(\d+\.?\d*)')[0]
-            col_values = pd.to_numeric(col_numeric, errors='coerce')
-        except Exception:
-            col_values = pd.Series([pd.NA]*len(marksheet))
+        if col in display_values:
+            # already known for computed columns; same number the regex would read back
+            col_values = pd.Series(display_values[col], index=marksheet.index)
+        else:
+            try:
+                # First try to extract numbers from strings (handles "85 A" format)
+                col_str = marksheet[col].astype(str).str.strip()
+                # Extract first numeric value from each cell
+                col_numeric = col_str.str.extract(r'(\d+\.?\d*)')[0]
+                col_values = pd.to_numeric(col_numeric, errors='coerce')
+            except Exception:
+                col_values = pd.Series([pd.NA]*len(marksheet))
         
         # Calculate totals and means (excluding marked students from both)
         if col_values.notna().any():
@@ -3273,16 +3117,9 @@ elif st.session_state.view == "analysis":
                 
                 if subj not in combined_parts:
                     # Format with subject-specific grading
-                    def format_for_subject(pct_value, subject=subj):
-                        if pd.notna(pct_value):
-                            pct_int = int(round(pct_value))
-                            if grading_enabled and grading_system:
-                                grade = get_grade(pct_int, grading_system, subject)
-                                return f"{pct_int} {grade}" if grade else str(pct_int)
-                            return str(pct_int)
-                        return ''
-                    
-                    marksheet[subj] = pct.apply(format_for_subject).astype(object)
+                    bands = grade_bands_for(subj, grading_system) if (grading_enabled and grading_system) else None
+                    marksheet[subj] = marksheet_engine.format_cells(
+                        pd.to_numeric(pct, errors='coerce').to_numpy(dtype=float), bands)
                     # include this subject's numeric pct in totals
                     numeric_cols_for_total.append((subj, pct.fillna(0)))
                     all_subject_percentages.append(pct)  # Track for points
@@ -3320,16 +3157,9 @@ elif st.session_state.view == "analysis":
                 combined_col_name = combined_header_map.get(cname, f"{cname}_Combined%")
                 
                 # Format combined with subject name
-                def format_combined_for_subject(pct_value, combined_name=cname):
-                    if pd.notna(pct_value):
-                        pct_int = int(round(pct_value))
-                        if grading_enabled and grading_system:
-                            grade = get_grade(pct_int, grading_system, combined_name)
-                            return f"{pct_int} {grade}" if grade else str(pct_int)
-                        return str(pct_int)
-                    return ''
-                
-                marksheet[combined_col_name] = combined_pct.apply(format_combined_for_subject).astype(object)
+                bands = grade_bands_for(cname, grading_system) if (grading_enabled and grading_system) else None
+                marksheet[combined_col_name] = marksheet_engine.format_cells(
+                    pd.to_numeric(combined_pct, errors='coerce').to_numpy(dtype=float), bands)
                 combined_display_cols.append(combined_col_name)
                 # Add combined percentage to totals (but not the component subjects)
                 numeric_cols_for_total.append((combined_col_name, combined_pct.fillna(0)))
@@ -3365,11 +3195,11 @@ elif st.session_state.view == "analysis":
 
             # Calculate Points column (sum of points for all subjects)
             if grading_enabled and grading_system and all_subject_percentages:
-                points_series = pd.Series([0] * len(marksheet), dtype=int)
+                points_arr = np.zeros(len(marksheet), dtype=np.int64)
                 for pct_col, subj_name in zip(all_subject_percentages, all_subject_names):
-                    subject_points = pct_col.apply(lambda x: get_points(x, grading_system, subj_name))
-                    points_series = points_series + subject_points
-                marksheet['Points'] = points_series.astype(object)
+                    pct_arr = pd.to_numeric(pct_col, errors='coerce').to_numpy(dtype=float)
+                    points_arr += grade_bands_for(subj_name, grading_system).points(pct_arr)
+                marksheet['Points'] = pd.Series(points_arr, index=marksheet.index).astype(object)
                 # Empty for Totals/Means rows
                 marksheet.loc[marksheet['Name'].isin(['Totals', 'Means']), 'Points'] = ''
             else:
@@ -3385,34 +3215,16 @@ elif st.session_state.view == "analysis":
             # Compute global ranks ONLY on valid students using competition style (min) to create gaps on ties
             # Example: two students at rank 28 -> next rank is 30
             # Since df was reset_index, total_numeric and marksheet should have matching indices
-            try:
-                ranks_numeric = pd.Series([pd.NA] * len(marksheet))
-                valid_totals = total_numeric[valid_student_mask]
-                ranks_numeric[valid_student_mask] = valid_totals.rank(method='min', ascending=False, na_option='bottom')
-            except TypeError:
-                # Fallback if pandas does not support na_option
-                ranks_numeric = pd.Series([pd.NA] * len(marksheet))
-                valid_totals = total_numeric[valid_student_mask]
-                ranks_numeric[valid_student_mask] = valid_totals.rank(method='min', ascending=False)
-            
-            marksheet['Rank'] = ranks_numeric.apply(lambda x: int(x) if pd.notna(x) else '').astype(object)
+            def fmt_rank(r):
+                return pd.Series([int(x) if pd.notna(x) else '' for x in r], index=marksheet.index, dtype=object)
+
+            marksheet['Rank'] = fmt_rank(marksheet_engine.rank_desc(total_numeric, valid_student_mask))
 
             # Calculate Stream Rank (rank within each class/stream)
-            marksheet['S/Rank'] = ''
             if 'Class' in marksheet.columns:
-                # Group by Class and calculate rank within each group
-                for class_val in marksheet['Class'].unique():
-                    if pd.isna(class_val) or str(class_val).strip() in ['', 'Totals', 'Means']:
-                        continue
-                    class_mask = (marksheet['Class'] == class_val) & valid_student_mask
-                    if class_mask.any():
-                        class_totals = total_numeric[class_mask]
-                        try:
-                            class_ranks = class_totals.rank(method='min', ascending=False, na_option='bottom')
-                        except TypeError:
-                            class_ranks = class_totals.rank(method='min', ascending=False)
-                        # Assign ranks to the class_mask positions
-                        marksheet.loc[class_mask, 'S/Rank'] = class_ranks.apply(lambda x: int(x) if pd.notna(x) else '').astype(object)
+                class_keys = marksheet['Class'].where(
+                    ~marksheet['Class'].astype(str).str.strip().isin(['', 'Totals', 'Means']))
+                marksheet['S/Rank'] = fmt_rank(marksheet_engine.rank_desc(total_numeric, valid_student_mask, groups=class_keys))
             else:
                 # If no Class column, Stream Rank is same as overall Rank
                 marksheet['S/Rank'] = marksheet['Rank']
@@ -0,0 +1,432 @@
+"""Indexed parent contacts.
+
+``student_contacts.json`` used to be the only copy of an account's contacts:
+the pages loaded the whole list, scanned it for every lookup and rewrote it on
+every change. The contacts now live in a table (``db.contact_tables``) indexed
+on (scope, student_id), (scope, name_key), (scope, phone_key) and
+(scope, grade, stream):
+
+  - ``get``, ``find_by_phone``, ``find_by_names`` and ``by_class`` are index
+    lookups instead of list scans.
+  - ``upsert`` merges a batch (a CSV import, phones typed on the send page) in
+    one transaction. A record matches an existing contact by student_id, else
+    by student name (case and spacing ignored), and by phone: another number
+    for the same student is another guardian and is inserted, a record without
+    a phone updates the student's first contact, and a student's contact
+    without a phone takes the record's number. With ``match_phone=False``
+    (the send page) the phone is not part of the match, so a typed number
+    replaces the saved one. Only a record's non-empty fields overwrite, and
+    unmatched records are inserted. Phones are normalized in bulk and
+    ``phone_key`` (last nine digits) is kept with each row.
+  - ``replace_all`` stores an edited list as it is, duplicates included.
+
+The table is in the app database when ``modules.db`` is enabled, otherwise in
+``saved_exams_storage/contacts.sqlite3``. Rows are partitioned by ``scope``
+(the account's storage directory name).
+
+``student_contacts.json`` stays as an export for the code that still reads it
+(home page, account markers, the portal fallback). ``sync(scope, raw)`` imports
+the file whenever its bytes differ from the last import or export, so a file
+restored or edited elsewhere wins; after changing the store, callers write the
+file again and record it with ``mark_synced``. ``merge`` applies the
+``upsert`` rules to a plain list for when the store is unavailable.
+
+Environment variables:
+  - CONTACTS_STORE: ``auto`` (default: database if enabled, else SQLite),
+    ``sqlite`` (always local) or ``off``.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+try:
+    from sqlalchemy import bindparam, func
+    from sqlalchemy.sql import select
+except Exception:
+    select = None
+
+try:
+    from . import db as _db
+except Exception:
+    _db = None
+try:
+    from .storage import BASE_STORAGE
+except Exception:
+    BASE_STORAGE = os.path.join(os.path.dirname(__file__), '..', 'saved_exams_storage')
+
+from utils import phones
+
+STORE = os.environ.get('CONTACTS_STORE', 'auto').lower()
+
+# contact fields with their own column; anything else on a contact dict is kept in ``extra``
+FIELDS = ('student_id', 'student_name', 'grade', 'stream', 'parent_name', 'phone_raw', 'phone')
+_COLUMNS = FIELDS + ('phone_key',)
+_CHUNK = 500
+
+
+def _backend():
+    """``(engine, tables)``: the app database when enabled, else local SQLite."""
+    if select is None or _db is None or STORE == 'off':
+        return None
+    try:
+        _db.init_from_env()
+        if STORE != 'sqlite' and _db.enabled() and _db.table('contacts') is not None:
+            return _db.engine(), {name: _db.table(name) for name in ('contacts', 'contact_sources')}
+    except Exception:
+        pass
+    try:
+        return _db.local_store(os.path.join(BASE_STORAGE, 'contacts.sqlite3'), _db.contact_tables)
+    except Exception:
+        return None
+
+
+def available() -> bool:
+    return _backend() is not None
+
+
+def name_key(name) -> str:
+    """Student name as matched between exams and contacts: lower case, single spaces."""
+    return ' '.join(_text(name).split()).lower()
+
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    try:
+        if value != value:  # NaN from pandas
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))  # ids/phones read as floats by pandas
+    except Exception:
+        pass
+    return str(value).strip()
+
+
+def _digest(raw: bytes) -> str:
+    return hashlib.sha256(raw or b'').hexdigest()
+
+
+def _rows(records: Iterable[Dict], default_country: str = 'KE') -> List[Dict[str, Any]]:
+    """Normalized field dicts (plus ``name_key``, ``phone_key`` and ``extra``)
+    for contact dicts; missing phones are normalized from ``phone_raw`` in bulk."""
+    out = []
+    for rec in records:
+        if not isinstance(rec, dict):
+            continue
+        row = {f: _text(rec.get(f)) for f in FIELDS}
+        row['extra'] = {k: v for k, v in rec.items() if k not in _COLUMNS} or None
+        out.append(row)
+    missing = [r for r in out if not r['phone'] and r['phone_raw']]
+    if missing:
+        for r, phone in zip(missing, phones.normalize_phones([r['phone_raw'] for r in missing], default_country)):
+            r['phone'] = phone
+    for r in out:
+        r['name_key'] = name_key(r['student_name'])
+        r['phone_key'] = phones.phone_key(r['phone'] or r['phone_raw'])
+    return out
+
+
+def _phone_key(c: Dict) -> str:
+    return phones.phone_key(c.get('phone') or c.get('phone_raw'))
+
+
+def _merge(contacts: List[Dict], rows: List[Dict], new: Callable[[Dict], Dict],
+           match_phone: bool = True) -> List[Dict]:
+    """Apply ``rows`` to ``contacts`` in place (see ``upsert``); returns the
+    contacts that were changed or appended."""
+    # keys are (student_id or name_key, phone_key); phone_key None = any phone
+    by_id, by_name, by_name_no_id = {}, {}, {}
+
+    def index(c):
+        sid, nk = _text(c.get('student_id')), name_key(c.get('student_name'))
+        pks = (None, _phone_key(c)) if match_phone else (None,)
+        for pk in pks:
+            if sid:
+                by_id.setdefault((sid, pk), c)
+            if nk:
+                by_name.setdefault((nk, pk), c)
+                if not sid:
+                    by_name_no_id.setdefault((nk, pk), c)
+
+    def find(sid, nk, pk):
+        target = by_id.get((sid, pk)) if sid else by_name.get((nk, pk))
+        if target is None and sid and nk:
+            target = by_name_no_id.get((nk, pk))
+            if target is not None and _text(target.get('student_id')):
+                target = None  # already taken by a record with another id
+        # an index entry goes stale once its contact's phone changes
+        if target is not None and pk is not None and _phone_key(target) != pk:
+            target = None
+        return target
+
+    for c in contacts:
+        index(c)
+    touched = {}
+    for r in rows:
+        sid, nk = r['student_id'], r['name_key']
+        if match_phone and r['phone_key']:
+            target = find(sid, nk, r['phone_key']) or find(sid, nk, '')
+        else:
+            target = find(sid, nk, None)
+        if target is None:
+            target = new(r)
+            contacts.append(target)
+        else:
+            for f in FIELDS:
+                if r[f] and not (f == 'student_name' and name_key(target.get(f)) == nk):
+                    target[f] = r[f]
+            target['phone_key'] = phones.phone_key(target.get('phone') or target.get('phone_raw'))
+        index(target)
+        touched[id(target)] = target
+    return list(touched.values())
+
+
+def _plain(row: Dict) -> Dict:
+    c = dict(row.get('extra') or {})
+    c.update({k: row[k] for k in _COLUMNS})
+    return c
+
+
+def merge(contacts: List[Dict], records: Iterable[Dict], default_country: str = 'KE',
+          match_phone: bool = True) -> Dict[str, int]:
+    """``upsert`` for a plain contact list (modified in place)."""
+    before = len(contacts)
+    touched = _merge(contacts, _rows(records, default_country), _plain, match_phone)
+    inserted = len(contacts) - before
+    return {'inserted': inserted, 'updated': len(touched) - inserted}
+
+
+def _contact(row) -> Dict:
+    m = row._mapping
+    c = dict(m['extra'] or {})
+    c.update({k: m[k] or '' for k in _COLUMNS})
+    return c
+
+
+def _query(t):
+    return select(*[t.c[k] for k in _COLUMNS], t.c.extra)
+
+
+def _fetch_rows(q):
+    backend = _backend()
+    if backend is None:
+        return []
+    engine, _t = backend
+    with engine.connect() as conn:
+        return conn.execute(q).fetchall()
+
+
+def _fetch(q) -> List[Dict]:
+    return [_contact(r) for r in _fetch_rows(q)]
+
+
+def _table():
+    backend = _backend()
+    return backend[1]['contacts'] if backend else None
+
+
+def load(scope: str) -> List[Dict]:
+    """Every contact of ``scope`` in the order they were added."""
+    t = _table()
+    if t is None:
+        return []
+    return _fetch(_query(t).where(t.c.scope == scope).order_by(t.c.id))
+
+
+def count(scope: str) -> int:
+    backend = _backend()
+    if backend is None:
+        return 0
+    engine, tables = backend
+    t = tables['contacts']
+    with engine.connect() as conn:
+        return int(conn.execute(select(func.count()).select_from(t).where(t.c.scope == scope)).scalar() or 0)
+
+
+def get(scope: str, student_id) -> Optional[Dict]:
+    """The first contact with ``student_id``, or None."""
+    t = _table()
+    sid = _text(student_id)
+    if t is None or not sid:
+        return None
+    found = _fetch(_query(t).where(t.c.scope == scope, t.c.student_id == sid).order_by(t.c.id).limit(1))
+    return found[0] if found else None
+
+
+def find_by_phone(scope: str, phone) -> List[Dict]:
+    """Contacts whose number has the same last nine digits as ``phone``."""
+    t = _table()
+    key = phones.phone_key(phone)
+    if t is None or not key:
+        return []
+    return _fetch(_query(t).where(t.c.scope == scope, t.c.phone_key == key).order_by(t.c.id))
+
+
+def find_by_names(scope: str, names: Iterable) -> Dict[str, Dict]:
+    """``{name_key(name): first contact with that name}`` for the given names."""
+    t = _table()
+    keys = list(dict.fromkeys(k for k in (name_key(n) for n in names) if k))
+    out: Dict[str, Dict] = {}
+    if t is None or not keys:
+        return out
+    for k in range(0, len(keys), _CHUNK):
+        q = (_query(t).add_columns(t.c.name_key)
+             .where(t.c.scope == scope, t.c.name_key.in_(keys[k:k + _CHUNK])).order_by(t.c.id))
+        for row in _fetch_rows(q):
+            out.setdefault(row._mapping['name_key'], _contact(row))
+    return out
+
+
+def by_class(scope: str, grade, stream=None) -> List[Dict]:
+    """Contacts in ``grade`` (and ``stream`` when given)."""
+    t = _table()
+    if t is None:
+        return []
+    q = _query(t).where(t.c.scope == scope, t.c.grade == _text(grade))
+    if stream is not None:
+        q = q.where(t.c.stream == _text(stream))
+    return _fetch(q.order_by(t.c.id))
+
+
+def _db_row(scope: str, row: Dict, now: float) -> Dict[str, Any]:
+    out = {k: row[k] for k in _COLUMNS}
+    out.update(scope=scope, name_key=row['name_key'], extra=row.get('extra'), updated_at=now)
+    return out
+
+
+def _set_source(conn, sources, scope: str, digest: str, now: float):
+    conn.execute(sources.delete().where(sources.c.scope == scope))
+    conn.execute(sources.insert().values(scope=scope, source_hash=digest, updated_at=now))
+
+
+def _replace(conn, tables, scope: str, records: Iterable[Dict], now: float) -> int:
+    t = tables['contacts']
+    rows = [_db_row(scope, r, now) for r in _rows(records)]
+    conn.execute(t.delete().where(t.c.scope == scope))
+    for k in range(0, len(rows), _CHUNK):
+        conn.execute(t.insert(), rows[k:k + _CHUNK])
+    return len(rows)
+
+
+def replace_all(scope: str, records: List[Dict], raw: Optional[bytes] = None) -> int:
+    """Make ``records`` the scope's contacts. ``raw`` is the JSON export written
+    for them, if any (see ``mark_synced``). Returns the number stored."""
+    backend = _backend()
+    if backend is None:
+        raise RuntimeError('contacts store unavailable')
+    engine, tables = backend
+    now = time.time()
+    with engine.begin() as conn:
+        stored = _replace(conn, tables, scope, records, now)
+        if raw is not None:
+            _set_source(conn, tables['contact_sources'], scope, _digest(raw), now)
+    return stored
+
+
+def upsert(scope: str, records: Iterable[Dict], default_country: str = 'KE',
+           match_phone: bool = True) -> Dict[str, int]:
+    """Merge ``records`` into the scope's contacts in one transaction.
+
+    Matching and overwrite rules are described in the module docstring.
+    Returns ``{'inserted', 'updated'}``.
+    """
+    backend = _backend()
+    if backend is None:
+        raise RuntimeError('contacts store unavailable')
+    engine, tables = backend
+    t = tables['contacts']
+    rows = _rows(records, default_country)
+    ids = list(dict.fromkeys(r['student_id'] for r in rows if r['student_id']))
+    names = list(dict.fromkeys(r['name_key'] for r in rows if r['name_key']))
+    now = time.time()
+    with engine.begin() as conn:
+        candidates, seen = [], set()
+        for col, values in ((t.c.student_id, ids), (t.c.name_key, names)):
+            for k in range(0, len(values), _CHUNK):
+                q = (select(t.c.id, *[t.c[c] for c in _COLUMNS], t.c.name_key)
+                     .where(t.c.scope == scope, col.in_(values[k:k + _CHUNK])))
+                for r in conn.execute(q):
+                    m = r._mapping
+                    if m['id'] not in seen:
+                        seen.add(m['id'])
+                        candidates.append({'_id': m['id'], **{c: m[c] or '' for c in _COLUMNS}})
+        # earliest row first, as the JSON list order did
+        candidates.sort(key=lambda c: c['_id'])
+        touched = _merge(candidates, rows, dict, match_phone)
+        inserts = [_db_row(scope, c, now) for c in touched if '_id' not in c]
+        updates = [{'b_id': c['_id'], 'b_name_key': name_key(c['student_name']), 'b_updated_at': now,
+                    **{f'b_{k}': c[k] for k in _COLUMNS}} for c in touched if '_id' in c]
+        if updates:
+            values = {k: bindparam(f'b_{k}') for k in _COLUMNS + ('name_key', 'updated_at')}
+            conn.execute(t.update().where(t.c.id == bindparam('b_id')).values(values), updates)
+        for k in range(0, len(inserts), _CHUNK):
+            conn.execute(t.insert(), inserts[k:k + _CHUNK])
+    return {'inserted': len(inserts), 'updated': len(updates)}
+
+
+def sync(scope: str, raw: Optional[bytes]) -> bool:
+    """Import the scope's ``student_contacts.json`` (its raw bytes) when they
+    differ from the last import or export. ``raw`` None means the file could
+    not be read, which leaves the store as it is. Returns True when the store
+    can serve the scope."""
+    backend = _backend()
+    if backend is None:
+        return False
+    if raw is None:
+        return True
+    engine, tables = backend
+    sources = tables['contact_sources']
+    digest = _digest(raw)
+    try:
+        with engine.connect() as conn:
+            current = conn.execute(select(sources.c.source_hash).where(sources.c.scope == scope)).scalar()
+        if current == digest:
+            return True
+        data = json.loads(raw.decode('utf-8-sig') or '[]') if raw.strip() else []
+        if not isinstance(data, list):
+            return False
+        now = time.time()
+        with engine.begin() as conn:
+            _replace(conn, tables, scope, data, now)
+            _set_source(conn, sources, scope, digest, now)
+        return True
+    except Exception:
+        return False
+
+
+def mark_synced(scope: str, raw: bytes) -> None:
+    """Record ``raw`` as the JSON export matching the store, so ``sync`` does
+    not import it back."""
+    backend = _backend()
+    if backend is None:
+        return
+    engine, tables = backend
+    with engine.begin() as conn:
+        _set_source(conn, tables['contact_sources'], scope, _digest(raw), time.time())
+
+
+def dumps(contacts: List[Dict]) -> bytes:
+    """The JSON export of ``contacts`` (as ``storage.write_json`` writes it)."""
+    return json.dumps(contacts, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def records_from_frame(df) -> List[Dict[str, str]]:
+    """Contact records from an uploaded or edited table (student_id,
+    student_name, grade, stream, parent_name, phone). The ``phone`` column is
+    taken as ``phone_raw``; ``upsert``/``merge`` normalize it."""
+    frame = df.rename(columns=lambda c: str(c).strip())
+    n = len(frame)
+
+    def column(name):
+        if name not in frame.columns:
+            return [''] * n
+        s = frame[name]
+        return [_text(v) for v in s.astype(object).tolist()]
+
+    cols = {f: column(f) for f in ('student_id', 'student_name', 'grade', 'stream', 'parent_name')}
+    cols['phone_raw'] = column('phone')
+    keys = list(cols)
+    return [dict(zip(keys, vals)) for vals in zip(*cols.values())]
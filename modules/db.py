@@ -1,86 +1,452 @@
 import os
 import json
-from typing import Optional, Dict, Any, List, Tuple
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterable, List, Tuple
 from datetime import datetime
 
 try:
-    from sqlalchemy import create_engine, Table, Column, Integer, String, MetaData, LargeBinary, Text
+    from sqlalchemy import create_engine, Table, Column, Integer, Float, String, MetaData, LargeBinary, Text, JSON, Index, func, text
+    from sqlalchemy import inspect as _sa_inspect, event
     from sqlalchemy.dialects.postgresql import JSONB
     from sqlalchemy.sql import select
 except Exception:
     create_engine = None
 
+try:
+    from sqlalchemy.dialects.postgresql import insert as _pg_insert
+    from sqlalchemy.dialects.sqlite import insert as _sqlite_insert
+except Exception:
+    _pg_insert = _sqlite_insert = None
+
 
 _engine = None
+_engine_url = None
 _metadata = None
 _tables = {}
 
+# Engine construction and schema bootstrap happen once per process; callers may
+# keep calling init_from_env() before every operation, it is a cheap no-op then.
+_init_lock = threading.Lock()
+_failed_at: Dict[str, float] = {}
+INIT_RETRY_SECONDS = float(os.environ.get('DB_INIT_RETRY_SECONDS', '60'))
+
+# QueuePool tuning (ignored for SQLite, which uses its own pool classes)
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+
+# exam_files keeps this many versions per (exam_id, filename); older ones are pruned on save
+EXAM_FILE_VERSIONS_KEPT = max(1, int(os.environ.get('EXAM_FILE_VERSIONS_KEPT', '2')))
+
+# Connection of the session() active in the current thread, if any
+_local = threading.local()
+_counters = {'transactions': 0, 'sessions': 0, 'rollbacks': 0, 'init_calls': 0, 'engine_builds': 0}
+
+
+def _build_tables(metadata):
+    json_type = JSON().with_variant(JSONB(), 'postgresql')
+    exams = Table('exams_metadata', metadata,
+                  Column('exam_id', String, primary_key=True),
+                  Column('school_id', String, index=True),
+                  Column('metadata', json_type))
+
+    files = Table('exam_files', metadata,
+                  Column('id', Integer, primary_key=True, autoincrement=True),
+                  Column('exam_id', String, index=True),
+                  Column('school_id', String, index=True),
+                  Column('filename', String),
+                  Column('data', LargeBinary),
+                  Column('mimetype', String),
+                  Column('created_at', String),
+                  Column('content_hash', String(64)),
+                  Column('version', Integer),
+                  Index('ix_exam_files_exam_filename_version', 'exam_id', 'filename', 'version', unique=True))
+
+    kv = Table('kv_store', metadata,
+               Column('key', String, primary_key=True),
+               Column('value', json_type))
+
+    tables = {'exams': exams, 'files': files, 'kv': kv}
+    tables.update(message_tables(metadata))
+    tables.update(outbox_tables(metadata))
+    tables.update(contact_tables(metadata))
+    tables.update(job_tables(metadata))
+    return tables
+
+
+def message_tables(metadata):
+    """SMS history tables (see modules.message_store). Also used on their own
+    for the local SQLite store when no database is configured."""
+    json_type = JSON().with_variant(JSONB(), 'postgresql')
+    messages = Table('message_log', metadata,
+                     Column('id', Integer, primary_key=True, autoincrement=True),
+                     Column('scope', String),
+                     Column('time', Float),
+                     Column('phone', String),
+                     Column('exam_id', String),
+                     Column('status', String),
+                     Column('provider', String),
+                     Column('entry', json_type),
+                     Index('ix_message_log_scope_time', 'scope', 'time'),
+                     Index('ix_message_log_scope_phone_time', 'scope', 'phone', 'time'),
+                     Index('ix_message_log_scope_exam_time', 'scope', 'exam_id', 'time'),
+                     Index('ix_message_log_scope_status_time', 'scope', 'status', 'time'))
+
+    # running totals per scope and period ('d:YYYY-MM-DD', 'm:YYYY-MM', 'y:YYYY', 'all')
+    counters = Table('message_counters', metadata,
+                     Column('scope', String, primary_key=True),
+                     Column('period', String, primary_key=True),
+                     Column('count', Integer, nullable=False, default=0))
+
+    return {'messages': messages, 'message_counters': counters}
+
+
+def outbox_tables(metadata):
+    """Durable SMS outbox (see modules.outbox)."""
+    json_type = JSON().with_variant(JSONB(), 'postgresql')
+    batches = Table('sms_outbox_batches', metadata,
+                    Column('batch_id', String, primary_key=True),
+                    Column('scope', String, index=True),
+                    Column('created_at', Float),
+                    Column('log_file', String),
+                    Column('test_mode', Integer, default=0),
+                    Column('config', json_type))
+
+    jobs = Table('sms_outbox', metadata,
+                 Column('id', Integer, primary_key=True, autoincrement=True),
+                 Column('batch_id', String, index=True),
+                 Column('scope', String),
+                 Column('idempotency_key', String(64), nullable=False),
+                 Column('phone', String),
+                 Column('message', Text),
+                 Column('contact', json_type),
+                 Column('status', String, nullable=False),
+                 Column('attempts', Integer, nullable=False, default=0),
+                 Column('next_attempt_at', Float),
+                 Column('locked_until', Float),
+                 Column('worker', String),
+                 Column('last_error', Text),
+                 Column('result', json_type),
+                 Column('created_at', Float),
+                 Column('updated_at', Float),
+                 Index('ux_sms_outbox_scope_key', 'scope', 'idempotency_key', unique=True),
+                 Index('ix_sms_outbox_status_next', 'status', 'next_attempt_at'))
+
+    workers = Table('sms_outbox_workers', metadata,
+                    Column('worker_id', String, primary_key=True),
+                    Column('seen_at', Float),
+                    Column('processed', Integer, default=0),
+                    # account the worker drains ('' = every account)
+                    Column('scope', String, default=''))
+
+    return {'outbox_batches': batches, 'outbox': jobs, 'outbox_workers': workers}
+
+
+def contact_tables(metadata):
+    """Parent contacts with their lookup indexes (see modules.contacts_store)."""
+    json_type = JSON().with_variant(JSONB(), 'postgresql')
+    contacts = Table('contacts', metadata,
+                     Column('id', Integer, primary_key=True, autoincrement=True),
+                     Column('scope', String, nullable=False),
+                     Column('student_id', String),
+                     Column('student_name', String),
+                     Column('name_key', String),
+                     Column('grade', String),
+                     Column('stream', String),
+                     Column('parent_name', String),
+                     Column('phone_raw', String),
+                     Column('phone', String),
+                     Column('phone_key', String(16)),
+                     Column('extra', json_type),
+                     Column('updated_at', Float),
+                     Index('ix_contacts_scope_student_id', 'scope', 'student_id'),
+                     Index('ix_contacts_scope_name_key', 'scope', 'name_key'),
+                     Index('ix_contacts_scope_phone_key', 'scope', 'phone_key'),
+                     Index('ix_contacts_scope_class', 'scope', 'grade', 'stream'))
+
+    sources = Table('contact_sources', metadata,
+                    Column('scope', String, primary_key=True),
+                    Column('source_hash', String(64)),
+                    Column('updated_at', Float))
+
+    return {'contacts': contacts, 'contact_sources': sources}
+
+
+def job_tables(metadata):
+    """Background generation jobs (see modules.jobs)."""
+    jobs = Table('jobs', metadata,
+                 Column('job_id', String, primary_key=True),
+                 Column('scope', String),
+                 Column('kind', String, nullable=False),
+                 Column('label', String),
+                 Column('status', String, nullable=False),
+                 Column('payload', LargeBinary),
+                 Column('progress_done', Integer, default=0),
+                 Column('progress_total', Integer),
+                 Column('attempts', Integer, nullable=False, default=0),
+                 Column('worker', String),
+                 Column('locked_until', Float),
+                 Column('artifact', String),
+                 Column('file_name', String),
+                 Column('mime', String),
+                 Column('size', Integer),
+                 Column('error', Text),
+                 Column('created_at', Float),
+                 Column('started_at', Float),
+                 Column('finished_at', Float),
+                 Column('updated_at', Float),
+                 Index('ix_jobs_scope_created', 'scope', 'created_at'),
+                 Index('ix_jobs_status_created', 'status', 'created_at'))
+
+    return {'jobs': jobs}
+
+
+_local_stores: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+
+
+def local_store(path: str, build) -> Tuple[Any, Dict[str, Any]]:
+    """``(engine, tables)`` for a SQLite file holding the tables of ``build``
+    (e.g. message_tables), used when no database is configured. Cached per path."""
+    path = os.path.abspath(path)
+    with _init_lock:
+        found = _local_stores.get(path)
+        if found is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            engine = create_engine(f'sqlite:///{path}')
+
+            @event.listens_for(engine, 'connect')
+            def _pragmas(dbapi_conn, _record):
+                cur = dbapi_conn.cursor()
+                cur.execute('PRAGMA journal_mode=WAL')
+                cur.execute('PRAGMA synchronous=NORMAL')
+                cur.execute('PRAGMA busy_timeout=5000')
+                cur.close()
+
+            metadata = MetaData()
+            tables = build(metadata)
+            metadata.create_all(engine)
+            _upgrade_schema(engine, tables)
+            found = _local_stores[path] = (engine, tables)
+        return found
+
+
+# columns added after their table was first created: table key -> ((name, ddl), ...)
+_ADDED_COLUMNS = {
+    'files': (('content_hash', 'VARCHAR(64)'), ('version', 'INTEGER')),
+    'outbox_workers': (('scope', "VARCHAR DEFAULT ''"),),
+}
+
+
+def _upgrade_schema(engine, tables):
+    """Add columns introduced after a table was first created (create_all only
+    creates missing tables)."""
+    inspector = _sa_inspect(engine)
+    for key, added in _ADDED_COLUMNS.items():
+        table = tables.get(key)
+        if table is None:
+            continue
+        cols = {c['name'] for c in inspector.get_columns(table.name)}
+        with engine.begin() as conn:
+            for name, ddl in added:
+                if name not in cols:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {name} {ddl}'))
+        for idx in table.indexes:
+            idx.create(engine, checkfirst=True)
+
 
 def init_from_env(db_url: Optional[str] = None) -> bool:
     """Initialize DB connection from environment or provided URL.
     Returns True if engine available.
+
+    The engine (and its connection pool) is a process-wide singleton and the
+    schema is created only when it is first built. Repeated calls with the same
+    URL return immediately; a failed URL is retried after INIT_RETRY_SECONDS.
     """
-    global _engine, _metadata, _tables
+    global _engine, _engine_url, _metadata, _tables
+    _counters['init_calls'] += 1
     if create_engine is None:
         return False
     url = db_url or os.environ.get('RENDER_DATABASE_URL') or os.environ.get('DATABASE_URL')
     if not url:
         return False
-    try:
-        _engine = create_engine(url, connect_args={})
-        _metadata = MetaData()
-
-        # Define tables
-        exams = Table('exams_metadata', _metadata,
-                      Column('exam_id', String, primary_key=True),
-                      Column('school_id', String, index=True),
-                      Column('metadata', JSONB))
-
-        files = Table('exam_files', _metadata,
-                      Column('id', Integer, primary_key=True, autoincrement=True),
-                      Column('exam_id', String, index=True),
-                      Column('school_id', String, index=True),
-                      Column('filename', String),
-                      Column('data', LargeBinary),
-                      Column('mimetype', String),
-                      Column('created_at', String))
-
-        kv = Table('kv_store', _metadata,
-                   Column('key', String, primary_key=True),
-                   Column('value', JSONB))
-
-        _tables = {'exams': exams, 'files': files, 'kv': kv}
-
-        # create tables if missing
-        _metadata.create_all(_engine)
+    if _engine is not None and url == _engine_url:
         return True
-    except Exception:
-        _engine = None
+    if time.time() - _failed_at.get(url, 0.0) < INIT_RETRY_SECONDS:
         return False
+    with _init_lock:
+        if _engine is not None and url == _engine_url:
+            return True
+        try:
+            kwargs = {'pool_pre_ping': True}
+            if not url.startswith('sqlite'):
+                kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                              pool_timeout=POOL_TIMEOUT, pool_recycle=POOL_RECYCLE)
+            engine = create_engine(url, **kwargs)
+            metadata = MetaData()
+            tables = _build_tables(metadata)
+            # create tables if missing
+            metadata.create_all(engine)
+            _upgrade_schema(engine, tables)
+        except Exception:
+            _failed_at[url] = time.time()
+            return False
+        old = _engine
+        _engine, _engine_url, _metadata, _tables = engine, url, metadata, tables
+        _failed_at.pop(url, None)
+        _counters['engine_builds'] += 1
+        if old is not None:
+            try:
+                old.dispose()
+            except Exception:
+                pass
+        return True
 
 
 def enabled() -> bool:
     return _engine is not None
 
 
+def engine():
+    """The shared engine (None until init_from_env succeeds)."""
+    return _engine
+
+
+def table(name: str):
+    """A table built by _build_tables ('exams', 'files', 'kv', 'messages', ...)."""
+    return _tables.get(name)
+
+
+def dispose():
+    """Close all pooled connections and forget the engine (next init_from_env rebuilds it)."""
+    global _engine, _engine_url
+    with _init_lock:
+        if _engine is not None:
+            try:
+                _engine.dispose()
+            except Exception:
+                pass
+        _engine, _engine_url = None, None
+
+
+@contextmanager
+def session():
+    """Run several helpers in one transaction::
+
+        with db.session():
+            db.save_exam_metadata(...)
+            db.save_exam_file(...)
+
+    Helpers called inside the block (same thread) share one pooled connection.
+    The transaction commits on exit; if any helper or the block itself fails,
+    everything is rolled back and the first error is raised. Nested calls join
+    the outer transaction.
+    """
+    if not enabled():
+        raise RuntimeError('database not initialized')
+    state = getattr(_local, 'state', None)
+    if state is not None:
+        yield state['conn']
+        return
+    _counters['sessions'] += 1
+    with _engine.connect() as conn:
+        trans = conn.begin()
+        state = {'conn': conn, 'error': None}
+        _local.state = state
+        try:
+            yield conn
+            if state['error'] is not None:
+                raise state['error']
+            trans.commit()
+            _counters['transactions'] += 1
+        except BaseException:
+            trans.rollback()
+            _counters['rollbacks'] += 1
+            raise
+        finally:
+            _local.state = None
+
+
+@contextmanager
+def _conn():
+    """Connection for one helper call: the active session()'s connection, or a
+    pooled connection in its own short transaction."""
+    state = getattr(_local, 'state', None)
+    if state is not None:
+        try:
+            yield state['conn']
+        except Exception as e:
+            if state['error'] is None:
+                state['error'] = e
+            raise
+        return
+    with _engine.begin() as conn:
+        yield conn
+    _counters['transactions'] += 1
+
+
+def _upsert(conn, tbl, rows: List[Dict[str, Any]], key: str, update_cols: Tuple[str, ...], overwrite: bool = True):
+    """Insert ``rows`` into ``tbl`` in one ``INSERT ... ON CONFLICT (key)``
+    statement: existing rows get ``update_cols`` replaced (or are left alone when
+    ``overwrite`` is False). Dialects without ON CONFLICT fall back to
+    per-row SELECT then UPDATE/INSERT on the same connection."""
+    if not rows:
+        return
+    insert = {'postgresql': _pg_insert, 'sqlite': _sqlite_insert}.get(_engine.dialect.name)
+    if insert is not None:
+        stmt = insert(tbl).values(rows)
+        if overwrite:
+            stmt = stmt.on_conflict_do_update(index_elements=[key],
+                                              set_={c: stmt.excluded[c] for c in update_cols})
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[key])
+        conn.execute(stmt)
+        return
+    col = tbl.c[key]
+    for row in rows:
+        found = conn.execute(select(col).where(col == row[key])).fetchone()
+        if found is None:
+            conn.execute(tbl.insert().values(**row))
+        elif overwrite:
+            conn.execute(tbl.update().where(col == row[key]).values(**{c: row[c] for c in update_cols}))
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Connection-pool and transaction counters for monitoring."""
+    out = dict(_counters)
+    out['enabled'] = enabled()
+    if _engine is None:
+        return out
+    pool = _engine.pool
+    out['pool_class'] = type(pool).__name__
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            try:
+                out[name] = fn()
+            except Exception:
+                pass
+    try:
+        out['status'] = pool.status()
+    except Exception:
+        pass
+    return out
+
+
 def save_exam_metadata(school_id: str, exam_id: str, metadata: Dict[str, Any]) -> bool:
     """Upsert exam metadata for an exam_id and school_id."""
     if not enabled():
         return False
     try:
         tbl = _tables['exams']
-        conn = _engine.connect()
-        stmt = select([tbl.c.exam_id]).where(tbl.c.exam_id == exam_id)
-        res = conn.execute(stmt).fetchone()
         payload = dict(metadata)
         payload['saved_at'] = datetime.utcnow().isoformat()
-        if res:
-            upd = tbl.update().where(tbl.c.exam_id == exam_id).values(metadata=payload, school_id=school_id)
-            conn.execute(upd)
-        else:
-            ins = tbl.insert().values(exam_id=exam_id, school_id=school_id, metadata=payload)
-            conn.execute(ins)
-        conn.close()
+        with _conn() as conn:
+            _upsert(conn, tbl, [{'exam_id': exam_id, 'school_id': school_id, 'metadata': payload}],
+                    'exam_id', ('school_id', 'metadata'))
         return True
     except Exception:
         return False
@@ -91,16 +457,15 @@ def list_exams(school_id: Optional[str] = None) -> List[Dict[str, Any]]:
         return []
     try:
         tbl = _tables['exams']
-        conn = _engine.connect()
         if school_id:
-            stmt = select([tbl]).where(tbl.c.school_id == school_id)
+            stmt = select(tbl).where(tbl.c.school_id == school_id)
         else:
-            stmt = select([tbl])
-        res = conn.execute(stmt).fetchall()
+            stmt = select(tbl)
+        with _conn() as conn:
+            res = conn.execute(stmt).mappings().fetchall()
         out = []
         for r in res:
             out.append({'exam_id': r['exam_id'], 'school_id': r['school_id'], 'metadata': r['metadata']})
-        conn.close()
         return out
     except Exception:
         return []
@@ -111,63 +476,176 @@ def get_exam_metadata(exam_id: str) -> Optional[Dict[str, Any]]:
         return None
     try:
         tbl = _tables['exams']
-        conn = _engine.connect()
-        stmt = select([tbl.c.metadata]).where(tbl.c.exam_id == exam_id)
-        res = conn.execute(stmt).fetchone()
-        conn.close()
+        stmt = select(tbl.c.metadata).where(tbl.c.exam_id == exam_id)
+        with _conn() as conn:
+            res = conn.execute(stmt).fetchone()
         return res[0] if res else None
     except Exception:
         return None
 
 
-def save_exam_file(school_id: str, exam_id: str, filename: str, data: bytes, mimetype: str = '') -> bool:
+def save_exam_file(school_id: str, exam_id: str, filename: str, data: bytes, mimetype: str = '',
+                   supersedes: Iterable[str] = ()) -> bool:
+    """Store a new version of ``filename`` for an exam.
+
+    Payloads identical to the latest stored version (same sha256) are skipped.
+    Otherwise the version number is bumped and versions beyond
+    EXAM_FILE_VERSIONS_KEPT are pruned in the same transaction. Every version
+    of the filenames in ``supersedes`` (the same frame saved in another format)
+    is deleted, so readers cannot pick up the older copy.
+    """
     if not enabled():
         return False
     try:
         tbl = _tables['files']
-        conn = _engine.connect()
-        ins = tbl.insert().values(exam_id=exam_id, school_id=school_id, filename=filename, data=data, mimetype=mimetype, created_at=datetime.utcnow().isoformat())
-        conn.execute(ins)
-        conn.close()
+        digest = hashlib.sha256(data or b'').hexdigest()
+        others = [f for f in supersedes if f != filename]
+        with _conn() as conn:
+            if others:
+                conn.execute(tbl.delete().where(tbl.c.exam_id == exam_id, tbl.c.filename.in_(others)))
+            latest = conn.execute(
+                select(tbl.c.version, tbl.c.content_hash)
+                .where(tbl.c.exam_id == exam_id, tbl.c.filename == filename)
+                .order_by(tbl.c.id.desc()).limit(1)
+            ).fetchone()
+            if latest is not None and latest[1] == digest:
+                return True
+            version = (latest[0] or 0) + 1 if latest is not None else 1
+            conn.execute(tbl.insert().values(exam_id=exam_id, school_id=school_id, filename=filename, data=data,
+                                             mimetype=mimetype, created_at=datetime.utcnow().isoformat(),
+                                             content_hash=digest, version=version))
+            _prune_locked(conn, exam_id, filename)
         return True
     except Exception:
         return False
 
 
+def _prune_locked(conn, exam_id: str, filename: Optional[str] = None, keep: Optional[int] = None) -> int:
+    """Delete all but the newest ``keep`` versions per filename of one exam."""
+    tbl = _tables['files']
+    keep = max(1, keep or EXAM_FILE_VERSIONS_KEPT)
+    cond = [tbl.c.exam_id == exam_id]
+    if filename is not None:
+        cond.append(tbl.c.filename == filename)
+    rows = conn.execute(select(tbl.c.id, tbl.c.filename).where(*cond).order_by(tbl.c.id.desc())).fetchall()
+    seen: Dict[str, int] = {}
+    stale = []
+    for rid, fname in rows:
+        seen[fname] = seen.get(fname, 0) + 1
+        if seen[fname] > keep:
+            stale.append(rid)
+    if stale:
+        conn.execute(tbl.delete().where(tbl.c.id.in_(stale)))
+    return len(stale)
+
+
+def prune_exam_files(exam_id: Optional[str] = None, keep: Optional[int] = None) -> int:
+    """Apply the retention policy to one exam (or every exam when ``exam_id`` is
+    None). Returns the number of deleted rows."""
+    if not enabled():
+        return 0
+    try:
+        tbl = _tables['files']
+        removed = 0
+        with _conn() as conn:
+            if exam_id is not None:
+                ids = [exam_id]
+            else:
+                ids = [r[0] for r in conn.execute(select(tbl.c.exam_id).distinct()).fetchall()]
+            for eid in ids:
+                removed += _prune_locked(conn, eid, keep=keep)
+        return removed
+    except Exception:
+        return 0
+
+
+def delete_exam_files(exam_id: str) -> bool:
+    """Remove every stored file (all versions) of an exam."""
+    if not enabled():
+        return False
+    try:
+        tbl = _tables['files']
+        with _conn() as conn:
+            conn.execute(tbl.delete().where(tbl.c.exam_id == exam_id))
+        return True
+    except Exception:
+        return False
+
+
+def _latest_ids(tbl, *cond):
+    # newest row per (exam_id, filename); ids grow with every saved version
+    return select(func.max(tbl.c.id)).where(*cond).group_by(tbl.c.exam_id, tbl.c.filename)
+
+
 def get_exam_files(exam_id: str) -> List[Tuple[str, bytes, str]]:
-    """Return list of (filename, data, mimetype) for an exam."""
+    """Return list of (filename, data, mimetype) for an exam (latest version of each file)."""
     if not enabled():
         return []
     try:
         tbl = _tables['files']
-        conn = _engine.connect()
-        stmt = select([tbl.c.filename, tbl.c.data, tbl.c.mimetype]).where(tbl.c.exam_id == exam_id)
-        res = conn.execute(stmt).fetchall()
-        conn.close()
+        stmt = (select(tbl.c.filename, tbl.c.data, tbl.c.mimetype)
+                .where(tbl.c.id.in_(_latest_ids(tbl, tbl.c.exam_id == exam_id))))
+        with _conn() as conn:
+            res = conn.execute(stmt).fetchall()
         out = []
         for r in res:
-            out.append((r['filename'], r['data'], r['mimetype']))
+            out.append((r[0], r[1], r[2]))
         return out
     except Exception:
         return []
 
 
+def get_exam_files_many(exam_ids: List[str], timings: Optional[Dict[str, float]] = None) -> Dict[str, List[Tuple[str, bytes, str]]]:
+    """Return {exam_id: [(filename, data, mimetype), ...]} (latest versions) for
+    many exams using a single ``IN (...)`` query. When ``timings`` is given, each exam_id is mapped
+    to the elapsed seconds of the shared query.
+    """
+    ids = [str(e) for e in dict.fromkeys(exam_ids or [])]
+    out = {eid: [] for eid in ids}
+    if not enabled() or not ids:
+        return out
+    try:
+        tbl = _tables['files']
+        t0 = time.perf_counter()
+        stmt = (select(tbl.c.exam_id, tbl.c.filename, tbl.c.data, tbl.c.mimetype)
+                .where(tbl.c.id.in_(_latest_ids(tbl, tbl.c.exam_id.in_(ids)))))
+        with _conn() as conn:
+            res = conn.execute(stmt).fetchall()
+        elapsed = time.perf_counter() - t0
+        for r in res:
+            out.setdefault(r[0], []).append((r[1], r[2], r[3]))
+        if timings is not None:
+            for eid in ids:
+                timings[eid] = elapsed
+        return out
+    except Exception:
+        return out
+
+
 def set_kv(key: str, value: Any) -> bool:
     if not enabled():
         return False
     try:
         tbl = _tables['kv']
-        conn = _engine.connect()
-        stmt = select([tbl.c.key]).where(tbl.c.key == key)
-        res = conn.execute(stmt).fetchone()
-        payload = value
-        if res:
-            upd = tbl.update().where(tbl.c.key == key).values(value=payload)
-            conn.execute(upd)
-        else:
-            ins = tbl.insert().values(key=key, value=payload)
-            conn.execute(ins)
-        conn.close()
+        with _conn() as conn:
+            _upsert(conn, tbl, [{'key': key, 'value': value}], 'key', ('value',))
+        return True
+    except Exception:
+        return False
+
+
+def set_kv_many(items: Dict[str, Any], overwrite: bool = True) -> bool:
+    """Upsert many keys with a single statement. With ``overwrite=False`` only
+    missing keys are inserted and existing values are kept."""
+    if not enabled():
+        return False
+    if not items:
+        return True
+    try:
+        tbl = _tables['kv']
+        rows = [{'key': k, 'value': v} for k, v in items.items()]
+        with _conn() as conn:
+            _upsert(conn, tbl, rows, 'key', ('value',), overwrite=overwrite)
         return True
     except Exception:
         return False
@@ -178,10 +656,9 @@ def get_kv(key: str) -> Any:
         return None
     try:
         tbl = _tables['kv']
-        conn = _engine.connect()
-        stmt = select([tbl.c.value]).where(tbl.c.key == key)
-        res = conn.execute(stmt).fetchone()
-        conn.close()
+        stmt = select(tbl.c.value).where(tbl.c.key == key)
+        with _conn() as conn:
+            res = conn.execute(stmt).fetchone()
         return res[0] if res else None
     except Exception:
         return None
@@ -0,0 +1,647 @@
+"""Process-wide cache of saved exam payloads shared by every Streamlit session.
+
+Pages used to unpickle every exam of a school into ``st.session_state`` so each
+browser tab held its own full copy of the school's history. This module keeps a
+single in-process store keyed by ``(school_id, exam_id, version)`` where
+``version`` is a short hash of the exam's metadata entry (which changes whenever
+the exam is re-saved). Payloads are loaded on first access, shared read-only by
+all sessions and evicted least-recently-used once the byte budget is exceeded.
+
+Session state no longer holds DataFrames: ``attach_session`` installs small
+dict-like views under the legacy keys (``saved_exam_data``,
+``saved_exam_raw_data`` and ``saved_exam_configs``) that fetch by exam id from
+the shared store, so existing page code keeps working unchanged. Values a
+page assigns through a view stay in that session until the exam is saved
+(``save_exam_to_disk`` puts the new version and calls ``register``), so other
+sessions never see unsaved edits.
+
+Each session also gets ``saved_exam_handles``, a metadata-only index of
+``ExamHandle`` objects whose ``.data``/``.raw``/``.config`` load on first
+touch, so opening a page costs O(metadata) rather than O(all pickles).
+
+Environment variables:
+  - EXAM_STORE_MAX_BYTES (default 536870912 / 512 MiB)
+  - EXAM_STORE_MAX_ENTRIES (default 256)
+  - EXAM_STORE_LAZY (default true)
+"""
+from __future__ import annotations
+import os
+import json
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Optional, Dict, Any, Tuple
+
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+try:
+    from . import storage
+except Exception:
+    storage = None
+try:
+    from . import db as _db
+except Exception:
+    _db = None
+
+
+MAX_BYTES = int(os.environ.get('EXAM_STORE_MAX_BYTES', str(512 * 1024 * 1024)))
+MAX_ENTRIES = int(os.environ.get('EXAM_STORE_MAX_ENTRIES', '256'))
+# Lazy mode (default): sessions get metadata immediately and payloads load on
+# first access. Set EXAM_STORE_LAZY=0 to warm the store for every exam on login.
+LAZY = os.environ.get('EXAM_STORE_LAZY', 'true').lower() in ('1', 'true', 'yes')
+
+PARTS = ('data', 'raw', 'config')
+# logical file names; frames may be stored as .feather/.parquet (see storage.frame_keys)
+PART_FILES = {'data': 'data.pkl', 'raw': 'raw_data.pkl', 'config': 'config.json'}
+# session_state keys the pages have always used, mapped to store parts
+SESSION_KEYS = {
+    'saved_exam_data': 'data',
+    'saved_exam_raw_data': 'raw',
+    'saved_exam_configs': 'config',
+}
+
+_MISSING = object()
+
+_lock = threading.RLock()
+# (school_id, exam_id, version) -> {'data': ..., 'raw': ..., 'config': ..., 'nbytes': int}
+_entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+# (school_id, exam_id) -> version of the most recent explicit save
+_latest: Dict[Tuple[str, str], str] = {}
+# one lock per exam so concurrent sessions don't load the same exam twice
+_load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_total_bytes = 0
+_stats = {'hits': 0, 'misses': 0, 'loads': 0, 'evictions': 0}
+
+
+def content_version(metadata: Optional[Dict[str, Any]]) -> str:
+    """Return a short, stable hash of an exam's metadata entry."""
+    try:
+        raw = json.dumps(metadata or {}, sort_keys=True, default=str).encode('utf-8')
+    except Exception:
+        raw = repr(metadata).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def _freeze(obj):
+    """Mark the numpy buffers behind a DataFrame read-only (best-effort).
+
+    Shared frames must never be modified in place; callers that need to edit
+    a frame take a ``.copy()`` first, which yields writable buffers again.
+    """
+    if pd is None or np is None or not isinstance(obj, pd.DataFrame):
+        return obj
+    try:
+        for blk in obj._mgr.blocks:
+            vals = getattr(blk, 'values', None)
+            if isinstance(vals, np.ndarray):
+                vals.flags.writeable = False
+    except Exception:
+        pass
+    return obj
+
+
+def _sizeof(value) -> int:
+    if value is None or value is _MISSING:
+        return 0
+    try:
+        if pd is not None and isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(index=True, deep=True).sum())
+    except Exception:
+        pass
+    try:
+        return len(json.dumps(value, default=str))
+    except Exception:
+        return 0
+
+
+def _entry_bytes(entry: Dict[str, Any]) -> int:
+    return sum(_sizeof(entry.get(p)) for p in PARTS)
+
+
+def _evict_locked():
+    global _total_bytes
+    while _entries and (_total_bytes > MAX_BYTES or len(_entries) > MAX_ENTRIES):
+        # never evict the entry that was just touched if it is the only one
+        if len(_entries) == 1:
+            break
+        _, old = _entries.popitem(last=False)
+        _total_bytes -= old.get('nbytes', 0)
+        _stats['evictions'] += 1
+
+
+def _store_locked(key: Tuple[str, str, str], entry: Dict[str, Any]):
+    global _total_bytes
+    prev = _entries.pop(key, None)
+    if prev is not None:
+        _total_bytes -= prev.get('nbytes', 0)
+    for p in PARTS:
+        if p in ('data', 'raw'):
+            _freeze(entry.get(p))
+    entry['nbytes'] = _entry_bytes(entry)
+    _entries[key] = entry
+    _total_bytes += entry['nbytes']
+    _evict_locked()
+
+
+def _read_pickle_bytes(b: bytes):
+    if not b:
+        return None
+    if pd is not None:
+        return pd.read_pickle(BytesIO(b))
+    import pickle
+    return pickle.loads(b)
+
+
+def _want(parts) -> Tuple[str, ...]:
+    return tuple(p for p in PARTS if p in (parts or PARTS))
+
+
+def _candidates(exam_id: str, part: str):
+    """Storage keys that may hold ``part``, in read order (columnar before .pkl)."""
+    key = f"{exam_id}/{PART_FILES[part]}"
+    if part == 'config' or storage is None:
+        return [key]
+    return storage.frame_keys(key)
+
+
+def _decode(part: str, b: Optional[bytes]):
+    if not b:
+        return None
+    try:
+        if part == 'config':
+            return json.loads(b.decode('utf-8'))
+        if storage is not None:
+            return storage.loads_frame(b)
+        return _read_pickle_bytes(b)
+    except Exception:
+        return None
+
+
+def _load_local(exam_id: str, parts, storage_dir: Optional[str]) -> Dict[str, Any]:
+    out = {}
+    if not storage_dir:
+        return out
+    for p in parts:
+        for rel in _candidates(exam_id, p):
+            try:
+                path = os.path.join(storage_dir, rel)
+                if not os.path.exists(path):
+                    continue
+                with open(path, 'rb') as fh:
+                    out[p] = _decode(p, fh.read())
+                break
+            except Exception:
+                pass
+    return out
+
+
+def load_many_from_backend(wanted: Dict[str, Tuple[str, ...]], storage_dir: Optional[str] = None,
+                           timings: Optional[Dict[str, float]] = None) -> Dict[str, Dict[str, Any]]:
+    """Batch-read ``{exam_id: parts}`` from the DB (one ``IN (...)`` query),
+    the storage adapter (parallel ``read_many``) or the local per-school
+    folder, in that order. Returns ``{exam_id: {part: value or None}}``.
+    Per-key read timings are written into ``timings`` when provided.
+    """
+    out = {str(eid): {p: None for p in _want(parts)} for eid, parts in wanted.items()}
+    pending = dict(out)
+
+    db_ok = False
+    try:
+        if _db is not None:
+            _db.init_from_env()
+            db_ok = _db.enabled()
+    except Exception:
+        db_ok = False
+    if db_ok and pending:
+        try:
+            files = _db.get_exam_files_many(list(pending), timings=timings)
+            for eid, rows in files.items():
+                res = pending.get(eid)
+                if res is None:
+                    continue
+                blobs = {fname: data for fname, data, _mimetype in rows}
+                for p in res:
+                    for key in _candidates(eid, p):
+                        fname = key.split('/', 1)[1]
+                        if blobs.get(fname):
+                            res[p] = _decode(p, blobs[fname])
+                            break
+        except Exception:
+            pass
+        pending = {eid: res for eid, res in pending.items() if all(v is None for v in res.values())}
+
+    if storage is not None and pending:
+        # One parallel round per candidate format: columnar keys first, then
+        # legacy .pkl for whatever was not found.
+        todo = [(eid, p, _candidates(eid, p)) for eid, res in pending.items() for p in res]
+        while todo:
+            keys = {cands[0]: (eid, p) for eid, p, cands in todo}
+            try:
+                blobs = storage.read_many(list(keys), timings=timings)
+            except Exception:
+                blobs = {}
+            for key, (eid, p) in keys.items():
+                if blobs.get(key):
+                    pending[eid][p] = _decode(p, blobs[key])
+            todo = [(eid, p, cands[1:]) for eid, p, cands in todo
+                    if not blobs.get(cands[0]) and len(cands) > 1]
+        pending = {eid: res for eid, res in pending.items() if all(v is None for v in res.values())}
+
+    # Local fallback: per-school cache folder
+    for eid, res in pending.items():
+        res.update(_load_local(eid, tuple(res), storage_dir))
+    return out
+
+
+def load_from_backend(exam_id: str, parts=PARTS, storage_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Read the requested parts of one exam (see ``load_many_from_backend``).
+    Missing parts are returned as None; parts that were not requested are omitted.
+    """
+    eid = str(exam_id)
+    return load_many_from_backend({eid: _want(parts)}, storage_dir=storage_dir).get(eid, {})
+
+
+def part_exists(exam_id: str, part: str, storage_dir: Optional[str] = None) -> bool:
+    """Cheap existence check for one stored part (no payload is deserialized
+    for the storage adapter or local folders)."""
+    eid = str(exam_id)
+    try:
+        if _db is not None:
+            _db.init_from_env()
+            if _db.enabled():
+                return load_from_backend(eid, (part,), storage_dir=storage_dir).get(part) is not None
+    except Exception:
+        pass
+    for key in _candidates(eid, part):
+        try:
+            if storage is not None and storage.exists(key):
+                return True
+        except Exception:
+            pass
+        if storage_dir and os.path.exists(os.path.join(storage_dir, key)):
+            return True
+    return False
+
+
+def latest_version(school_id: str, exam_id: str) -> Optional[str]:
+    """Version recorded by the most recent ``put`` for this exam, if any."""
+    with _lock:
+        return _latest.get((str(school_id), str(exam_id)))
+
+
+def peek(school_id: str, exam_id: str, part: str, version: Optional[str] = None):
+    """Return a cached part without loading it (``_MISSING`` is mapped to None)."""
+    sid, eid = str(school_id), str(exam_id)
+    with _lock:
+        ver = version or _latest.get((sid, eid)) or ''
+        entry = _entries.get((sid, eid, ver))
+        if entry is None:
+            return None
+        val = entry.get(part, _MISSING)
+        return None if val is _MISSING else val
+
+
+def get(school_id: str, exam_id: str, version: Optional[str] = None,
+        storage_dir: Optional[str] = None, parts=PARTS) -> Dict[str, Any]:
+    """Return the shared payload dict for an exam, loading only the requested
+    ``parts`` that are not cached yet.
+
+    Returned DataFrames are shared between sessions and must be treated as
+    read-only.
+    """
+    sid, eid = str(school_id), str(exam_id)
+    parts = _want(parts)
+    with _lock:
+        ver = version or _latest.get((sid, eid)) or ''
+        key = (sid, eid, ver)
+        entry = _entries.get(key)
+        if entry is not None and all(entry.get(p, _MISSING) is not _MISSING for p in parts):
+            _entries.move_to_end(key)
+            _stats['hits'] += 1
+            return entry
+        _stats['misses'] += 1
+        load_lock = _load_locks.setdefault((sid, eid), threading.Lock())
+
+    with load_lock:
+        # another session may have loaded it while we waited
+        with _lock:
+            entry = _entries.get(key) or {}
+            missing = tuple(p for p in parts if entry.get(p, _MISSING) is _MISSING)
+            if not missing:
+                _entries.move_to_end(key)
+                return entry
+        try:
+            loaded = load_from_backend(eid, missing, storage_dir=storage_dir)
+        except Exception:
+            loaded = {}
+        with _lock:
+            return _merge_locked(key, missing, loaded)
+
+
+def _merge_locked(key: Tuple[str, str, str], missing, loaded: Dict[str, Any]) -> Dict[str, Any]:
+    _stats['loads'] += 1
+    merged = dict(_entries.get(key) or {p: _MISSING for p in PARTS})
+    for p in missing:
+        # parts set explicitly by a session take precedence over disk
+        if merged.get(p, _MISSING) is _MISSING:
+            merged[p] = loaded.get(p)
+    _store_locked(key, merged)
+    return merged
+
+
+def prefetch(school_id: str, exam_ids, versions: Optional[Dict[str, str]] = None,
+             storage_dir: Optional[str] = None, parts=PARTS,
+             timings: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """Warm the store for many exams with one batched backend read instead of
+    a round trip per file. Returns the per-key timings of the batch.
+    """
+    sid = str(school_id)
+    parts = _want(parts)
+    versions = versions or {}
+    timings = {} if timings is None else timings
+    todo = {}
+    with _lock:
+        for eid in exam_ids:
+            eid = str(eid)
+            ver = versions.get(eid) or _latest.get((sid, eid)) or ''
+            entry = _entries.get((sid, eid, ver)) or {}
+            missing = tuple(p for p in parts if entry.get(p, _MISSING) is _MISSING)
+            if missing:
+                todo[eid] = (ver, missing)
+    if not todo:
+        return timings
+    try:
+        loaded = load_many_from_backend({eid: m for eid, (_v, m) in todo.items()},
+                                        storage_dir=storage_dir, timings=timings)
+    except Exception:
+        loaded = {}
+    with _lock:
+        for eid, (ver, missing) in todo.items():
+            _merge_locked((sid, eid, ver), missing, loaded.get(eid) or {})
+    return timings
+
+
+def put(school_id: str, exam_id: str, data=_MISSING, raw=_MISSING, config=_MISSING,
+        version: Optional[str] = None):
+    """Record freshly saved payloads for an exam and drop superseded versions.
+
+    Parts left as the default are kept from the existing entry (or loaded lazily
+    on the next ``get``).
+    """
+    sid, eid = str(school_id), str(exam_id)
+    with _lock:
+        ver = version or _latest.get((sid, eid)) or ''
+        key = (sid, eid, ver)
+        entry = dict(_entries.get(key) or {p: _MISSING for p in PARTS})
+        for p, val in (('data', data), ('raw', raw), ('config', config)):
+            if val is not _MISSING:
+                entry[p] = val
+        _drop_locked(sid, eid, keep=key)
+        _latest[(sid, eid)] = ver
+        _store_locked(key, entry)
+
+
+def _drop_locked(sid: str, eid: str, keep=None):
+    global _total_bytes
+    for k in [k for k in _entries if k[0] == sid and k[1] == eid and k != keep]:
+        _total_bytes -= _entries.pop(k).get('nbytes', 0)
+
+
+def invalidate(school_id: str, exam_id: Optional[str] = None):
+    """Forget cached payloads for one exam, or for a whole school."""
+    global _total_bytes
+    sid = str(school_id)
+    with _lock:
+        if exam_id is None:
+            for k in [k for k in _entries if k[0] == sid]:
+                _total_bytes -= _entries.pop(k).get('nbytes', 0)
+            for k in [k for k in _latest if k[0] == sid]:
+                _latest.pop(k, None)
+            return
+        _drop_locked(sid, str(exam_id))
+        _latest.pop((sid, str(exam_id)), None)
+
+
+def clear():
+    """Drop every cached exam (all schools)."""
+    global _total_bytes
+    with _lock:
+        _entries.clear()
+        _latest.clear()
+        _total_bytes = 0
+
+
+def stats() -> Dict[str, Any]:
+    """Return cache counters for diagnostics pages and logs."""
+    with _lock:
+        out = dict(_stats)
+        out.update({'entries': len(_entries), 'bytes': _total_bytes,
+                    'max_bytes': MAX_BYTES, 'max_entries': MAX_ENTRIES})
+        return out
+
+
+class ExamHandle:
+    """Metadata for one saved exam plus lazily loaded payloads.
+
+    ``handle.metadata`` is available immediately; ``handle.data``, ``.raw`` and
+    ``.config`` are read from the shared store (and from storage on a miss)
+    only when first touched.
+    """
+
+    def __init__(self, school_id: str, exam_id: str, metadata: Dict[str, Any],
+                 versions: Dict[str, str], storage_dir: Optional[str] = None):
+        self.school_id = str(school_id or 'global')
+        self.exam_id = str(exam_id)
+        self.metadata = metadata if isinstance(metadata, dict) else {}
+        self._versions = versions
+        self._storage_dir = storage_dir
+
+    @property
+    def version(self) -> str:
+        return self._versions.get(self.exam_id) or ''
+
+    def _part(self, part: str):
+        entry = get(self.school_id, self.exam_id, self.version,
+                    storage_dir=self._storage_dir, parts=(part,))
+        val = entry.get(part)
+        return None if val is _MISSING else val
+
+    @property
+    def data(self):
+        return self._part('data')
+
+    @property
+    def raw(self):
+        return self._part('raw')
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        cfg = self._part('config')
+        return dict(cfg) if isinstance(cfg, dict) else {}
+
+    def is_loaded(self, part: str) -> bool:
+        """True if ``part`` is already cached (never triggers a load)."""
+        return peek(self.school_id, self.exam_id, part, self.version) is not None
+
+    def has(self, part: str) -> bool:
+        """True if ``part`` is cached or present in storage (no deserialization)."""
+        return self.is_loaded(part) or part_exists(self.exam_id, part, storage_dir=self._storage_dir)
+
+    def __repr__(self):
+        return f"ExamHandle({self.exam_id!r}, {self.metadata.get('exam_name', '')!r})"
+
+
+class ExamPartView(MutableMapping):
+    """Dict-like view of one part of the shared store for a single session.
+
+    Reading ``view[exam_id]`` fetches only that part from the process-wide
+    store (loading on a miss); ``exam_id in view`` checks the cache or storage
+    without deserializing; assigning keeps the value for this session only
+    until the exam is saved and ``register``ed; deleting only hides the exam
+    from this session (use ``invalidate`` after deleting it from disk).
+    """
+
+    def __init__(self, school_id: str, part: str, versions: Dict[str, str],
+                 storage_dir: Optional[str] = None):
+        self._sid = str(school_id or 'global')
+        self._part = part
+        # shared between the views and handles of one session
+        self._versions = versions
+        self._storage_dir = storage_dir
+        self._hidden = set()
+        # unsaved values assigned in this session (dropped by register after a save)
+        self._overlay = {}
+
+    def _visible(self, eid: str) -> bool:
+        return eid not in self._hidden and (eid in self._overlay or eid in self._versions)
+
+    def _value(self, exam_id):
+        eid = str(exam_id)
+        if not self._visible(eid):
+            return None
+        if eid in self._overlay:
+            val = self._overlay[eid]
+        else:
+            entry = get(self._sid, eid, self._versions.get(eid), storage_dir=self._storage_dir,
+                        parts=(self._part,))
+            val = entry.get(self._part)
+        if val is _MISSING:
+            return None
+        if self._part == 'config' and isinstance(val, dict):
+            # configs are small; hand out a copy so callers can't mutate the shared dict
+            return dict(val)
+        return val
+
+    def __getitem__(self, exam_id):
+        val = self._value(exam_id)
+        if val is None:
+            raise KeyError(exam_id)
+        return val
+
+    def __setitem__(self, exam_id, value):
+        eid = str(exam_id)
+        self._hidden.discard(eid)
+        self._overlay[eid] = value
+
+    def __delitem__(self, exam_id):
+        eid = str(exam_id)
+        if not self._visible(eid):
+            raise KeyError(exam_id)
+        self._overlay.pop(eid, None)
+        self._hidden.add(eid)
+
+    def __contains__(self, exam_id):
+        eid = str(exam_id)
+        if not self._visible(eid):
+            return False
+        if eid in self._overlay:
+            return self._overlay[eid] is not None
+        with _lock:
+            entry = _entries.get((self._sid, eid, self._versions.get(eid) or ''))
+            cached = _MISSING if entry is None else entry.get(self._part, _MISSING)
+        if cached is not _MISSING:
+            return cached is not None
+        return part_exists(eid, self._part, storage_dir=self._storage_dir)
+
+    def __iter__(self):
+        for eid in list(self._versions) + [e for e in self._overlay if e not in self._versions]:
+            if eid in self:
+                yield eid
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"ExamPartView({self._sid!r}, {self._part!r}, {len(self._versions)} exams)"
+
+
+def attach_session(session_state, school_id: Optional[str], all_metadata: Dict[str, Any],
+                   storage_dir: Optional[str] = None):
+    """Populate ``saved_exams`` and the metadata-only ``saved_exam_handles``
+    index, and install shared-store views under the legacy ``saved_exam_*``
+    session keys. No payloads are read unless EXAM_STORE_LAZY is disabled.
+    """
+    all_metadata = all_metadata if isinstance(all_metadata, dict) else {}
+    session_state.saved_exams = [m for m in all_metadata.values()]
+    sid = str(school_id or 'global')
+    versions = {}
+    handles = {}
+    for exam_id, meta in all_metadata.items():
+        eid = str((meta or {}).get('exam_id') or exam_id) if isinstance(meta, dict) else str(exam_id)
+        versions[eid] = content_version(meta)
+        handles[eid] = ExamHandle(sid, eid, meta, versions, storage_dir=storage_dir)
+    session_state.saved_exam_handles = handles
+    for key, part in SESSION_KEYS.items():
+        session_state[key] = ExamPartView(sid, part, versions, storage_dir=storage_dir)
+    if not LAZY:
+        try:
+            prefetch(sid, list(handles), versions, storage_dir=storage_dir)
+        except Exception:
+            pass
+
+
+def register(session_state, exam_id: str, metadata: Dict[str, Any]) -> Optional[ExamHandle]:
+    """Add or refresh one exam in a session attached with ``attach_session``
+    (used after a save so the session's index and views see the new version)."""
+    view = session_state.get('saved_exam_data')
+    if not isinstance(view, ExamPartView):
+        return None
+    eid = str(exam_id)
+    view._versions[eid] = content_version(metadata)
+    for key in SESSION_KEYS:
+        v = session_state.get(key)
+        if isinstance(v, ExamPartView):
+            v._hidden.discard(eid)
+            v._overlay.pop(eid, None)
+    handle = ExamHandle(view._sid, eid, metadata, view._versions, storage_dir=view._storage_dir)
+    handles = session_state.get('saved_exam_handles')
+    if isinstance(handles, dict):
+        handles[eid] = handle
+    return handle
+
+
+def handle_for(session_state, exam_id: str) -> Optional[ExamHandle]:
+    """Return the session's handle for ``exam_id`` (None if unknown)."""
+    handles = session_state.get('saved_exam_handles')
+    if isinstance(handles, dict):
+        return handles.get(str(exam_id))
+    return None
+
+
+def prefetch_session(session_state, exam_ids, parts=PARTS) -> Dict[str, float]:
+    """Batch-load the given exams for a session attached with ``attach_session``
+    (e.g. before a page iterates over several selected exams)."""
+    view = session_state.get('saved_exam_data')
+    if not isinstance(view, ExamPartView):
+        return {}
+    ids = [str(e) for e in exam_ids if e and str(e) in view._versions]
+    return prefetch(view._sid, ids, view._versions, storage_dir=view._storage_dir, parts=parts)
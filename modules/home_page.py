@@ -341,8 +341,6 @@ def render_home_page():
             _storage = None
         if _storage is not None:
             # ensure keys exist in storage (use per-account paths so adapter targets the correct files)
-            if not _storage.exists(LOG_PATH):
-                _storage.write_json(LOG_PATH, [])
             if not _storage.exists(PURCHASES_PATH):
                 _storage.write_json(PURCHASES_PATH, [])
             if not _storage.exists(CREDITS_PATH):
@@ -350,8 +348,6 @@ def render_home_page():
         else:
             if not os.path.exists(STORAGE_DIR):
                 os.makedirs(STORAGE_DIR, exist_ok=True)
-            if not os.path.exists(LOG_PATH):
-                open(LOG_PATH, 'w', encoding='utf-8').write('[]')
             if not os.path.exists(PURCHASES_PATH):
                 open(PURCHASES_PATH, 'w', encoding='utf-8').write('[]')
             if not os.path.exists(CREDITS_PATH):
@@ -359,15 +355,21 @@ def render_home_page():
     except Exception:
         pass
 
-    # load logs and purchases
+    now = datetime.now()
+    # message counts come from the indexed store's running counters; without it, scan the log
+    message_counts = None
     try:
-        if _storage is not None:
-            sent_log = _storage.read_json(LOG_PATH) or []
-        else:
-            with open(LOG_PATH, 'r', encoding='utf-8') as f:
-                sent_log = json.load(f)
+        from modules import message_store as _message_store
+        message_counts = _message_store.counts(LOG_PATH, now)
     except Exception:
-        sent_log = []
+        message_counts = None
+    sent_log = []
+    if message_counts is None:
+        try:
+            from utils import message_log as _message_log
+            sent_log = list(_message_log.iter_entries(LOG_PATH))
+        except Exception:
+            sent_log = []
     try:
         if _storage is not None:
             purchases = _storage.read_json(PURCHASES_PATH) or []
@@ -385,7 +387,6 @@ def render_home_page():
     except Exception:
         credits = {}
 
-    now = datetime.now()
     def _is_same_day(ts):
         try:
             t = datetime.fromtimestamp(float(ts))
@@ -405,9 +406,14 @@ def render_home_page():
         except Exception:
             return False
 
-    sent_today = sum(1 for e in sent_log if _is_same_day(e.get('time')))
-    sent_month = sum(1 for e in sent_log if _is_same_month(e.get('time')))
-    sent_year = sum(1 for e in sent_log if _is_same_year(e.get('time')))
+    if message_counts is not None:
+        sent_today = message_counts['day']
+        sent_month = message_counts['month']
+        sent_year = message_counts['year']
+    else:
+        sent_today = sum(1 for e in sent_log if _is_same_day(e.get('time')))
+        sent_month = sum(1 for e in sent_log if _is_same_month(e.get('time')))
+        sent_year = sum(1 for e in sent_log if _is_same_year(e.get('time')))
 
     # messages purchased by account total
     total_purchased = sum((p.get('quantity') or 0) for p in purchases if isinstance(p, dict))
@@ -754,7 +760,7 @@ def render_home_page():
     num_classes = len(classes)
 
     # Cards — each with a solid color and consistent, modern layout. Also add message metric banners.
-    total_sent = len(sent_log)
+    total_sent = message_counts['total'] if message_counts is not None else len(sent_log)
     remaining_messages = max(int(total_purchased) - int(total_sent), 0)
 
 
@@ -0,0 +1,536 @@
+"""Background jobs for long-running exports (bulk report cards, PDF reports).
+
+A page calls ``submit(kind, args, kwargs)`` and keeps the returned job id in
+``st.session_state``; the work runs outside the Streamlit script, so reruns do
+not restart it and other sessions are not held up. The page then polls
+``get(job_id)`` (or draws ``show_job``) and offers the artifact when the job is
+done.
+
+  - Rows live in the app database when ``modules.db`` is enabled, otherwise in
+    ``saved_exams_storage/jobs.sqlite3`` (see ``db.job_tables``). Arguments are
+    pickled into the row, so anything a page passes must be picklable.
+  - ``KINDS`` maps a job kind to an importable ``'module:function'`` target.
+    A target returns the file content (bytes or a buffer) or, when registered
+    with ``writes_file``, writes to the path given as its first argument.
+    Targets registered with ``progress`` get ``on_progress(done, total)``.
+  - Jobs run in a process pool owned by the app process (``spawn`` workers,
+    JOBS_WORKERS of them) or in ``scripts/job_worker.py`` when the pool is off.
+    ``claim`` leases a job to one runner and a heartbeat renews the lease while
+    it runs; a job whose runner died is run again once its lease expires, up to
+    MAX_ATTEMPTS times, after which it is marked failed ("worker died").
+  - Artifacts go to JOBS_DIR/<job_id>/<file name>. With S3 storage they are
+    uploaded to ``jobs/<job_id>/<file name>`` and downloaded through a
+    presigned URL.
+  - ``prune`` drops finished jobs (and their files) older than KEEP_SECONDS.
+
+Environment variables:
+  - JOBS_WORKERS (default 2), JOBS_POOL (default on; ``off`` leaves jobs to
+    scripts/job_worker.py)
+  - JOBS_LEASE (default 120 seconds), JOBS_MAX_ATTEMPTS (default 2)
+  - JOBS_KEEP_SECONDS (default 86400)
+  - JOBS_STORE: ``auto`` (default: database if enabled, else SQLite) or
+    ``sqlite``
+"""
+from __future__ import annotations
+import atexit
+import importlib
+import multiprocessing
+import os
+import pickle
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    from sqlalchemy import and_, or_
+    from sqlalchemy.sql import select
+except Exception:
+    select = None
+
+try:
+    from . import db as _db
+except Exception:
+    _db = None
+try:
+    from . import storage as _storage
+    from .storage import BASE_STORAGE
+except Exception:
+    _storage = None
+    BASE_STORAGE = os.path.join(os.path.dirname(__file__), '..', 'saved_exams_storage')
+
+WORKERS = max(1, int(os.environ.get('JOBS_WORKERS', '2')))
+POOL_ENABLED = os.environ.get('JOBS_POOL', 'on').lower() not in ('0', 'off', 'false', 'no')
+LEASE_SECONDS = float(os.environ.get('JOBS_LEASE', '120'))
+MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', '2'))
+KEEP_SECONDS = float(os.environ.get('JOBS_KEEP_SECONDS', str(24 * 3600)))
+STORE = os.environ.get('JOBS_STORE', 'auto').lower()
+JOBS_DIR = os.path.normpath(os.path.join(BASE_STORAGE, 'jobs'))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# kind -> target ('module:function'), output type and calling convention
+KINDS: Dict[str, Dict[str, Any]] = {}
+
+
+def register(kind: str, target: str, ext: str = 'pdf', mime: str = 'application/pdf',
+             writes_file: bool = False, progress: bool = False):
+    KINDS[kind] = {'target': target, 'ext': ext, 'mime': mime, 'writes_file': writes_file, 'progress': progress}
+
+
+register('report_cards', 'utils.report_cards:write_report_cards', writes_file=True, progress=True)
+register('stream_table', 'utils.pdf_export:generate_pdf_stream_table')
+register('student_history', 'utils.pdf_export:generate_student_history_pdf')
+register('class_marksheet', 'utils.pdf_export:generate_class_marksheet_pdf')
+register('analytics', 'utils.pdf_export:generate_analytics_pdf', writes_file=True)
+register('teacher_table', 'utils.pdf_export:generate_teacher_table_bytes')
+
+
+class Cancelled(Exception):
+    """Raised inside a running job once it has been cancelled."""
+
+
+def _backend():
+    """``(engine, tables)``: the app database when enabled, else local SQLite."""
+    if select is None or _db is None:
+        return None
+    try:
+        _db.init_from_env()
+        if STORE != 'sqlite' and _db.enabled() and _db.table('jobs') is not None:
+            return _db.engine(), {'jobs': _db.table('jobs')}
+    except Exception:
+        pass
+    try:
+        return _db.local_store(os.path.join(BASE_STORAGE, 'jobs.sqlite3'), _db.job_tables)
+    except Exception:
+        return None
+
+
+def available() -> bool:
+    return _backend() is not None
+
+
+def _public(row) -> Dict:
+    out = dict(row)
+    out.pop('payload', None)
+    return out
+
+
+def submit(kind: str, args: tuple = (), kwargs: Optional[Dict] = None, scope: str = '', label: str = '',
+           file_name: Optional[str] = None, start: bool = True) -> str:
+    """Queue a ``kind`` job called with ``args``/``kwargs`` and return its id.
+    ``file_name`` is the download name of the artifact (default: ``<kind>.<ext>``).
+    With ``start`` the app's pool picks it up right away."""
+    spec = KINDS.get(kind)
+    if spec is None:
+        raise ValueError(f'unknown job kind: {kind}')
+    backend = _backend()
+    if backend is None:
+        raise RuntimeError('jobs unavailable')
+    engine, t = backend
+    jobs_t = t['jobs']
+    now = time.time()
+    job_id = uuid.uuid4().hex
+    payload = pickle.dumps((tuple(args), dict(kwargs or {})), protocol=pickle.HIGHEST_PROTOCOL)
+    with engine.begin() as conn:
+        conn.execute(jobs_t.insert().values(job_id=job_id, scope=scope or '', kind=kind, label=label or kind,
+                                            status=QUEUED, payload=payload, progress_done=0, attempts=0,
+                                            file_name=file_name or f"{kind}.{spec['ext']}", mime=spec['mime'],
+                                            created_at=now, updated_at=now))
+    if start:
+        dispatch()
+    return job_id
+
+
+def get(job_id: str) -> Optional[Dict]:
+    """The job row (without its payload), or None."""
+    backend = _backend()
+    if backend is None or not job_id:
+        return None
+    engine, t = backend
+    jobs_t = t['jobs']
+    cols = [c for c in jobs_t.c if c.name != 'payload']
+    with engine.connect() as conn:
+        row = conn.execute(select(*cols).where(jobs_t.c.job_id == job_id)).mappings().first()
+    return dict(row) if row else None
+
+
+def list_jobs(scope: Optional[str] = None, limit: int = 20, kind: Optional[str] = None) -> List[Dict]:
+    """Most recent jobs first."""
+    backend = _backend()
+    if backend is None:
+        return []
+    engine, t = backend
+    jobs_t = t['jobs']
+    stmt = select(*[c for c in jobs_t.c if c.name != 'payload'])
+    if scope is not None:
+        stmt = stmt.where(jobs_t.c.scope == scope)
+    if kind is not None:
+        stmt = stmt.where(jobs_t.c.kind == kind)
+    stmt = stmt.order_by(jobs_t.c.created_at.desc()).limit(int(limit))
+    with engine.connect() as conn:
+        return [dict(r) for r in conn.execute(stmt).mappings()]
+
+
+def cancel(job_id: str) -> bool:
+    """Cancel a queued or running job. A running job stops at its next
+    progress report (targets without progress finish, but the result is dropped)."""
+    backend = _backend()
+    if backend is None:
+        return False
+    engine, t = backend
+    jobs_t = t['jobs']
+    now = time.time()
+    with engine.begin() as conn:
+        res = conn.execute(jobs_t.update().where(jobs_t.c.job_id == job_id, jobs_t.c.status.in_((QUEUED, RUNNING)))
+                           .values(status=CANCELLED, finished_at=now, updated_at=now, locked_until=None))
+    return res.rowcount > 0
+
+
+def _due(jobs_t, now):
+    # queued, or running under a lease that expired (the runner died) with attempts left
+    return or_(jobs_t.c.status == QUEUED,
+               and_(jobs_t.c.status == RUNNING, jobs_t.c.locked_until < now, jobs_t.c.attempts < MAX_ATTEMPTS))
+
+
+def _fail_abandoned(conn, jobs_t, now):
+    """Mark running jobs whose runner died on their last attempt as failed;
+    nothing would ever claim them again."""
+    conn.execute(jobs_t.update().where(jobs_t.c.status == RUNNING, jobs_t.c.locked_until < now,
+                                       jobs_t.c.attempts >= MAX_ATTEMPTS)
+                 .values(status=FAILED, error='worker died', finished_at=now, updated_at=now, locked_until=None))
+
+
+def claim(worker: str, job_id: Optional[str] = None, lease: float = LEASE_SECONDS) -> Optional[Dict]:
+    """Lease one due job (``job_id`` or the oldest) to ``worker``; returns the
+    full row including the payload, or None."""
+    backend = _backend()
+    if backend is None:
+        return None
+    engine, t = backend
+    jobs_t = t['jobs']
+    now = time.time()
+    due = _due(jobs_t, now)
+    stmt = select(jobs_t.c.job_id).where(due)
+    if job_id:
+        stmt = stmt.where(jobs_t.c.job_id == job_id)
+    stmt = stmt.order_by(jobs_t.c.created_at).limit(1)
+    if engine.dialect.name == 'postgresql':
+        stmt = stmt.with_for_update(skip_locked=True)
+    until = now + lease
+    with engine.begin() as conn:
+        _fail_abandoned(conn, jobs_t, now)
+        found = conn.execute(stmt).scalar()
+        if not found:
+            return None
+        # the due condition is repeated so two runners racing on SQLite cannot both win
+        res = conn.execute(jobs_t.update().where(jobs_t.c.job_id == found, due)
+                           .values(status=RUNNING, worker=worker, locked_until=until, attempts=jobs_t.c.attempts + 1,
+                                   started_at=now, updated_at=now, error=None))
+        if res.rowcount == 0:
+            return None
+        row = conn.execute(select(jobs_t).where(jobs_t.c.job_id == found)).mappings().first()
+    return dict(row) if row else None
+
+
+def _update(job_id: str, worker: str, **values) -> bool:
+    """Update a job this worker still owns; False when it was cancelled or taken over."""
+    engine, t = _backend()
+    jobs_t = t['jobs']
+    values.setdefault('updated_at', time.time())
+    with engine.begin() as conn:
+        res = conn.execute(jobs_t.update().where(jobs_t.c.job_id == job_id, jobs_t.c.worker == worker,
+                                                 jobs_t.c.status == RUNNING).values(**values))
+    return res.rowcount > 0
+
+
+class _Heartbeat(threading.Thread):
+    """Renews a running job's lease until stopped."""
+
+    def __init__(self, job_id: str, worker: str, lease: float):
+        super().__init__(name=f'job-heartbeat-{job_id[:8]}', daemon=True)
+        self.job_id, self.worker, self.lease = job_id, worker, lease
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(max(1.0, self.lease / 3)):
+            try:
+                if not _update(self.job_id, self.worker, locked_until=time.time() + self.lease):
+                    self.lost = True
+                    return
+            except Exception:
+                pass
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _target(spec: Dict) -> Callable:
+    module, _, name = spec['target'].partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def artifact_dir(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def _store_artifact(job_id: str, path: str) -> str:
+    """Where the finished file lives: an S3 key when S3 is enabled, else the local path."""
+    if _storage is not None and getattr(_storage, '_USE_S3', False):
+        key = f'jobs/{job_id}/{os.path.basename(path)}'
+        if _storage.upload_file(path, key):
+            shutil.rmtree(artifact_dir(job_id), ignore_errors=True)
+            return key
+    return path
+
+
+def _write_result(result, path: str):
+    if hasattr(result, 'getvalue'):
+        result = result.getvalue()
+    elif hasattr(result, 'read'):
+        result.seek(0)
+        result = result.read()
+    if not isinstance(result, (bytes, bytearray)):
+        raise TypeError(f'job target returned {type(result).__name__}, expected bytes')
+    with open(path, 'wb') as fh:
+        fh.write(result)
+
+
+def run(row: Dict, worker: str, lease: float = LEASE_SECONDS) -> Dict:
+    """Run a claimed job row and record the outcome; returns the final job."""
+    job_id = row['job_id']
+    spec = KINDS.get(row['kind'])
+    folder = artifact_dir(job_id)
+    heartbeat = _Heartbeat(job_id, worker, lease)
+    heartbeat.start()
+    last_report = [0.0]
+
+    def on_progress(done, total):
+        now = time.time()
+        if now - last_report[0] < 1.0 and done != total:
+            return
+        last_report[0] = now
+        if not _update(job_id, worker, progress_done=int(done), progress_total=int(total) if total else None):
+            raise Cancelled(job_id)
+
+    try:
+        if spec is None:
+            raise ValueError(f"unknown job kind: {row['kind']}")
+        args, kwargs = pickle.loads(row['payload'])
+        if spec['progress']:
+            kwargs = dict(kwargs, on_progress=on_progress)
+        os.makedirs(folder, exist_ok=True)
+        name = os.path.basename(row.get('file_name') or f"{row['kind']}.{spec['ext']}")
+        path = os.path.join(folder, name)
+        target = _target(spec)
+        if spec['writes_file']:
+            target(path, *args, **kwargs)
+        else:
+            _write_result(target(*args, **kwargs), path)
+        size = os.path.getsize(path)
+        artifact = _store_artifact(job_id, path)
+        now = time.time()
+        _update(job_id, worker, status=DONE, artifact=artifact, size=size, finished_at=now, locked_until=None)
+    except Cancelled:
+        shutil.rmtree(folder, ignore_errors=True)
+    except Exception as e:
+        shutil.rmtree(folder, ignore_errors=True)
+        try:
+            _update(job_id, worker, status=FAILED, error=f'{type(e).__name__}: {e}', finished_at=time.time(),
+                    locked_until=None)
+        except Exception:
+            pass
+    finally:
+        heartbeat.stop()
+    return get(job_id) or {}
+
+
+def run_next(worker: str, job_id: Optional[str] = None) -> Optional[Dict]:
+    """Claim and run one due job (``job_id`` or the oldest). None when nothing was due."""
+    row = claim(worker, job_id=job_id)
+    if row is None:
+        return None
+    return run(row, worker)
+
+
+def _pool_task(job_id: str) -> Optional[str]:
+    """Process-pool task: run ``job_id`` if it is still due."""
+    job = run_next(f'pool-{socket.gethostname()}-{os.getpid()}', job_id=job_id)
+    return job.get('status') if job else None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_submitted = set()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _drop_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _submitted.clear()
+
+
+atexit.register(_drop_pool)
+
+
+def _forget(job_id: str):
+    def _done(future):
+        with _pool_lock:
+            _submitted.discard(job_id)
+        if future.exception() is not None:
+            # the pool broke (a worker was killed): start a fresh one for later jobs
+            _drop_pool()
+    return _done
+
+
+def dispatch() -> int:
+    """Hand due jobs to the app's process pool; returns how many were handed
+    over. Safe to call on every rerun."""
+    backend = _backend()
+    if backend is None:
+        return 0
+    engine, t = backend
+    jobs_t = t['jobs']
+    now = time.time()
+    with engine.begin() as conn:
+        _fail_abandoned(conn, jobs_t, now)
+    if not POOL_ENABLED:
+        return 0
+    with engine.connect() as conn:
+        due = [r[0] for r in conn.execute(select(jobs_t.c.job_id).where(_due(jobs_t, now))
+                                          .order_by(jobs_t.c.created_at).limit(100))]
+    started = 0
+    for job_id in due:
+        with _pool_lock:
+            if job_id in _submitted:
+                continue
+            _submitted.add(job_id)
+        try:
+            future = _get_pool().submit(_pool_task, job_id)
+        except Exception:
+            with _pool_lock:
+                _submitted.discard(job_id)
+            _drop_pool()
+            break
+        future.add_done_callback(_forget(job_id))
+        started += 1
+    return started
+
+
+def wait(job_id: str, timeout: Optional[float] = None, poll: float = 0.5) -> Optional[Dict]:
+    """Block until the job finishes or ``timeout`` passes; returns the job."""
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        job = get(job_id)
+        if job is None or job['status'] in FINISHED:
+            return job
+        if deadline is not None and time.time() >= deadline:
+            return job
+        time.sleep(poll)
+
+
+def read_artifact(job: Dict) -> Optional[bytes]:
+    artifact = (job or {}).get('artifact')
+    if not artifact:
+        return None
+    if os.path.isabs(artifact) or os.path.exists(artifact):
+        try:
+            with open(artifact, 'rb') as fh:
+                return fh.read()
+        except Exception:
+            return None
+    return _storage.read_bytes(artifact) if _storage is not None else None
+
+
+def download_url(job: Dict, expires: int = 3600) -> Optional[str]:
+    """Presigned URL for a job stored in S3, else None (serve ``artifact`` from disk)."""
+    artifact = (job or {}).get('artifact')
+    if not artifact or _storage is None or os.path.isabs(artifact):
+        return None
+    return _storage.download_url(artifact, expires=expires, filename=job.get('file_name'))
+
+
+def prune(max_age: float = KEEP_SECONDS) -> int:
+    """Delete finished jobs older than ``max_age`` seconds and their artifacts."""
+    backend = _backend()
+    if backend is None:
+        return 0
+    engine, t = backend
+    jobs_t = t['jobs']
+    cutoff = time.time() - max_age
+    with engine.begin() as conn:
+        _fail_abandoned(conn, jobs_t, time.time())
+        old = conn.execute(select(jobs_t.c.job_id, jobs_t.c.artifact)
+                           .where(jobs_t.c.status.in_(FINISHED), jobs_t.c.updated_at < cutoff)).all()
+        if old:
+            conn.execute(jobs_t.delete().where(jobs_t.c.job_id.in_([r[0] for r in old])))
+    for job_id, artifact in old:
+        shutil.rmtree(artifact_dir(job_id), ignore_errors=True)
+        if artifact and not os.path.isabs(artifact) and _storage is not None:
+            try:
+                _storage.delete(artifact)
+            except Exception:
+                pass
+    return len(old)
+
+
+def show_job(job_id: str, download_label: str = '📥 Download', key: Optional[str] = None) -> Optional[Dict]:
+    """Streamlit status panel for a job: progress while it runs, a download once
+    it is done, the error if it failed. Returns the job."""
+    import streamlit as st
+    key = key or job_id
+    dispatch()
+    job = get(job_id)
+    if job is None:
+        st.warning('This export is no longer available; start it again.')
+        return None
+    status = job['status']
+    label = job.get('label') or job['kind']
+    if status in (QUEUED, RUNNING):
+        total = job.get('progress_total') or 0
+        done = job.get('progress_done') or 0
+        text = f'{label}: queued' if status == QUEUED else f'{label}: running'
+        if total:
+            text += f' ({done} of {total})'
+        st.progress(min(1.0, done / total) if total else 0.0, text=text)
+        c1, c2 = st.columns(2)
+        with c1:
+            st.button('🔄 Refresh status', key=f'job_refresh_{key}', use_container_width=True)
+        with c2:
+            if st.button('✖ Cancel', key=f'job_cancel_{key}', use_container_width=True):
+                cancel(job_id)
+        return job
+    if status == DONE:
+        url = download_url(job)
+        if url:
+            st.link_button(download_label, url, use_container_width=True)
+        else:
+            artifact = job.get('artifact')
+            if artifact and os.path.exists(artifact):
+                with open(artifact, 'rb') as fh:
+                    st.download_button(download_label, data=fh, file_name=job.get('file_name'),
+                                       mime=job.get('mime'), key=f'job_download_{key}', use_container_width=True)
+            else:
+                st.warning('The file for this export was removed; start it again.')
+        return job
+    if status == FAILED:
+        st.error(f"{label} failed: {job.get('error') or 'unknown error'}")
+    else:
+        st.info(f'{label} was cancelled.')
+    return job
@@ -0,0 +1,343 @@
+"""Indexed SMS history with running day/month/year counters.
+
+The append-only JSONL log (``utils.message_log``) stays the audit trail; this
+store indexes the same entries so dashboards and the log view no longer scan
+the history:
+
+  - ``message_log`` rows carry the entry plus indexed ``time``, ``phone``
+    (digits only), ``exam_id`` and ``status`` columns, so a filtered page of the
+    log is one index range scan.
+  - ``message_counters`` holds a running count per day, month, year and in
+    total, bumped in the same transaction as the insert, so ``counts`` is three
+    or four primary-key lookups.
+
+The store lives in the app database (``modules.db``) when one is configured and
+otherwise in ``sent_messages_log.sqlite3`` beside the JSONL log. Rows are
+partitioned by ``scope`` (the account's storage directory name). It registers
+itself as a ``message_log`` sink, and the first access for a scope imports the
+existing JSONL history.
+
+Environment variables:
+  - MESSAGE_STORE: ``auto`` (default: database if enabled, else SQLite),
+    ``sqlite`` (always local) or ``off``.
+"""
+from __future__ import annotations
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from sqlalchemy import create_engine, func
+    from sqlalchemy.sql import select
+    from sqlalchemy.dialects.postgresql import insert as _pg_insert
+    from sqlalchemy.dialects.sqlite import insert as _sqlite_insert
+except Exception:
+    create_engine = None
+
+try:
+    from . import db as _db
+except Exception:
+    _db = None
+
+from utils import message_log
+
+MODE = os.environ.get('MESSAGE_STORE', 'auto').lower()
+BACKFILL_CHUNK = 1000
+STATUSES = ('Delivered', 'Sent', 'Blacklisted', 'Failed', 'Unknown')
+
+_lock = threading.RLock()
+_backfilled = set()
+
+
+def map_status(res_obj) -> str:
+    """Map a provider result object (as stored in the log) to a friendly status.
+    Conservative rules:
+    - Mark Delivered only when the provider explicitly indicates delivery (e.g. 'delivered', 'deliv').
+    - Treat general 'success' or 'accepted' as Sent (pending delivery confirmation).
+    - Detect blacklist/block and failures.
+    Returns one of: Delivered, Sent, Blacklisted, Failed (optionally 'Failed (<http code>)'), Unknown
+    """
+    try:
+        j = res_obj.get('json') if isinstance(res_obj, dict) else None
+        sms = j.get('SMSMessageData') if isinstance(j, dict) else None
+        first_rec_local = {}
+        if isinstance(sms, dict):
+            recs = sms.get('Recipients') or []
+            if recs:
+                first_rec_local = recs[0]
+        if not first_rec_local and isinstance(res_obj, dict) and isinstance(res_obj.get('recipient'), dict):
+            first_rec_local = res_obj['recipient']
+
+        recip_status = first_rec_local.get('status') if isinstance(first_rec_local, dict) else None
+        if recip_status:
+            s = str(recip_status).lower()
+            # explicit delivery markers (include common variants like 'dlvrd')
+            if any(k in s for k in ('deliver','deliv','delivered','dlvrd','delivered_to','deliveredto','delivered_to_handset','delivered_to_network')):
+                return 'Delivered'
+            # blacklist/blocked
+            if 'black' in s or 'block' in s:
+                return 'Blacklisted'
+            # explicit failures
+            if 'fail' in s or 'error' in s or 'reject' in s or 'rejected' in s:
+                return 'Failed'
+            # success/accepted/sent/queued -> treat as Sent (not necessarily delivered)
+            if 'success' in s or 'accepted' in s or 'queued' in s or 'sent' in s or s in ('true','1','100'):
+                return 'Sent'
+
+        # top-level flags
+        if isinstance(res_obj, dict):
+            if res_obj.get('ok') is True:
+                return 'Sent'
+            if res_obj.get('ok') is False:
+                st_code = res_obj.get('status_code')
+                if st_code:
+                    try:
+                        sc = int(st_code)
+                        if sc >= 400:
+                            return f'Failed ({sc})'
+                    except Exception:
+                        pass
+                return 'Failed'
+
+        # inspect provider message text for clues
+        prov_msg_local = None
+        try:
+            prov_msg_local = sms.get('Message') if isinstance(sms, dict) else None
+        except Exception:
+            prov_msg_local = None
+        if prov_msg_local and isinstance(prov_msg_local, str):
+            low = prov_msg_local.lower()
+            if 'blacklist' in low or 'blocked' in low:
+                return 'Blacklisted'
+            if any(k in low for k in ('delivered','deliv','dlvrd','delivered_to','deliveredto')):
+                return 'Delivered'
+            # 'sent to' / 'total cost' often means provider accepted the message
+            if 'sent to' in low or 'total cost' in low or 'success' in low or 'accepted' in low:
+                return 'Sent'
+
+        return 'Unknown'
+    except Exception:
+        return 'Unknown'
+
+
+def _digits(phone) -> str:
+    return ''.join(ch for ch in str(phone or '') if ch.isdigit())
+
+
+def _scope(log_file) -> str:
+    return Path(log_file).resolve().parent.name or 'default'
+
+
+def _periods(ts) -> List[str]:
+    try:
+        t = datetime.fromtimestamp(float(ts))
+    except Exception:
+        return ['all']
+    return [f"d:{t:%Y-%m-%d}", f"m:{t:%Y-%m}", f"y:{t:%Y}", 'all']
+
+
+def _backend(log_file):
+    """``(engine, tables)`` for the store, or None when disabled/unavailable."""
+    if MODE == 'off' or create_engine is None:
+        return None
+    if MODE != 'sqlite' and _db is not None:
+        try:
+            _db.init_from_env()
+            if _db.enabled() and _db.table('messages') is not None:
+                return _db.engine(), {'messages': _db.table('messages'),
+                                      'message_counters': _db.table('message_counters')}
+        except Exception:
+            pass
+    return _db.local_store(str(Path(log_file).with_suffix('.sqlite3').resolve()), _db.message_tables)
+
+
+def _rows(scope: str, entries: Iterable[Dict]) -> Tuple[List[Dict], Counter]:
+    rows, bumps = [], Counter()
+    for e in entries:
+        if not isinstance(e, dict):
+            continue
+        contact = e.get('contact') if isinstance(e.get('contact'), dict) else {}
+        try:
+            ts = float(e.get('time'))
+        except Exception:
+            ts = None
+        rows.append({
+            'scope': scope,
+            'time': ts,
+            'phone': _digits(e.get('phone') or e.get('to') or contact.get('phone')),
+            'exam_id': str(e.get('exam_id') or contact.get('exam_id') or '') or None,
+            'status': map_status(e.get('response') or e.get('result') or {}).split(' (')[0],
+            'provider': e.get('provider'),
+            'entry': e,
+        })
+        bumps.update(_periods(ts))
+    return rows, bumps
+
+
+def _bump(engine, conn, counters, scope: str, bumps: Dict[str, int]):
+    """Add ``bumps`` to the running counters (one upsert statement)."""
+    if not bumps:
+        return
+    rows = [{'scope': scope, 'period': p, 'count': int(n)} for p, n in bumps.items()]
+    insert = {'postgresql': _pg_insert, 'sqlite': _sqlite_insert}.get(engine.dialect.name)
+    if insert is not None:
+        stmt = insert(counters).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=['scope', 'period'],
+                                          set_={'count': counters.c.count + stmt.excluded['count']})
+        conn.execute(stmt)
+        return
+    for row in rows:
+        cond = (counters.c.scope == scope) & (counters.c.period == row['period'])
+        if conn.execute(counters.update().where(cond).values(count=counters.c.count + row['count'])).rowcount == 0:
+            conn.execute(counters.insert().values(**row))
+
+
+def _write(engine, conn, tables, scope: str, entries: Iterable[Dict]) -> int:
+    rows, bumps = _rows(scope, entries)
+    if not rows:
+        return 0
+    conn.execute(tables['messages'].insert(), rows)
+    _bump(engine, conn, tables['message_counters'], scope, bumps)
+    return len(rows)
+
+
+def _insert(engine, tables, scope: str, entries: Iterable[Dict]):
+    with engine.begin() as conn:
+        return _write(engine, conn, tables, scope, entries)
+
+
+def _claim_backfill(engine, conn, counters, scope: str) -> bool:
+    """Insert the scope's ``meta:backfilled`` marker; False when it already
+    exists (another process imported, or is importing, the history)."""
+    row = {'scope': scope, 'period': 'meta:backfilled', 'count': 1}
+    insert = {'postgresql': _pg_insert, 'sqlite': _sqlite_insert}.get(engine.dialect.name)
+    if insert is not None:
+        stmt = insert(counters).values(row).on_conflict_do_nothing(index_elements=['scope', 'period'])
+        return conn.execute(stmt).rowcount == 1
+    # other dialects: a concurrent claim fails the transaction on the primary key
+    if conn.execute(select(counters.c.count).where(counters.c.scope == scope,
+                                                   counters.c.period == 'meta:backfilled')).fetchone():
+        return False
+    conn.execute(counters.insert().values(**row))
+    return True
+
+
+def _ensure_backfilled(log_file, backend) -> bool:
+    """Import the JSONL history the first time a scope is used. Returns True
+    when an import ran (it already covers entries just appended)."""
+    engine, tables = backend
+    scope = _scope(log_file)
+    key = (str(engine.url), scope)
+    if key in _backfilled:
+        return False
+    # migrate a legacy JSON log before taking our lock (message_log calls the
+    # sink with its own lock held, so never take them in the other order)
+    message_log.migrate_legacy(log_file)
+    with _lock:
+        if key in _backfilled:
+            return False
+        counters = tables['message_counters']
+        with engine.connect() as conn:
+            done = conn.execute(select(counters.c.count).where(counters.c.scope == scope,
+                                                               counters.c.period == 'meta:backfilled')).fetchone()
+        ran = False
+        if done is None:
+            # the marker is claimed in the import's own transaction: of two
+            # processes starting together (app and outbox worker) only one
+            # imports, the other waits on the marker row and then skips; a
+            # failed import rolls the claim back
+            with engine.begin() as conn:
+                if _claim_backfill(engine, conn, counters, scope):
+                    chunk = []
+                    for e in message_log.iter_entries(log_file, migrate=False):
+                        chunk.append(e)
+                        if len(chunk) >= BACKFILL_CHUNK:
+                            _write(engine, conn, tables, scope, chunk)
+                            chunk = []
+                    _write(engine, conn, tables, scope, chunk)
+                    ran = True
+        _backfilled.add(key)
+        return ran
+
+
+def record(log_file, entries: List[Dict]) -> int:
+    """Index entries just appended to ``log_file`` (message_log sink)."""
+    backend = _backend(log_file)
+    if backend is None:
+        return 0
+    if _ensure_backfilled(log_file, backend):
+        return 0
+    engine, tables = backend
+    return _insert(engine, tables, _scope(log_file), entries)
+
+
+def counts(log_file, now: Optional[datetime] = None) -> Optional[Dict[str, int]]:
+    """``{'day', 'month', 'year', 'total'}`` message counts for the current
+    period, or None when the store is unavailable."""
+    backend = _backend(log_file)
+    if backend is None:
+        return None
+    _ensure_backfilled(log_file, backend)
+    engine, tables = backend
+    counters = tables['message_counters']
+    now = now or datetime.now()
+    keys = {'day': f"d:{now:%Y-%m-%d}", 'month': f"m:{now:%Y-%m}", 'year': f"y:{now:%Y}", 'total': 'all'}
+    with engine.connect() as conn:
+        found = dict(conn.execute(select(counters.c.period, counters.c.count)
+                                  .where(counters.c.scope == _scope(log_file),
+                                         counters.c.period.in_(list(keys.values())))).fetchall())
+    return {name: int(found.get(period) or 0) for name, period in keys.items()}
+
+
+def recent(log_file, limit: int = 200, offset: int = 0, phone: Optional[str] = None,
+           exam_id: Optional[str] = None, status: Optional[str] = None,
+           since: Optional[float] = None) -> Optional[List[Dict]]:
+    """A page of log entries, newest ``offset``..``offset+limit`` returned oldest
+    first (like ``message_log.tail``), optionally filtered on the indexed
+    columns (``phone`` is compared on its digits only). None when the store is
+    unavailable."""
+    backend = _backend(log_file)
+    if backend is None:
+        return None
+    _ensure_backfilled(log_file, backend)
+    engine, tables = backend
+    msgs = tables['messages']
+    stmt = select(msgs.c.entry).where(msgs.c.scope == _scope(log_file))
+    if phone:
+        stmt = stmt.where(msgs.c.phone == _digits(phone))
+    if exam_id:
+        stmt = stmt.where(msgs.c.exam_id == str(exam_id))
+    if status:
+        stmt = stmt.where(msgs.c.status == status)
+    if since is not None:
+        stmt = stmt.where(msgs.c.time >= float(since))
+    stmt = stmt.order_by(msgs.c.time.desc(), msgs.c.id.desc()).limit(int(limit)).offset(int(offset))
+    with engine.connect() as conn:
+        rows = [r[0] for r in conn.execute(stmt).fetchall()]
+    return rows[::-1]
+
+
+def rebuild(log_file) -> int:
+    """Drop the scope's rows and counters and re-import the JSONL log."""
+    backend = _backend(log_file)
+    if backend is None:
+        return 0
+    engine, tables = backend
+    scope = _scope(log_file)
+    with _lock:
+        with engine.begin() as conn:
+            conn.execute(tables['messages'].delete().where(tables['messages'].c.scope == scope))
+            conn.execute(tables['message_counters'].delete().where(tables['message_counters'].c.scope == scope))
+        _backfilled.discard((str(engine.url), scope))
+    # re-import outside our lock: _ensure_backfilled calls into message_log,
+    # whose sink calls back here with message_log's lock held
+    _ensure_backfilled(log_file, backend)
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(tables['messages'])
+                            .where(tables['messages'].c.scope == scope)).scalar() or 0
+
+
+message_log.add_sink(record)
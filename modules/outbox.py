@@ -0,0 +1,383 @@
+"""Durable SMS outbox.
+
+The send buttons enqueue rendered messages here instead of sending them inside
+the Streamlit run. A worker (``scripts/sms_outbox_worker.py``) or, when no
+worker is running, the page itself drains the queue; anything left behind by a
+closed tab or a rerun is picked up again once its lease expires.
+
+  - Rows live in the app database when ``modules.db`` is enabled, otherwise in
+    ``saved_exams_storage/sms_outbox.sqlite3`` (see ``db.outbox_tables``).
+  - Each row has an idempotency key per (exam, student, phone, message text)
+    and account scope. Enqueueing the same message to the same recipient again
+    is a no-op unless the earlier row failed, in which case it is queued again;
+    a corrected or different message is a new row.
+  - ``claim`` leases rows to one worker (``worker`` + ``locked_until``), so
+    several workers can share a queue. ``process`` renews the lease while it
+    sends and only records results for rows it still holds. Delivery is
+    at-least-once: a worker that dies after the provider accepted a message but
+    before ``process`` recorded it will send that message again when the lease
+    runs out.
+  - Failures that look transient (no response, HTTP 429/5xx) are retried with
+    exponential backoff and jitter up to MAX_ATTEMPTS; other failures are final.
+  - Every attempt is still written to the message log by ``utils.messaging``,
+    and the row keeps the last result for the log view.
+
+Environment variables:
+  - SMS_OUTBOX_MAX_ATTEMPTS (default 5)
+  - SMS_OUTBOX_BACKOFF_BASE (default 30 seconds; doubled per attempt)
+  - SMS_OUTBOX_BACKOFF_MAX (default 1800 seconds)
+  - SMS_OUTBOX_LEASE (default 300 seconds)
+  - SMS_OUTBOX_WORKER_STALE (default 60 seconds without a heartbeat)
+  - SMS_OUTBOX_STORE: ``auto`` (default: database if enabled, else SQLite) or
+    ``sqlite`` (always the local file, e.g. for benchmarks)
+"""
+from __future__ import annotations
+import hashlib
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    from sqlalchemy import and_, bindparam, func, or_
+    from sqlalchemy.sql import select
+except Exception:
+    select = None
+
+try:
+    from . import db as _db
+except Exception:
+    _db = None
+try:
+    from .storage import BASE_STORAGE
+except Exception:
+    BASE_STORAGE = os.path.join(os.path.dirname(__file__), '..', 'saved_exams_storage')
+
+MAX_ATTEMPTS = int(os.environ.get('SMS_OUTBOX_MAX_ATTEMPTS', '5'))
+BACKOFF_BASE = float(os.environ.get('SMS_OUTBOX_BACKOFF_BASE', '30'))
+BACKOFF_MAX = float(os.environ.get('SMS_OUTBOX_BACKOFF_MAX', '1800'))
+LEASE_SECONDS = float(os.environ.get('SMS_OUTBOX_LEASE', '300'))
+WORKER_STALE_SECONDS = float(os.environ.get('SMS_OUTBOX_WORKER_STALE', '60'))
+STORE = os.environ.get('SMS_OUTBOX_STORE', 'auto').lower()
+
+QUEUED, RETRY, SENDING, SENT, FAILED = 'queued', 'retry', 'sending', 'sent', 'failed'
+
+
+def _backend():
+    """``(engine, tables)``: the app database when enabled, else local SQLite."""
+    if select is None or _db is None:
+        return None
+    try:
+        _db.init_from_env()
+        if STORE != 'sqlite' and _db.enabled() and _db.table('outbox') is not None:
+            return _db.engine(), {name: _db.table(name) for name in ('outbox_batches', 'outbox', 'outbox_workers')}
+    except Exception:
+        pass
+    try:
+        return _db.local_store(os.path.join(BASE_STORAGE, 'sms_outbox.sqlite3'), _db.outbox_tables)
+    except Exception:
+        return None
+
+
+def available() -> bool:
+    return _backend() is not None
+
+
+def _digits(phone) -> str:
+    return ''.join(ch for ch in str(phone or '') if ch.isdigit())
+
+
+def idempotency_key(contact: Optional[Dict], phone: str, message: str = '') -> str:
+    """sha256 of (exam, student, phone, message text): a rerun of the same
+    send is deduplicated, a corrected or different message goes out."""
+    c = contact if isinstance(contact, dict) else {}
+    exam = str(c.get('exam_id') or c.get('exam_name') or '')
+    student = str(c.get('student_id') or c.get('adm_no') or c.get('student_name') or '').strip().lower()
+    parts = [exam, student, _digits(phone), message or '']
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def enqueue(jobs: List[Dict], config: Dict, scope: str, log_file: Optional[str] = None,
+            test_mode: bool = False) -> Dict[str, Any]:
+    """Queue ``{'phone', 'message', 'contact'}`` jobs as one batch.
+
+    Returns ``{'batch_id', 'queued', 'requeued', 'duplicates', 'keys'}`` where
+    ``keys`` lists each job's idempotency key (in input order) and duplicates
+    are jobs already queued, in flight or sent.
+    """
+    backend = _backend()
+    if backend is None:
+        raise RuntimeError('outbox unavailable')
+    engine, t = backend
+    jobs_t, batches_t = t['outbox'], t['outbox_batches']
+    now = time.time()
+    batch_id = uuid.uuid4().hex
+    keys = [idempotency_key(j.get('contact'), j.get('phone'), j.get('message') or '') for j in jobs]
+    out = {'batch_id': batch_id, 'queued': 0, 'requeued': 0, 'duplicates': 0, 'keys': keys}
+    with engine.begin() as conn:
+        existing = {}
+        unique = list(dict.fromkeys(keys))
+        for k in range(0, len(unique), 500):
+            chunk = unique[k:k + 500]
+            for key, status in conn.execute(select(jobs_t.c.idempotency_key, jobs_t.c.status)
+                                            .where(jobs_t.c.scope == scope, jobs_t.c.idempotency_key.in_(chunk))):
+                existing[key] = status
+        conn.execute(batches_t.insert().values(batch_id=batch_id, scope=scope, created_at=now,
+                                               log_file=str(Path(log_file).resolve()) if log_file else None,
+                                               test_mode=1 if test_mode else 0, config=config or {}))
+        new_rows, requeue, seen = [], [], set()
+        for job, key in zip(jobs, keys):
+            if key in seen:
+                out['duplicates'] += 1
+                continue
+            seen.add(key)
+            status = existing.get(key)
+            if status is None:
+                new_rows.append({'batch_id': batch_id, 'scope': scope, 'idempotency_key': key,
+                                 'phone': job.get('phone'), 'message': job.get('message') or '',
+                                 'contact': job.get('contact') or {}, 'status': QUEUED, 'attempts': 0,
+                                 'next_attempt_at': now, 'created_at': now, 'updated_at': now})
+            elif status == FAILED:
+                requeue.append({'_key': key, 'phone': job.get('phone'), 'message': job.get('message') or '',
+                                'contact': job.get('contact') or {}})
+            else:
+                out['duplicates'] += 1
+        if new_rows:
+            conn.execute(jobs_t.insert(), new_rows)
+        if requeue:
+            conn.execute(jobs_t.update()
+                         .where(jobs_t.c.scope == scope, jobs_t.c.idempotency_key == bindparam('_key'))
+                         .values(batch_id=batch_id, phone=bindparam('phone'), message=bindparam('message'),
+                                 contact=bindparam('contact'), status=QUEUED, attempts=0, next_attempt_at=now,
+                                 locked_until=None, worker=None, last_error=None, updated_at=now), requeue)
+        out['queued'], out['requeued'] = len(new_rows), len(requeue)
+    return out
+
+
+def claim(worker: str, limit: int = 100, lease: float = LEASE_SECONDS,
+          batch_id: Optional[str] = None, scope: Optional[str] = None) -> List[Dict]:
+    """Lease up to ``limit`` due rows to ``worker`` (queued/retry rows whose
+    time has come, plus 'sending' rows whose lease expired), optionally only
+    one batch's or one account's rows."""
+    backend = _backend()
+    if backend is None:
+        return []
+    engine, t = backend
+    jobs_t = t['outbox']
+    now = time.time()
+    due = or_(and_(jobs_t.c.status.in_((QUEUED, RETRY)), jobs_t.c.next_attempt_at <= now),
+              and_(jobs_t.c.status == SENDING, jobs_t.c.locked_until < now))
+    stmt = select(jobs_t.c.id).where(due)
+    if batch_id:
+        stmt = stmt.where(jobs_t.c.batch_id == batch_id)
+    if scope is not None:
+        stmt = stmt.where(jobs_t.c.scope == scope)
+    stmt = stmt.order_by(jobs_t.c.id).limit(int(limit))
+    if engine.dialect.name == 'postgresql':
+        stmt = stmt.with_for_update(skip_locked=True)
+    until = now + lease
+    with engine.begin() as conn:
+        ids = [r[0] for r in conn.execute(stmt)]
+        if not ids:
+            return []
+        # the claim condition is repeated so two workers racing on SQLite cannot both win a row
+        conn.execute(jobs_t.update().where(jobs_t.c.id.in_(ids), due)
+                     .values(status=SENDING, worker=worker, locked_until=until, updated_at=now))
+        rows = conn.execute(select(jobs_t).where(jobs_t.c.id.in_(ids), jobs_t.c.worker == worker,
+                                                 jobs_t.c.locked_until == until)
+                            .order_by(jobs_t.c.id)).mappings().all()
+    return [dict(r) for r in rows]
+
+
+def backoff(attempts: int) -> float:
+    """Delay before retry number ``attempts`` (1-based): base * 2^(n-1), capped, ±20% jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _retryable(res: Dict) -> bool:
+    code = res.get('status_code') if isinstance(res, dict) else None
+    if code is None:
+        return True
+    try:
+        code = int(code)
+    except (TypeError, ValueError):
+        return True
+    return code == 429 or code >= 500
+
+
+def _compact(res: Dict) -> Dict:
+    if not isinstance(res, dict):
+        return {'ok': False, 'error': str(res)}
+    return {k: res[k] for k in ('ok', 'status_code', 'error', 'recipient', 'json', 'test_mode') if k in res}
+
+
+def renew(worker: str, ids: List[int], lease: float = LEASE_SECONDS) -> int:
+    """Extend the lease on rows ``worker`` is still sending; returns how many it holds."""
+    engine, t = _backend()
+    jobs_t = t['outbox']
+    now = time.time()
+    with engine.begin() as conn:
+        res = conn.execute(jobs_t.update().where(jobs_t.c.id.in_(ids), jobs_t.c.worker == worker,
+                                                 jobs_t.c.status == SENDING)
+                           .values(locked_until=now + lease, updated_at=now))
+    return res.rowcount
+
+
+class _LeaseKeeper(threading.Thread):
+    """Renews the lease on claimed rows until stopped, so a chunk of slow
+    (throttled or timing-out) sends is not claimed and sent again elsewhere."""
+
+    def __init__(self, worker: str, ids: List[int], lease: float):
+        super().__init__(name=f'outbox-lease-{worker}', daemon=True)
+        self.worker, self.ids, self.lease = worker, ids, lease
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(max(1.0, self.lease / 3)):
+            try:
+                if not renew(self.worker, self.ids, self.lease):
+                    return
+            except Exception:
+                pass
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def process(rows: List[Dict], on_progress: Optional[Callable] = None,
+            lease: float = LEASE_SECONDS) -> List[Dict]:
+    """Send claimed rows batch by batch through utils.messaging and record the
+    outcome. Attempts are logged to the log file each batch was queued with.
+    The claim's lease is renewed while sending; rows another worker took over
+    in the meantime keep that worker's result and are left out of the return
+    value. Returns ``[{'contact', 'result', 'status'}]`` in row order."""
+    if not rows:
+        return []
+    from utils import messaging
+    engine, t = _backend()
+    jobs_t, batches_t = t['outbox'], t['outbox_batches']
+    worker = rows[0].get('worker')
+    batch_ids = list(dict.fromkeys(r['batch_id'] for r in rows))
+    with engine.connect() as conn:
+        batches = {b['batch_id']: dict(b) for b in conn.execute(
+            select(batches_t).where(batches_t.c.batch_id.in_(batch_ids))).mappings()}
+    # only rows still leased to this worker are updated (cf. jobs._update)
+    record = (jobs_t.update()
+              .where(jobs_t.c.id == bindparam('_id'), jobs_t.c.worker == worker, jobs_t.c.status == SENDING)
+              .values(status=bindparam('status'), attempts=bindparam('attempts'),
+                      next_attempt_at=bindparam('next_attempt_at'), last_error=bindparam('last_error'),
+                      result=bindparam('result'), updated_at=bindparam('updated_at'), locked_until=None))
+    out: Dict[int, Dict] = {}
+    total, done = len(rows), [0]
+    keeper = _LeaseKeeper(worker, [r['id'] for r in rows], lease)
+    keeper.start()
+    try:
+        for batch_id in batch_ids:
+            group = [r for r in rows if r['batch_id'] == batch_id]
+            batch = batches.get(batch_id) or {}
+            jobs = [{'phone': r['phone'], 'message': r['message'], 'contact': r['contact'] or {}} for r in group]
+
+            def _progress(_done, _total, item, res):
+                done[0] += 1
+                if on_progress is not None:
+                    on_progress(done[0], total, item, res)
+
+            sent = messaging.send_many(jobs, config=batch.get('config') or {}, test_mode=bool(batch.get('test_mode')),
+                                       on_progress=_progress, log_file=batch.get('log_file') or None)
+            now = time.time()
+            with engine.begin() as conn:
+                for r, s in zip(group, sent):
+                    res = s.get('result') or {}
+                    attempts = int(r.get('attempts') or 0) + 1
+                    if isinstance(res, dict) and res.get('ok'):
+                        status, next_at, err = SENT, None, None
+                    elif attempts < MAX_ATTEMPTS and _retryable(res):
+                        status, next_at, err = RETRY, now + backoff(attempts), str(res.get('error') or res.get('status_code') or 'failed')
+                    else:
+                        status, next_at, err = FAILED, None, str((res or {}).get('error') or (res or {}).get('status_code') or 'failed')
+                    kept = conn.execute(record, {'_id': r['id'], 'status': status, 'attempts': attempts,
+                                                 'next_attempt_at': next_at, 'last_error': err,
+                                                 'result': _compact(res), 'updated_at': now}).rowcount
+                    if kept:
+                        out[r['id']] = {'contact': s.get('contact'), 'result': res, 'status': status}
+    finally:
+        keeper.stop()
+    return [out[r['id']] for r in rows if r['id'] in out]
+
+
+def drain(batch_id: Optional[str] = None, worker: Optional[str] = None, chunk: int = 200,
+          on_progress: Optional[Callable] = None,
+          deadline: Optional[float] = None, scope: Optional[str] = None) -> List[Dict]:
+    """Claim and send due rows (optionally of one batch or account) until none are left or
+    ``deadline`` (epoch seconds) passes. Rows scheduled for a later retry stay
+    queued for the worker."""
+    worker = worker or f'inline-{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+    results: List[Dict] = []
+    while deadline is None or time.time() < deadline:
+        rows = claim(worker, limit=chunk, batch_id=batch_id, scope=scope)
+        if not rows:
+            break
+        base = len(results)
+
+        def _progress(done, _total, item, res):
+            if on_progress is not None:
+                on_progress(base + done, None, item, res)
+
+        results.extend(process(rows, on_progress=_progress))
+    return results
+
+
+def heartbeat(worker: str, processed: int = 0, scope: str = ''):
+    """Record that ``worker`` (draining ``scope``, '' = every account) is alive."""
+    backend = _backend()
+    if backend is None:
+        return
+    engine, t = backend
+    workers = t['outbox_workers']
+    now = time.time()
+    with engine.begin() as conn:
+        if conn.execute(workers.update().where(workers.c.worker_id == worker)
+                        .values(seen_at=now, scope=scope or '',
+                                processed=workers.c.processed + int(processed))).rowcount == 0:
+            conn.execute(workers.insert().values(worker_id=worker, seen_at=now, processed=int(processed),
+                                                 scope=scope or ''))
+
+
+def worker_alive(max_age: float = WORKER_STALE_SECONDS, scope: Optional[str] = None) -> bool:
+    """True when a worker sent a heartbeat within ``max_age`` seconds (with
+    ``scope``: a worker that drains that account or every account)."""
+    backend = _backend()
+    if backend is None:
+        return False
+    engine, t = backend
+    workers = t['outbox_workers']
+    try:
+        with engine.connect() as conn:
+            stmt = select(func.max(workers.c.seen_at))
+            if scope is not None:
+                stmt = stmt.where(or_(workers.c.scope == scope, workers.c.scope == '', workers.c.scope.is_(None)))
+            last = conn.execute(stmt).scalar()
+        return last is not None and time.time() - float(last) < max_age
+    except Exception:
+        return False
+
+
+def summary(scope: Optional[str] = None, batch_id: Optional[str] = None) -> Dict[str, int]:
+    """Row counts per status (queued, retry, sending, sent, failed)."""
+    backend = _backend()
+    if backend is None:
+        return {}
+    engine, t = backend
+    jobs_t = t['outbox']
+    stmt = select(jobs_t.c.status, func.count()).group_by(jobs_t.c.status)
+    if scope is not None:
+        stmt = stmt.where(jobs_t.c.scope == scope)
+    if batch_id is not None:
+        stmt = stmt.where(jobs_t.c.batch_id == batch_id)
+    with engine.connect() as conn:
+        return {status: int(n) for status, n in conn.execute(stmt)}
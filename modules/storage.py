@@ -1,5 +1,5 @@
 """Storage adapter that routes reads/writes to S3 when configured, otherwise
-uses the local filesystem. Provides helpers for JSON, pickles and bytes.
+uses the local filesystem. Provides helpers for JSON, pickles, DataFrames and bytes.
 
 This adapter aims to be non-destructive: when S3 is enabled (STORAGE_PROVIDER=s3)
 all write operations will target S3 and local writes are skipped. Read operations
@@ -8,13 +8,25 @@ prefer S3 and fall back to local files if present.
 from __future__ import annotations
 import os
 import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
 from io import BytesIO
-from typing import Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Iterable, Any
 
 try:
     import pandas as pd
 except Exception:
     pd = None
+try:
+    import pyarrow as pa
+    import pyarrow.feather as _feather
+    import pyarrow.parquet as _pq
+except Exception:
+    pa = None
 
 _USE_S3 = os.environ.get('STORAGE_PROVIDER', '').lower() == 's3'
 _s3_mod = None
@@ -33,6 +45,22 @@ if _USE_S3:
 # is not available while this is enabled, write ops will fail (return False).
 STRICT_S3 = os.environ.get('STORAGE_STRICT_S3', '').lower() in ('1', 'true', 'yes')
 
+# Upper bound on concurrent S3 requests issued by read_many.
+READ_MANY_WORKERS = int(os.environ.get('STORAGE_READ_WORKERS', '8'))
+
+# On-disk format for exam DataFrames: 'feather' (Arrow IPC), 'parquet' or
+# 'pickle'. Columnar formats need pyarrow; without it frames stay pickled.
+# Existing .pkl files are always readable regardless of this setting.
+FRAME_FORMAT = (os.environ.get('EXAM_FRAME_FORMAT') or ('feather' if pa is not None else 'pickle')).lower()
+FRAME_EXTS = {'feather': '.feather', 'parquet': '.parquet', 'pickle': '.pkl'}
+FRAME_MIMETYPES = {'.feather': 'application/vnd.apache.arrow.file',
+                   '.parquet': 'application/vnd.apache.parquet',
+                   '.pkl': 'application/octet-stream'}
+# Low-cardinality label columns stored dictionary-encoded in columnar files
+DICT_COLUMNS = ('Name', 'Class', 'Stream', 'Gender')
+# Schema metadata key listing mixed-type columns stored as JSON text
+_JSON_COLS_META = b'eduscore.json_columns'
+
 
 BASE_STORAGE = os.path.join(os.path.dirname(__file__), '..', 'saved_exams_storage')
 
@@ -72,6 +100,169 @@ def _path_to_key(path: str) -> str:
     return path.lstrip('/').replace('\\', '/')
 
 
+# ---------------------------------------------------------------------------
+# Read-through cache for S3 mode: memory LRU -> local disk -> bucket.
+# Entries younger than CACHE_TTL are served as-is; older ones are revalidated
+# with a conditional GET (If-None-Match on the stored ETag). Missing keys are
+# cached too so optional files are not re-requested on every rerun. Any other
+# S3 error serves the stale copy (if any) and leaves the cache alone. Writes and
+# deletes through this module invalidate the key in both tiers.
+# ---------------------------------------------------------------------------
+CACHE_ENABLED = os.environ.get('STORAGE_CACHE', 'true').lower() in ('1', 'true', 'yes')
+CACHE_TTL = float(os.environ.get('STORAGE_CACHE_TTL', '30'))
+CACHE_MAX_BYTES = int(os.environ.get('STORAGE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+CACHE_MAX_ITEM_BYTES = int(os.environ.get('STORAGE_CACHE_MAX_ITEM_BYTES', str(8 * 1024 * 1024)))
+CACHE_DIR = os.environ.get('STORAGE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'eduscore_storage_cache')
+
+_cache_lock = threading.RLock()
+_mem_cache: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (data or None, etag, checked_at)
+_mem_bytes = 0
+_cache_stats = {'memory_hits': 0, 'disk_hits': 0, 'revalidated': 0, 'misses': 0,
+                'invalidations': 0, 'evictions': 0, 'errors': 0}
+
+
+def _cache_on() -> bool:
+    return CACHE_ENABLED and _USE_S3 and _s3_mod is not None
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def _mem_put(key: str, data: Optional[bytes], etag: Optional[str], checked_at: float):
+    global _mem_bytes
+    size = len(data) if data else 0
+    if size > CACHE_MAX_ITEM_BYTES:
+        _mem_drop(key)
+        return
+    with _cache_lock:
+        _mem_drop(key)
+        _mem_cache[key] = (data, etag, checked_at)
+        _mem_bytes += size
+        while _mem_bytes > CACHE_MAX_BYTES and len(_mem_cache) > 1:
+            _k, (old, _e, _t) = _mem_cache.popitem(last=False)
+            _mem_bytes -= len(old) if old else 0
+            _cache_stats['evictions'] += 1
+
+
+def _mem_drop(key: str):
+    global _mem_bytes
+    with _cache_lock:
+        old = _mem_cache.pop(key, None)
+        if old is not None:
+            _mem_bytes -= len(old[0]) if old[0] else 0
+
+
+def _disk_get(key: str):
+    p = _disk_path(key)
+    try:
+        with open(p + '.json', 'r', encoding='utf-8') as fh:
+            meta = json.load(fh)
+        if meta.get('key') != key or not meta.get('etag'):
+            return None
+        with open(p, 'rb') as fh:
+            return fh.read(), meta['etag']
+    except Exception:
+        return None
+
+
+def _disk_put(key: str, data: bytes, etag: Optional[str]):
+    if not etag or data is None:
+        return
+    p = _disk_path(key)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{p}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, p)
+        with open(p + '.json', 'w', encoding='utf-8') as fh:
+            json.dump({'key': key, 'etag': etag}, fh)
+    except Exception:
+        pass
+
+
+def _disk_drop(key: str):
+    p = _disk_path(key)
+    for f in (p + '.json', p):
+        try:
+            os.remove(f)
+        except Exception:
+            pass
+
+
+def invalidate_cache(key_or_path: str):
+    """Forget a key in the memory and disk cache tiers."""
+    key = _path_to_key(key_or_path)
+    _mem_drop(key)
+    _disk_drop(key)
+    with _cache_lock:
+        _cache_stats['invalidations'] += 1
+
+
+def clear_cache(disk: bool = True):
+    global _mem_bytes
+    with _cache_lock:
+        _mem_cache.clear()
+        _mem_bytes = 0
+    if disk:
+        import shutil
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters and current size of the read cache."""
+    with _cache_lock:
+        out = dict(_cache_stats)
+        out.update(enabled=_cache_on(), entries=len(_mem_cache), bytes=_mem_bytes,
+                   max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL)
+    return out
+
+
+def _cached_s3_read(key: str) -> Optional[bytes]:
+    now = time.time()
+    with _cache_lock:
+        hit = _mem_cache.get(key)
+        if hit is not None:
+            _mem_cache.move_to_end(key)
+    if hit is not None and now - hit[2] < CACHE_TTL:
+        with _cache_lock:
+            _cache_stats['memory_hits'] += 1
+        return hit[0]
+    data, etag = (hit[0], hit[1]) if hit is not None else (None, None)
+    if hit is None:
+        disk = _disk_get(key)
+        if disk is not None:
+            data, etag = disk
+    if etag and hasattr(_s3_mod, 'download_bytes_if_changed'):
+        status, body, new_etag = _s3_mod.download_bytes_if_changed(key, etag)
+        if status == 'not_modified':
+            with _cache_lock:
+                _cache_stats['revalidated' if hit is not None else 'disk_hits'] += 1
+            _mem_put(key, data, etag, now)
+            return data
+    elif hasattr(_s3_mod, 'download_bytes_if_changed'):
+        status, body, new_etag = _s3_mod.download_bytes_if_changed(key)
+    else:
+        body, new_etag = _s3_mod.download_bytes(key), None
+        status = 'ok' if body is not None else 'missing'
+    if status == 'error':
+        # not a deleted object (access denied, throttling, 5xx): keep what we have
+        with _cache_lock:
+            _cache_stats['errors'] += 1
+        return data
+    with _cache_lock:
+        _cache_stats['misses'] += 1
+    if status != 'ok':
+        body, new_etag = None, None
+    _mem_put(key, body, new_etag, now)
+    if body is not None:
+        _disk_put(key, body, new_etag)
+    else:
+        _disk_drop(key)
+    return body
+
+
 def write_bytes(key_or_path: str, data: bytes, content_type: Optional[str] = None) -> bool:
     """Write bytes to S3 (when enabled) or to local filesystem.
     If S3 is enabled we treat key_or_path as an S3 key under the bucket/prefix.
@@ -85,7 +276,9 @@ def write_bytes(key_or_path: str, data: bytes, content_type: Optional[str] = Non
         try:
             # Normalize local paths under BASE_STORAGE to relative S3 keys
             key = _path_to_key(key_or_path)
-            return _s3_mod.upload_bytes(key, data, content_type=content_type)
+            ok = _s3_mod.upload_bytes(key, data, content_type=content_type)
+            invalidate_cache(key)
+            return ok
         except Exception:
             return False
     # local write
@@ -107,6 +300,8 @@ def read_bytes(key_or_path: str) -> Optional[bytes]:
     if _USE_S3 and _s3_mod is not None:
         try:
             key = _path_to_key(key_or_path)
+            if _cache_on():
+                return _cached_s3_read(key)
             return _s3_mod.download_bytes(key)
         except Exception:
             return None
@@ -122,10 +317,46 @@ def read_bytes(key_or_path: str) -> Optional[bytes]:
         return None
 
 
+def read_many(keys: Iterable[str], max_workers: Optional[int] = None,
+              timings: Optional[Dict[str, float]] = None) -> Dict[str, Optional[bytes]]:
+    """Read several keys at once and return {key: bytes or None}.
+
+    In S3 mode the GETs fan out on a bounded thread pool (READ_MANY_WORKERS,
+    env STORAGE_READ_WORKERS); local files are read sequentially. When a
+    ``timings`` dict is passed it is filled with the seconds spent per key.
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+
+    def _timed(k):
+        t0 = time.perf_counter()
+        b = read_bytes(k)
+        return k, b, time.perf_counter() - t0
+
+    if _USE_S3 and _s3_mod is not None and len(keys) > 1:
+        workers = max(1, min(max_workers or READ_MANY_WORKERS, len(keys)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_timed, keys))
+    else:
+        results = [_timed(k) for k in keys]
+
+    out = {}
+    for k, b, dt in results:
+        out[k] = b
+        if timings is not None:
+            timings[k] = dt
+    return out
+
+
 def exists(key_or_path: str) -> bool:
     if _USE_S3 and _s3_mod is not None:
         try:
             key = _path_to_key(key_or_path)
+            with _cache_lock:
+                hit = _mem_cache.get(key) if _cache_on() else None
+            if hit is not None and time.time() - hit[2] < CACHE_TTL:
+                return hit[0] is not None
             return _s3_mod.exists(key)
         except Exception:
             return False
@@ -155,13 +386,40 @@ def list_objects(prefix: str = '') -> List[str]:
     return out
 
 
+def delete_older_than(prefix: str, max_age: float) -> int:
+    """Delete objects (or local files) under ``prefix`` last modified more than
+    ``max_age`` seconds ago. Returns how many were deleted."""
+    cutoff = time.time() - max_age
+    if _USE_S3 and _s3_mod is not None:
+        try:
+            base = _path_to_key(prefix).rstrip('/')
+            stale = [rel for rel, modified in _s3_mod.list_objects_modified(base) if modified < cutoff]
+        except Exception:
+            return 0
+        return sum(1 for rel in stale if delete(f'{base}/{rel}' if base else rel))
+    removed = 0
+    for rel in list_objects(prefix):
+        fp = os.path.join(BASE_STORAGE, rel)
+        try:
+            if os.path.getmtime(fp) < cutoff:
+                os.remove(fp)
+                removed += 1
+        except Exception:
+            pass
+    return removed
+
+
 def write_json(key_or_path: str, obj: object) -> bool:
     b = json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
     return write_bytes(key_or_path, b, content_type='application/json')
 
 
 def read_json(key_or_path: str) -> Optional[object]:
-    b = read_bytes(key_or_path)
+    return loads_json(read_bytes(key_or_path))
+
+
+def loads_json(b: Optional[bytes]) -> Optional[object]:
+    """Decode JSON bytes returned by read_bytes/read_many (None on failure)."""
     if not b:
         return None
     try:
@@ -189,7 +447,14 @@ def write_pickle(key_or_path: str, obj) -> bool:
 
 
 def read_pickle(key_or_path: str):
-    b = read_bytes(key_or_path)
+    # ``.pkl`` keys may since have been rewritten in a columnar format
+    if str(key_or_path).endswith('.pkl'):
+        return read_frame(key_or_path)
+    return loads_pickle(read_bytes(key_or_path))
+
+
+def loads_pickle(b: Optional[bytes]):
+    """Decode pickle bytes returned by read_bytes/read_many (None on failure)."""
     if not b:
         return None
     try:
@@ -202,6 +467,170 @@ def read_pickle(key_or_path: str):
         return None
 
 
+def frame_keys(key_or_path: str) -> List[str]:
+    """Candidate keys for a stored DataFrame in read order: the configured
+    format first, then the other known format (``.pkl`` for legacy files).
+    ``key_or_path`` may carry any known extension (e.g. ``<exam_id>/data.pkl``).
+    """
+    base = key_or_path
+    for ext in FRAME_EXTS.values():
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+            break
+    first = FRAME_EXTS.get(FRAME_FORMAT, '.pkl')
+    second = '.pkl' if first != '.pkl' else '.feather'
+    return [base + first, base + second]
+
+
+def _to_arrow(df):
+    """Convert a DataFrame to an Arrow table. Object columns holding mixed
+    types (e.g. marks with 'ABS') are stored as JSON text and restored on read.
+    """
+    json_cols = []
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=None)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        work = df.copy(deep=False)
+        for c in df.columns:
+            if df[c].dtype != object:
+                continue
+            try:
+                pa.array(df[c], from_pandas=True)
+            except Exception:
+                work[c] = df[c].map(lambda v: json.dumps(v, default=lambda o: o.item() if hasattr(o, 'item') else str(o)))
+                json_cols.append(str(c))
+        table = pa.Table.from_pandas(work, preserve_index=None)
+    for name in DICT_COLUMNS:
+        i = table.schema.get_field_index(name)
+        if i >= 0 and name not in json_cols and pa.types.is_string(table.schema.field(i).type):
+            table = table.set_column(i, name, table.column(i).dictionary_encode())
+    meta = dict(table.schema.metadata or {})
+    meta[_JSON_COLS_META] = json.dumps(json_cols).encode('utf-8')
+    return table.replace_schema_metadata(meta)
+
+
+def dumps_frame(df, fmt: Optional[str] = None):
+    """Serialize a DataFrame in the configured format. Returns (bytes, ext).
+    Falls back to pickle when pyarrow is missing or the frame can't be
+    represented in Arrow (e.g. duplicate column names).
+    """
+    fmt = (fmt or FRAME_FORMAT).lower()
+    if fmt in ('feather', 'parquet') and pa is not None and pd is not None and isinstance(df, pd.DataFrame):
+        try:
+            table = _to_arrow(df)
+            sink = pa.BufferOutputStream()
+            if fmt == 'parquet':
+                _pq.write_table(table, sink, compression='zstd')
+            else:
+                _feather.write_feather(table, sink, compression='lz4')
+            return sink.getvalue().to_pybytes(), FRAME_EXTS[fmt]
+        except Exception:
+            pass
+    import pickle
+    buf = BytesIO()
+    if pd is not None and isinstance(df, pd.DataFrame):
+        df.to_pickle(buf)
+    else:
+        pickle.dump(df, buf)
+    return buf.getvalue(), '.pkl'
+
+
+def loads_frame(b: Optional[bytes], columns: Optional[List[str]] = None, categorical: bool = False):
+    """Decode bytes produced by dumps_frame (or a legacy pickle).
+
+    ``columns`` restricts the result to those columns (missing ones are
+    ignored); columnar files only decode the requested columns. Dictionary
+    encoded label columns come back as object dtype unless ``categorical``.
+    """
+    if not b:
+        return None
+    try:
+        if pa is not None and (b[:6] == b'ARROW1' or b[:4] == b'PAR1'):
+            src = pa.BufferReader(b)
+            if b[:4] == b'PAR1':
+                schema = _pq.read_schema(pa.BufferReader(b))
+            else:
+                schema = pa.ipc.open_file(pa.BufferReader(b)).schema
+            cols = None
+            if columns is not None:
+                names = set(schema.names)
+                cols = [c for c in columns if c in names]
+                # keep stored index columns so the frame index survives projection
+                pmeta = schema.pandas_metadata or {}
+                for ic in pmeta.get('index_columns', []):
+                    if isinstance(ic, str) and ic in names and ic not in cols:
+                        cols.append(ic)
+            if b[:4] == b'PAR1':
+                table = _pq.read_table(src, columns=cols, use_pandas_metadata=True)
+            else:
+                table = _feather.read_table(src, columns=cols)
+            df = table.to_pandas()
+            json_cols = json.loads((schema.metadata or {}).get(_JSON_COLS_META, b'[]').decode('utf-8'))
+            for c in json_cols:
+                if c in df.columns:
+                    df[c] = df[c].map(lambda v: json.loads(v) if isinstance(v, str) else v)
+            if not categorical:
+                for c in df.columns:
+                    if isinstance(df[c].dtype, pd.CategoricalDtype):
+                        col = df[c]
+                        df[c] = col.astype(object).where(col.notna(), None)
+            return df
+        obj = loads_pickle(b)
+        if columns is not None and pd is not None and isinstance(obj, pd.DataFrame):
+            obj = obj[[c for c in columns if c in obj.columns]]
+        return obj
+    except Exception:
+        return None
+
+
+def write_frame(key_or_path: str, df, fmt: Optional[str] = None) -> bool:
+    """Write a DataFrame under ``key_or_path`` (extension replaced by the
+    format's) and remove copies stored in the other formats."""
+    b, ext = dumps_frame(df, fmt)
+    target = frame_keys(key_or_path)[0]
+    target = target[:target.rfind('.')] + ext
+    ok = write_bytes(target, b, content_type=FRAME_MIMETYPES.get(ext))
+    if ok:
+        for k in frame_keys(key_or_path):
+            if k != target:
+                try:
+                    if exists(k):
+                        delete(k)
+                except Exception:
+                    pass
+    return ok
+
+
+def read_frame(key_or_path: str, columns: Optional[List[str]] = None, categorical: bool = False):
+    """Read a DataFrame written by write_frame/write_pickle, preferring the
+    configured columnar format and falling back to legacy ``.pkl`` files."""
+    for k in frame_keys(key_or_path):
+        b = read_bytes(k)
+        if b:
+            return loads_frame(b, columns=columns, categorical=categorical)
+    return None
+
+
+def local_frame_path(path) -> Optional[str]:
+    """First existing local file among the frame candidates of ``path``."""
+    for p in frame_keys(str(path)):
+        if os.path.exists(p):
+            return p
+    return None
+
+
+def read_frame_file(path, columns: Optional[List[str]] = None, categorical: bool = False):
+    """Read a DataFrame from the local filesystem only (any supported format)."""
+    p = local_frame_path(path)
+    if not p:
+        return None
+    try:
+        with open(p, 'rb') as fh:
+            return loads_frame(fh.read(), columns=columns, categorical=categorical)
+    except Exception:
+        return None
+
+
 def download_file(key: str, local_path: str) -> bool:
     """Download from S3 to local path. If S3 not enabled, copy from local storage."""
     # If strict S3-only mode is requested and S3 isn't available, fail.
@@ -231,7 +660,9 @@ def upload_file(local_path: str, key: str) -> bool:
     if _USE_S3 and _s3_mod is not None:
         try:
             keyn = _path_to_key(key)
-            return _s3_mod.upload_file(local_path, keyn)
+            ok = _s3_mod.upload_file(local_path, keyn)
+            invalidate_cache(keyn)
+            return ok
         except Exception:
             return False
     # local copy: ensure directory exists
@@ -245,6 +676,17 @@ def upload_file(local_path: str, key: str) -> bool:
         return False
 
 
+def download_url(key_or_path: str, expires: int = 3600, filename: Optional[str] = None) -> Optional[str]:
+    """Presigned URL for downloading a stored object directly from S3, or None
+    when S3 is not enabled (callers then serve the local file)."""
+    if _USE_S3 and _s3_mod is not None:
+        try:
+            return _s3_mod.presigned_url(_path_to_key(key_or_path), expires=expires, filename=filename)
+        except Exception:
+            return None
+    return None
+
+
 def delete(key_or_path: str) -> bool:
     """Delete an object/key or local file. Returns True if deleted or missing.
     When S3 is enabled this will attempt to delete the S3 object; otherwise remove
@@ -252,7 +694,10 @@ def delete(key_or_path: str) -> bool:
     """
     if _USE_S3 and _s3_mod is not None:
         try:
-            return _s3_mod.delete_object(key_or_path)
+            key = _path_to_key(key_or_path)
+            ok = _s3_mod.delete_object(key)
+            invalidate_cache(key)
+            return ok
         except Exception:
             return False
     # local delete
@@ -317,6 +762,31 @@ def get_storage_dir():
     return path
 
 
+def account_kv_defaults(school_id: str) -> Dict[str, Any]:
+    """Initial kv_store entries (``storage:<school_id>:<filename>``) of a new
+    account in DB-only mode."""
+    defaults = {
+        'exams_metadata.json': {},
+        'student_contacts.json': [],
+        'student_photos.json': {},
+        'sent_messages_log.json': [],
+        'purchases.json': {},
+        'ta_teachers.json': {},
+        'teacher_assignments.json': {},
+        'ta_assignments.json': {},
+        'ta_assignments_simple.json': {},
+        'ta_class_map.json': {},
+        'ta_selected_exams.json': {},
+        'ta_settings.json': {},
+        'report_card_settings.json': {},
+        'app_persistent_config.json': {},
+    }
+    items = {f'storage:{school_id}:{k}': v for k, v in defaults.items()}
+    # ensure student_photos key exists as empty dict
+    items[f'storage:{school_id}:student_photos'] = {}
+    return items
+
+
 def initialize_account(school_id: str):
     """Create a fresh per-school storage folder with empty datasets and
     prefilled messaging configuration copied from the global config (if present).
@@ -334,34 +804,7 @@ def initialize_account(school_id: str):
             if USE_DB_STRICT and _db is not None:
                 _db.init_from_env()
                 if _db.enabled():
-                    # create default keys under storage:<school_id>:<filename>
-                    defaults = {
-                        'exams_metadata.json': {},
-                        'student_contacts.json': [],
-                        'student_photos.json': {},
-                        'sent_messages_log.json': [],
-                        'purchases.json': {},
-                        'ta_teachers.json': {},
-                        'teacher_assignments.json': {},
-                        'ta_assignments.json': {},
-                        'ta_assignments_simple.json': {},
-                        'ta_class_map.json': {},
-                        'ta_selected_exams.json': {},
-                        'ta_settings.json': {},
-                        'report_card_settings.json': {},
-                        'app_persistent_config.json': {},
-                    }
-                    for k, v in defaults.items():
-                        try:
-                            _db.set_kv(f'storage:{school_id}:{k}', v)
-                        except Exception:
-                            pass
-                    # ensure student_photos key exists as empty dict
-                    try:
-                        _db.set_kv(f'storage:{school_id}:student_photos', {})
-                    except Exception:
-                        pass
-                    return True
+                    return _db.set_kv_many(account_kv_defaults(school_id))
         except Exception:
             pass
         root = os.path.join(os.path.dirname(__file__), '..', 'saved_exams_storage')
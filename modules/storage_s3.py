@@ -3,11 +3,12 @@
 This module provides simple helpers to upload/download files to S3 while
 keeping a fallback to local filesystem. It intentionally implements a small
 surface (init_from_env, upload_file, download_file, exists, list_objects,
-upload_bytes, download_bytes) used by the app.
+upload_bytes, download_bytes, download_bytes_if_changed, presigned_url) used
+by the app.
 """
 from __future__ import annotations
 import os
-from typing import Optional, List
+from typing import Optional, List, Tuple
 try:
     import boto3
     from botocore.exceptions import ClientError
@@ -113,6 +114,28 @@ def list_objects(prefix: str) -> List[str]:
         return []
 
 
+def list_objects_modified(prefix: str) -> List[Tuple[str, float]]:
+    """Like ``list_objects`` but with each object's LastModified (epoch seconds)."""
+    global _s3, _bucket
+    if _s3 is None:
+        raise RuntimeError('S3 not initialized')
+    p = _s3_key(prefix)
+    try:
+        paginator = _s3.get_paginator('list_objects_v2')
+        out = []
+        for page in paginator.paginate(Bucket=_bucket, Prefix=p):
+            for obj in page.get('Contents', []):
+                key = obj.get('Key')
+                if key is None:
+                    continue
+                rel = key[len(p):].lstrip('/') if p and key.startswith(p) else key
+                modified = obj.get('LastModified')
+                out.append((rel, modified.timestamp() if modified is not None else 0.0))
+        return out
+    except ClientError:
+        return []
+
+
 def upload_bytes(key: str, data: bytes, content_type: str = None) -> bool:
     global _s3, _bucket
     if _s3 is None:
@@ -140,6 +163,46 @@ def download_bytes(key: str) -> Optional[bytes]:
         return None
 
 
+def download_bytes_if_changed(key: str, etag: Optional[str] = None) -> Tuple[str, Optional[bytes], Optional[str]]:
+    """Conditional GET. Returns ``(status, data, etag)`` where status is
+    ``'ok'`` (data is the new body), ``'not_modified'`` (the object still
+    matches ``etag``), ``'missing'`` (no such key) or ``'error'`` (access
+    denied, throttling, 5xx, network: the object may still exist)."""
+    global _s3, _bucket
+    if _s3 is None:
+        raise RuntimeError('S3 not initialized')
+    k = _s3_key(key)
+    kwargs = {'IfNoneMatch': etag} if etag else {}
+    try:
+        resp = _s3.get_object(Bucket=_bucket, Key=k, **kwargs)
+        return 'ok', resp['Body'].read(), resp.get('ETag')
+    except ClientError as e:
+        code = str(getattr(e, 'response', {}).get('Error', {}).get('Code', ''))
+        if code in ('304', 'NotModified'):
+            return 'not_modified', None, etag
+        if code in ('404', 'NoSuchKey', 'NotFound'):
+            return 'missing', None, None
+        return 'error', None, None
+    except Exception:
+        return 'error', None, None
+
+
+def presigned_url(key: str, expires: int = 3600, filename: Optional[str] = None) -> Optional[str]:
+    """Time-limited GET URL for an object, so large files are downloaded
+    straight from the bucket. ``filename`` makes browsers save it under that
+    name."""
+    global _s3, _bucket
+    if _s3 is None:
+        raise RuntimeError('S3 not initialized')
+    params = {'Bucket': _bucket, 'Key': _s3_key(key)}
+    if filename:
+        params['ResponseContentDisposition'] = f'attachment; filename="{filename}"'
+    try:
+        return _s3.generate_presigned_url('get_object', Params=params, ExpiresIn=int(expires))
+    except ClientError:
+        return None
+
+
 def delete_object(key: str) -> bool:
     """Delete an object from the S3 bucket. Returns True on success."""
     global _s3, _bucket
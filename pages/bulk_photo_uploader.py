@@ -14,42 +14,20 @@ import pandas as pd
 import os
 from utils import student_photos as photos_mod
 from modules import storage
+from modules import exam_store
 
 # --- Ensure session state is initialized (copied from saved_exams.py) ---
 def load_all_exams_into_session():
-    import json
-    # Use storage adapter for metadata and exam files
+    # Use storage adapter for metadata; exam payloads come from the shared store
     base = storage.get_storage_dir()
     METADATA_FILE = os.path.join(base, 'exams_metadata.json')
     all_metadata = storage.read_json(METADATA_FILE) or {}
-    st.session_state.saved_exams = []
-    for exam_id, metadata in all_metadata.items():
-        st.session_state.saved_exams.append(metadata)
-    st.session_state.saved_exam_data = {}
-    st.session_state.saved_exam_raw_data = {}
-    st.session_state.saved_exam_configs = {}
-    for exam_id in all_metadata.keys():
-        data_key = os.path.join(exam_id, 'data.pkl')
-        raw_data_key = os.path.join(exam_id, 'raw_data.pkl')
-        config_key = os.path.join(exam_id, 'config.json')
-        try:
-            df = storage.read_pickle(data_key)
-            if df is not None:
-                st.session_state.saved_exam_data[exam_id] = df
-        except Exception:
-            pass
-        try:
-            rdf = storage.read_pickle(raw_data_key)
-            if rdf is not None:
-                st.session_state.saved_exam_raw_data[exam_id] = rdf
-        except Exception:
-            pass
-        try:
-            cfg = storage.read_json(config_key)
-            if cfg is not None:
-                st.session_state.saved_exam_configs[exam_id] = cfg
-        except Exception:
-            pass
+    try:
+        from modules import auth as _auth
+        sid = _auth.get_current_school_id() or 'global'
+    except Exception:
+        sid = 'global'
+    exam_store.attach_session(st.session_state, sid, all_metadata, storage_dir=base)
 
 # Initialize session state for saved exams if not present
 if 'saved_exams' not in st.session_state:
@@ -484,10 +484,10 @@ for e in sorted(filtered, key=lambda x: (x.get('year') or '', x.get('exam_name')
     # try to read pickles for counts
     try:
         df = None
-        if eid and os.path.exists(data_p):
-            df = pd.read_pickle(data_p)
-        elif eid and os.path.exists(raw_p):
-            df = pd.read_pickle(raw_p)
+        if eid and storage.local_frame_path(data_p):
+            df = storage.read_frame_file(data_p)
+        elif eid and storage.local_frame_path(raw_p):
+            df = storage.read_frame_file(raw_p)
         if isinstance(df, pd.DataFrame):
             # student count
             name_col = None
@@ -691,14 +691,12 @@ def load_exam_from_disk_local(exam_id):
         cfg = {}
 
         try:
-            if storage.exists(data_key):
-                exam_data = storage.read_pickle(data_key)
+            exam_data = storage.read_frame(data_key)
         except Exception:
             exam_data = None
 
         try:
-            if storage.exists(raw_key):
-                exam_raw = storage.read_pickle(raw_key)
+            exam_raw = storage.read_frame(raw_key)
         except Exception:
             exam_raw = None
 
@@ -1148,8 +1146,8 @@ for year in sorted(grouped.keys(), reverse=True, key=lambda x: (x == 'Unknown',
                                         files = os.listdir(exam_dir)
                                 except Exception:
                                     files = []
-                                raw_exists = 'raw_data.pkl' in files
-                                data_exists = 'data.pkl' in files
+                                raw_exists = any(f in files for f in storage.frame_keys('raw_data.pkl'))
+                                data_exists = any(f in files for f in storage.frame_keys('data.pkl'))
                                 st.write(f"Data file present: {data_exists}")
                                 st.write(f"Raw file present: {raw_exists}")
                                 if files:
@@ -4,13 +4,10 @@ import io
 import json
 import os
 from pathlib import Path
-try:
-    import phonenumbers
-    _HAS_PHONENUM = True
-except Exception:
-    phonenumbers = None
-    _HAS_PHONENUM = False
-from modules import storage
+from modules import storage, contacts_store
+from utils import phones
+
+_HAS_PHONENUM = phones.HAS_PHONENUMBERS
 
 # Use per-school storage dir (or global) from storage helper to match other pages
 def _contacts_key():
@@ -39,51 +36,75 @@ def ensure_storage():
     except Exception:
         pass
 
+def _contacts_scope():
+    # contacts_store partitions rows by the account's storage directory name
+    try:
+        return Path(storage.get_storage_dir()).name
+    except Exception:
+        return 'default'
+
+def _read_contacts_file():
+    try:
+        return storage.read_bytes(_contacts_key())
+    except Exception:
+        return None
+
+def _write_contacts_file(contacts):
+    # student_contacts.json stays as an export of the store for pages that still read it
+    raw = contacts_store.dumps(contacts)
+    storage.write_bytes(_contacts_key(), raw, content_type='application/json')
+    return raw
+
 def load_contacts():
     ensure_storage()
+    scope = _contacts_scope()
+    try:
+        if contacts_store.sync(scope, _read_contacts_file()):
+            return contacts_store.load(scope)
+    except Exception:
+        pass
     try:
         k = _contacts_key()
-        data = storage.read_json(k)
-        return data or []
+        data = storage.read_json(k) or []
     except Exception:
         return []
+    # contacts saved before phone_key existed (or edited elsewhere) are normalized once and written back
+    try:
+        if phones.ensure_contacts(data):
+            storage.write_json(k, data)
+    except Exception:
+        pass
+    return data
 
 def save_contacts(contacts):
     ensure_storage()
-    k = _contacts_key()
-    storage.write_json(k, contacts)
+    phones.ensure_contacts(contacts)
+    raw = _write_contacts_file(contacts)
+    try:
+        contacts_store.replace_all(_contacts_scope(), contacts, raw=raw)
+    except Exception:
+        pass
+
+def import_contacts(records):
+    """Upsert records (matched by student_id, else student name, and phone, so
+    a second guardian is added) and return {'inserted', 'updated'}."""
+    ensure_storage()
+    scope = _contacts_scope()
+    try:
+        if contacts_store.sync(scope, _read_contacts_file()):
+            counts = contacts_store.upsert(scope, records)
+            contacts_store.mark_synced(scope, _write_contacts_file(contacts_store.load(scope)))
+            return counts
+    except Exception:
+        pass
+    contacts = load_contacts()
+    counts = contacts_store.merge(contacts, records)
+    save_contacts(contacts)
+    return counts
 
 def normalize_number(raw, default_country='KE'):
-    if not raw or str(raw).strip() == '':
-        return ''
-    s = str(raw).strip()
-    # Remove common formatting
-    # Prefer using the phonenumbers library when available for robust parsing.
-    if _HAS_PHONENUM and phonenumbers is not None:
-        try:
-            if s.startswith('+'):
-                pn = phonenumbers.parse(s, None)
-            else:
-                pn = phonenumbers.parse(s, default_country)
-            if phonenumbers.is_valid_number(pn):
-                return phonenumbers.format_number(pn, phonenumbers.PhoneNumberFormat.E164)
-        except Exception:
-            pass
-
-    # Fallback heuristics (digits only, assume KE local numbers if starting with 0)
-    digits = ''.join(ch for ch in s if ch.isdigit())
-    if not digits:
-        return ''
-    if digits.startswith('0'):
-        # assume Kenya local -> +254
-        return '+254' + digits.lstrip('0')
-    if digits.startswith('254'):
-        return '+' + digits
-    if digits.startswith('7') and len(digits) in (9,10):
-        # common mobile start in KE without leading zero
-        return '+254' + digits[-9:]
-    # last resort, return digits as-is
-    return digits
+    # cached, with a regex fast path for Kenyan mobiles (see utils.phones)
+    return phones.normalize_number(raw, default_country)
 
 st.set_page_config(page_title="Parent Contacts", layout="wide")
 
@@ -98,34 +119,23 @@ st.markdown(
 
 ensure_storage()
 contacts = load_contacts()
-df = pd.DataFrame(contacts)
+df = pd.DataFrame(contacts).drop(columns=['phone_key'], errors='ignore')
 
 with st.expander("Upload contacts CSV", expanded=True):
     st.markdown("CSV should contain at least: student_id, student_name, grade, stream, parent_name, phone")
     uploaded = st.file_uploader("Upload CSV file", type=["csv"]) 
     if uploaded is not None:
         try:
-            new_df = pd.read_csv(uploaded)
+            # read as text so ids and phone numbers keep their leading zeros
+            new_df = pd.read_csv(uploaded, dtype=str)
             st.write("Preview uploaded file:")
             st.dataframe(new_df.head())
             if st.button("Normalize and add to contacts"):
-                # normalize phones and append
-                added = 0
-                for _, row in new_df.iterrows():
-                    rec = {
-                        'student_id': str(row.get('student_id', '')).strip(),
-                        'student_name': str(row.get('student_name', '')).strip(),
-                        'grade': str(row.get('grade', '')).strip(),
-                        'stream': str(row.get('stream', '')).strip(),
-                        'parent_name': str(row.get('parent_name', '')).strip(),
-                        'phone_raw': str(row.get('phone', '')).strip(),
-                    }
-                    rec['phone'] = normalize_number(rec['phone_raw'])
-                    contacts.append(rec)
-                    added += 1
-                save_contacts(contacts)
-                st.success(f"Added {added} contacts and normalized phone numbers.")
-                df = pd.DataFrame(contacts)
+                # one bulk upsert: existing students (by student_id, else name) are updated, new ones added
+                counts = import_contacts(contacts_store.records_from_frame(new_df))
+                st.success(f"Added {counts['inserted']} and updated {counts['updated']} contacts; phone numbers normalized.")
+                contacts = load_contacts()
+                df = pd.DataFrame(contacts).drop(columns=['phone_key'], errors='ignore')
         except Exception as e:
             st.error(f"Failed to read CSV: {e}")
 
@@ -139,19 +149,8 @@ else:
     if hasattr(st, 'experimental_data_editor'):
         edited = st.experimental_data_editor(df, num_rows="dynamic")
         if st.button("Save edited contacts"):
-            # convert back to list of dicts, ensure phone normalization
-            saved = []
-            for _, row in edited.fillna('').iterrows():
-                rec = {
-                    'student_id': str(row.get('student_id', '')).strip(),
-                    'student_name': str(row.get('student_name', '')).strip(),
-                    'grade': str(row.get('grade', '')).strip(),
-                    'stream': str(row.get('stream', '')).strip(),
-                    'parent_name': str(row.get('parent_name', '')).strip(),
-                    'phone_raw': str(row.get('phone', '')).strip(),
-                }
-                rec['phone'] = normalize_number(rec['phone_raw'])
-                saved.append(rec)
+            # convert back to list of dicts; phones are normalized from the edited 'phone' column
+            saved = contacts_store.records_from_frame(edited)
             save_contacts(saved)
             st.success("Contacts saved.")
     else:
@@ -161,20 +160,9 @@ else:
         edited_csv = st.text_area("Edit contacts as CSV (header row required). After editing click Parse and save.", value=csv_val, height=300)
         if st.button("Parse and save CSV edits"):
             try:
-                new_df = pd.read_csv(io.StringIO(edited_csv))
-                # convert back to list of dicts, ensure phone normalization
-                saved = []
-                for _, row in new_df.fillna('').iterrows():
-                    rec = {
-                        'student_id': str(row.get('student_id', '')).strip(),
-                        'student_name': str(row.get('student_name', '')).strip(),
-                        'grade': str(row.get('grade', '')).strip(),
-                        'stream': str(row.get('stream', '')).strip(),
-                        'parent_name': str(row.get('parent_name', '')).strip(),
-                        'phone_raw': str(row.get('phone', '')).strip(),
-                    }
-                    rec['phone'] = normalize_number(rec['phone_raw'])
-                    saved.append(rec)
+                new_df = pd.read_csv(io.StringIO(edited_csv), dtype=str)
+                # convert back to list of dicts; phones are normalized from the edited 'phone' column
+                saved = contacts_store.records_from_frame(new_df)
                 save_contacts(saved)
                 st.success("Contacts saved from CSV edits.")
             except Exception as e:
@@ -201,8 +189,7 @@ with st.form("single_contact"):
             'phone_raw': str(phone).strip(),
         }
         rec['phone'] = normalize_number(rec['phone_raw'])
-        contacts.append(rec)
-        save_contacts(contacts)
-        st.success("Contact added.")
+        counts = import_contacts([rec])
+        st.success("Contact added." if counts['inserted'] else "Existing contact updated.")
 
-st.info(f"Contacts are stored in `{CONTACTS_FILE}`. The Send Messages page will use these when composing messages.")
+st.info(f"Contacts are stored in `{_contacts_key()}`. The Send Messages page will use these when composing messages.")
@@ -18,6 +18,9 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from numbers import Number
 from modules import storage
+from modules import exam_store
+from modules import jobs
+from utils.pdf_export import generate_pdf_stream_table as _stream_table_pdf
 
 # ReportLab default styles
 styles = getSampleStyleSheet()
@@ -134,16 +137,14 @@ def convert_score_to_numeric(val):
     return None
 
 def generate_pdf_stream_table(exam_name, subj_list, streams, table_data, most_improved_info=None, include_subjects=None, stream_total_means=None, most_improved_table=None):
-    """Generate a PDF containing a subject × stream mean table, with Average and Rank rows at the bottom.
-    include_subjects: list of subject names to include (defaults to subj_list)
-    """
-    buf = BytesIO()
-    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=0.4*inch, rightMargin=0.4*inch, topMargin=0.6*inch, bottomMargin=0.4*inch)
-    story = []
-    # (Title rendering is handled below after metadata enrichment.)
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('title', parent=styles['Heading1'], alignment=1, fontSize=14)
-    # Enrich title with metadata if available
+    """Subject × stream PDF (utils.pdf_export), titled with the exam's year and kind."""
+    return _stream_table_pdf(exam_name, subj_list, streams, table_data, most_improved_info=most_improved_info,
+                             include_subjects=include_subjects, stream_total_means=stream_total_means,
+                             most_improved_table=most_improved_table, **_stream_table_title_args(exam_name))
+
+
+def _stream_table_title_args(exam_name):
+    """Year and kind of ``exam_name`` for the stream-table title."""
     try:
         meta_list = st.session_state.get('saved_exams', [])
         meta_obj = next((m for m in meta_list if m.get('exam_name') == exam_name), None)
@@ -157,253 +158,7 @@ def generate_pdf_stream_table(exam_name, subj_list, streams, table_data, most_im
         exam_kind = _exam_kind_from_label(exam_name) if exam_name else ''
     except Exception:
         exam_kind = ''
-    title_text = f"Subject-wise Stream Comparison — {exam_name}"
-    if exam_year is not None:
-        title_text += f" — Year: {exam_year}"
-    if exam_kind:
-        title_text += f" — Kind: {exam_kind}"
-    try:
-        story.append(Paragraph(title_text, title_style))
-        story.append(Spacer(1, 0.12*inch))
-    except Exception:
-        pass
-
-    if include_subjects is None:
-        include_subjects = list(subj_list)
-
-    # Build rows and compute per-stream averages and per-subject averages/ranks
-    # Build header, initialize stream accumulators, then collect subject averages and prepared row cells for each subject
-    header = ['Subject'] + list(streams) + ['Average', 'Rank']
-    rows = [header]
-    stream_sums = {s: 0.0 for s in streams}
-    stream_counts = {s: 0 for s in streams}
-
-    # Collect subject averages and prepared row cells for each subject
-    subj_avgs = {}
-    subject_rows = {}
-    for subj in include_subjects:
-        cells = [subj]
-        vals_for_avg = []
-        for s in streams:
-            val = table_data.get((subj, s), None)
-            if val is None:
-                cells.append('-')
-            else:
-                try:
-                    fv = float(val)
-                    cells.append(f"{fv:.2f}")
-                    vals_for_avg.append(fv)
-                    stream_sums[s] += fv
-                    stream_counts[s] += 1
-                except Exception:
-                    cells.append('-')
-        if vals_for_avg:
-            avg = sum(vals_for_avg) / len(vals_for_avg)
-            subj_avgs[subj] = avg
-            cells.append(f"{avg:.2f}")
-        else:
-            subj_avgs[subj] = None
-            cells.append('-')
-        # placeholder for rank - we'll replace after ranking
-        cells.append('-')
-        subject_rows[subj] = cells
-
-    # Compute dense ranks for subjects (highest average -> rank 1)
-    try:
-        valid_avgs = [v for v in subj_avgs.values() if v is not None]
-        if valid_avgs:
-            unique_sorted = sorted(list({round(x,8) for x in valid_avgs}), reverse=True)
-            subj_ranks = {}
-            for subj, v in subj_avgs.items():
-                if v is None:
-                    subj_ranks[subj] = '-'
-                else:
-                    try:
-                        r = unique_sorted.index(round(v,8)) + 1
-                    except Exception:
-                        r = 1
-                    # store numeric rank (int) so we can format consistently later
-                    subj_ranks[subj] = r
-        else:
-            subj_ranks = {s: '-' for s in subj_avgs.keys()}
-    except Exception:
-        subj_ranks = {s: '-' for s in subj_avgs.keys()}
-
-    # Order subjects by average (highest first), placing subjects with no average at the end
-    try:
-        def sort_key(s):
-            v = subj_avgs.get(s)
-            return (v is None, -v if v is not None else 0)
-        ordered_subjects = sorted(include_subjects, key=sort_key)
-    except Exception:
-        ordered_subjects = list(include_subjects)
-
-    # Append ordered subject rows, filling ranks
-    for subj in ordered_subjects:
-        row = subject_rows.get(subj, [subj] + ['-'] * (len(streams) + 2))
-        rnk = subj_ranks.get(subj, '-')
-        # Format numeric ranks with 0 decimals (integers), leave '-' as-is
-        if isinstance(rnk, (int, float)):
-            try:
-                row[-1] = f"{float(rnk):.0f}"
-            except Exception:
-                row[-1] = str(rnk)
-        else:
-            row[-1] = rnk
-        rows.append(row)
-
-    # Average row: use provided stream_total_means (mean of student Total per stream) if available,
-    # otherwise fall back to mean of included subject means.
-    avg_row = ['Average']
-    stream_avg_values = {}
-    if stream_total_means:
-        for s in streams:
-            v = stream_total_means.get(s)
-            if v is None:
-                avg_row.append('-')
-                stream_avg_values[s] = None
-            else:
-                avg_row.append(f"{float(v):.2f}")
-                stream_avg_values[s] = float(v)
-    else:
-        for s in streams:
-            cnt = stream_counts.get(s, 0)
-            if cnt > 0:
-                avg = stream_sums[s] / cnt
-                avg_row.append(f"{avg:.2f}")
-                stream_avg_values[s] = avg
-            else:
-                avg_row.append('-')
-                stream_avg_values[s] = None
-    # For the Average row, leave the final two columns empty (they refer to per-subject Average/Rank)
-    avg_row.append('-')
-    avg_row.append('-')
-    rows.append(avg_row)
-
-    # Rank row based on descending average (1 = best) for streams
-    sorted_avgs = sorted([v for v in stream_avg_values.values() if v is not None], reverse=True)
-    rank_row = ['Rank']
-    for s in streams:
-        v = stream_avg_values.get(s)
-        if v is None:
-            rank_row.append('-')
-        else:
-            try:
-                rank = sorted_avgs.index(v) + 1
-            except Exception:
-                rank = 1
-            # format stream rank with 0 decimals
-            try:
-                rank_row.append(f"{float(rank):.0f}")
-            except Exception:
-                rank_row.append(str(rank))
-    # leave last two columns blank for the streams' rank row
-    rank_row.append('-')
-    rank_row.append('-')
-    rows.append(rank_row)
-
-    # Build table
-    col_widths = [2.5*inch] + [((A4[0] - 0.8*inch) - 2.5*inch) / max(1, len(streams) + 2)] * (len(streams) + 2)
-    t = Table(rows, colWidths=col_widths, hAlign='LEFT')
-    tbl_style = TableStyle([
-        ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0E6BA8')),
-        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-    ])
-    t.setStyle(tbl_style)
-    story.append(t)
-    story.append(Spacer(1, 0.2*inch))
-
-    if most_improved_info:
-        story.append(Paragraph('Most Improved Student (comparison):', styles['Heading3']))
-        mi_text = f"{most_improved_info.get('Name','N/A')} — Adm: {most_improved_info.get('Adm','N/A')} — Improvement: {most_improved_info.get('Improvement',0):.2f}"
-        story.append(Paragraph(mi_text, styles['Normal']))
-
-    # If a Most Improved table (top-N) is provided, render it as a simple table in the PDF
-    if most_improved_table is not None:
-        try:
-            story.append(Spacer(1, 0.12*inch))
-            story.append(Paragraph('Most Improved — Top Students', styles['Heading3']))
-            # most_improved_table may be a pandas DataFrame or list of dicts
-            if hasattr(most_improved_table, 'columns'):
-                mi_df = most_improved_table.copy()
-            else:
-                import pandas as _pd
-                mi_df = _pd.DataFrame(most_improved_table)
-
-            # Convert DataFrame to rows
-            mi_header = list(mi_df.columns)
-            mi_rows = [mi_header]
-            for _, r in mi_df.iterrows():
-                row = []
-                # detect if this is the special Rank row by checking the first column value
-                first_val = r.get(mi_header[0], '')
-                is_rank_row = isinstance(first_val, str) and first_val.strip().lower() == 'rank'
-                for c in mi_header:
-                    v = r.get(c, '')
-                    # treat missing values
-                    try:
-                        if pd.isna(v):
-                            row.append('-')
-                            continue
-                    except Exception:
-                        pass
-                    # For the Rank row, render numeric cells as integers (no decimals).
-                    try:
-                        fv = float(v)
-                        if is_rank_row:
-                            try:
-                                row.append(str(int(fv)))
-                            except Exception:
-                                row.append(str(fv))
-                        else:
-                            row.append(f"{fv:.2f}")
-                    except Exception:
-                        row.append(str(v) if v is not None else '')
-                mi_rows.append(row)
-
-            # Add table with a lighter grid
-            mi_col_widths = [((A4[0] - 0.8*inch) / max(1, len(mi_header))) ] * len(mi_header)
-            mi_table = Table(mi_rows, colWidths=mi_col_widths, hAlign='LEFT')
-            mi_style = TableStyle([
-                ('GRID', (0,0), (-1,-1), 0.3, colors.grey),
-                ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0E6BA8')),
-                ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-                ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ])
-            mi_table.setStyle(mi_style)
-            story.append(mi_table)
-        except Exception:
-            pass
-
-    # Footer drawer: company name and copyright (EDUSCORE ANALYTICS)
-    def _draw_footer_stream(canvas, doc_):
-        try:
-            canvas.saveState()
-            company = 'EDUSCORE ANALYTICS'
-            year_now = datetime.now().year
-            canvas.setFont('Helvetica', 8)
-            canvas.setFillColor(colors.grey)
-            canvas.drawCentredString(A4[0] / 2.0, 0.35 * inch, company)
-            canvas.setFont('Helvetica', 7)
-            canvas.drawCentredString(A4[0] / 2.0, 0.18 * inch, f"\u00A9 {year_now} {company}. All rights reserved.")
-            canvas.restoreState()
-        except Exception:
-            pass
-
-    try:
-        doc.build(story, onFirstPage=_draw_footer_stream, onLaterPages=_draw_footer_stream)
-    except Exception:
-        try:
-            doc.build(story)
-        except Exception:
-            pass
-    buf.seek(0)
-    return buf
-
+    return {'exam_year': exam_year, 'exam_kind': exam_kind}
 
 def generate_pdf_most_improved(title, mi_df):
     """Generate a simple PDF listing the Most Improved students from a DataFrame `mi_df`.
@@ -674,9 +429,9 @@ def save_exam_to_disk(exam_id, exam_metadata, exam_data, exam_raw_data, exam_con
             # Save dataframes and config under per-exam keys
             try:
                 if isinstance(exam_data, pd.DataFrame):
-                    storage.write_pickle(os.path.join(str(exam_id), 'data.pkl'), exam_data)
+                    storage.write_frame(os.path.join(str(exam_id), 'data.pkl'), exam_data)
                 if isinstance(exam_raw_data, pd.DataFrame):
-                    storage.write_pickle(os.path.join(str(exam_id), 'raw_data.pkl'), exam_raw_data)
+                    storage.write_frame(os.path.join(str(exam_id), 'raw_data.pkl'), exam_raw_data)
             except Exception:
                 pass
             try:
@@ -693,24 +448,19 @@ def save_exam_to_disk(exam_id, exam_metadata, exam_data, exam_raw_data, exam_con
 
         if db_ok:
             try:
-                _db.save_exam_metadata(sid, exam_id, exam_metadata)
-            except Exception:
-                pass
-            try:
-                from io import BytesIO
-                if isinstance(exam_data, pd.DataFrame):
-                    b = BytesIO()
-                    exam_data.to_pickle(b)
-                    _db.save_exam_file(sid, exam_id, 'data.pkl', b.getvalue(), mimetype='application/octet-stream')
-                if isinstance(exam_raw_data, pd.DataFrame):
-                    b = BytesIO()
-                    exam_raw_data.to_pickle(b)
-                    _db.save_exam_file(sid, exam_id, 'raw_data.pkl', b.getvalue(), mimetype='application/octet-stream')
-                try:
-                    cfgb = json.dumps(exam_config, ensure_ascii=False).encode('utf-8')
-                    _db.save_exam_file(sid, exam_id, 'config.json', cfgb, mimetype='application/json')
-                except Exception:
-                    pass
+                files = []
+                for stem, frame in (('data', exam_data), ('raw_data', exam_raw_data)):
+                    if isinstance(frame, pd.DataFrame):
+                        payload, ext = storage.dumps_frame(frame)
+                        # a frame Arrow can't hold falls back to .pkl: drop the copy in the other format
+                        stale = [stem + e for e in storage.FRAME_EXTS.values() if e != ext]
+                        files.append((stem + ext, payload, storage.FRAME_MIMETYPES[ext], stale))
+                files.append(('config.json', json.dumps(exam_config, ensure_ascii=False).encode('utf-8'), 'application/json', []))
+                # metadata + files in one transaction
+                with _db.session():
+                    _db.save_exam_metadata(sid, exam_id, exam_metadata)
+                    for fname, payload, mimetype, stale in files:
+                        _db.save_exam_file(sid, exam_id, fname, payload, mimetype=mimetype, supersedes=stale)
             except Exception:
                 pass
         else:
@@ -732,7 +482,8 @@ def save_exam_to_disk(exam_id, exam_metadata, exam_data, exam_raw_data, exam_con
                             pass
                     except Exception:
                         pass
-                    for fname in ('data.pkl', 'raw_data.pkl', 'config.json'):
+                    fnames = storage.frame_keys('data.pkl') + storage.frame_keys('raw_data.pkl') + ['config.json']
+                    for fname in fnames:
                         try:
                             # download each exam file to a temp local path before firebase upload
                             tmpf = os.path.join(STORAGE_DIR, exam_id, fname)
@@ -747,6 +498,15 @@ def save_exam_to_disk(exam_id, exam_metadata, exam_data, exam_raw_data, exam_con
             except Exception:
                 pass
 
+        # Publish the saved payloads to the shared exam store for other sessions
+        # and point this session's index at the new version.
+        try:
+            exam_store.put(sid, exam_id, data=exam_data, raw=exam_raw_data, config=exam_config,
+                           version=exam_store.content_version(exam_metadata))
+            exam_store.register(st.session_state, exam_id, exam_metadata)
+        except Exception:
+            pass
+
         return True
     except Exception as e:
         st.error(f"Error saving exam to disk: {e}")
@@ -762,13 +522,20 @@ def load_all_metadata():
         return {}
 
 def load_exam_from_disk(exam_id):
-    """Load a single exam from disk"""
+    """Load a single exam through the shared exam store.
+
+    DataFrames are shared with other sessions; take a ``.copy()`` before editing.
+    """
     try:
-        # Try reading via storage adapter
-        exam_data = storage.read_pickle(os.path.join(str(exam_id), 'data.pkl'))
-        exam_raw_data = storage.read_pickle(os.path.join(str(exam_id), 'raw_data.pkl'))
-        exam_config = storage.read_json(os.path.join(str(exam_id), 'config.json')) or {}
-        return exam_data, exam_raw_data, exam_config
+        handle = exam_store.handle_for(st.session_state, exam_id)
+        if handle is None:
+            try:
+                from modules import auth as _auth
+                sid = _auth.get_current_school_id() or 'global'
+            except Exception:
+                sid = 'global'
+            handle = exam_store.ExamHandle(sid, exam_id, {}, {}, storage_dir=STORAGE_DIR)
+        return handle.data, handle.raw, handle.config
     except Exception as e:
         st.error(f"Error loading exam {exam_id}: {e}")
         return None, None, None
@@ -795,35 +562,35 @@ def delete_exam_from_disk(exam_id):
         except Exception:
             pass
 
+        # Drop every stored version of the exam's files from the DB
+        try:
+            if _db is not None and _db.init_from_env() and _db.enabled():
+                _db.delete_exam_files(exam_id)
+        except Exception:
+            pass
+
+        try:
+            from modules import auth as _auth
+            exam_store.invalidate(_auth.get_current_school_id() or 'global', exam_id)
+        except Exception:
+            pass
+
         return True
     except Exception as e:
         st.error(f"Error deleting exam from disk: {e}")
         return False
 
 def load_all_exams_into_session():
-    """Load all saved exams from disk into session state"""
+    """Load saved exam metadata into session state and attach the shared exam store"""
     all_metadata = load_all_metadata()
-    
-    # Build saved_exams list from metadata
-    st.session_state.saved_exams = []
-    for exam_id, metadata in all_metadata.items():
-        st.session_state.saved_exams.append(metadata)
-    
-    # Load data on demand (lazy loading to avoid memory issues)
-    # We'll load individual exams when needed
-    st.session_state.saved_exam_data = {}
-    st.session_state.saved_exam_raw_data = {}
-    st.session_state.saved_exam_configs = {}
-    
-    # Optionally preload all (for small datasets)
-    for exam_id in all_metadata.keys():
-        data, raw_data, config = load_exam_from_disk(exam_id)
-        if data is not None:
-            st.session_state.saved_exam_data[exam_id] = data
-        if raw_data is not None:
-            st.session_state.saved_exam_raw_data[exam_id] = raw_data
-        if config:
-            st.session_state.saved_exam_configs[exam_id] = config
+    try:
+        from modules import auth as _auth
+        sid = _auth.get_current_school_id() or 'global'
+    except Exception:
+        sid = 'global'
+    # Exam payloads are fetched by id from the process-wide store when a page
+    # first touches them, instead of being copied into every session.
+    exam_store.attach_session(st.session_state, sid, all_metadata, storage_dir=STORAGE_DIR)
 
 # Custom CSS for modern design
 st.markdown("""
@@ -950,20 +717,23 @@ else:
 
         # If we have in-memory processed data for this exam but it's not saved on disk,
         # persist it now so the Data Status won't be 'Missing' after restart.
+        # Only exams already in memory are considered; nothing is loaded here.
         try:
-            data_df = st.session_state.get('saved_exam_data', {}).get(eid)
-            raw_df = st.session_state.get('saved_exam_raw_data', {}).get(eid)
-            cfg = st.session_state.get('saved_exam_configs', {}).get(eid, {})
+            handle = exam_store.handle_for(st.session_state, eid) if eid else None
+            in_memory = handle is None or handle.is_loaded('data')
+            data_df = st.session_state.get('saved_exam_data', {}).get(eid) if in_memory else None
+            raw_df = st.session_state.get('saved_exam_raw_data', {}).get(eid) if data_df is not None else None
+            cfg = st.session_state.get('saved_exam_configs', {}).get(eid, {}) if data_df is not None else {}
             # Only attempt to save when we have a DataFrame in memory and no data file on disk
-            if data_df is not None and exam_dir and not os.path.exists(data_path):
+            if data_df is not None and exam_dir and not storage.local_frame_path(data_path):
                 # save using existing helper to keep metadata consistent
                 save_exam_to_disk(eid, exam, data_df, raw_df, cfg)
         except Exception:
             pass
 
         # Consider data present if it's either in-memory or on-disk
-        data_present = (eid in st.session_state.get('saved_exam_data', {})) or (exam_dir and os.path.exists(data_path))
-        raw_present = (eid in st.session_state.get('saved_exam_raw_data', {})) or (exam_dir and os.path.exists(raw_path))
+        data_present = (eid in st.session_state.get('saved_exam_data', {})) or (exam_dir and storage.local_frame_path(data_path))
+        raw_present = (eid in st.session_state.get('saved_exam_raw_data', {})) or (exam_dir and storage.local_frame_path(raw_path))
 
         if data_present:
             status = 'Full'
@@ -1101,8 +871,8 @@ else:
                                             files = os.listdir(exam_dir)
                                     except Exception:
                                         files = []
-                                    raw_exists = 'raw_data.pkl' in files
-                                    data_exists = 'data.pkl' in files
+                                    raw_exists = any(f in files for f in storage.frame_keys('raw_data.pkl'))
+                                    data_exists = any(f in files for f in storage.frame_keys('data.pkl'))
                                     st.write(f"Data file present: {data_exists}")
                                     st.write(f"Raw file present: {raw_exists}")
                                     if files:
@@ -1472,13 +1242,24 @@ else:
                                             stream_total_means = None
 
                                         # PDF export using reportlab (respect included_subjects and use stream_total_means for Average row)
+                                        # rendered as a background job (modules.jobs) when available, so the page stays responsive
+                                        stream_pdf_name = f"{selected_exam_name.replace(' ','_')}_stream_table.pdf"
                                         if st.button("📄 Download PDF (subject × stream table)", key=f"pdf_subj_{exam_id}"):
                                             try:
-                                                buf = generate_pdf_stream_table(selected_exam_name, subject_cols, streams, table_data, include_subjects=included_subjects, stream_total_means=stream_total_means)
-                                                pdf_bytes = buf.getvalue() if hasattr(buf, 'getvalue') else buf
-                                                st.download_button("Download PDF", data=pdf_bytes, file_name=f"{selected_exam_name.replace(' ','_')}_stream_table.pdf", mime='application/pdf')
+                                                if jobs.available():
+                                                    st.session_state[f"stream_table_job_{exam_id}"] = jobs.submit(
+                                                        'stream_table', (selected_exam_name, subject_cols, streams, table_data),
+                                                        dict(include_subjects=included_subjects, stream_total_means=stream_total_means,
+                                                             **_stream_table_title_args(selected_exam_name)),
+                                                        label=f"{selected_exam_name} stream table", file_name=stream_pdf_name)
+                                                else:
+                                                    buf = generate_pdf_stream_table(selected_exam_name, subject_cols, streams, table_data, include_subjects=included_subjects, stream_total_means=stream_total_means)
+                                                    pdf_bytes = buf.getvalue() if hasattr(buf, 'getvalue') else buf
+                                                    st.download_button("Download PDF", data=pdf_bytes, file_name=stream_pdf_name, mime='application/pdf')
                                             except Exception as e:
                                                 st.error(f"Failed to generate PDF: {e}")
+                                        if st.session_state.get(f"stream_table_job_{exam_id}"):
+                                            jobs.show_job(st.session_state[f"stream_table_job_{exam_id}"], "Download PDF", key=f"stream_table_{exam_id}")
 
                                         # Offer Most Improved calculation vs another exam
                                         st.markdown("---")
@@ -1497,7 +1278,9 @@ else:
                                                     comp_df = st.session_state.saved_exam_data.get(comp_id)
                                                     if comp_df is None:
                                                         try:
-                                                            comp_df = pd.read_pickle(os.path.join(STORAGE_DIR, comp_id, 'data.pkl'))
+                                                            comp_df = storage.read_frame_file(os.path.join(STORAGE_DIR, comp_id, 'data.pkl'))
+                                                            if comp_df is None:
+                                                                raise FileNotFoundError(f"no data file for {comp_id}")
                                                             st.session_state.saved_exam_data[comp_id] = comp_df
                                                         except Exception as e:
                                                             st.error(f"Failed to load comparison exam data: {e}")
@@ -2363,6 +2146,9 @@ else:
             data, raw_data, cfg = load_exam_from_disk(exam_id)
             if data is None and raw_data is None:
                 return 0
+            # payloads come from the shared store; edit private copies
+            data = data.copy() if data is not None else None
+            raw_data = raw_data.copy() if raw_data is not None else None
             removed = 0
 
             for df_name, df in (('data', data), ('raw', raw_data)):
@@ -2526,6 +2312,10 @@ else:
             # Determine union of subject columns across selected exams
             subj_union = set()
             exam_dfs = {}
+            try:
+                exam_store.prefetch_session(st.session_state, selected_ids, parts=('data',))
+            except Exception:
+                pass
             for eid in selected_ids:
                 df_e = None
                 try:
@@ -2580,7 +2370,8 @@ else:
                 # If still not found, create a fallback 'Class' column with a single group so
                 # downstream grouping logic can run without KeyError.
                 if actual_class_col is None:
-                    df_e['Class'] = 'All'
+                    # df_e may be shared with other sessions; add the column on a new frame
+                    df_e = df_e.assign(Class='All')
                     actual_class_col = 'Class'
 
                 # create a working copy for grouping if grouping by grade
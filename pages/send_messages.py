@@ -2,17 +2,15 @@ import streamlit as st
 import json
 from pathlib import Path
 import pandas as pd
-from utils import messaging
+from utils import messaging, message_log, phones, recipients
+from modules import contacts_store, message_store, outbox
 import ssl
 import socket
 from urllib.parse import urlparse
-import requests
 import copy
-import shutil
-import datetime
 
 # Paths
-from modules.storage import get_storage_dir
+from modules.storage import get_storage_dir, local_frame_path, read_frame_file
 BASE = Path(get_storage_dir())
 CONTACTS_FILE = BASE / 'student_contacts.json'
 CONFIG_FILE = BASE / 'messaging_config.json'
@@ -20,6 +18,19 @@ LOG_FILE = BASE / 'sent_messages_log.json'
 META_FILE = BASE / 'exams_metadata.json'
 
 
+def _exam_data_path(exam_id) -> Path:
+    """Local path of an exam's processed data (columnar or legacy .pkl)."""
+    p = BASE / str(exam_id) / 'data.pkl'
+    return Path(local_frame_path(p) or p)
+
+
+def _read_exam_frame(path):
+    df = read_frame_file(path)
+    if df is None:
+        raise FileNotFoundError(str(path))
+    return df
+
+
 st.set_page_config(page_title="Send Messages", layout="wide")
 # Sanitize accidental admin-hidden message on this page only.
 # Intercept common Streamlit output helpers and remove the exact
@@ -122,7 +133,20 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Helpers
+def _read_contacts_file():
+    try:
+        return CONTACTS_FILE.read_bytes() if CONTACTS_FILE.exists() else None
+    except Exception:
+        return None
+
+
 def load_contacts():
+    # indexed copy in modules.contacts_store (re-imported when the JSON file changes)
+    try:
+        if contacts_store.sync(BASE.name, _read_contacts_file()):
+            return contacts_store.load(BASE.name)
+    except Exception:
+        pass
     try:
         if CONTACTS_FILE.exists():
             return json.loads(CONTACTS_FILE.read_text(encoding='utf-8'))
@@ -131,6 +155,35 @@ def load_contacts():
         return []
 
 
+def _contact_update(rec):
+    """The contact fields a send remembers for a recipient: phone and parent name."""
+    phone = rec.get('phone') or ''
+    return {'student_name': rec.get('student_name', ''), 'parent_name': rec.get('parent_name') or '',
+            'phone_raw': phone, 'phone': phone}
+
+
+def save_contact_updates(updates):
+    """Merge updates into the saved contacts (matched by student name, unknown
+    students added; empty fields leave the saved value) and rewrite
+    student_contacts.json."""
+    if not updates:
+        return
+    scope = BASE.name
+    try:
+        if contacts_store.sync(scope, _read_contacts_file()):
+            contacts_store.upsert(scope, updates, match_phone=False)
+            raw = contacts_store.dumps(contacts_store.load(scope))
+            CONTACTS_FILE.write_bytes(raw)
+            contacts_store.mark_synced(scope, raw)
+            return
+    except Exception:
+        pass
+    contacts_list = load_contacts()
+    contacts_store.merge(contacts_list, updates, match_phone=False)
+    phones.ensure_contacts(contacts_list)
+    CONTACTS_FILE.write_text(json.dumps(contacts_list, indent=2), encoding='utf-8')
+
+
 def load_config():
     try:
         if CONFIG_FILE.exists():
@@ -161,7 +214,8 @@ def _tls_check(host: str, port: int = 443, timeout: int = 8):
 
 def _http_options_check(url: str, headers: dict = None, timeout: int = 8):
     try:
-        r = requests.options(url, headers=headers or {}, timeout=timeout)
+        # reuse the pooled provider session instead of opening another connection
+        r = messaging.http_session('diagnostics').options(url, headers=headers or {}, timeout=timeout)
         return {'ok': True, 'status_code': r.status_code, 'headers': dict(r.headers)}
     except Exception as e:
         return {'ok': False, 'error': str(e)}
@@ -203,10 +257,10 @@ def build_preview_message(recipient: dict) -> str:
         parent_name = (recipient.get('parent_name') or '').strip()
         if not exam_id or not student_name:
             return ''
-        exam_path = BASE / exam_id / 'data.pkl'
+        exam_path = _exam_data_path(exam_id)
         if not exam_path.exists():
             return ''
-        exdf = pd.read_pickle(exam_path)
+        exdf = _read_exam_frame(exam_path)
         # find name column
         name_col = None
         for c in ['student_name','name','Name','student','Student','student full name','Student Name']:
@@ -366,10 +420,10 @@ def compute_subject_parts(recipient: dict, min_subjects: int = 1):
         student_name = (recipient.get('student_name') or '').strip()
         if not exam_id or not student_name:
             return (None, None)
-        exam_path = BASE / exam_id / 'data.pkl'
+        exam_path = _exam_data_path(exam_id)
         if not exam_path.exists():
             return (None, None)
-        exdf = pd.read_pickle(exam_path)
+        exdf = _read_exam_frame(exam_path)
         # find name column
         name_col = None
         for c in ['student_name','name','Name','student','Student','student full name','Student Name']:
@@ -462,6 +516,55 @@ def compute_subject_parts(recipient: dict, min_subjects: int = 1):
         return (None, None)
 
 
+def _send_with_progress(jobs: list, cfg: dict) -> list:
+    """Send prepared ``{'phone', 'message', 'contact'}`` jobs, showing a progress
+    bar; returns render_send_results rows.
+
+    Jobs go through the durable outbox: when a background worker
+    (scripts/sms_outbox_worker.py) is running they are only queued, otherwise
+    this run drains its own batch. Either way, messages left over by a closed
+    tab or a rerun stay queued and are resumed later. Recipients already queued
+    or sent the same message for the same exam are skipped.
+    """
+    total = len(jobs)
+    try:
+        queued = outbox.enqueue(jobs, cfg, scope=BASE.name, log_file=str(LOG_FILE))
+    except Exception:
+        queued = None
+    if queued is None:
+        # no outbox store available: send directly
+        bar = st.progress(0.0, text=f'Sending {total} messages...')
+
+        def _progress(done, total, item, res):
+            bar.progress(done / max(1, total), text=f'Sent {done} of {total} messages')
+
+        try:
+            return messaging.send_many(jobs, config=cfg, test_mode=False, on_progress=_progress, log_file=LOG_FILE)
+        finally:
+            bar.empty()
+
+    if queued['duplicates']:
+        st.info(f"Skipped {queued['duplicates']} recipients already queued or sent this message.")
+    to_send = queued['queued'] + queued['requeued']
+    if outbox.worker_alive(scope=BASE.name):
+        st.info(f'Queued {to_send} messages; the background sender is delivering them. Progress shows in the message audit log.')
+        return []
+
+    bar = st.progress(0.0, text=f'Sending {to_send} messages...')
+
+    def _drain_progress(done, _total, item, res):
+        bar.progress(min(1.0, done / max(1, to_send)), text=f'Sent {done} of {to_send} messages')
+
+    try:
+        rows = outbox.drain(batch_id=queued['batch_id'], on_progress=_drain_progress)
+    finally:
+        bar.empty()
+    pending = outbox.summary(batch_id=queued['batch_id']).get(outbox.RETRY, 0)
+    if pending:
+        st.warning(f'{pending} messages failed temporarily and will be retried (run the outbox worker or use "Resume queued messages").')
+    return [{'contact': r['contact'], 'result': r['result']} for r in rows]
+
+
 def render_send_results(results: list):
     """Render a clean summary table for send results and per-result details.
     - results: list of {'contact':..., 'result': ...} as returned by messaging loop.
@@ -489,6 +592,9 @@ def render_send_results(results: list):
                         first_rec = recs[0]
             except Exception:
                 prov_msg = None
+            # batched sends also carry the normalized per-recipient status
+            if not first_rec and isinstance(res, dict) and isinstance(res.get('recipient'), dict):
+                first_rec = res['recipient']
 
             num = first_rec.get('number') if isinstance(first_rec, dict) else None
             recip_status = first_rec.get('status') if isinstance(first_rec, dict) else None
@@ -526,6 +632,8 @@ def render_send_results(results: list):
                     recs = sms.get('Recipients') or []
                     if recs:
                         first_rec_local = recs[0]
+                if not first_rec_local and isinstance(res_obj, dict) and isinstance(res_obj.get('recipient'), dict):
+                    first_rec_local = res_obj['recipient']
 
                 recip_status = first_rec_local.get('status') if isinstance(first_rec_local, dict) else None
                 if recip_status:
@@ -639,72 +747,9 @@ def render_send_results(results: list):
 
 
 def _map_status_from_result(res_obj):
-    """Map a provider result object (as stored in the log) to a friendly status.
-    Conservative rules:
-    - Mark Delivered only when the provider explicitly indicates delivery (e.g. 'delivered', 'deliv').
-    - Treat general 'success' or 'accepted' as Sent (pending delivery confirmation).
-    - Detect blacklist/block and failures.
-    Returns one of: Delivered, Sent, Blacklisted, Failed, Unknown
-    """
-    try:
-        j = res_obj.get('json') if isinstance(res_obj, dict) else None
-        sms = j.get('SMSMessageData') if isinstance(j, dict) else None
-        first_rec_local = {}
-        if isinstance(sms, dict):
-            recs = sms.get('Recipients') or []
-            if recs:
-                first_rec_local = recs[0]
-
-        recip_status = first_rec_local.get('status') if isinstance(first_rec_local, dict) else None
-        if recip_status:
-            s = str(recip_status).lower()
-            # explicit delivery markers (include common variants like 'dlvrd')
-            if any(k in s for k in ('deliver','deliv','delivered','dlvrd','delivered_to','deliveredto','delivered_to_handset','delivered_to_network')):
-                return 'Delivered'
-            # blacklist/blocked
-            if 'black' in s or 'block' in s:
-                return 'Blacklisted'
-            # explicit failures
-            if 'fail' in s or 'error' in s or 'reject' in s or 'rejected' in s:
-                return 'Failed'
-            # success/accepted/sent/queued -> treat as Sent (not necessarily delivered)
-            if 'success' in s or 'accepted' in s or 'queued' in s or 'sent' in s or s in ('true','1','100'):
-                return 'Sent'
-
-        # top-level flags
-        if isinstance(res_obj, dict):
-            if res_obj.get('ok') is True:
-                return 'Sent'
-            if res_obj.get('ok') is False:
-                st_code = res_obj.get('status_code')
-                if st_code:
-                    try:
-                        sc = int(st_code)
-                        if sc >= 400:
-                            return f'Failed ({sc})'
-                    except Exception:
-                        pass
-                return 'Failed'
-
-        # inspect provider message text for clues
-        prov_msg_local = None
-        try:
-            prov_msg_local = sms.get('Message') if isinstance(sms, dict) else None
-        except Exception:
-            prov_msg_local = None
-        if prov_msg_local and isinstance(prov_msg_local, str):
-            low = prov_msg_local.lower()
-            if 'blacklist' in low or 'blocked' in low:
-                return 'Blacklisted'
-            if any(k in low for k in ('delivered','deliv','dlvrd','delivered_to','deliveredto')):
-                return 'Delivered'
-            # 'sent to' / 'total cost' often means provider accepted the message
-            if 'sent to' in low or 'total cost' in low or 'success' in low or 'accepted' in low:
-                return 'Sent'
-
-        return 'Unknown'
-    except Exception:
-        return 'Unknown'
+    """Map a provider result object (as stored in the log) to a friendly status
+    (Delivered, Sent, Blacklisted, Failed, Unknown); see message_store.map_status."""
+    return message_store.map_status(res_obj)
 
 
 def render_sent_messages_log(limit: int = 200):
@@ -713,7 +758,7 @@ def render_sent_messages_log(limit: int = 200):
     """
     try:
         st.markdown('### Message audit log')
-        if not LOG_FILE.exists():
+        if not message_log.has_entries(LOG_FILE):
             st.info('No sent messages log found.')
             return
         # controls: refresh, redact (Clear will be at the bottom as a prominent red button)
@@ -734,14 +779,12 @@ def render_sent_messages_log(limit: int = 200):
             with ca:
                 if st.button('Confirm clear log'):
                     try:
-                        # backup
-                        bak_dir = LOG_FILE.parent
-                        tsstr = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-                        bak_name = f"sent_messages_log.{tsstr}.bak.json"
-                        bak_path = bak_dir / bak_name
-                        shutil.copy(str(LOG_FILE), str(bak_path))
-                        # clear
-                        LOG_FILE.write_text('[]', encoding='utf-8')
+                        # backup (the log directory is moved aside) and start empty
+                        bak_name = message_log.clear(LOG_FILE)
+                        try:
+                            message_store.rebuild(LOG_FILE)
+                        except Exception:
+                            pass
                         st.success(f'Log cleared and backed up to {bak_name}')
                         st.session_state['confirm_clear_log'] = False
                         # reload
@@ -755,9 +798,33 @@ def render_sent_messages_log(limit: int = 200):
                 if st.button('Cancel'):
                     st.session_state['confirm_clear_log'] = False
 
-        # load log
+        # outbox status for this account, with a manual resume when no worker is running
+        try:
+            pending = outbox.summary(scope=BASE.name)
+            waiting = pending.get(outbox.QUEUED, 0) + pending.get(outbox.RETRY, 0) + pending.get(outbox.SENDING, 0)
+            if waiting or pending.get(outbox.FAILED):
+                st.caption(f"Outbox — queued: {pending.get(outbox.QUEUED, 0)} · retrying: {pending.get(outbox.RETRY, 0)} · "
+                           f"sending: {pending.get(outbox.SENDING, 0)} · sent: {pending.get(outbox.SENT, 0)} · failed: {pending.get(outbox.FAILED, 0)}")
+            if waiting and not outbox.worker_alive(scope=BASE.name):
+                if st.button('Resume queued messages', key='resume_outbox'):
+                    with st.spinner('Sending queued messages...'):
+                        done = outbox.drain(scope=BASE.name)
+                    st.success(f'Processed {len(done)} queued messages')
+        except Exception:
+            pass
+
+        # filters run on the indexed message store; only one page of entries is loaded
+        f1, f2 = st.columns([1,1])
+        with f1:
+            phone_filter = st.text_input('Filter by phone', value='', key='msg_log_phone_filter').strip()
+        with f2:
+            status_filter = st.selectbox('Filter by status', options=['All'] + list(message_store.STATUSES), index=0, key='msg_log_status_filter')
         try:
-            raw = json.loads(LOG_FILE.read_text(encoding='utf-8'))
+            raw = message_store.recent(LOG_FILE, limit, phone=phone_filter or None,
+                                       status=None if status_filter == 'All' else status_filter)
+            if raw is None:
+                # store unavailable: fall back to the end of the JSONL log
+                raw = message_log.tail(LOG_FILE, limit)
         except Exception:
             st.error('Failed to read log file')
             return
@@ -770,13 +837,10 @@ def render_sent_messages_log(limit: int = 200):
         contacts_list = load_contacts() if callable(load_contacts) else []
         # build quick lookup by phone (normalized forms)
         phone_map = {}
+        key_map = {}
         def _norm_num(p):
-            if not p: return ''
-            s = str(p)
-            # drop leading + and non-digits
-            s = ''.join([c for c in s if c.isdigit()])
-            # drop leading country code '0' prefixes if present? keep digits as-is
-            return s
+            # digits only (drops the leading + and separators)
+            return phones.digits(p) if p else ''
 
         for c in contacts_list:
             ph = c.get('phone') or c.get('phone_e164') or c.get('phone_raw') or c.get('mobile') or c.get('msisdn') or ''
@@ -784,6 +848,7 @@ def render_sent_messages_log(limit: int = 200):
             if not n:
                 continue
             phone_map.setdefault(n, []).append(c)
+            key_map.setdefault(c.get('phone_key') or phones.phone_key(n), c)
 
         # helper to find contact by phone (tries exact, longest suffix match)
         def find_contact_by_phone(ph):
@@ -795,6 +860,9 @@ def render_sent_messages_log(limit: int = 200):
             # exact
             if n in phone_map:
                 return (phone_map.get(n)[0], 'exact')
+            # same subscriber number (last nine digits) in another format
+            if len(n) >= 9 and n[-9:] in key_map:
+                return (key_map[n[-9:]], 'suffix(9)')
             # longest suffix match: try decreasing lengths but prefer longer matches to avoid collisions
             best = None
             best_len = 0
@@ -1037,272 +1105,37 @@ def render_sent_messages_log(limit: int = 200):
     except Exception as e:
         st.error('Failed to render message log: ' + str(e))
 
-def prepare_messages_action(sel_df, contacts_df_local, limit_val):
-    """Prepare messages for the provided selection dataframe and contacts.
-    This encapsulates the existing prepare logic so it can be invoked from multiple places.
-    Results are written to st.session_state['prepared_messages'] and ['prepared_unmatched'].
-    """
-    prepared = []
-    unmatched_overall = []
-
-    # diagnostic counters
-    total_exam_rows_scanned = 0
-    valid_total_rows = 0
-    merged_rows_total = 0
-    merged_rows_with_phone = 0
-    missing_total_count = 0
-    missing_phone_count = 0
-
-    def pick_default_cols(cols_list, candidates):
-        for c in candidates:
-            if c in cols_list:
-                return c
-        return cols_list[0] if cols_list else None
-
-    for _, meta in sel_df.iterrows():
+def _exam_frames(meta_frame):
+    """``(exam_id, exam_name, frame)`` for each exam in ``meta_frame`` whose data loads."""
+    for meta in meta_frame.to_dict('records'):
         exam_id = meta.get('exam_id')
-        exam_name = meta.get('exam_name','')
-        exam_path = BASE / exam_id / 'data.pkl'
+        exam_path = _exam_data_path(exam_id)
         if not exam_path.exists():
             continue
         try:
-            exdf = pd.read_pickle(exam_path)
+            exdf = _read_exam_frame(exam_path)
         except Exception:
             continue
+        yield exam_id, meta.get('exam_name', ''), exdf
 
-        cols = list(exdf.columns)
-        match_col = pick_default_cols(cols, ['student_id','student','adm','adm_no','Admission','admno'])
-        name_col = pick_default_cols(cols, ['student_name','name','Name','student','Student','student full name','Student Name'])
-        score_col = pick_default_cols(cols, ['TOTALS','TOTAL','Total','total','Score','score','Total Marks','Marks','Total_Marks'])
-        class_col_in = pick_default_cols(cols, ['Class','class','class_name','className','Grade','GRADE'])
-
-        numeric_subjects = []
-        for c in cols:
-            if c in {match_col,name_col,score_col,class_col_in}:
-                continue
-            # skip rank/position columns which are not subject marks
-            try:
-                lc = str(c).lower()
-                if 'rank' in lc or 'position' in lc or lc.strip() in ('s/rank', 's_rank', 's rank'):
-                    continue
-            except Exception:
-                pass
-            try:
-                if pd.to_numeric(exdf[c], errors='coerce').notna().sum() > 0:
-                    numeric_subjects.append(c)
-            except Exception:
-                continue
-
-        # compute ranks
-        try:
-            tmp = exdf.copy()
-            tmp[score_col] = pd.to_numeric(tmp[score_col], errors='coerce')
-            tmp['overall_rank'] = tmp[score_col].rank(ascending=False, method='min')
-            if class_col_in in tmp.columns:
-                tmp['class_rank'] = tmp.groupby(class_col_in)[score_col].rank(ascending=False, method='min')
-            else:
-                tmp['class_rank'] = None
-        except Exception:
-            tmp = exdf.copy()
-            tmp['overall_rank'] = None
-            tmp['class_rank'] = None
-
-        # drop exam rows with missing/invalid totals
-        try:
-            if score_col in tmp.columns:
-                before_count = len(tmp)
-                tmp = tmp[pd.to_numeric(tmp[score_col], errors='coerce').notna()].copy()
-                after_count = len(tmp)
-                total_exam_rows_scanned += before_count
-                valid_total_rows += after_count
-                missing_total_count += (before_count - after_count)
-            else:
-                if 'Total' in tmp.columns:
-                    before_count = len(tmp)
-                    tmp = tmp[pd.to_numeric(tmp['Total'], errors='coerce').notna()].copy()
-                    after_count = len(tmp)
-                    total_exam_rows_scanned += before_count
-                    valid_total_rows += after_count
-                    missing_total_count += (before_count - after_count)
-        except Exception:
-            pass
-
-        # Merge exam rows (t) with contacts (c) -> exam-driven
-        try:
-            c = contacts_df_local.copy()
-            c['__name_norm'] = c.get('student_name','').astype(str).str.lower().str.replace(r"\s+", ' ', regex=True).str.strip()
-            c = c.drop_duplicates(subset=['__name_norm'], keep='first')
-
-            t = tmp.copy()
-            if name_col in t.columns:
-                t['__name_norm'] = t[name_col].astype(str).str.lower().str.replace(r"\s+", ' ', regex=True).str.strip()
-            else:
-                t['__name_norm'] = t.index.astype(str)
-
-            merged = t.merge(c, on='__name_norm', how='left')
-            # diagnostic
-            try:
-                merged_rows_total += len(merged)
-                def _has_phone(r):
-                    rp = r.get('phone') if 'phone' in r else r.get('phone_raw')
-                    try:
-                        if pd.isna(rp):
-                            return False
-                    except Exception:
-                        pass
-                    if rp is None:
-                        return False
-                    s = str(rp).strip().lower()
-                    return s not in ('', 'nan', 'none')
-                merged_with_phone_count = merged.apply(_has_phone, axis=1).sum()
-                merged_rows_with_phone += int(merged_with_phone_count)
-            except Exception:
-                pass
-        except Exception:
-            merged = tmp.copy()
-
-        # filter by selected classes
-        try:
-            if st.session_state.get('class_sel', None):
-                sel_norms = [str(x).lower().replace('grade ', '').strip() for x in st.session_state.get('class_sel')]
-                def _matches(row):
-                    exam_cv = str(row.get(class_col_in, '')).lower()
-                    if exam_cv and exam_cv != 'nan':
-                        for s in sel_norms:
-                            if not s:
-                                continue
-                            if s == exam_cv or s in exam_cv or exam_cv in s:
-                                return True
-                            if s.isdigit() and s in exam_cv:
-                                return True
-                        return False
-                    cgrade = str(row.get('grade', '')).lower()
-                    cstream = str(row.get('stream', '')).lower()
-                    for s in sel_norms:
-                        if not s:
-                            continue
-                        if s == cgrade or s in cgrade:
-                            return True
-                        if s == cstream or s in cstream:
-                            return True
-                    return False
-                merged = merged[merged.apply(_matches, axis=1)].copy()
-        except Exception:
-            pass
-
-        # apply recipient limit per exam
-        try:
-            if limit_val and int(limit_val) > 0:
-                merged = merged.head(int(limit_val))
-        except Exception:
-            pass
-
-        # compute sizes
-        try:
-            overall_size = int(len(tmp))
-        except Exception:
-            overall_size = None
-        class_counts = {}
-        try:
-            if class_col_in in tmp.columns:
-                class_counts = tmp.groupby(class_col_in).size().to_dict()
-        except Exception:
-            class_counts = {}
-
-        for _, row in merged.iterrows():
-            # normalize phone
-            raw_phone = None
-            if 'phone' in row:
-                raw_phone = row.get('phone')
-            elif 'phone_raw' in row:
-                raw_phone = row.get('phone_raw')
-            try:
-                if pd.isna(raw_phone):
-                    phone = None
-                else:
-                    phone = str(raw_phone).strip()
-                    if phone.lower() in ('', 'nan', 'none'):
-                        phone = None
-            except Exception:
-                phone = str(raw_phone).strip() if raw_phone is not None else None
-
-            student_name_val = None
-            if name_col in row and pd.notna(row.get(name_col)):
-                student_name_val = row.get(name_col)
-            elif 'student_name' in row and pd.notna(row.get('student_name')):
-                student_name_val = row.get('student_name')
-            else:
-                student_name_val = ''
-
-            if not phone or str(phone).strip() == '':
-                missing_phone_count += 1
-                unmatched_overall.append({'exam_id': exam_id, 'exam_name': exam_name, 'student_name': student_name_val, 'reason': 'missing_phone'})
-                continue
-
-            parts = []
-            for s in numeric_subjects:
-                try:
-                    v = row.get(s)
-                    if pd.isna(v) or v is None:
-                        continue
-                    parts.append(f"{s}: {v}")
-                except Exception:
-                    continue
-            subj_str = ', '.join(parts)
-
-            total_val = None
-            try:
-                if score_col in row and pd.notna(row.get(score_col)):
-                    total_val = pd.to_numeric(row.get(score_col), errors='coerce')
-                    if pd.notna(total_val):
-                        total_val = int(total_val)
-                    else:
-                        total_val = None
-                elif 'Total' in row and pd.notna(row.get('Total')):
-                    tmp_total = pd.to_numeric(row.get('Total'), errors='coerce')
-                    total_val = int(tmp_total) if pd.notna(tmp_total) else None
-            except Exception:
-                total_val = None
-
-            if total_val is None:
-                missing_total_count += 1
-                unmatched_overall.append({'exam_id': exam_id, 'exam_name': exam_name, 'student_name': student_name_val, 'reason': 'missing_total'})
-                continue
-
-            try:
-                class_rank_raw = row.get('class_rank') if 'class_rank' in row else None
-                overall_rank_raw = row.get('overall_rank') if 'overall_rank' in row else None
-                class_rank = int(class_rank_raw) if pd.notna(class_rank_raw) else None
-                overall_rank = int(overall_rank_raw) if pd.notna(overall_rank_raw) else None
-            except Exception:
-                class_rank = None
-                overall_rank = None
-
-            try:
-                cls_key = row.get(class_col_in) if class_col_in in row else None
-                class_size = int(class_counts.get(cls_key, 0)) if cls_key is not None else None
-            except Exception:
-                class_size = None
-
-            class_rank_str = f"{class_rank}/{class_size}" if class_rank is not None and class_size else (str(class_rank) if class_rank is not None else 'N/A')
-            overall_rank_str = f"{overall_rank}/{overall_size}" if overall_rank is not None and overall_size else (str(overall_rank) if overall_rank is not None else 'N/A')
-
-            parent = row.get('parent_name','') or ''
-            student = student_name_val or ''
 
-            message_text = f"Dear {parent}, Results for {student} — {exam_name}. {subj_str}. Total: {total_val if total_val is not None else 'N/A'}. Class Rank: {class_rank_str}. Overall Rank: {overall_rank_str}."
-
-            prepared.append({'phone': phone, 'message': message_text, 'student_name': student, 'exam_id': exam_id, 'exam_name': exam_name, 'total': total_val, 'class_rank': class_rank, 'class_size': class_size, 'overall_rank': overall_rank, 'overall_size': overall_size})
+def prepare_messages_action(sel_df, contacts_df_local, limit_val):
+    """Prepare messages for the provided selection dataframe and contacts.
+    This encapsulates the existing prepare logic so it can be invoked from multiple places.
+    Results are written to st.session_state['prepared_messages'] and ['prepared_unmatched'].
+    The per-exam work (contact join, ranks, message text) is vectorized in utils.recipients.
+    """
+    prepared, unmatched_overall, diagnostics = recipients.prepare_messages(
+        _exam_frames(sel_df), contacts_df_local,
+        class_sel=st.session_state.get('class_sel', None), limit=limit_val)
 
     # filter out prepared messages with empty/None/NaN totals (extra safety)
-    try:
-        filtered_prepared = [p for p in prepared if not pd.isna(p.get('total'))]
-    except Exception:
-        filtered_prepared = [p for p in prepared if p.get('total') is not None and str(p.get('total')).strip() != '']
+    filtered_prepared = [p for p in prepared if p.get('total') is not None]
+    diagnostics['prepared_count'] = len(filtered_prepared)
 
     st.session_state['prepared_messages'] = filtered_prepared
     st.session_state['prepared_unmatched'] = unmatched_overall
-    st.session_state['prepare_diagnostics'] = {'total_exam_rows_scanned': total_exam_rows_scanned, 'valid_total_rows': valid_total_rows, 'missing_total_rows': missing_total_count, 'merged_rows_total': merged_rows_total, 'merged_rows_with_phone': merged_rows_with_phone, 'missing_phone_count': missing_phone_count, 'prepared_count': len(filtered_prepared)}
+    st.session_state['prepare_diagnostics'] = diagnostics
 
     return st.session_state['prepare_diagnostics']
 
@@ -1394,7 +1227,7 @@ else:
                     metrics = [
                         ('Total exam rows scanned', 'total_exam_rows_scanned'),
                         ('Valid total rows', 'valid_total_rows'),
-                        ('Missing total rows', 'missing_total_count'),
+                        ('Missing total rows', 'missing_total_rows'),
                         ('Merged rows total', 'merged_rows_total'),
                         ('Merged rows with phone', 'merged_rows_with_phone'),
                         ('Missing phone count', 'missing_phone_count'),
@@ -1441,48 +1274,11 @@ else:
         if prepared_list_top:
             recipient_pool_top = prepared_list_top + normalized_unmatched_top
         else:
-            recipient_pool_top = []
             try:
                 contacts_list_top = load_contacts()
             except Exception:
                 contacts_list_top = []
-
-            def _pick_name_col_local(cols_list):
-                candidates = ['student_name','name','Name','student','Student','student full name','Student Name']
-                for c in candidates:
-                    if c in cols_list:
-                        return c
-                return cols_list[0] if cols_list else None
-
-            for _, mrow in meta_df.iterrows():
-                exam_id = mrow.get('exam_id')
-                exam_name = mrow.get('exam_name')
-                exam_path = BASE / exam_id / 'data.pkl'
-                if not exam_path.exists():
-                    continue
-                try:
-                    exdf = pd.read_pickle(exam_path)
-                except Exception:
-                    continue
-                name_col_local = _pick_name_col_local(list(exdf.columns))
-                parent_col_local = None
-                for pc in ('parent_name','Parent','parent'):
-                    if pc in exdf.columns:
-                        parent_col_local = pc
-                        break
-
-                for _, erow in exdf.iterrows():
-                    student_name = str(erow.get(name_col_local,'')).strip()
-                    parent_name = str(erow.get(parent_col_local,'')) if parent_col_local else ''
-                    name_norm = student_name.lower().replace('\n',' ').strip()
-                    found = next((c for c in contacts_list_top if str(c.get('student_name','')).lower().strip() == name_norm), None)
-                    phone = ''
-                    p_parent = ''
-                    if found:
-                        phone = found.get('phone') or found.get('phone_raw') or ''
-                        p_parent = found.get('parent_name') or ''
-                    parent_final = p_parent or parent_name or ''
-                    recipient_pool_top.append({'phone': phone, 'message': '', 'student_name': student_name, 'exam_id': exam_id, 'exam_name': exam_name, 'total': None, 'class_rank': None, 'class_size': None, 'overall_rank': None, 'overall_size': None, 'parent_name': parent_final})
+            recipient_pool_top = recipients.recipient_pool(_exam_frames(meta_df), contacts_list_top)
 
         # Build exam metadata map to power the top filters
         try:
@@ -1599,10 +1395,7 @@ else:
                 if st.button('Confirm — Send now', key='compact_confirm_top'):
                     to_send = []
                     skipped = []
-                    try:
-                        contacts_list = load_contacts()
-                    except Exception:
-                        contacts_list = []
+                    contact_updates = []
 
                     for i in applied_indices_top:
                         rec = dict(recipient_pool_top[i])
@@ -1615,20 +1408,7 @@ else:
                             skipped.append(rec.get('student_name',''))
                             continue
                         to_send.append(rec)
-                        nm_norm = str(rec.get('student_name','')).lower().strip()
-                        found = None
-                        for c in contacts_list:
-                            if str(c.get('student_name','')).lower().strip() == nm_norm:
-                                found = c
-                                break
-                        if found is not None:
-                            if rec.get('phone'):
-                                found['phone_raw'] = rec.get('phone')
-                                found['phone'] = rec.get('phone')
-                            if rec.get('parent_name'):
-                                found['parent_name'] = rec.get('parent_name')
-                        else:
-                            contacts_list.append({'student_id':'','student_name':rec.get('student_name',''), 'grade':'', 'stream':'', 'parent_name': rec.get('parent_name') or '', 'phone_raw': rec.get('phone') or '', 'phone': rec.get('phone') or ''})
+                        contact_updates.append(_contact_update(rec))
 
                     if skipped:
                         st.warning(f"Skipped {len(skipped)} recipients with no phone: {', '.join(skipped[:10])}{'...' if len(skipped)>10 else ''}")
@@ -1636,32 +1416,31 @@ else:
                         st.info('No recipients with phone numbers to send to.')
                     else:
                         try:
-                            CONTACTS_FILE.write_text(json.dumps(contacts_list, indent=2), encoding='utf-8')
+                            save_contact_updates(contact_updates)
                         except Exception:
                             pass
                         cfg = load_config()
-                        results = []
-                        with st.spinner(f'Sending {len(to_send)} messages...'):
-                            for c in to_send:
-                                msg = c.get('message') or ''
+                        jobs = []
+                        for c in to_send:
+                            msg = c.get('message') or ''
+                            if not msg:
+                                try:
+                                    msg = build_preview_message(c) or ''
+                                except Exception:
+                                    msg = ''
                                 if not msg:
+                                    # try to extract subject parts (relaxed) so sent message includes marks when available
                                     try:
-                                        msg = build_preview_message(c) or ''
-                                    except Exception:
-                                        msg = ''
-                                    if not msg:
-                                        # try to extract subject parts (relaxed) so sent message includes marks when available
-                                        try:
-                                            subj, tot = compute_subject_parts(c, min_subjects=1)
-                                            if subj:
-                                                total_disp = tot if tot is not None else 'N/A'
-                                                msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name')}. {subj}. Total: {total_disp}."
-                                            else:
-                                                msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name')}. Total: {c.get('total') if c.get('total') is not None else 'N/A'}."
-                                        except Exception:
+                                        subj, tot = compute_subject_parts(c, min_subjects=1)
+                                        if subj:
+                                            total_disp = tot if tot is not None else 'N/A'
+                                            msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name')}. {subj}. Total: {total_disp}."
+                                        else:
                                             msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name')}. Total: {c.get('total') if c.get('total') is not None else 'N/A'}."
-                                res = messaging.send_single(c.get('phone'), msg, config=cfg, test_mode=False)
-                                results.append({'contact': c, 'result': res})
+                                    except Exception:
+                                        msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name')}. Total: {c.get('total') if c.get('total') is not None else 'N/A'}."
+                            jobs.append({'phone': c.get('phone'), 'message': msg, 'contact': c})
+                        results = _send_with_progress(jobs, cfg)
                         st.success(f"Sent {len(results)} messages")
                         render_send_results(results)
                     st.session_state['compact_pending_send_top'] = False
@@ -1727,32 +1506,16 @@ else:
             c1, c2 = st.columns([1,1])
             with c1:
                 if st.button('Confirm — Send ALL now', key='confirm_send_all'):
-                    try:
-                        contacts_list = load_contacts()
-                    except Exception:
-                        contacts_list = []
+                    contact_updates = []
 
                     to_send = []
                     for rec in prepared:
                         r = dict(rec)
                         to_send.append(r)
-                        nm_norm = str(r.get('student_name','')).lower().strip()
-                        found = None
-                        for c in contacts_list:
-                            if str(c.get('student_name','')).lower().strip() == nm_norm:
-                                found = c
-                                break
-                        if found is not None:
-                            if r.get('phone'):
-                                found['phone_raw'] = r.get('phone')
-                                found['phone'] = r.get('phone')
-                            if r.get('parent_name'):
-                                found['parent_name'] = r.get('parent_name')
-                        else:
-                            contacts_list.append({'student_id':'','student_name':r.get('student_name',''), 'grade':'', 'stream':'', 'parent_name': r.get('parent_name') or '', 'phone_raw': r.get('phone') or '', 'phone': r.get('phone') or ''})
+                        contact_updates.append(_contact_update(r))
 
                     try:
-                        CONTACTS_FILE.write_text(json.dumps(contacts_list, indent=2), encoding='utf-8')
+                        save_contact_updates(contact_updates)
                     except Exception:
                         pass
 
@@ -1765,28 +1528,27 @@ else:
                         st.info('No recipients with phone numbers to send to.')
                     else:
                         cfg = load_config()
-                        results = []
-                        with st.spinner(f'Sending {len(filtered_to_send)} messages...'):
-                            for c in filtered_to_send:
-                                msg = c.get('message') or ''
-                                # fallback message if none present; try building from exam data first
+                        jobs = []
+                        for c in filtered_to_send:
+                            msg = c.get('message') or ''
+                            # fallback message if none present; try building from exam data first
+                            if not msg:
+                                try:
+                                    msg = build_preview_message(c) or ''
+                                except Exception:
+                                    msg = ''
                                 if not msg:
                                     try:
-                                        msg = build_preview_message(c) or ''
-                                    except Exception:
-                                        msg = ''
-                                    if not msg:
-                                        try:
-                                            subj, tot = compute_subject_parts(c, min_subjects=1)
-                                            if subj:
-                                                total_disp = tot if tot is not None else 'N/A'
-                                                msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name','')}. {subj}. Total: {total_disp}."
-                                            else:
-                                                msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name','')}. Total: {c.get('total') if c.get('total') is not None else 'N/A'}."
-                                        except Exception:
+                                        subj, tot = compute_subject_parts(c, min_subjects=1)
+                                        if subj:
+                                            total_disp = tot if tot is not None else 'N/A'
+                                            msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name','')}. {subj}. Total: {total_disp}."
+                                        else:
                                             msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name','')}. Total: {c.get('total') if c.get('total') is not None else 'N/A'}."
-                                res = messaging.send_single(c.get('phone'), msg, config=cfg, test_mode=False)
-                                results.append({'contact': c, 'result': res})
+                                    except Exception:
+                                        msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name','')}. Total: {c.get('total') if c.get('total') is not None else 'N/A'}."
+                            jobs.append({'phone': c.get('phone'), 'message': msg, 'contact': c})
+                        results = _send_with_progress(jobs, cfg)
                         st.success('Done')
                         render_send_results(results)
                     st.session_state['pending_bulk_send'] = False
@@ -1849,11 +1611,11 @@ else:
                 for _, meta2 in sel.iterrows():
                     exam_id2 = meta2.get('exam_id')
                     exam_name2 = meta2.get('exam_name','')
-                    ep = BASE / exam_id2 / 'data.pkl'
+                    ep = _exam_data_path(exam_id2)
                     if not ep.exists():
                         continue
                     try:
-                        exdf2 = pd.read_pickle(ep)
+                        exdf2 = _read_exam_frame(ep)
                     except Exception:
                         continue
 
@@ -1930,11 +1692,11 @@ else:
                     classes_set = set()
                     # read each exam file once
                     for eid, entries in unmatched_by_exam.items():
-                        ep = BASE / eid / 'data.pkl'
+                        ep = _exam_data_path(eid)
                         exdf = None
                         if ep.exists():
                             try:
-                                exdf = pd.read_pickle(ep)
+                                exdf = _read_exam_frame(ep)
                             except Exception:
                                 exdf = None
 
@@ -2036,23 +1798,6 @@ else:
             except Exception:
                 _current_contacts = []
 
-            def _normalize_phone_simple(raw):
-                if not raw or str(raw).strip() == '':
-                    return ''
-                s = str(raw).strip()
-                if s.startswith('+'):
-                    return s
-                digits = ''.join(ch for ch in s if ch.isdigit())
-                if not digits:
-                    return ''
-                if digits.startswith('0'):
-                    return '+254' + digits.lstrip('0')
-                if digits.startswith('254'):
-                    return '+' + digits
-                if digits.startswith('7') and len(digits) in (9,10):
-                    return '+254' + digits[-9:]
-                return digits
-
             new_phones = {}
             new_parents = {}
             for i, u in enumerate(display_items_page):
@@ -2083,10 +1828,7 @@ else:
                     safe_rerun()
 
             if container.button('Save phones'):
-                try:
-                    contacts_list = load_contacts()
-                except Exception:
-                    contacts_list = []
+                contact_updates = []
                 updated = 0
                 for i, u in enumerate(display_items_page):
                     name = u.get('student_name') or ''
@@ -2099,34 +1841,20 @@ else:
                         parent_val = str(parent_val or '').strip()
                         if phone_val or parent_val:
                             # normalize before saving so Parent Contacts shows normalized numbers
-                            phone_norm = _normalize_phone_simple(phone_val) if phone_val else ''
-                            nm_norm = str(name).lower().replace('\n',' ').strip()
-                            found = None
-                            for c in contacts_list:
-                                if str(c.get('student_name','')).lower().strip() == nm_norm:
-                                    found = c
-                                    break
-                            if found is not None:
-                                if phone_val:
-                                    found['phone_raw'] = phone_val
-                                    found['phone'] = phone_norm
-                                if parent_val:
-                                    found['parent_name'] = parent_val
-                            else:
-                                contacts_list.append({'student_id': '', 'student_name': name, 'grade': '', 'stream': '', 'parent_name': parent_val or '', 'phone_raw': phone_val or '', 'phone': phone_norm or ''})
+                            phone_norm = phones.normalize_number(phone_val) if phone_val else ''
+                            contact_updates.append({'student_name': name, 'parent_name': parent_val,
+                                                    'phone_raw': phone_val, 'phone': phone_norm})
                             updated += 1
                 try:
-                    CONTACTS_FILE.write_text(json.dumps(contacts_list, indent=2), encoding='utf-8')
+                    save_contact_updates(contact_updates)
                 except Exception as e:
                     container.error('Failed to save contacts: ' + str(e))
                     return
-
                 # Refresh in-memory contacts and re-run the centralized prepare logic so prepared messages update immediately
                 try:
-                    new_contacts = load_contacts()
-                    new_contacts_df = pd.DataFrame(new_contacts)
+                    new_contacts_df = pd.DataFrame(load_contacts())
                 except Exception:
-                    new_contacts_df = pd.DataFrame(contacts_list)
+                    new_contacts_df = pd.DataFrame()
 
                 # Call the central prepare action to rebuild prepared lists using updated contacts
                 try:
@@ -2170,49 +1898,11 @@ else:
         if prepared_list:
             recipient_pool = prepared_list + normalized_unmatched
         else:
-            recipient_pool = []
             try:
                 contacts_list = load_contacts()
             except Exception:
                 contacts_list = []
-
-            def _pick_name_col(cols_list):
-                candidates = ['student_name','name','Name','student','Student','student full name','Student Name']
-                for c in candidates:
-                    if c in cols_list:
-                        return c
-                return cols_list[0] if cols_list else None
-
-            for _, mrow in meta_df.iterrows():
-                exam_id = mrow.get('exam_id')
-                exam_name = mrow.get('exam_name')
-                exam_path = BASE / exam_id / 'data.pkl'
-                if not exam_path.exists():
-                    continue
-                try:
-                    exdf = pd.read_pickle(exam_path)
-                except Exception:
-                    continue
-                name_col = _pick_name_col(list(exdf.columns))
-                parent_col = None
-                for pc in ('parent_name','Parent','parent'):
-                    if pc in exdf.columns:
-                        parent_col = pc
-                        break
-
-                for _, erow in exdf.iterrows():
-                    student_name = str(erow.get(name_col,'')).strip()
-                    parent_name = str(erow.get(parent_col,'')) if parent_col else ''
-                    # find contact phone by normalized name
-                    name_norm = student_name.lower().replace('\n',' ').strip()
-                    found = next((c for c in contacts_list if str(c.get('student_name','')).lower().strip() == name_norm), None)
-                    phone = ''
-                    p_parent = ''
-                    if found:
-                        phone = found.get('phone') or found.get('phone_raw') or ''
-                        p_parent = found.get('parent_name') or ''
-                    parent_final = p_parent or parent_name or ''
-                    recipient_pool.append({'phone': phone, 'message': '', 'student_name': student_name, 'exam_id': exam_id, 'exam_name': exam_name, 'total': None, 'class_rank': None, 'class_size': None, 'overall_rank': None, 'overall_size': None, 'parent_name': parent_final})
+            recipient_pool = recipients.recipient_pool(_exam_frames(meta_df), contacts_list)
 
         # Build exam metadata map to support bottom filters (year/term/kind/class)
         try:
@@ -2351,12 +2041,12 @@ else:
             # One-click exam row inspector for bottom preview
             try:
                 if st.button('Show exam row', key=f'show_row_{first}'):
-                    ep = BASE / recipient_pool[first].get('exam_id', '') / 'data.pkl'
+                    ep = _exam_data_path(recipient_pool[first].get('exam_id', ''))
                     if not ep.exists():
                         st.error('Exam file not found: ' + str(ep))
                     else:
                         try:
-                            edf = pd.read_pickle(ep)
+                            edf = _read_exam_frame(ep)
                             # detect name column
                             name_col = None
                             for c in ['student_name','name','Name','student','Student','student full name','Student Name']:
@@ -2392,10 +2082,7 @@ else:
                 if st.button('Confirm — Send now', key='compact_confirm'):
                     to_send = []
                     skipped = []
-                    try:
-                        contacts_list = load_contacts()
-                    except Exception:
-                        contacts_list = []
+                    contact_updates = []
 
                     for i in applied_indices:
                         rec = dict(recipient_pool[i])
@@ -2408,21 +2095,7 @@ else:
                             skipped.append(rec.get('student_name',''))
                             continue
                         to_send.append(rec)
-                        # update contacts_list
-                        nm_norm = str(rec.get('student_name','')).lower().strip()
-                        found = None
-                        for c in contacts_list:
-                            if str(c.get('student_name','')).lower().strip() == nm_norm:
-                                found = c
-                                break
-                        if found is not None:
-                            if rec.get('phone'):
-                                found['phone_raw'] = rec.get('phone')
-                                found['phone'] = rec.get('phone')
-                            if rec.get('parent_name'):
-                                found['parent_name'] = rec.get('parent_name')
-                        else:
-                            contacts_list.append({'student_id':'','student_name':rec.get('student_name',''), 'grade':'', 'stream':'', 'parent_name': rec.get('parent_name') or '', 'phone_raw': rec.get('phone') or '', 'phone': rec.get('phone') or ''})
+                        contact_updates.append(_contact_update(rec))
 
                     if skipped:
                         st.warning(f"Skipped {len(skipped)} recipients with no phone: {', '.join(skipped[:10])}{'...' if len(skipped)>10 else ''}")
@@ -2430,18 +2103,17 @@ else:
                         st.info('No recipients with phone numbers to send to.')
                     else:
                         try:
-                            CONTACTS_FILE.write_text(json.dumps(contacts_list, indent=2), encoding='utf-8')
+                            save_contact_updates(contact_updates)
                         except Exception:
                             pass
                         cfg = load_config()
-                        results = []
-                        with st.spinner(f'Sending {len(to_send)} messages...'):
-                            for c in to_send:
-                                msg = c.get('message') or ''
-                                if not msg:
-                                    msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name')}. Total: {c.get('total') if c.get('total') is not None else 'N/A'}."
-                                res = messaging.send_single(c.get('phone'), msg, config=cfg, test_mode=False)
-                                results.append({'contact': c, 'result': res})
+                        jobs = []
+                        for c in to_send:
+                            msg = c.get('message') or ''
+                            if not msg:
+                                msg = f"Dear {c.get('parent_name','')}, Results for {c.get('student_name','')} — {c.get('exam_name')}. Total: {c.get('total') if c.get('total') is not None else 'N/A'}."
+                            jobs.append({'phone': c.get('phone'), 'message': msg, 'contact': c})
+                        results = _send_with_progress(jobs, cfg)
                         st.success(f"Sent {len(results)} messages")
                         render_send_results(results)
                     st.session_state['compact_pending_send'] = False
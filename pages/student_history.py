@@ -6,16 +6,11 @@ import streamlit as st
 import pandas as pd
 import os
 from modules import storage as storage_mod
+from modules import jobs
 import json
-from datetime import datetime
 from io import BytesIO
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER
 from utils import student_photos as photos
+from utils.pdf_export import generate_student_history_pdf
 
 # Try to import plotly, fallback to basic charts if not available
 try:
@@ -80,154 +75,15 @@ def load_all_metadata():
     except Exception:
         return {}
 
-def load_exam_from_disk(exam_id):
-    """Load a single exam's data from disk"""
+def load_exam_from_disk(exam_id, columns=None):
+    """Load a single exam's data from disk (optionally only ``columns``)"""
     try:
         data_key = os.path.join(str(exam_id), 'data.pkl')
-        df = storage_mod.read_pickle(data_key)
+        df = storage_mod.read_frame(data_key, columns=columns)
         return df
     except Exception:
         return None
 
-def generate_student_history_pdf(student_name, adm_no, records, orientation='landscape', 
-                                include_columns=None, chart_type='none', chart_image=None):
-    """Generate PDF report of student's exam history with customization options
-    
-    Args:
-        student_name: Student's full name
-        adm_no: Admission number
-        records: List of exam records
-        orientation: 'portrait' or 'landscape'
-        include_columns: List of columns to include (e.g., ['Total', 'Mean', 'Points', 'Rank'])
-        chart_type: 'bar', 'line', or 'none'
-        chart_image: BytesIO object containing chart image (if chart_type != 'none')
-    """
-    buffer = BytesIO()
-    
-    # Set page size based on orientation
-    pagesize = landscape(A4) if orientation == 'landscape' else A4
-    
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=pagesize,
-        leftMargin=0.5*inch,
-        rightMargin=0.5*inch,
-        topMargin=0.5*inch,
-        bottomMargin=0.5*inch
-    )
-    
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        textColor=colors.HexColor('#0E6BA8'),
-        spaceAfter=12,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    elements.append(Paragraph(f"STUDENT EXAM HISTORY", title_style))
-    elements.append(Paragraph(f"Name: {student_name} | Admission No: {adm_no}", styles['Normal']))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    # Default columns if none specified
-    if include_columns is None:
-        include_columns = ['Total', 'Mean', 'Points', 'S/Rank', 'Rank']
-    
-    # Build table headers dynamically
-    table_headers = ['Exam Name', 'Year', 'Class']
-    column_map = {
-        'Total': 'Total Marks',
-        'Mean': 'Mean %',
-        'Points': 'Points',
-        'S/Rank': 'Class Rank',
-        'Rank': 'Overall Rank'
-    }
-    
-    for col in include_columns:
-        if col in column_map:
-            table_headers.append(column_map[col])
-    
-    table_data = [table_headers]
-    
-    # Build table rows
-    for rec in sorted(records, key=lambda x: (x.get('year', 0), x.get('date', '')), reverse=True):
-        student_row = rec['student_data']
-        
-        # Basic columns
-        row = [
-            str(rec.get('exam_name', 'N/A')),
-            str(rec.get('year', 'N/A')),
-            normalize_class_name(rec.get('class_name', 'N/A'))
-        ]
-        
-        # Add selected columns
-        for col in include_columns:
-            if col == 'Points':
-                val = student_row.get('Points')
-                row.append(str(val) if pd.notna(val) and str(val).strip() else 'N/A')
-            else:
-                row.append(str(student_row.get(col, 'N/A')))
-        
-        table_data.append(row)
-    
-    # Calculate column widths dynamically
-    num_cols = len(table_headers)
-    available_width = (pagesize[0] - 1*inch) if orientation == 'landscape' else (pagesize[0] - 1*inch)
-    
-    # Allocate widths: Exam Name gets more space
-    exam_name_width = 2.5*inch if num_cols <= 6 else 2*inch
-    remaining_width = available_width - exam_name_width
-    other_col_width = remaining_width / (num_cols - 1)
-    
-    col_widths = [exam_name_width] + [other_col_width] * (num_cols - 1)
-    
-    # Create table
-    table = Table(table_data, colWidths=col_widths)
-    
-    # Style table
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0E6BA8')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 9),
-        ('FONTSIZE', (0, 1), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('TOPPADDING', (0, 0), (-1, 0), 8),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')]),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]))
-    
-    elements.append(table)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Add chart if provided
-    if chart_type != 'none' and chart_image is not None:
-        from reportlab.platypus import Image as RLImage
-        try:
-            chart_image.seek(0)
-            img = RLImage(chart_image, width=6*inch, height=3.5*inch)
-            elements.append(Spacer(1, 0.2*inch))
-            elements.append(Paragraph(f"Performance Chart ({chart_type.capitalize()})", styles['Heading2']))
-            elements.append(Spacer(1, 0.1*inch))
-            elements.append(img)
-        except Exception as e:
-            elements.append(Paragraph(f"Chart could not be embedded: {str(e)}", styles['Normal']))
-    
-    # Footer
-    footer_text = f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')} | EDUSCORE ANALYTICS"
-    elements.append(Paragraph(footer_text, styles['Normal']))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
-
 # Custom CSS
 st.markdown("""
     <style>
@@ -326,7 +182,8 @@ else:
     with st.spinner("Loading student database..."):
         for exam_id in filtered_exam_ids:
             metadata = all_metadata.get(exam_id, {})
-            exam_df = load_exam_from_disk(exam_id)
+            # only the identity columns are needed here; columnar files skip the rest
+            exam_df = load_exam_from_disk(exam_id, columns=['Name', 'Adm No'])
             if exam_df is not None and 'Name' in exam_df.columns:
                 for _, row in exam_df.iterrows():
                     name = str(row.get('Name', '')).strip()
@@ -563,9 +420,18 @@ else:
                         if include_rank:
                             selected_columns.append('Rank')
                         
+                        # The PDF (and its chart) is built only when asked for, as a background job when available
+                        history_job_key = f"history_pdf_job_{student_key}"
+                        prepare_pdf = False
+                        if selected_columns:
+                            prepare_pdf = st.button("📄 Prepare Complete History (PDF)", key=f"prepare_pdf_{student_key}",
+                                                    use_container_width=True, type="primary")
+                        else:
+                            st.warning("⚠️ Please select at least one column to include in the PDF")
+                        
                         # Generate chart image if needed
                         chart_image = None
-                        if chart_type != 'none' and PLOTLY_AVAILABLE and (means or totals):
+                        if prepare_pdf and chart_type != 'none' and PLOTLY_AVAILABLE and (means or totals):
                             try:
                                 import plotly.io as pio
                                 
@@ -616,8 +482,8 @@ else:
                                 st.warning(f"Could not generate chart: {str(e)}")
                         
                         # PDF Download button
-                        if selected_columns:
-                            pdf_buffer = generate_student_history_pdf(
+                        if prepare_pdf:
+                            pdf_kwargs = dict(
                                 student_name=student_info['name'],
                                 adm_no=student_info['adm_no'],
                                 records=records,
@@ -629,16 +495,26 @@ else:
                             
                             safe_filename = "".join(c if c.isalnum() or c in (' ', '_') else '_' for c in student_info['name'])
                             
-                            st.download_button(
-                                label="📄 Download Complete History (PDF)",
-                                data=pdf_buffer,
-                                file_name=f"{safe_filename}_exam_history.pdf",
-                                mime="application/pdf",
-                                use_container_width=True,
-                                type="primary"
-                            )
-                        else:
-                            st.warning("⚠️ Please select at least one column to include in the PDF")
+                            try:
+                                if jobs.available():
+                                    st.session_state[history_job_key] = jobs.submit(
+                                        'student_history', kwargs=pdf_kwargs,
+                                        label=f"{student_info['name']} exam history",
+                                        file_name=f"{safe_filename}_exam_history.pdf")
+                                else:
+                                    st.download_button(
+                                        label="📄 Download Complete History (PDF)",
+                                        data=generate_student_history_pdf(**pdf_kwargs),
+                                        file_name=f"{safe_filename}_exam_history.pdf",
+                                        mime="application/pdf",
+                                        use_container_width=True,
+                                        type="primary"
+                                    )
+                            except Exception as e:
+                                st.error(f"Could not generate PDF: {e}")
+                        if st.session_state.get(history_job_key):
+                            jobs.show_job(st.session_state[history_job_key], "📄 Download Complete History (PDF)",
+                                          key=history_job_key)
                         
                         st.markdown("---")
                         
@@ -22,7 +22,6 @@ from pathlib import Path
 
 import streamlit as st
 import pandas as pd
-from io import BytesIO
 
 # Very early defensive check: if the browser URL contains a multipage `page` query param
 # (for example `?page=login`) clear it and rerun immediately. This helps prevent
@@ -46,11 +45,7 @@ except Exception:
     pass
 
 from utils import student_photos as photos_mod
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+from utils import phones
 
 # optional: use Altair for larger, configurable charts when available
 try:
@@ -197,6 +192,16 @@ try:
 except Exception:
     _auth = None
 
+try:
+    from modules import storage as _storage
+except Exception:
+    _storage = None
+
+try:
+    from modules import contacts_store as _contacts_store
+except Exception:
+    _contacts_store = None
+
 # Branding: use the same fonts, logo and banner style as the main auth page if available
 try:
     st.markdown("<link href='https://fonts.googleapis.com/css2?family=Montserrat:wght@700;900&family=Poppins:wght@400;600;700&display=swap' rel='stylesheet'>", unsafe_allow_html=True)
@@ -305,10 +310,8 @@ if not ROOT.exists():
 # helpers
 
 def normalize_phone(p: str):
-    if not p:
-        return ''
-    s = re.sub(r"[^0-9]", "", str(p))
-    return s[-9:]
+    # last nine digits, the form stored on contacts as phone_key
+    return phones.phone_key(p)
 
 
 def find_school_by_account_number(accno: str):
@@ -339,6 +342,29 @@ def load_contacts_for_school(school_dir: Path):
         return []
 
 
+def find_contacts_by_phone(school_dir: Path, phone: str):
+    """Contacts of the school whose number matches ``phone`` (last nine digits).
+    Uses the indexed contacts store, refreshed from the school's JSON file, and
+    falls back to scanning the file."""
+    norm_input = normalize_phone(phone)
+    if not norm_input:
+        return []
+    f = school_dir / 'student_contacts.json'
+    if _contacts_store is not None and f.exists():
+        try:
+            if _contacts_store.sync(school_dir.name, f.read_bytes()):
+                return _contacts_store.find_by_phone(school_dir.name, norm_input)
+        except Exception:
+            pass
+    matches = []
+    for c in load_contacts_for_school(school_dir):
+        # phone_key is stored by the contacts pages; older files fall back to parsing the number
+        key = c.get('phone_key') or normalize_phone(c.get('phone') or c.get('phone_raw') or '')
+        if key == norm_input:
+            matches.append(c)
+    return matches
+
+
 def list_exams_for_school(school_dir: Path):
     meta_f = school_dir / 'exams_metadata.json'
     if not meta_f.exists():
@@ -351,6 +377,9 @@ def list_exams_for_school(school_dir: Path):
 
 def load_exam_df(school_dir: Path, exam_id: str):
     p = school_dir / exam_id / 'data.pkl'
+    if _storage is not None:
+        # columnar (.feather/.parquet) or legacy .pkl
+        return _storage.read_frame_file(p)
     if not p.exists():
         return None
     try:
@@ -969,41 +998,6 @@ def build_progress_rows_for_student(school_dir: Path, student_name: str, student
     return rows
 
 
-def generate_class_marksheet_pdf(df: pd.DataFrame, title: str = 'Class marksheet') -> bytes:
-    buf = BytesIO()
-    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=10*mm, rightMargin=10*mm, topMargin=10*mm, bottomMargin=10*mm)
-    styles = getSampleStyleSheet()
-    elems = []
-    elems.append(Paragraph(title, styles['Heading2']))
-    elems.append(Spacer(1, 6))
-    # prepare table data (header + rows)
-    header = [str(c) for c in df.columns]
-    data = [header]
-    # convert rows to strings, limit columns to a reasonable width
-    for _, r in df.iterrows():
-        row = []
-        for c in df.columns:
-            v = r.get(c, '')
-            s = '' if pd.isna(v) else str(v)
-            # truncate very long cells
-            if len(s) > 120:
-                s = s[:117] + '...'
-            row.append(s)
-        data.append(row)
-    table = Table(data, repeatRows=1)
-    table_style = TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0E6BA8')),
-        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-        ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,-1), 8),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-    ])
-    table.setStyle(table_style)
-    elems.append(table)
-    doc.build(elems)
-    return buf.getvalue()
-
 # Parent login form
 # Persist parent login in session_state so the portal stays open across form submits
 if 'pp_logged_in' not in st.session_state:
@@ -1037,13 +1031,7 @@ if not school_dir:
     st.error('School with that system number not found. Please check the number and try again.')
     st.stop()
 
-contacts = load_contacts_for_school(school_dir)
-norm_input = normalize_phone(parent_phone)
-matches = []
-for c in contacts:
-    ph = c.get('phone') or c.get('phone_raw') or ''
-    if normalize_phone(ph) == norm_input and norm_input != '':
-        matches.append(c)
+matches = find_contacts_by_phone(school_dir, parent_phone)
 
 if not matches:
     st.error('No child found for that phone number at the specified school. Please confirm the phone number with the school.')
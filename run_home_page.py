@@ -11,6 +11,7 @@ import uuid
 
 import modules.auth as auth
 from modules import storage as storage
+from modules import exam_store
 
 
 # Page configuration
@@ -117,7 +118,6 @@ PROFILE_OVERLAY_PLACEHOLDER = st.empty()
 # to `home.py` (earlier flows put the loader in app.py which is skipped when delegating).
 def _load_saved_exams_if_missing():
     import json, os
-    import pandas as pd
     # If already populated, skip
     if st.session_state.get('saved_exams'):
         return
@@ -160,47 +160,13 @@ def _load_saved_exams_if_missing():
         with open(meta_path, 'r', encoding='utf-8') as f:
             all_metadata = json.load(f)
 
-    for exam_id, metadata in all_metadata.items():
-        st.session_state.saved_exams.append(metadata)
-
-    # Load per-exam data into backing stores (pickles + config)
-    for exam_id in all_metadata.keys():
-        try:
-            # Try adapter-backed pickles/config first
-            try:
-                d = storage.read_pickle(f"{exam_id}/data.pkl")
-                if d is not None:
-                    st.session_state.saved_exam_data[exam_id] = d
-                rd = storage.read_pickle(f"{exam_id}/raw_data.pkl")
-                if rd is not None:
-                    st.session_state.saved_exam_raw_data[exam_id] = rd
-                cfg = storage.read_json(f"{exam_id}/config.json")
-                if cfg is not None:
-                    st.session_state.saved_exam_configs[exam_id] = cfg
-                # if any of the adapter reads returned data, continue to next exam
-                if exam_id in st.session_state.saved_exam_data or exam_id in st.session_state.saved_exam_raw_data or exam_id in st.session_state.saved_exam_configs:
-                    continue
-            except Exception:
-                # adapter read failed; fallback to local files
-                pass
-
-            # Local fallback: read from storage_dir cache
-            exam_dir = os.path.join(storage_dir, exam_id)
-            if not os.path.exists(exam_dir):
-                continue
-            data_path = os.path.join(exam_dir, 'data.pkl')
-            raw_path = os.path.join(exam_dir, 'raw_data.pkl')
-            cfg_path = os.path.join(exam_dir, 'config.json')
-            if os.path.exists(data_path):
-                st.session_state.saved_exam_data[exam_id] = pd.read_pickle(data_path)
-            if os.path.exists(raw_path):
-                st.session_state.saved_exam_raw_data[exam_id] = pd.read_pickle(raw_path)
-            if os.path.exists(cfg_path):
-                with open(cfg_path, 'r', encoding='utf-8') as fh:
-                    st.session_state.saved_exam_configs[exam_id] = json.load(fh)
-        except Exception:
-            # Non-fatal; proceed with other exams
-            pass
+    # Payloads are fetched by id from the process-wide exam store on first use
+    # instead of being unpickled into this session.
+    try:
+        sid = auth.get_current_school_id() or 'global'
+    except Exception:
+        sid = 'global'
+    exam_store.attach_session(st.session_state, sid, all_metadata, storage_dir=storage_dir)
 
 # Attempt to populate saved exams now (covers cases where app.py delegated early)
 try:
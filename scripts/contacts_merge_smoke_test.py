@@ -0,0 +1,59 @@
+"""Smoke test for contact merging: two guardians of one student stay two
+contacts, re-importing a guardian updates it, and the send page's updates
+(match_phone=False) still replace the saved number.
+
+Checks both ``contacts_store.merge`` (plain list) and ``contacts_store.upsert``
+(the local SQLite store, under a throwaway scope that is emptied afterwards).
+"""
+import sys
+import time
+
+from modules import contacts_store
+
+GUARDIANS = [
+    {'student_id': '101', 'student_name': 'Jane Atieno', 'parent_name': 'Mother', 'phone_raw': '0712345678'},
+    {'student_id': '101', 'student_name': 'Jane Atieno', 'parent_name': 'Father', 'phone_raw': '0722345678'},
+    {'student_id': '', 'student_name': 'Tom Otieno', 'parent_name': 'Mother', 'phone_raw': '0733345678'},
+    {'student_id': '', 'student_name': 'tom  otieno', 'parent_name': 'Aunt', 'phone_raw': '0744345678'},
+]
+UPDATE = {'student_id': '101', 'student_name': 'Jane Atieno', 'parent_name': 'Mother (Mrs A.)', 'phone_raw': '0712345678'}
+SEND_PAGE = {'student_name': 'Tom Otieno', 'parent_name': '', 'phone_raw': '+254755345678', 'phone': '+254755345678'}
+
+failures = []
+
+
+def check(label, got, want):
+    ok = got == want
+    print(('OK  ' if ok else 'FAIL'), label, got, '' if ok else f'(expected {want})')
+    if not ok:
+        failures.append(label)
+
+
+def summary(contacts):
+    return sorted((c.get('student_name'), c.get('parent_name'), c.get('phone')) for c in contacts)
+
+
+# plain list
+contacts = []
+check('merge: one row per guardian', contacts_store.merge(contacts, GUARDIANS), {'inserted': 4, 'updated': 0})
+check('merge: same guardian again', contacts_store.merge(contacts, [UPDATE]), {'inserted': 0, 'updated': 1})
+check('merge: send page replaces', contacts_store.merge(contacts, [SEND_PAGE], match_phone=False),
+      {'inserted': 0, 'updated': 1})
+listed = summary(contacts)
+print(listed)
+
+# store
+if contacts_store.available():
+    scope = f'smoke-contacts-{time.time_ns()}'
+    try:
+        check('upsert: one row per guardian', contacts_store.upsert(scope, GUARDIANS), {'inserted': 4, 'updated': 0})
+        check('upsert: same guardian again', contacts_store.upsert(scope, [UPDATE]), {'inserted': 0, 'updated': 1})
+        check('upsert: send page replaces', contacts_store.upsert(scope, [SEND_PAGE], match_phone=False),
+              {'inserted': 0, 'updated': 1})
+        check('upsert: same contacts as merge', summary(contacts_store.load(scope)), listed)
+    finally:
+        contacts_store.replace_all(scope, [])
+else:
+    print('Contacts store unavailable; skipped the upsert checks.')
+
+sys.exit(1 if failures else 0)
@@ -2,6 +2,8 @@
 
 This scans the local users store and calls modules.storage.initialize_account()
 for any username that doesn't already have a proper per-account folder (by marker files).
+In DB-only mode the default keys of every account are upserted in a single
+statement instead, keeping values that already exist.
 
 Run locally:
     python .\scripts\ensure_accounts_for_users.py
@@ -48,6 +50,19 @@ def main():
         print('Failed to import modules.auth or modules.storage:', e)
         sys.exit(1)
 
+    try:
+        from modules import db as _db
+        db_mode = _storage.USE_DB_STRICT and _db.init_from_env() and _db.enabled()
+    except Exception:
+        db_mode = False
+    if db_mode:
+        items = {}
+        for uname in users.keys():
+            items.update(_storage.account_kv_defaults(safe_email_to_schoolid(f"{uname}@local")))
+        ok = _db.set_kv_many(items, overwrite=False)
+        print(f'Done. accounts={len(users)}, keys={len(items)}, ok={ok}')
+        return
+
     created = 0
     fixed = 0
     for uname in users.keys():
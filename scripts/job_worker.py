@@ -0,0 +1,54 @@
+"""Run queued export jobs (bulk report cards, PDF reports) in the background.
+
+Usage:
+    python -m scripts.job_worker [--once] [--poll 2] [--worker-id NAME]
+
+Use it when the app runs with JOBS_POOL=off, or to add capacity next to the
+app's own pool. It needs the same DATABASE_URL as the app (or the same checkout
+when jobs live in the local SQLite file). Each round it claims the oldest due
+job from modules.jobs and runs it to completion. Stop it with Ctrl+C. A job that
+was running when the worker stopped is claimed again after its lease
+(JOBS_LEASE) expires.
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+
+from modules import jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--once', action='store_true', help='run what is due now, then exit')
+    parser.add_argument('--poll', type=float, default=2.0, help='seconds to sleep when the queue is empty')
+    parser.add_argument('--prune', action='store_true', help='also delete finished jobs older than JOBS_KEEP_SECONDS')
+    parser.add_argument('--worker-id', default=f'{socket.gethostname()}-{os.getpid()}')
+    args = parser.parse_args()
+
+    if not jobs.available():
+        print('Jobs unavailable (SQLAlchemy missing or database unreachable).')
+        sys.exit(1)
+    print(f'Worker {args.worker_id} running export jobs (Ctrl+C to stop)')
+    total = 0
+    try:
+        while True:
+            job = jobs.run_next(args.worker_id)
+            if job is not None:
+                total += 1
+                print(f"{time.strftime('%H:%M:%S')} {job.get('kind')} {job.get('job_id')}: {job.get('status')}"
+                      + (f" ({job.get('error')})" if job.get('error') else ''))
+                continue
+            if args.prune:
+                jobs.prune()
+            if args.once:
+                break
+            time.sleep(args.poll)
+    except KeyboardInterrupt:
+        print('Stopping.')
+    print(f'Ran {total} jobs.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Convert pickled exam DataFrames under saved_exams_storage/ to the columnar format.
+
+Usage:
+    python scripts/migrate_exam_frames_to_columnar.py [--dry-run] [--keep-pickle] [--format feather|parquet]
+
+Every ``data.pkl`` / ``raw_data.pkl`` found under the local storage root is
+re-written as ``data.feather`` / ``raw_data.feather`` (or ``.parquet``) next to
+it. The pickle is removed once the columnar copy reads back with the same shape,
+unless --keep-pickle is given. Readers fall back to ``.pkl`` for anything not
+converted, so the script can be re-run safely. Run
+scripts/migrate_saved_exams_to_s3.py afterwards when the tree is mirrored to S3.
+"""
+import os
+import sys
+import argparse
+from modules import storage
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', 'saved_exams_storage')
+FRAME_FILES = ('data.pkl', 'raw_data.pkl')
+
+
+def convert(path: str, fmt: str, dry_run: bool = False, keep_pickle: bool = False) -> bool:
+    df = storage.read_frame_file(path)
+    if df is None:
+        print('Skipping unreadable file:', path)
+        return False
+    payload, ext = storage.dumps_frame(df, fmt)
+    if ext == '.pkl':
+        print('Kept as pickle (not representable in columnar form):', path)
+        return False
+    target = path[:-len('.pkl')] + ext
+    print(f'{path} -> {target} ({os.path.getsize(path)} -> {len(payload)} bytes)')
+    if dry_run:
+        return True
+    with open(target, 'wb') as fh:
+        fh.write(payload)
+    back = storage.read_frame_file(target)
+    if back is None or back.shape != df.shape:
+        print('Verification failed, keeping pickle:', path)
+        os.remove(target)
+        return False
+    if not keep_pickle:
+        os.remove(path)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--root', default=ROOT)
+    parser.add_argument('--format', default=None, choices=('feather', 'parquet'))
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--keep-pickle', action='store_true')
+    args = parser.parse_args()
+
+    fmt = args.format or (storage.FRAME_FORMAT if storage.FRAME_FORMAT != 'pickle' else 'feather')
+    if storage.pa is None:
+        print('pyarrow is not installed; install it (see requirements.txt) before migrating.')
+        sys.exit(1)
+    if not os.path.exists(args.root):
+        print('Local saved_exams_storage not found at', args.root)
+        sys.exit(1)
+    converted = 0
+    for root, dirs, files in os.walk(args.root):
+        for f in files:
+            if f in FRAME_FILES:
+                try:
+                    if convert(os.path.join(root, f), fmt, args.dry_run, args.keep_pickle):
+                        converted += 1
+                except Exception as e:
+                    print('Failed:', os.path.join(root, f), e)
+    print(f'{"Would convert" if args.dry_run else "Converted"} {converted} file(s).')
+
+
+if __name__ == '__main__':
+    main()
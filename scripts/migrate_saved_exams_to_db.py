@@ -5,6 +5,7 @@ before running.
 import os
 import json
 from modules import db
+from modules import storage
 from pathlib import Path
 
 
@@ -34,13 +35,15 @@ def migrate(root_path: str):
             db.save_exam_metadata(school_id, exam_id, md)
             exam_dir = acct / exam_id
             if exam_dir.exists() and exam_dir.is_dir():
-                # save pickles and config.json
-                for fname in ('data.pkl', 'raw_data.pkl', 'config.json'):
+                # save frames (columnar or legacy .pkl) and config.json
+                fnames = storage.frame_keys('data.pkl') + storage.frame_keys('raw_data.pkl') + ['config.json']
+                for fname in fnames:
                     p = exam_dir / fname
                     if p.exists():
                         try:
                             b = p.read_bytes()
-                            db.save_exam_file(school_id, exam_id, fname, b, mimetype='application/octet-stream')
+                            mimetype = storage.FRAME_MIMETYPES.get(p.suffix, 'application/octet-stream')
+                            db.save_exam_file(school_id, exam_id, fname, b, mimetype=mimetype)
                         except Exception as e:
                             print('Failed to save file', p, e)
     print('Migration complete.')
@@ -6,6 +6,8 @@ This script will:
 - If the file doesn't exist, write a Mobitech JSON default (POST, application/json).
 - If it exists, fill any missing keys with defaults but do NOT overwrite existing non-empty values.
 - Back up any replaced file to `messaging_config.json.bak` before modifying.
+- When a database is configured, upsert the same config for all accounts into the
+  kv_store in one statement.
 
 Run this from the repository root with the same Python used to run the app.
 """
@@ -54,6 +56,7 @@ def main():
     # Heuristic: treat a child as an account only if it contains typical account files
     ACCOUNT_MARKERS = {'exams_metadata.json', 'student_contacts.json', 'messaging_config.json', 'app_persistent_config.json'}
     SKIP_DIRS = {'student_photos', 'watermarks', 'exports', 'attachments', 'static'}
+    applied = []
     for child in sorted(ROOT.iterdir()):
         if not child.is_dir():
             continue
@@ -81,9 +84,20 @@ def main():
                 except Exception:
                     pass
             cfg_file.write_text(json.dumps(global_cfg, indent=2), encoding='utf-8')
+            applied.append(child.name)
             print(f"Applied global messaging_config.json to: {child.name}")
         except Exception as e:
             print(f"Failed to write for {child.name}: {e}")
 
+    # mirror into the kv_store (storage:<school_id>:messaging_config.json) in one upsert
+    try:
+        from modules import db
+        if applied and db.init_from_env() and db.enabled():
+            items = {f'storage:{name}:messaging_config.json': global_cfg for name in applied}
+            ok = db.set_kv_many(items)
+            print(f"Upserted messaging config for {len(items)} account(s) into the database: {ok}")
+    except Exception as e:
+        print(f"Database update skipped: {e}")
+
 if __name__ == '__main__':
     main()
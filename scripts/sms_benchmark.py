@@ -0,0 +1,190 @@
+"""Load-test utils.messaging against the local stub providers (utils.sms_stub).
+
+Usage:
+    python -m scripts.sms_benchmark [--provider all] [--count 2000] [--path bulk|outbox]
+        [--latency-ms 50] [--jitter-ms 20] [--error-rate 0.02] [--rate-limit 40]
+        [--workers 8] [--client-rate 50] [--no-batch] [--url http://host:port]
+    python -m scripts.sms_benchmark --serve [--port 8765] [...stub options]
+
+For each provider it sends ``--count`` rendered messages with test_mode off and
+prints messages/sec, p50/p99 HTTP request latency, p50/p99 per-message
+completion time, the stub's status codes and, for ``--path outbox``, how many
+retries the outbox needed. ``--path bulk`` measures ``messaging.send_bulk``
+(no retries: 429/5xx show up as failures); ``--path outbox`` enqueues the same
+messages and drains them until every row is sent or final, with the backoff
+shortened to ``--backoff`` seconds.
+
+The message log, message store and outbox go to a temporary directory, so a run
+never touches real history. ``--serve`` only runs the stub (e.g. to point a dev
+messaging_config.json at it); ``--url`` benchmarks an already running stub.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+# keep benchmark traffic out of the app database before the stores are imported
+os.environ['MESSAGE_STORE'] = 'sqlite'
+os.environ['SMS_OUTBOX_STORE'] = 'sqlite'
+
+import requests
+
+from utils import messaging
+from utils.sms_stub import StubSMSServer, percentiles, provider_config
+from modules import outbox
+
+PROVIDERS = ('africastalking', 'infobip', 'mobitech')
+
+
+@contextmanager
+def _timed_requests(samples: list):
+    """Record the wall time of every HTTP request made through ``requests``."""
+    original = requests.Session.send
+    lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(self, request, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.append(elapsed)
+
+    requests.Session.send = send
+    try:
+        yield
+    finally:
+        requests.Session.send = original
+
+
+def _contacts(count: int):
+    return [{'phone': f'+2547{i:08d}', 'student_name': f'Student {i}', 'class': f'Form {1 + i % 4}',
+             'exam_id': 'benchmark', 'student_id': str(i)} for i in range(count)]
+
+
+def _run_bulk(cfg, contacts, template, on_progress):
+    results = messaging.send_bulk(contacts, template, config=cfg, test_mode=False, on_progress=on_progress)
+    ok = sum(1 for r in results if (r.get('result') or {}).get('ok'))
+    return ok, len(results) - ok, 0
+
+
+def _run_outbox(cfg, contacts, template, on_progress):
+    jobs = []
+    for c in contacts:
+        try:
+            msg = template.format(**c)
+        except Exception:
+            msg = template
+        jobs.append({'phone': c['phone'], 'message': msg, 'contact': c})
+    queued = outbox.enqueue(jobs, cfg, scope=f'benchmark-{time.time_ns()}', log_file=str(messaging.LOG_FILE))
+    attempts, done = 0, [0]
+
+    def _progress(_done, _total, item, res):
+        done[0] += 1
+        on_progress(done[0], len(jobs), item, res)
+
+    while True:
+        rows = outbox.drain(batch_id=queued['batch_id'], on_progress=_progress)
+        attempts += len(rows)
+        pending = outbox.summary(batch_id=queued['batch_id'])
+        if not (pending.get(outbox.QUEUED) or pending.get(outbox.RETRY) or pending.get(outbox.SENDING)):
+            break
+        time.sleep(0.05)
+    return pending.get(outbox.SENT, 0), pending.get(outbox.FAILED, 0), attempts - len(jobs)
+
+
+def _bench(provider, cfg, args, stub):
+    contacts = _contacts(args.count)
+    samples, finished = [], []
+    started = time.perf_counter()
+
+    def _progress(done, total, item, res):
+        finished.append(time.perf_counter() - started)
+
+    if stub is not None:
+        stub.reset_stats()
+    run = _run_outbox if args.path == 'outbox' else _run_bulk
+    with _timed_requests(samples):
+        ok, failed, retries = run(cfg, contacts, args.template, _progress)
+    elapsed = time.perf_counter() - started
+    req = percentiles(samples)
+    msg = percentiles(finished)
+    print(f'{provider:<15} {args.count} msgs in {elapsed:.2f}s = {args.count / max(elapsed, 1e-9):.1f} msg/s; '
+          f'ok {ok}, failed {failed}, retries {retries}')
+    print(f'{"":<15} {len(samples)} HTTP requests, latency p50 {req[50] * 1000:.0f} ms / p99 {req[99] * 1000:.0f} ms; '
+          f'message done p50 {msg[50]:.2f}s / p99 {msg[99]:.2f}s')
+    if stub is not None:
+        codes = (stub.stats().get(provider) or {}).get('codes') or {}
+        print(f'{"":<15} stub status codes: {dict(sorted(codes.items()))}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--provider', default='all', choices=('all',) + PROVIDERS)
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--path', default='bulk', choices=('bulk', 'outbox'))
+    parser.add_argument('--template', default='Dear parent, {student_name} of {class}: results are out.')
+    parser.add_argument('--workers', type=int, default=None, help='client max_workers (default: SMS_MAX_WORKERS)')
+    parser.add_argument('--client-rate', type=float, default=None, help='client rate_limit_per_sec (0 = unthrottled)')
+    parser.add_argument('--no-batch', action='store_true', help='one request per message for AT/Infobip')
+    parser.add_argument('--backoff', type=float, default=0.2, help='outbox retry backoff base in seconds')
+    parser.add_argument('--url', default=None, help='benchmark a stub already running at this URL')
+    parser.add_argument('--serve', action='store_true', help='run the stub server in the foreground only')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='stub requests/sec per provider before 429 (0 = off)')
+    parser.add_argument('--burst', type=int, default=10)
+    parser.add_argument('--invalid-suffix', default=None, help='reject numbers ending with these digits')
+    args = parser.parse_args()
+
+    stub = None
+    if args.url is None:
+        stub = StubSMSServer(host=args.host, port=args.port or (8765 if args.serve else 0),
+                             latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                             rate_limit=args.rate_limit, burst=args.burst, invalid_suffix=args.invalid_suffix)
+    if args.serve:
+        if stub is None:
+            parser.error('--serve starts its own stub; drop --url')
+        print(f'Stub SMS providers on {stub.url}: /africastalking, /infobip, /mobitech (Ctrl+C to stop)')
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            print('Stopping.')
+        return
+
+    work = Path(tempfile.mkdtemp(prefix='sms_benchmark_'))
+    messaging.LOG_FILE = work / 'sent_messages_log.json'
+    outbox.BASE_STORAGE = str(work)
+    outbox.BACKOFF_BASE = args.backoff
+    outbox.BACKOFF_MAX = max(args.backoff, 1.0)
+    base_url = (args.url or stub.url).rstrip('/')
+    if stub is not None:
+        stub.start()
+    print(f'Benchmarking {args.path} path against {base_url} (log/outbox in {work})')
+    try:
+        for provider in (PROVIDERS if args.provider == 'all' else (args.provider,)):
+            cfg = provider_config(base_url, provider)
+            if args.workers:
+                cfg['max_workers'] = args.workers
+            if args.client_rate is not None:
+                cfg['rate_limit_per_sec'] = args.client_rate
+            if args.no_batch:
+                cfg['batch_sends'] = False
+            _bench(provider, cfg, args, stub)
+    finally:
+        if stub is not None:
+            stub.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""Drain the SMS outbox in the background.
+
+Usage:
+    python -m scripts.sms_outbox_worker [--once] [--chunk 200] [--poll 2] [--scope ACCOUNT] [--worker-id NAME]
+
+Run it next to the Streamlit app (same DATABASE_URL, or the same checkout when
+the outbox is the local SQLite file). It claims due rows, sends them through
+utils.messaging with the batch's saved config, records sent/retry/failed on each
+row and writes the usual message-log entries to the account that queued them.
+With --scope it only drains that account's rows.
+While a worker is heartbeating, the send pages only enqueue. Stop with Ctrl+C;
+rows in flight are picked up again after their lease (SMS_OUTBOX_LEASE) expires.
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+
+from modules import outbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--once', action='store_true', help='drain what is due now, then exit')
+    parser.add_argument('--chunk', type=int, default=200, help='rows claimed per round')
+    parser.add_argument('--poll', type=float, default=2.0, help='seconds to sleep when the queue is empty')
+    parser.add_argument('--scope', default='', help="only drain this account's rows (default: every account)")
+    parser.add_argument('--worker-id', default=f'{socket.gethostname()}-{os.getpid()}')
+    args = parser.parse_args()
+
+    if not outbox.available():
+        print('Outbox unavailable (SQLAlchemy missing or database unreachable).')
+        sys.exit(1)
+    print(f'Worker {args.worker_id} draining the SMS outbox (Ctrl+C to stop)')
+    total = 0
+    try:
+        while True:
+            outbox.heartbeat(args.worker_id, scope=args.scope)
+            rows = outbox.claim(args.worker_id, limit=args.chunk, scope=args.scope or None)
+            if rows:
+                results = outbox.process(rows)
+                counts = {}
+                for r in results:
+                    counts[r['status']] = counts.get(r['status'], 0) + 1
+                total += len(results)
+                outbox.heartbeat(args.worker_id, processed=len(results), scope=args.scope)
+                print(f"{time.strftime('%H:%M:%S')} processed {len(results)} ({counts}); total {total}")
+                continue
+            if args.once:
+                break
+            time.sleep(args.poll)
+    except KeyboardInterrupt:
+        print('Stopping.')
+    print(f'Processed {total} messages.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,12 @@
 import pandas as pd
 
+from .grading import GradingScheme, threshold_bands
+
+# Mean-score ladder used by compute_results
+RESULT_GRADING = GradingScheme(threshold_bands(
+    [(80, 'A'), (75, 'A-'), (70, 'B+'), (65, 'B'), (60, 'B-'),
+     (55, 'C+'), (50, 'C'), (45, 'C-'), (40, 'D+'), (35, 'D')], 'E'))
+
 def read_marks(file):
     """
     Read an Excel file into a DataFrame.
@@ -42,23 +49,6 @@ def compute_results(df):
     pivot['Total'] = pivot[subj_cols].sum(axis=1, skipna=True)
     pivot['Mean'] = pivot['Total'] / len(subj_cols)
 
-    # grading function (example)
-    def grade(mean):
-        try:
-            m = float(mean)
-        except:
-            return ''
-        if m >= 80: return 'A'
-        if m >= 75: return 'A-'
-        if m >= 70: return 'B+'
-        if m >= 65: return 'B'
-        if m >= 60: return 'B-'
-        if m >= 55: return 'C+'
-        if m >= 50: return 'C'
-        if m >= 45: return 'C-'
-        if m >= 40: return 'D+'
-        if m >= 35: return 'D'
-        return 'E'
-
-    pivot['Grade'] = pivot['Mean'].apply(grade)
+    # grading (example)
+    pivot['Grade'] = RESULT_GRADING.grade(pivot['Mean'].fillna(float('-inf')))
     return pivot
\ No newline at end of file
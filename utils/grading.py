@@ -0,0 +1,200 @@
+"""Grading tables compiled for fast, vectorized lookups.
+
+Grading systems are lists of rules ``{'grade', 'min', 'max', 'points'}`` where,
+as everywhere else in the app, ``max`` is the *lower* bound and ``min`` the
+*upper* bound of the band (both inclusive). When bands overlap, the first rule
+in the list wins. Comment bands on the report-card page use the same layout
+with ``text``/``label`` instead of ``grade``.
+
+``GradingScheme`` bundles the default table with per-subject overrides (strict
+grading) and is compiled once per distinct configuration::
+
+    scheme = GradingScheme.from_config(st.session_state.cfg)
+    scheme.grade(78, 'Maths')            # 'A-'
+    scheme.points(df['Maths %'], 'Maths')  # int array
+"""
+from __future__ import annotations
+import json
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class GradeBands:
+    """A band table compiled into sorted bound arrays for ``searchsorted``."""
+
+    def __init__(self, grading_system: Optional[Sequence[dict]], label_keys: Tuple[str, ...] = ('grade',)):
+        rules = []
+        for order, rule in enumerate(grading_system or []):
+            try:
+                lo, hi = float(rule['max']), float(rule['min'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            try:
+                pts = int(rule.get('points', 0))
+            except (TypeError, ValueError):
+                pts = 0
+            label = next((rule.get(k) for k in label_keys if rule.get(k)), '')
+            rules.append((lo, hi, str(label or ''), pts, order))
+        rules.sort(key=lambda r: (r[0], r[4]))
+        self.lows = np.array([r[0] for r in rules], dtype=float)
+        self.highs = np.array([r[1] for r in rules], dtype=float)
+        self.labels = np.array([r[2] for r in rules] + [''], dtype=object)
+        self.point_values = np.array([r[3] for r in rules] + [0], dtype=np.int64)
+        self._orders = [r[4] for r in rules]
+        # searchsorted is only exact when no two bands overlap
+        self.disjoint = bool(np.all(self.lows[1:] > self.highs[:-1])) if len(rules) > 1 else True
+
+    def __len__(self):
+        return len(self.lows)
+
+    def index(self, values) -> np.ndarray:
+        """Band index of every value (``len(self)`` when no band matches or value is NaN)."""
+        x = np.asarray(values, dtype=float)
+        n = len(self.lows)
+        out = np.full(x.shape, n, dtype=np.intp)
+        if n == 0:
+            return out
+        valid = ~np.isnan(x)
+        if self.disjoint:
+            pos = np.searchsorted(self.lows, x, side='right') - 1
+            ok = valid & (pos >= 0)
+            hit = np.zeros(x.shape, dtype=bool)
+            hit[ok] = x[ok] <= self.highs[pos[ok]]
+            out[hit] = pos[hit]
+            return out
+        # overlapping bands: paint in reverse list order so the first listed rule wins
+        for i in sorted(range(n), key=lambda i: self._orders[i], reverse=True):
+            out[valid & (x >= self.lows[i]) & (x <= self.highs[i])] = i
+        return out
+
+    def grades(self, values) -> np.ndarray:
+        return self.labels[self.index(values)]
+
+    def points(self, values) -> np.ndarray:
+        return self.point_values[self.index(values)]
+
+
+@lru_cache(maxsize=64)
+def _compile(key: str, label_keys: Tuple[str, ...]) -> GradeBands:
+    return GradeBands(json.loads(key), label_keys)
+
+
+def compile_bands(grading_system: Optional[Sequence[dict]], label_keys: Tuple[str, ...] = ('grade',)) -> GradeBands:
+    """Compiled (and memoized per distinct table) ``GradeBands``."""
+    try:
+        key = json.dumps(list(grading_system or []), sort_keys=True, default=str)
+    except Exception:
+        return GradeBands(grading_system, label_keys)
+    return _compile(key, tuple(label_keys))
+
+
+def _as_float_array(values) -> Tuple[np.ndarray, bool]:
+    """``(float array, was_scalar)``; blanks and non-numeric entries become NaN."""
+    scalar = np.ndim(values) == 0
+    if scalar:
+        try:
+            return np.array(float(values)), True
+        except (TypeError, ValueError):
+            return np.array(np.nan), True
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'fiub':
+        return arr.astype(float), False
+    import pandas as pd
+    return pd.to_numeric(pd.Series(arr.ravel()), errors='coerce').to_numpy(dtype=float).reshape(arr.shape), False
+
+
+class GradingScheme:
+    """Default grading table plus per-subject overrides, compiled once.
+
+    ``overrides`` maps subject names to their own grading table (strict grading
+    is expressed this way). ``grade``/``points``/``remark`` accept a scalar or
+    any array-like and return the same shape; missing or non-numeric values give
+    ``''`` / ``0`` like the old per-cell helpers.
+    """
+
+    def __init__(self, grading_system: Optional[Sequence[dict]],
+                 overrides: Optional[Mapping[str, Sequence[dict]]] = None):
+        self.default = compile_bands(grading_system)
+        self.overrides: Dict[str, GradeBands] = {
+            str(subj): compile_bands(system) for subj, system in (overrides or {}).items()
+        }
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Mapping[str, Any]], grading_system: Optional[Sequence[dict]] = None) -> 'GradingScheme':
+        """Scheme for the marksheet config: ``grading_system`` (or the explicit
+        table passed in) with ``strict_grading_system`` applied to
+        ``strict_grading_subjects`` when ``strict_grading_enabled`` is set, and
+        any ``subject_grading_systems`` overrides."""
+        cfg = cfg or {}
+        base = grading_system if grading_system is not None else (cfg.get('grading_system') or [])
+        overrides = dict(cfg.get('subject_grading_systems') or {})
+        if cfg.get('strict_grading_enabled', False):
+            strict = cfg.get('strict_grading_system', base) or []
+            for subj in cfg.get('strict_grading_subjects', []) or []:
+                overrides[str(subj)] = strict
+        try:
+            key = json.dumps([base, overrides], sort_keys=True, default=str)
+        except Exception:
+            return cls(base, overrides)
+        return _scheme(key)
+
+    def bands_for(self, subject: Optional[str] = None) -> GradeBands:
+        if subject is not None and self.overrides:
+            return self.overrides.get(str(subject), self.default)
+        return self.default
+
+    def __bool__(self):
+        return bool(len(self.default) or self.overrides)
+
+    def grade(self, values, subject: Optional[str] = None):
+        x, scalar = _as_float_array(values)
+        out = self.bands_for(subject).grades(x)
+        return str(out[()]) if scalar else out
+
+    def points(self, values, subject: Optional[str] = None):
+        x, scalar = _as_float_array(values)
+        out = self.bands_for(subject).points(x)
+        return int(out[()]) if scalar else out
+
+    @staticmethod
+    def remark(values, comment_bands: Optional[Sequence[dict]] = None,
+               thresholds: Optional[Mapping[str, float]] = None,
+               texts: Optional[Mapping[str, str]] = None):
+        """Teacher remark per score: the first matching comment band's text
+        (or label), otherwise the excellent/vgood/good/average/improve
+        thresholds. Missing scores give None."""
+        x, scalar = _as_float_array(values)
+        thresholds = thresholds or {}
+        texts = texts or {}
+        steps = [
+            (thresholds.get('excellent', 80), texts.get('excellent', 'Excellent')),
+            (thresholds.get('vgood', 70), texts.get('vgood', 'Very good')),
+            (thresholds.get('good', 60), texts.get('good', 'Good')),
+            (thresholds.get('average', 50), texts.get('average', 'Average')),
+        ]
+        fallback = np.select([x >= float(t) for t, _ in steps], [label for _, label in steps],
+                             default=texts.get('improve', 'Needs improvement')).astype(object)
+        if comment_bands:
+            picked = compile_bands(comment_bands, label_keys=('text', 'label')).grades(x)
+            fallback = np.where(picked != '', picked, fallback)
+        fallback[np.isnan(x)] = None
+        return fallback[()] if scalar else fallback
+
+
+@lru_cache(maxsize=32)
+def _scheme(key: str) -> GradingScheme:
+    base, overrides = json.loads(key)
+    return GradingScheme(base, overrides)
+
+
+def threshold_bands(steps: Iterable[Tuple[float, str]], floor: str) -> list:
+    """Grading rules for ``value >= bound`` ladders (highest bound first), with
+    ``floor`` for everything below the last bound."""
+    rules, upper = [], float('inf')
+    for bound, label in steps:
+        rules.append({'grade': label, 'max': float(bound), 'min': upper})
+        upper = float(np.nextafter(float(bound), -np.inf))
+    rules.append({'grade': floor, 'max': float('-inf'), 'min': upper})
+    return rules
@@ -0,0 +1,96 @@
+"""Vectorized marksheet engine.
+
+Builds the numeric parts of a marksheet (subject percentages, grade labels,
+points, totals, means, drop-lowest and ranks) as whole-array NumPy operations
+instead of per-cell ``apply`` calls. ``app.build_export_from_raw`` uses it; the
+results match the per-cell ``get_grade``/``get_points`` helpers.
+
+Grade lookups use the compiled bands of ``utils.grading``.
+"""
+from __future__ import annotations
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .grading import GradeBands
+
+
+def format_cells(pct, bands: Optional[GradeBands] = None) -> np.ndarray:
+    """Display strings for a percentage column: ``'<int>'`` or ``'<int> <grade>'``
+    (grade looked up on the rounded value), ``''`` for missing values."""
+    x = np.asarray(pct, dtype=float)
+    valid = ~np.isnan(x)
+    ints = np.round(np.where(valid, x, 0)).astype(np.int64)
+    txt = ints.astype(str).astype(object)
+    if bands is not None and len(bands):
+        g = bands.grades(ints)
+        has = valid & (g != '')
+        txt[has] = txt[has] + ' ' + g[has]
+    txt[~valid] = ''
+    return txt
+
+
+def totals(pct_matrix: np.ndarray, bands: Optional[List[Optional[GradeBands]]] = None,
+           drop_lowest: int = 0) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """Per-student ``(total, mean, points)`` over the counted subject columns.
+
+    ``pct_matrix`` is ``(students, subjects)`` with NaN for missing marks and
+    ``bands`` the compiled grading per column (points are None when no column
+    has grading). Without drop-lowest, missing marks add 0 to the total and 0
+    points and the mean divides by the number of subjects. With
+    ``drop_lowest=k`` missing marks count as 0, the k lowest marks per student
+    are removed (ties drop the leftmost column first) and the mean divides by
+    ``subjects - k``.
+    """
+    m = np.asarray(pct_matrix, dtype=float)
+    n_students, n_subj = m.shape
+    if n_subj == 0:
+        nan = np.full(n_students, np.nan)
+        return nan, nan, None
+    grading = bands is not None and any(b is not None and len(b) for b in bands)
+    k = min(int(drop_lowest or 0), n_subj - 1)
+
+    if drop_lowest:
+        filled = np.nan_to_num(m, nan=0.0)
+        keep = np.ones(m.shape, dtype=bool)
+        if k == 1:
+            drop = np.argmin(filled, axis=1)[:, None]
+        else:
+            drop = np.argsort(filled, axis=1, kind='stable')[:, :k]
+        if k > 0:
+            np.put_along_axis(keep, drop, False, axis=1)
+        total = np.where(keep, filled, 0.0).sum(axis=1)
+        mean = total / max(1, n_subj - k)
+        points_src, points_mask = filled, keep
+    else:
+        total = np.nan_to_num(m, nan=0.0).sum(axis=1)
+        mean = total / max(1, n_subj)
+        points_src, points_mask = m, np.ones(m.shape, dtype=bool)
+
+    points = None
+    if grading:
+        points = np.zeros(n_students, dtype=np.int64)
+        for j, b in enumerate(bands):
+            if b is None or not len(b):
+                continue
+            points += np.where(points_mask[:, j], b.points(points_src[:, j]), 0)
+    return total, mean, points
+
+
+def rank_desc(metric, valid_mask, groups=None) -> pd.Series:
+    """Competition ('min') ranks, highest first, for rows in ``valid_mask``;
+    NaN metrics rank last. With ``groups`` ranks are computed within each group
+    (rows whose group is missing stay unranked)."""
+    metric = pd.to_numeric(pd.Series(metric).reset_index(drop=True), errors='coerce')
+    valid = pd.Series(valid_mask).reset_index(drop=True).astype(bool)
+    out = pd.Series(np.nan, index=metric.index)
+    if groups is None:
+        out[valid] = metric[valid].rank(method='min', ascending=False, na_option='bottom')
+        return out
+    g = pd.Series(groups).reset_index(drop=True)
+    valid = valid & g.notna()
+    if valid.any():
+        out[valid] = metric[valid].groupby(g[valid], sort=False).rank(method='min', ascending=False,
+                                                                      na_option='bottom')
+    return out
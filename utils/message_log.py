@@ -0,0 +1,252 @@
+"""Append-only SMS audit log.
+
+Entries are stored one JSON object per line in monthly files next to the old
+log: ``<dir>/sent_messages_log/YYYY-MM.jsonl`` (month taken from the entry's
+``time``). Appends are a single ``write`` on a file opened in append mode
+followed by one fsync, so concurrent senders never lose entries and the cost of
+logging no longer grows with the size of the history.
+
+Bulk sends wrap their work in ``buffered(log_file)``: entries collected during
+the block are flushed every ``flush_every`` entries / ``flush_interval``
+seconds and once more on exit, one write+fsync per month file per flush.
+
+Readers use ``tail`` (newest entries, read backwards from the end of the latest
+files) or ``iter_entries`` (optionally only months since a timestamp). A legacy
+``sent_messages_log.json`` list found next to the log directory is migrated on
+first access and kept as ``sent_messages_log.<timestamp>.migrated.json``.
+
+Indexes built from the log (``modules.message_store``) register with
+``add_sink`` and are handed every batch of appended entries once it is on disk.
+
+All functions take the legacy log path (``.../sent_messages_log.json``) to
+locate the log, as the callers already carry it around.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+PathLike = Union[str, Path]
+
+_lock = threading.RLock()
+_buffers: Dict[str, dict] = {}
+_sinks: List[Callable] = []
+
+
+def log_dir(log_file: PathLike) -> Path:
+    p = Path(log_file)
+    return p.parent / p.stem
+
+
+def _month_of(entry: Dict) -> str:
+    try:
+        return datetime.fromtimestamp(float(entry.get('time'))).strftime('%Y-%m')
+    except Exception:
+        return datetime.now().strftime('%Y-%m')
+
+
+def _month_files(log_file: PathLike) -> List[Path]:
+    d = log_dir(log_file)
+    if not d.is_dir():
+        return []
+    return sorted(d.glob('????-??.jsonl'))
+
+
+def _write(log_file: PathLike, entries: List[Dict]):
+    """Append entries grouped by month: one write and one fsync per file."""
+    d = log_dir(log_file)
+    d.mkdir(parents=True, exist_ok=True)
+    by_month: Dict[str, List[str]] = {}
+    for e in entries:
+        by_month.setdefault(_month_of(e), []).append(json.dumps(e, ensure_ascii=False, default=str))
+    for month, lines in sorted(by_month.items()):
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        fd = os.open(str(d / f'{month}.jsonl'), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, data)
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+        finally:
+            os.close(fd)
+
+
+def add_sink(fn: Callable):
+    """Call ``fn(log_file, entries)`` after appended entries reach disk."""
+    if fn not in _sinks:
+        _sinks.append(fn)
+
+
+def _publish(log_file: PathLike, entries: List[Dict]):
+    _write(log_file, entries)
+    for fn in list(_sinks):
+        try:
+            fn(log_file, entries)
+        except Exception:
+            pass
+
+
+def migrate_legacy(log_file: PathLike) -> int:
+    """Move entries of a legacy JSON-list log into the monthly files. Returns
+    the number of entries migrated (0 when there was nothing to do)."""
+    legacy = Path(log_file)
+    with _lock:
+        if not legacy.is_file():
+            return 0
+        try:
+            data = json.loads(legacy.read_text(encoding='utf-8') or '[]')
+        except Exception:
+            # unreadable: leave it alone rather than losing history
+            return 0
+        entries = [e for e in data if isinstance(e, dict)] if isinstance(data, list) else []
+        if entries:
+            _write(legacy, entries)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        try:
+            if entries:
+                legacy.rename(legacy.with_name(f'{legacy.stem}.{stamp}.migrated.json'))
+            else:
+                legacy.unlink()
+        except Exception:
+            pass
+        return len(entries)
+
+
+def _ensure_migrated(log_file: PathLike):
+    if Path(log_file).is_file():
+        migrate_legacy(log_file)
+
+
+def append(log_file: PathLike, entries: Iterable[Dict]):
+    """Append entries (buffered when inside ``buffered(log_file)``)."""
+    entries = [e for e in entries if isinstance(e, dict)]
+    if not entries:
+        return
+    key = str(Path(log_file).resolve())
+    with _lock:
+        _ensure_migrated(log_file)
+        buf = _buffers.get(key)
+        if buf is None:
+            _publish(log_file, entries)
+            return
+        buf['entries'].extend(entries)
+        if len(buf['entries']) >= buf['flush_every'] or time.monotonic() - buf['flushed'] >= buf['flush_interval']:
+            _flush(log_file, buf)
+
+
+def _flush(log_file: PathLike, buf: dict):
+    pending, buf['entries'] = buf['entries'], []
+    buf['flushed'] = time.monotonic()
+    if pending:
+        _publish(log_file, pending)
+
+
+@contextmanager
+def buffered(log_file: PathLike, flush_every: int = 200, flush_interval: float = 2.0):
+    """Batch appends to ``log_file`` for the duration of the block (re-entrant
+    and shared by concurrent bulk sends to the same log)."""
+    key = str(Path(log_file).resolve())
+    with _lock:
+        buf = _buffers.get(key)
+        if buf is None:
+            buf = _buffers[key] = {'entries': [], 'depth': 0, 'flushed': time.monotonic(),
+                                   'flush_every': flush_every, 'flush_interval': flush_interval}
+        buf['depth'] += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _flush(log_file, buf)
+            buf['depth'] -= 1
+            if buf['depth'] <= 0:
+                _buffers.pop(key, None)
+
+
+def _iter_file(path: Path) -> Iterator[Dict]:
+    with open(path, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                e = json.loads(line)
+            except Exception:
+                continue
+            if isinstance(e, dict):
+                yield e
+
+
+def _reverse_lines(path: Path, block: int = 64 * 1024) -> Iterator[bytes]:
+    """Lines of a file from last to first, reading fixed-size blocks from the end."""
+    with open(path, 'rb') as fh:
+        fh.seek(0, os.SEEK_END)
+        pos = fh.tell()
+        rest = b''
+        while pos > 0:
+            step = min(block, pos)
+            pos -= step
+            fh.seek(pos)
+            chunk = fh.read(step) + rest
+            lines = chunk.split(b'\n')
+            rest = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if rest.strip():
+            yield rest
+
+
+def tail(log_file: PathLike, limit: int = 200) -> List[Dict]:
+    """The last ``limit`` entries, oldest first (like ``entries[-limit:]``)."""
+    _ensure_migrated(log_file)
+    out = deque()
+    if limit <= 0:
+        return []
+    for path in reversed(_month_files(log_file)):
+        for line in _reverse_lines(path):
+            try:
+                e = json.loads(line)
+            except Exception:
+                continue
+            if isinstance(e, dict):
+                out.appendleft(e)
+                if len(out) >= limit:
+                    return list(out)
+    return list(out)
+
+
+def iter_entries(log_file: PathLike, since: Optional[float] = None, migrate: bool = True) -> Iterator[Dict]:
+    """All entries in file order; with ``since`` (epoch seconds) only the month
+    files from that month on are read (callers still filter by ``time``)."""
+    if migrate:
+        _ensure_migrated(log_file)
+    first = datetime.fromtimestamp(since).strftime('%Y-%m') if since is not None else None
+    for path in _month_files(log_file):
+        if first is not None and path.stem < first:
+            continue
+        yield from _iter_file(path)
+
+
+def has_entries(log_file: PathLike) -> bool:
+    _ensure_migrated(log_file)
+    return any(p.stat().st_size > 0 for p in _month_files(log_file))
+
+
+def clear(log_file: PathLike) -> Optional[str]:
+    """Move the current log aside (``<dir>.<timestamp>.bak``) and start empty.
+    Returns the backup directory name, or None when there was nothing to clear."""
+    _ensure_migrated(log_file)
+    with _lock:
+        d = log_dir(log_file)
+        if not d.is_dir():
+            return None
+        bak = d.with_name(f"{d.name}.{datetime.now().strftime('%Y%m%d_%H%M%S')}.bak")
+        d.rename(bak)
+        d.mkdir(parents=True, exist_ok=True)
+        return bak.name
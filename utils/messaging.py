@@ -9,13 +9,27 @@ config dict with keys: api_url, username, password, sender, extra_params (dict).
 
 Real HTTP requests use `requests`. Phone formatting/normalization is done by the
 caller (pages/send_messages.py or pages/parent_contacts.py).
+
+Bulk sends go through ``utils.sms_dispatch``: a worker pool throttled by a
+per-provider token bucket, with optional progress callbacks.
+
+HTTP goes through one pooled ``requests.Session`` per provider (see
+``http_session``), so connections and TLS sessions are reused across sends.
 """
 import time
 import json
 import os
+import threading
 from pathlib import Path
 import requests
-from typing import List, Dict
+from requests.adapters import HTTPAdapter
+from typing import Callable, List, Dict, Optional, Tuple
+try:
+    from urllib3.util.retry import Retry
+except Exception:
+    Retry = None
+
+from . import message_log, sms_dispatch
 try:
     import certifi
     CA_BUNDLE = certifi.where()
@@ -23,17 +37,95 @@ except Exception:
     CA_BUNDLE = True
 
 from modules.storage import get_storage_dir
+try:
+    # keeps the indexed message history (and its counters) in step with the log
+    from modules import message_store  # noqa: F401
+except Exception:
+    message_store = None
 BASE = Path(get_storage_dir())
 BASE.mkdir(parents=True, exist_ok=True)
 # Keep per-account logs, but use a global messaging config so all accounts share the
 # same SMS provider credentials (so every school uses the same Africa's Talking account).
+# LOG_FILE is the legacy JSON log; entries now live in monthly JSONL files beside it
+# (see utils.message_log), and an old JSON log is migrated on first use.
 LOG_FILE = BASE / 'sent_messages_log.json'
 GLOBAL_CONFIG_FILE = BASE.parent / 'messaging_config.json'
 CONFIG_FILE = GLOBAL_CONFIG_FILE
 
+# ---------------------------------------------------------------------------
+# Pooled HTTP sessions
+#
+# One keep-alive session per provider and process, shared by every send and
+# every dispatcher thread. The pool holds as many connections as the
+# dispatcher has workers. Only connection failures (nothing reached the
+# provider) are retried here; anything later is left to the caller/outbox so a
+# message is never posted twice by the HTTP layer.
+#
+# Config keys (optional): timeout (read, seconds), connect_timeout,
+# http_retries, max_workers. Env defaults: SMS_HTTP_TIMEOUT=30,
+# SMS_HTTP_CONNECT_TIMEOUT=10, SMS_HTTP_RETRIES=2.
+# ---------------------------------------------------------------------------
+HTTP_TIMEOUT = float(os.environ.get('SMS_HTTP_TIMEOUT', '30'))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('SMS_HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_RETRIES = int(os.environ.get('SMS_HTTP_RETRIES', '2'))
+
+_sessions: Dict[Tuple, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _cfg_number(cfg: Optional[Dict], key: str, default, cast=float):
+    try:
+        v = (cfg or {}).get(key)
+        return default if v in (None, '') else cast(v)
+    except (TypeError, ValueError):
+        return default
+
+
+def http_timeout(cfg: Optional[Dict] = None) -> Tuple[float, float]:
+    """``(connect, read)`` timeout for provider requests."""
+    return (_cfg_number(cfg, 'connect_timeout', HTTP_CONNECT_TIMEOUT),
+            _cfg_number(cfg, 'timeout', HTTP_TIMEOUT))
+
+
+def http_session(provider: str, cfg: Optional[Dict] = None) -> requests.Session:
+    """Process-wide keep-alive session for ``provider``, its pool sized to the
+    dispatcher's worker count for ``cfg``."""
+    pool = max(4, sms_dispatch.limits_from_config(cfg)['max_workers'])
+    retries = max(0, _cfg_number(cfg, 'http_retries', HTTP_RETRIES, int))
+    key = ((provider or 'default').lower(), pool, retries)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            if Retry is not None:
+                # connect errors only: a request that reached the provider is never resent here
+                max_retries = Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                                    backoff_factor=0.3, allowed_methods=None, raise_on_status=False)
+            else:
+                max_retries = retries
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool, max_retries=max_retries)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.verify = CA_BUNDLE
+            _sessions[key] = session
+        return session
+
+
+def close_sessions():
+    """Close every pooled session (they are recreated on next use)."""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for s in sessions:
+        try:
+            s.close()
+        except Exception:
+            pass
+
+
 def ensure_log():
-    if not LOG_FILE.exists():
-        LOG_FILE.write_text('[]', encoding='utf-8')
+    message_log.log_dir(LOG_FILE).mkdir(parents=True, exist_ok=True)
+    message_log.migrate_legacy(LOG_FILE)
 
 def load_config():
     if not CONFIG_FILE.exists():
@@ -55,14 +147,29 @@ def load_config():
     except Exception:
         return {}
 
-def log_send(entry: Dict):
-    ensure_log()
-    try:
-        data = json.loads(LOG_FILE.read_text(encoding='utf-8'))
-    except Exception:
-        data = []
-    data.append(entry)
-    LOG_FILE.write_text(json.dumps(data, indent=2), encoding='utf-8')
+def log_send(entry: Dict, log_file: Optional[message_log.PathLike] = None):
+    """Append one entry to ``log_file`` (default LOG_FILE, this account's log)."""
+    message_log.append(log_file or LOG_FILE, [entry])
+
+
+def log_send_many(entries: List[Dict], log_file: Optional[message_log.PathLike] = None):
+    """Append several log entries in one write."""
+    message_log.append(log_file or LOG_FILE, entries)
+
+
+def _attach_contact(entry: Dict, contact: Dict, phone: str):
+    if isinstance(contact, dict):
+        try:
+            entry['contact'] = {
+                'student_name': contact.get('student_name') or contact.get('student'),
+                'parent_name': contact.get('parent_name') or contact.get('parent'),
+                'class': contact.get('class') or contact.get('grade') or contact.get('class_name'),
+                'phone': contact.get('phone') or contact.get('phone_raw') or phone,
+                'exam_id': contact.get('exam_id'),
+                'exam_name': contact.get('exam_name'),
+            }
+        except Exception:
+            pass
 
 
 def _is_html_response(text: str, headers: Dict = None) -> bool:
@@ -77,7 +184,31 @@ def _is_html_response(text: str, headers: Dict = None) -> bool:
     return False
 
 
-def send_single_africastalking(phone_e164: str, message: str, config: Dict = None, test_mode: bool = True, contact: Dict = None):
+def _post_africastalking(cfg: Dict, payload: Dict):
+    url = cfg.get('api_url') or 'https://api.africastalking.com/version1/messaging'
+    api_key = cfg.get('api_key') or cfg.get('password')
+    # Africa's Talking expects the header 'apiKey' and typically form-encoded body
+    headers = {'Accept': 'application/json'}
+    content_type = (cfg.get('content_type') or '').lower()
+    if content_type == 'application/x-www-form-urlencoded' or not content_type:
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        send_as_json = False
+    else:
+        headers['Content-Type'] = cfg.get('content_type')
+        send_as_json = (content_type == 'application/json')
+
+    if api_key:
+        headers['apiKey'] = api_key
+
+    session = http_session('africastalking', cfg)
+    if send_as_json:
+        return session.post(url, json=payload, headers=headers, timeout=http_timeout(cfg))
+    # form-encoded body
+    return session.post(url, data=payload, headers=headers, timeout=http_timeout(cfg))
+
+
+def send_single_africastalking(phone_e164: str, message: str, config: Dict = None, test_mode: bool = True, contact: Dict = None,
+                               log_file: Optional[message_log.PathLike] = None):
     """Send a single SMS via Africa's Talking REST API.
 
     Expects config to contain:
@@ -100,16 +231,7 @@ def send_single_africastalking(phone_e164: str, message: str, config: Dict = Non
         'status': 'TEST' if test_mode else 'SENT'
     }
     # include contact metadata if provided so audit logs are unambiguous
-    if isinstance(contact, dict):
-        try:
-            entry['contact'] = {
-                'student_name': contact.get('student_name') or contact.get('student'),
-                'parent_name': contact.get('parent_name') or contact.get('parent'),
-                'class': contact.get('class') or contact.get('grade') or contact.get('class_name'),
-                'phone': contact.get('phone') or contact.get('phone_raw') or phone_e164
-            }
-        except Exception:
-            pass
+    _attach_contact(entry, contact, phone_e164)
 
     payload = {
         'username': cfg.get('username', ''),
@@ -121,35 +243,16 @@ def send_single_africastalking(phone_e164: str, message: str, config: Dict = Non
 
     if test_mode:
         entry['response'] = {'ok': True, 'note': "test-mode, no network call made", 'payload': payload}
-        log_send(entry)
+        log_send(entry, log_file)
         return {'ok': True, 'test_mode': True, 'entry': entry}
 
-    url = cfg.get('api_url') or 'https://api.africastalking.com/version1/messaging'
-    api_key = cfg.get('api_key') or cfg.get('password')
-    # Africa's Talking expects the header 'apiKey' and typically form-encoded body
-    headers = {'Accept': 'application/json'}
-    content_type = (cfg.get('content_type') or '').lower()
-    if content_type == 'application/x-www-form-urlencoded' or not content_type:
-        headers['Content-Type'] = 'application/x-www-form-urlencoded'
-        send_as_json = False
-    else:
-        headers['Content-Type'] = cfg.get('content_type')
-        send_as_json = (content_type == 'application/json')
-
-    if api_key:
-        headers['apiKey'] = api_key
-
     try:
-        if send_as_json:
-            r = requests.post(url, json=payload, headers=headers, timeout=30, verify=CA_BUNDLE)
-        else:
-            # form-encoded body
-            r = requests.post(url, data=payload, headers=headers, timeout=30, verify=CA_BUNDLE)
+        r = _post_africastalking(cfg, payload)
         text = r.text
         if _is_html_response(text, r.headers):
             entry['response'] = {'status_code': r.status_code, 'text': text, 'error': 'HTML response received (likely wrong endpoint or missing auth)'}
             entry['ok'] = False
-            log_send(entry)
+            log_send(entry, log_file)
             return {'ok': False, 'status_code': r.status_code, 'text': text}
 
         # attempt to parse JSON
@@ -160,52 +263,159 @@ def send_single_africastalking(phone_e164: str, message: str, config: Dict = Non
 
         entry['response'] = {'status_code': r.status_code, 'json': resp_json}
         entry['ok'] = r.ok
-        log_send(entry)
+        log_send(entry, log_file)
         return {'ok': r.ok, 'status_code': r.status_code, 'json': resp_json}
     except Exception as e:
         entry['response'] = {'error': str(e)}
         entry['ok'] = False
-        log_send(entry)
+        log_send(entry, log_file)
         return {'ok': False, 'error': str(e)}
 
 
-def send_bulk_africastalking(contacts: List[Dict], message_template: str, config: Dict = None, test_mode: bool = True, delay_seconds: float = 0.2):
-    results = []
+def send_bulk_africastalking(contacts: List[Dict], message_template: str, config: Dict = None, test_mode: bool = True, delay_seconds: float = 0.2,
+                             on_progress: Optional[Callable] = None):
     cfg = config or load_config()
-    for c in contacts:
+    return _send_bulk_with('africastalking', contacts, message_template, cfg, test_mode, on_progress)
+
+
+def _provider_name(cfg: Dict) -> str:
+    provider = (cfg.get('provider') or 'mobitech').lower()
+    if provider in ('africastalking', 'at'):
+        return 'africastalking'
+    if provider == 'infobip':
+        return 'infobip'
+    # default to mobitech
+    return 'mobitech'
+
+
+def _single_sender(provider: str) -> Callable:
+    return {
+        'africastalking': send_single_africastalking,
+        'infobip': send_single_infobip,
+    }.get(provider, send_single_mobitech)
+
+
+def send_single(phone_e164: str, message: str, config: Dict = None, test_mode: bool = True, contact: Dict = None,
+                log_file: Optional[message_log.PathLike] = None):
+    cfg = config or load_config()
+    return _single_sender(_provider_name(cfg))(phone_e164, message, config=cfg, test_mode=test_mode, contact=contact,
+                                               log_file=log_file)
+
+
+def send_many(messages: List[Dict], config: Dict = None, test_mode: bool = True,
+              on_progress: Optional[Callable] = None, max_workers: Optional[int] = None,
+              log_file: Optional[message_log.PathLike] = None) -> List[Dict]:
+    """Send already-rendered messages concurrently through the configured provider.
+
+    messages: dicts with 'phone', 'message' and optionally 'contact'.
+    Returns [{'contact', 'result'}] in input order. ``on_progress(done, total,
+    item, result)`` is called on the calling thread as sends complete. Attempts
+    are logged to ``log_file`` (default LOG_FILE).
+    """
+    cfg = config or load_config()
+    results = _dispatch_jobs(messages, cfg, _provider_name(cfg), test_mode, on_progress, max_workers, log_file)
+    return [{'contact': m.get('contact') or {'phone': m.get('phone')}, 'result': r} for m, r in zip(messages, results)]
+
+
+def _send_bulk_with(provider: str, contacts: List[Dict], message_template: str, cfg: Dict,
+                    test_mode: bool, on_progress: Optional[Callable] = None) -> List[Dict]:
+    """Render ``message_template`` per contact and send through the dispatcher.
+    Contacts without a phone get an immediate 'no phone' result."""
+    results: List[Optional[Dict]] = [None] * len(contacts)
+    slots, jobs = [], []
+    for i, c in enumerate(contacts):
         phone = c.get('phone') or c.get('phone_e164') or c.get('phone_raw')
         if not phone:
-            results.append({'ok': False, 'error': 'no phone', 'contact': c})
+            results[i] = {'ok': False, 'error': 'no phone', 'contact': c}
             continue
         try:
             msg = message_template.format(**c)
         except Exception:
+            # fall back to raw message
             msg = message_template
-        res = send_single_africastalking(phone, msg, config=cfg, test_mode=test_mode, contact=c)
-        results.append({'contact': c, 'result': res})
-        if not test_mode:
-            time.sleep(delay_seconds)
+        slots.append(i)
+        jobs.append({'phone': phone, 'message': msg, 'contact': c})
+
+    sent = _dispatch_jobs(jobs, cfg, provider, test_mode, on_progress)
+    for i, job, res in zip(slots, jobs, sent):
+        results[i] = {'contact': job['contact'], 'result': res}
     return results
 
 
-def send_single(phone_e164: str, message: str, config: Dict = None, test_mode: bool = True):
-    cfg = config or load_config()
-    provider = (cfg.get('provider') or 'mobitech').lower()
-    if provider == 'africastalking' or provider == 'at':
-        return send_single_africastalking(phone_e164, message, config=cfg, test_mode=test_mode)
-    # default to mobitech
-    return send_single_mobitech(phone_e164, message, config=cfg, test_mode=test_mode)
+def _dispatch_jobs(jobs: List[Dict], cfg: Dict, provider: str, test_mode: bool,
+                   on_progress: Optional[Callable] = None, max_workers: Optional[int] = None,
+                   log_file: Optional[message_log.PathLike] = None) -> List[Dict]:
+    """Provider results for ``{'phone', 'message', 'contact'}`` jobs, in order.
+
+    Live sends to providers that accept many recipients per request are packed
+    into batches (see ``_plan_batches``); each batch is one dispatcher task.
+    Everything else goes out one request per job.
+    """
+    log_file = log_file or LOG_FILE
+    with message_log.buffered(log_file):
+        return _dispatch_logged(jobs, cfg, provider, test_mode, on_progress, max_workers, log_file)
 
 
-def send_bulk(contacts: List[Dict], message_template: str, config: Dict = None, test_mode: bool = True, delay_seconds: float = 0.2):
+def _dispatch_logged(jobs: List[Dict], cfg: Dict, provider: str, test_mode: bool,
+                     on_progress: Optional[Callable] = None, max_workers: Optional[int] = None,
+                     log_file: Optional[message_log.PathLike] = None) -> List[Dict]:
+    limits = sms_dispatch.limits_from_config(cfg)
+    if max_workers:
+        limits['max_workers'] = max_workers
+    batch_sender = _BATCH_SENDERS.get(provider)
+    if test_mode or batch_sender is None or cfg.get('batch_sends') is False or len(jobs) < 2:
+        sender = _single_sender(provider)
+
+        def _send(job):
+            return sender(job.get('phone'), job.get('message') or '', config=cfg, test_mode=test_mode, contact=job.get('contact'),
+                          log_file=log_file)
+
+        return sms_dispatch.dispatch(jobs, _send, provider=provider, on_progress=on_progress, **limits)
+
+    batches = _plan_batches(jobs, provider, cfg)
+    total, done = len(jobs), [0]
+
+    def _send_batch(idx):
+        try:
+            return batch_sender([jobs[i] for i in idx], config=cfg, log_file=log_file)
+        except Exception as e:
+            return [{'ok': False, 'error': str(e)} for _ in idx]
+
+    def _batch_progress(_done, _total, idx, batch_results):
+        # report per message so callers see the same progress as unbatched sends
+        if on_progress is None:
+            return
+        for i, res in zip(idx, batch_results):
+            done[0] += 1
+            on_progress(done[0], total, jobs[i], res)
+
+    results: List[Optional[Dict]] = [None] * total
+    sent = sms_dispatch.dispatch(batches, _send_batch, provider=provider, on_progress=_batch_progress, **limits)
+    for idx, batch_results in zip(batches, sent):
+        for i, res in zip(idx, batch_results):
+            results[i] = res
+    return results
+
+
+def send_bulk(contacts: List[Dict], message_template: str, config: Dict = None, test_mode: bool = True, delay_seconds: float = 0.2,
+              on_progress: Optional[Callable] = None):
     cfg = config or load_config()
-    provider = (cfg.get('provider') or 'mobitech').lower()
-    if provider == 'africastalking' or provider == 'at':
-        return send_bulk_africastalking(contacts, message_template, config=cfg, test_mode=test_mode, delay_seconds=delay_seconds)
-    return send_bulk_mobitech(contacts, message_template, config=cfg, test_mode=test_mode, delay_seconds=delay_seconds)
+    return _send_bulk_with(_provider_name(cfg), contacts, message_template, cfg, test_mode, on_progress)
+
+
+def _post_infobip(cfg: Dict, payload: Dict):
+    url = cfg.get('api_url') or 'https://api.infobip.com/sms/2/text/advanced'
+    api_key = cfg.get('api_key') or cfg.get('password')
+    headers = {
+        'Authorization': f'App {api_key}',
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+    return http_session('infobip', cfg).post(url, json=payload, headers=headers, timeout=http_timeout(cfg))
 
 
-def send_single_infobip(phone: str, message: str, config: Dict = None, test_mode: bool = True, contact: Dict = None):
+def send_single_infobip(phone: str, message: str, config: Dict = None, test_mode: bool = True, contact: Dict = None,
+                        log_file: Optional[message_log.PathLike] = None):
     """Send a single SMS via Infobip REST API (Authorization: App <key>)."""
     cfg = config or load_config()
     entry = {
@@ -217,16 +427,7 @@ def send_single_infobip(phone: str, message: str, config: Dict = None, test_mode
         'config_used': cfg.copy() if isinstance(cfg, dict) else cfg,
         'status': 'TEST' if test_mode else 'SENT'
     }
-    if isinstance(contact, dict):
-        try:
-            entry['contact'] = {
-                'student_name': contact.get('student_name') or contact.get('student'),
-                'parent_name': contact.get('parent_name') or contact.get('parent'),
-                'class': contact.get('class') or contact.get('grade') or contact.get('class_name'),
-                'phone': contact.get('phone') or contact.get('phone_raw') or phone
-            }
-        except Exception:
-            pass
+    _attach_contact(entry, contact, phone)
 
     payload = {
         "messages": [
@@ -240,52 +441,33 @@ def send_single_infobip(phone: str, message: str, config: Dict = None, test_mode
 
     if test_mode:
         entry['response'] = {'ok': True, 'note': 'test-mode, not sent', 'payload': payload}
-        log_send(entry)
+        log_send(entry, log_file)
         return {'ok': True, 'test_mode': True, 'entry': entry}
 
-    url = cfg.get('api_url') or 'https://api.infobip.com/sms/2/text/advanced'
-    api_key = cfg.get('api_key') or cfg.get('password')
-    headers = {
-        'Authorization': f'App {api_key}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
     try:
-        r = requests.post(url, json=payload, headers=headers, timeout=30, verify=CA_BUNDLE)
+        r = _post_infobip(cfg, payload)
         try:
             resp = r.json()
         except Exception:
             resp = {'text': r.text}
         entry['response'] = {'status_code': r.status_code, 'json': resp}
         entry['ok'] = r.ok
-        log_send(entry)
+        log_send(entry, log_file)
         return {'ok': r.ok, 'status_code': r.status_code, 'json': resp}
     except Exception as e:
         entry['response'] = {'error': str(e)}
         entry['ok'] = False
-        log_send(entry)
+        log_send(entry, log_file)
         return {'ok': False, 'error': str(e)}
 
 
-def send_bulk_infobip(contacts: List[Dict], message_template: str, config: Dict = None, test_mode: bool = True, delay_seconds: float = 0.2):
-    results = []
+def send_bulk_infobip(contacts: List[Dict], message_template: str, config: Dict = None, test_mode: bool = True, delay_seconds: float = 0.2,
+                      on_progress: Optional[Callable] = None):
     cfg = config or load_config()
-    for c in contacts:
-        phone = c.get('phone') or c.get('phone_e164') or c.get('phone_raw')
-        if not phone:
-            results.append({'ok': False, 'error': 'no phone', 'contact': c})
-            continue
-        try:
-            msg = message_template.format(**c)
-        except Exception:
-            msg = message_template
-        res = send_single_infobip(phone, msg, config=cfg, test_mode=test_mode, contact=c)
-        results.append({'contact': c, 'result': res})
-        if not test_mode:
-            time.sleep(delay_seconds)
-    return results
+    return _send_bulk_with('infobip', contacts, message_template, cfg, test_mode, on_progress)
 
-def send_single_mobitech(phone_e164: str, message: str, config: Dict = None, test_mode: bool = True, contact: Dict = None):
+def send_single_mobitech(phone_e164: str, message: str, config: Dict = None, test_mode: bool = True, contact: Dict = None,
+                         log_file: Optional[message_log.PathLike] = None):
     """Send a single SMS via Mobitech (configurable endpoint).
 
     phone_e164 must be normalized (e.g., +2547XXXXXXXX).
@@ -309,21 +491,12 @@ def send_single_mobitech(phone_e164: str, message: str, config: Dict = None, tes
         'config_used': cfg.copy() if isinstance(cfg, dict) else cfg,
         'status': 'TEST' if test_mode else 'SENT'
     }
-    if isinstance(contact, dict):
-        try:
-            entry['contact'] = {
-                'student_name': contact.get('student_name') or contact.get('student'),
-                'parent_name': contact.get('parent_name') or contact.get('parent'),
-                'class': contact.get('class') or contact.get('grade') or contact.get('class_name'),
-                'phone': contact.get('phone') or contact.get('phone_raw') or phone_e164
-            }
-        except Exception:
-            pass
+    _attach_contact(entry, contact, phone_e164)
 
     if test_mode:
         # Log and return a simulated response
         entry['response'] = {'ok': True, 'note': 'test-mode, no network call made', 'payload': payload}
-        log_send(entry)
+        log_send(entry, log_file)
         return {'ok': True, 'test_mode': True, 'entry': entry}
 
     # Perform real HTTP call
@@ -341,47 +514,214 @@ def send_single_mobitech(phone_e164: str, message: str, config: Dict = None, tes
     if cfg.get('username') and cfg.get('password'):
         auth = (cfg.get('username'), cfg.get('password'))
 
+    session = http_session('mobitech', cfg)
+    timeout = http_timeout(cfg)
     try:
         if method == 'POST':
             if headers.get('Content-Type') == 'application/json':
-                r = requests.post(url, json=payload, headers=headers, auth=auth, timeout=30, verify=CA_BUNDLE)
+                r = session.post(url, json=payload, headers=headers, auth=auth, timeout=timeout)
             else:
-                r = requests.post(url, data=payload, headers=headers, auth=auth, timeout=30, verify=CA_BUNDLE)
+                r = session.post(url, data=payload, headers=headers, auth=auth, timeout=timeout)
         else:
-            r = requests.get(url, params=payload, headers=headers, auth=auth, timeout=30, verify=CA_BUNDLE)
+            r = session.get(url, params=payload, headers=headers, auth=auth, timeout=timeout)
 
         entry['response'] = {'status_code': r.status_code, 'text': r.text}
         entry['ok'] = r.ok
-        log_send(entry)
+        log_send(entry, log_file)
         return {'ok': r.ok, 'status_code': r.status_code, 'text': r.text}
     except Exception as e:
         entry['response'] = {'error': str(e)}
         entry['ok'] = False
-        log_send(entry)
+        log_send(entry, log_file)
         return {'ok': False, 'error': str(e)}
 
-def send_bulk_mobitech(contacts: List[Dict], message_template: str, config: Dict = None, test_mode: bool = True, delay_seconds: float = 0.2):
+def send_bulk_mobitech(contacts: List[Dict], message_template: str, config: Dict = None, test_mode: bool = True, delay_seconds: float = 0.2,
+                       on_progress: Optional[Callable] = None):
     """Send messages to multiple contacts.
 
     contacts: list of dicts with at least 'phone' and optionally other fields.
     message_template: may contain placeholders like {student_name}.
     test_mode: if True, no network calls will be made.
-    Returns list of results for each contact.
+    Returns list of results for each contact, in input order. Sends run on the
+    dispatcher's worker pool, throttled per provider (``rate_limit_per_sec`` in
+    the config); ``delay_seconds`` is kept for compatibility and no longer used.
     """
-    results = []
     cfg = config or load_config()
-    for c in contacts:
-        phone = c.get('phone') or c.get('phone_e164') or c.get('phone_raw')
-        if not phone:
-            results.append({'ok': False, 'error': 'no phone', 'contact': c})
-            continue
+    return _send_bulk_with('mobitech', contacts, message_template, cfg, test_mode, on_progress)
+
+
+# ---------------------------------------------------------------------------
+# Batched sends
+#
+# Africa's Talking takes a comma-separated ``to`` list for one message text and
+# Infobip takes many messages/destinations per request, so live bulk sends are
+# packed into provider-sized batches (config ``batch_size``; ``batch_sends:
+# false`` turns this off). Every recipient still gets its own result, log entry
+# and ``SMSMessageData.Recipients`` / ``recipient`` status for render_send_results.
+# ---------------------------------------------------------------------------
+BATCH_SIZES = {'africastalking': 500, 'infobip': 500}
+
+
+def _plan_batches(jobs: List[Dict], provider: str, cfg: Dict) -> List[List[int]]:
+    """Job indices grouped into batches. Africa's Talking batches share one
+    message text; Infobip batches may mix texts (one message per text)."""
+    try:
+        size = max(1, int(cfg.get('batch_size') or BATCH_SIZES.get(provider, 100)))
+    except (TypeError, ValueError):
+        size = BATCH_SIZES.get(provider, 100)
+    if provider == 'africastalking':
+        groups: Dict[str, List[int]] = {}
+        for i, job in enumerate(jobs):
+            groups.setdefault(job.get('message') or '', []).append(i)
+        ordered = list(groups.values())
+    else:
+        ordered = [list(range(len(jobs)))]
+    return [idx[k:k + size] for idx in ordered for k in range(0, len(idx), size)]
+
+
+def _digits(phone) -> str:
+    return ''.join(ch for ch in str(phone or '') if ch.isdigit())
+
+
+def _match_recipients(jobs: List[Dict], records: List[Dict], number_of: Callable) -> List[Optional[Dict]]:
+    """Pair each job with the response record for its number (in order when a
+    number repeats); None when the provider did not report it."""
+    by_number: Dict[str, List[Dict]] = {}
+    for rec in records:
+        if isinstance(rec, dict):
+            by_number.setdefault(_digits(number_of(rec)), []).append(rec)
+    out = []
+    for job in jobs:
+        recs = by_number.get(_digits(job.get('phone')))
+        out.append(recs.pop(0) if recs else None)
+    return out
+
+
+def _log_batch(provider: str, cfg: Dict, jobs: List[Dict], results: List[Dict], batch_id: str,
+               log_file: Optional[message_log.PathLike] = None):
+    now = time.time()
+    entries = []
+    for job, res in zip(jobs, results):
+        entry = {
+            'phone': job.get('phone'),
+            'message': job.get('message'),
+            'time': now,
+            'provider': provider,
+            'config_used': cfg.copy() if isinstance(cfg, dict) else cfg,
+            'status': 'SENT',
+            'batch': {'id': batch_id, 'size': len(jobs)},
+        }
+        _attach_contact(entry, job.get('contact'), job.get('phone'))
+        if 'error' in res and 'json' not in res:
+            entry['response'] = {k: res[k] for k in ('status_code', 'text', 'error') if k in res}
+        else:
+            entry['response'] = {'status_code': res.get('status_code'), 'json': res.get('json'), 'recipient': res.get('recipient')}
+        entry['ok'] = res.get('ok', False)
+        entries.append(entry)
+    log_send_many(entries, log_file)
+
+
+def send_batch_africastalking(jobs: List[Dict], config: Dict = None,
+                              log_file: Optional[message_log.PathLike] = None) -> List[Dict]:
+    """Send one message text to many recipients in a single Africa's Talking request.
+
+    jobs: ``{'phone', 'message', 'contact'}`` dicts (the first job's message is
+    used for all). Returns one result per job shaped like send_single_africastalking's,
+    with ``json.SMSMessageData.Recipients`` narrowed to that recipient.
+    """
+    cfg = config or load_config()
+    batch_id = f"at-{time.time_ns()}"
+    payload = {
+        'username': cfg.get('username', ''),
+        'to': ','.join(str(j.get('phone')) for j in jobs),
+        'message': (jobs[0].get('message') or '') if jobs else ''
+    }
+    if cfg.get('sender'):
+        payload['from'] = cfg.get('sender')
+    try:
+        r = _post_africastalking(cfg, payload)
+        if _is_html_response(r.text, r.headers):
+            results = [{'ok': False, 'status_code': r.status_code, 'text': r.text,
+                        'error': 'HTML response received (likely wrong endpoint or missing auth)'} for _ in jobs]
+        else:
+            try:
+                resp_json = r.json()
+            except Exception:
+                resp_json = {'text': r.text}
+            sms = resp_json.get('SMSMessageData') if isinstance(resp_json, dict) else None
+            sms = sms if isinstance(sms, dict) else {}
+            matched = _match_recipients(jobs, sms.get('Recipients') or [], lambda rec: rec.get('number'))
+            results = []
+            for rec in matched:
+                res = {
+                    'ok': r.ok and rec is not None,
+                    'status_code': r.status_code,
+                    'json': {'SMSMessageData': {'Message': sms.get('Message'), 'Recipients': [rec] if rec else []}},
+                    'recipient': rec,
+                    'batch_size': len(jobs),
+                }
+                if rec is None and r.ok:
+                    res['error'] = 'recipient missing from batch response'
+                results.append(res)
+    except Exception as e:
+        results = [{'ok': False, 'error': str(e)} for _ in jobs]
+    _log_batch('africastalking', cfg, jobs, results, batch_id, log_file)
+    return results
+
+
+def send_batch_infobip(jobs: List[Dict], config: Dict = None,
+                       log_file: Optional[message_log.PathLike] = None) -> List[Dict]:
+    """Send many messages in a single Infobip request (one message entry per
+    distinct text, with all its destinations). Returns one result per job with
+    that destination's ``messages`` entry and a normalized ``recipient``."""
+    cfg = config or load_config()
+    batch_id = f"ib-{time.time_ns()}"
+    by_text: Dict[str, List[Dict]] = {}
+    for j in jobs:
+        by_text.setdefault(j.get('message') or '', []).append({'to': str(j.get('phone') or '').lstrip('+')})
+    payload = {
+        "messages": [
+            {"destinations": dests, "from": cfg.get('sender', ''), "text": text}
+            for text, dests in by_text.items()
+        ]
+    }
+    try:
+        r = _post_infobip(cfg, payload)
         try:
-            msg = message_template.format(**c)
+            resp = r.json()
         except Exception:
-            # fall back to raw message
-            msg = message_template
-        res = send_single_mobitech(phone, msg, config=cfg, test_mode=test_mode, contact=c)
-        results.append({'contact': c, 'result': res})
-        if not test_mode:
-            time.sleep(delay_seconds)
+            resp = {'text': r.text}
+        messages = resp.get('messages') if isinstance(resp, dict) else None
+        matched = _match_recipients(jobs, messages or [], lambda m: m.get('to') or m.get('destination'))
+        results = []
+        for job, m in zip(jobs, matched):
+            status = (m or {}).get('status') or {}
+            recipient = None
+            if m is not None:
+                recipient = {
+                    'number': job.get('phone'),
+                    'status': (status.get('name') or status.get('groupName')) if isinstance(status, dict) else status,
+                    'messageId': m.get('messageId'),
+                }
+            res = {
+                'ok': r.ok and m is not None,
+                'status_code': r.status_code,
+                'json': {'bulkId': resp.get('bulkId') if isinstance(resp, dict) else None, 'messages': [m] if m else []},
+                'recipient': recipient,
+                'batch_size': len(jobs),
+            }
+            if m is None:
+                res['json'] = resp if not r.ok else res['json']
+                if r.ok:
+                    res['error'] = 'recipient missing from batch response'
+            results.append(res)
+    except Exception as e:
+        results = [{'ok': False, 'error': str(e)} for _ in jobs]
+    _log_batch('infobip', cfg, jobs, results, batch_id, log_file)
     return results
+
+
+_BATCH_SENDERS = {
+    'africastalking': send_batch_africastalking,
+    'infobip': send_batch_infobip,
+}
@@ -0,0 +1,130 @@
+"""Images for PDF generation, decoded once per run and shared by every page.
+
+ReportLab already stores an image drawn twice in one document as a single
+XObject, but every ``Image`` flowable and ``drawImage`` call still opens the
+file, and a 2000px logo is embedded at full size even though it prints at
+0.7 inch. ``ImageAssets`` keeps one ``ImageReader`` per image (keyed by path,
+size and mtime, or by content for bytes), downscaled to the largest box it is
+drawn in at ``dpi`` (PDF_IMAGE_DPI, default 200; faint full-page watermarks
+use WATERMARK_DPI, PDF_WATERMARK_DPI, default 100):
+
+  - images with transparency stay RGBA (embedded losslessly with a soft mask);
+  - JPEGs that need no downscaling are passed through untouched, others are
+    re-encoded as JPEG (quality PDF_IMAGE_JPEG_QUALITY, default 90);
+  - other opaque images (line-art logos) are embedded losslessly.
+
+Without Pillow the file is handed to ReportLab as-is. Unreadable or missing
+images come back as None, so callers keep their placeholders.
+"""
+import os
+import hashlib
+import threading
+from io import BytesIO
+
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import Image
+
+try:
+    from PIL import Image as PILImage
+    _PIL_AVAILABLE = True
+except Exception:
+    PILImage = None
+    _PIL_AVAILABLE = False
+
+PRINT_DPI = int(os.environ.get('PDF_IMAGE_DPI', '200') or 200)
+WATERMARK_DPI = int(os.environ.get('PDF_WATERMARK_DPI', '100') or 100)
+JPEG_QUALITY = int(os.environ.get('PDF_IMAGE_JPEG_QUALITY', '90') or 90)
+
+
+def _max_pixels(width, height, dpi):
+    side = max(float(width or 0), float(height or 0))
+    if side <= 0 or not dpi:
+        return None
+    return max(1, int(round(side / 72.0 * dpi)))
+
+
+def _has_alpha(im):
+    return im.mode in ('RGBA', 'LA', 'PA') or (im.mode == 'P' and 'transparency' in im.info)
+
+
+def _decode(data, max_px):
+    """ImageReader for image bytes, downscaled so the longest side is at most ``max_px``."""
+    if not _PIL_AVAILABLE:
+        return ImageReader(BytesIO(data))
+    with PILImage.open(BytesIO(data)) as im:
+        fmt = im.format
+        im.load()
+        small = bool(max_px) and max(im.size) > max_px
+        if fmt == 'JPEG' and not small and im.mode in ('RGB', 'L', 'CMYK'):
+            return ImageReader(BytesIO(data))
+        if _has_alpha(im):
+            im = im.convert('RGBA')
+        elif im.mode not in ('RGB', 'L'):
+            im = im.convert('RGB')
+        if small:
+            im.thumbnail((max_px, max_px), PILImage.LANCZOS)
+        if fmt == 'JPEG' and im.mode in ('RGB', 'L'):
+            out = BytesIO()
+            im.save(out, format='JPEG', quality=JPEG_QUALITY)
+            return ImageReader(BytesIO(out.getvalue()))
+        return ImageReader(im.copy())
+
+
+class ImageAssets:
+    """Per-run cache of decoded images. Create one per generation run (or per
+    worker) and pass it to everything that draws images in that run."""
+
+    def __init__(self, dpi=None):
+        self.dpi = PRINT_DPI if dpi is None else dpi
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, load, max_px):
+        key = key + (max_px,)
+        with self._lock:
+            if key in self._images:
+                return self._images[key]
+        try:
+            data = load()
+            reader = _decode(data, max_px) if data else None
+        except Exception:
+            reader = None
+        with self._lock:
+            self._images[key] = reader
+        return reader
+
+    def image(self, source, width=None, height=None, dpi=None):
+        """ImageReader for ``source`` (a path or image bytes) sized for a box of
+        ``width`` x ``height`` points at ``dpi`` (default: the cache's), or None
+        when it cannot be read."""
+        if not source:
+            return None
+        max_px = _max_pixels(width, height, dpi or self.dpi)
+        if isinstance(source, (bytes, bytearray)):
+            data = bytes(source)
+            return self._get(('bytes', hashlib.sha1(data).hexdigest()), lambda: data, max_px)
+        path = str(source)
+        try:
+            st_ = os.stat(path)
+        except Exception:
+            return None
+
+        def _read():
+            with open(path, 'rb') as fh:
+                return fh.read()
+        return self._get(('path', path, st_.st_size, st_.st_mtime_ns), _read, max_px)
+
+    def photo(self, name=None, adm_no=None, width=None, height=None):
+        """ImageReader for a student's saved photo (utils.student_photos), read
+        straight from storage without a temp file."""
+        from utils import student_photos
+        sid = student_photos._normalize_id(name, adm_no)
+        max_px = _max_pixels(width, height, self.dpi)
+        return self._get(('photo', sid), lambda: student_photos.get_photo_bytes_by_id(sid), max_px)
+
+    def flowable(self, source, width, height):
+        """Platypus ``Image`` drawing ``source`` in a ``width`` x ``height`` box, or None."""
+        reader = source if isinstance(source, ImageReader) else self.image(source, width, height)
+        if reader is None:
+            return None
+        return Image(reader, width=width, height=height)
@@ -1,7 +1,10 @@
 from reportlab.lib.pagesizes import landscape, A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.units import inch, mm
 from reportlab.lib import colors
+import pandas as pd
 import datetime
 import os
 from io import BytesIO
@@ -409,3 +412,444 @@ def generate_teacher_table_bytes(df, title='Teacher Ranking'):
     doc.build(elems)
     buf.seek(0)
     return buf.read()
+
+
+def generate_pdf_stream_table(exam_name, subj_list, streams, table_data, most_improved_info=None, include_subjects=None, stream_total_means=None, most_improved_table=None,
+                              exam_year=None, exam_kind=''):
+    """Generate a PDF containing a subject × stream mean table, with Average and Rank rows at the bottom.
+    include_subjects: list of subject names to include (defaults to subj_list)
+    exam_year / exam_kind: shown in the title when given
+    """
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=0.4*inch, rightMargin=0.4*inch, topMargin=0.6*inch, bottomMargin=0.4*inch)
+    story = []
+    # (Title rendering is handled below after metadata enrichment.)
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle('title', parent=styles['Heading1'], alignment=1, fontSize=14)
+    # Enrich title with metadata if available
+    title_text = f"Subject-wise Stream Comparison — {exam_name}"
+    if exam_year is not None:
+        title_text += f" — Year: {exam_year}"
+    if exam_kind:
+        title_text += f" — Kind: {exam_kind}"
+    try:
+        story.append(Paragraph(title_text, title_style))
+        story.append(Spacer(1, 0.12*inch))
+    except Exception:
+        pass
+
+    if include_subjects is None:
+        include_subjects = list(subj_list)
+
+    # Build rows and compute per-stream averages and per-subject averages/ranks
+    # Build header, initialize stream accumulators, then collect subject averages and prepared row cells for each subject
+    header = ['Subject'] + list(streams) + ['Average', 'Rank']
+    rows = [header]
+    stream_sums = {s: 0.0 for s in streams}
+    stream_counts = {s: 0 for s in streams}
+
+    # Collect subject averages and prepared row cells for each subject
+    subj_avgs = {}
+    subject_rows = {}
+    for subj in include_subjects:
+        cells = [subj]
+        vals_for_avg = []
+        for s in streams:
+            val = table_data.get((subj, s), None)
+            if val is None:
+                cells.append('-')
+            else:
+                try:
+                    fv = float(val)
+                    cells.append(f"{fv:.2f}")
+                    vals_for_avg.append(fv)
+                    stream_sums[s] += fv
+                    stream_counts[s] += 1
+                except Exception:
+                    cells.append('-')
+        if vals_for_avg:
+            avg = sum(vals_for_avg) / len(vals_for_avg)
+            subj_avgs[subj] = avg
+            cells.append(f"{avg:.2f}")
+        else:
+            subj_avgs[subj] = None
+            cells.append('-')
+        # placeholder for rank - we'll replace after ranking
+        cells.append('-')
+        subject_rows[subj] = cells
+
+    # Compute dense ranks for subjects (highest average -> rank 1)
+    try:
+        valid_avgs = [v for v in subj_avgs.values() if v is not None]
+        if valid_avgs:
+            unique_sorted = sorted(list({round(x,8) for x in valid_avgs}), reverse=True)
+            subj_ranks = {}
+            for subj, v in subj_avgs.items():
+                if v is None:
+                    subj_ranks[subj] = '-'
+                else:
+                    try:
+                        r = unique_sorted.index(round(v,8)) + 1
+                    except Exception:
+                        r = 1
+                    # store numeric rank (int) so we can format consistently later
+                    subj_ranks[subj] = r
+        else:
+            subj_ranks = {s: '-' for s in subj_avgs.keys()}
+    except Exception:
+        subj_ranks = {s: '-' for s in subj_avgs.keys()}
+
+    # Order subjects by average (highest first), placing subjects with no average at the end
+    try:
+        def sort_key(s):
+            v = subj_avgs.get(s)
+            return (v is None, -v if v is not None else 0)
+        ordered_subjects = sorted(include_subjects, key=sort_key)
+    except Exception:
+        ordered_subjects = list(include_subjects)
+
+    # Append ordered subject rows, filling ranks
+    for subj in ordered_subjects:
+        row = subject_rows.get(subj, [subj] + ['-'] * (len(streams) + 2))
+        rnk = subj_ranks.get(subj, '-')
+        # Format numeric ranks with 0 decimals (integers), leave '-' as-is
+        if isinstance(rnk, (int, float)):
+            try:
+                row[-1] = f"{float(rnk):.0f}"
+            except Exception:
+                row[-1] = str(rnk)
+        else:
+            row[-1] = rnk
+        rows.append(row)
+
+    # Average row: use provided stream_total_means (mean of student Total per stream) if available,
+    # otherwise fall back to mean of included subject means.
+    avg_row = ['Average']
+    stream_avg_values = {}
+    if stream_total_means:
+        for s in streams:
+            v = stream_total_means.get(s)
+            if v is None:
+                avg_row.append('-')
+                stream_avg_values[s] = None
+            else:
+                avg_row.append(f"{float(v):.2f}")
+                stream_avg_values[s] = float(v)
+    else:
+        for s in streams:
+            cnt = stream_counts.get(s, 0)
+            if cnt > 0:
+                avg = stream_sums[s] / cnt
+                avg_row.append(f"{avg:.2f}")
+                stream_avg_values[s] = avg
+            else:
+                avg_row.append('-')
+                stream_avg_values[s] = None
+    # For the Average row, leave the final two columns empty (they refer to per-subject Average/Rank)
+    avg_row.append('-')
+    avg_row.append('-')
+    rows.append(avg_row)
+
+    # Rank row based on descending average (1 = best) for streams
+    sorted_avgs = sorted([v for v in stream_avg_values.values() if v is not None], reverse=True)
+    rank_row = ['Rank']
+    for s in streams:
+        v = stream_avg_values.get(s)
+        if v is None:
+            rank_row.append('-')
+        else:
+            try:
+                rank = sorted_avgs.index(v) + 1
+            except Exception:
+                rank = 1
+            # format stream rank with 0 decimals
+            try:
+                rank_row.append(f"{float(rank):.0f}")
+            except Exception:
+                rank_row.append(str(rank))
+    # leave last two columns blank for the streams' rank row
+    rank_row.append('-')
+    rank_row.append('-')
+    rows.append(rank_row)
+
+    # Build table
+    col_widths = [2.5*inch] + [((A4[0] - 0.8*inch) - 2.5*inch) / max(1, len(streams) + 2)] * (len(streams) + 2)
+    t = Table(rows, colWidths=col_widths, hAlign='LEFT')
+    tbl_style = TableStyle([
+        ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0E6BA8')),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ])
+    t.setStyle(tbl_style)
+    story.append(t)
+    story.append(Spacer(1, 0.2*inch))
+
+    if most_improved_info:
+        story.append(Paragraph('Most Improved Student (comparison):', styles['Heading3']))
+        mi_text = f"{most_improved_info.get('Name','N/A')} — Adm: {most_improved_info.get('Adm','N/A')} — Improvement: {most_improved_info.get('Improvement',0):.2f}"
+        story.append(Paragraph(mi_text, styles['Normal']))
+
+    # If a Most Improved table (top-N) is provided, render it as a simple table in the PDF
+    if most_improved_table is not None:
+        try:
+            story.append(Spacer(1, 0.12*inch))
+            story.append(Paragraph('Most Improved — Top Students', styles['Heading3']))
+            # most_improved_table may be a pandas DataFrame or list of dicts
+            if hasattr(most_improved_table, 'columns'):
+                mi_df = most_improved_table.copy()
+            else:
+                import pandas as _pd
+                mi_df = _pd.DataFrame(most_improved_table)
+
+            # Convert DataFrame to rows
+            mi_header = list(mi_df.columns)
+            mi_rows = [mi_header]
+            for _, r in mi_df.iterrows():
+                row = []
+                # detect if this is the special Rank row by checking the first column value
+                first_val = r.get(mi_header[0], '')
+                is_rank_row = isinstance(first_val, str) and first_val.strip().lower() == 'rank'
+                for c in mi_header:
+                    v = r.get(c, '')
+                    # treat missing values
+                    try:
+                        if pd.isna(v):
+                            row.append('-')
+                            continue
+                    except Exception:
+                        pass
+                    # For the Rank row, render numeric cells as integers (no decimals).
+                    try:
+                        fv = float(v)
+                        if is_rank_row:
+                            try:
+                                row.append(str(int(fv)))
+                            except Exception:
+                                row.append(str(fv))
+                        else:
+                            row.append(f"{fv:.2f}")
+                    except Exception:
+                        row.append(str(v) if v is not None else '')
+                mi_rows.append(row)
+
+            # Add table with a lighter grid
+            mi_col_widths = [((A4[0] - 0.8*inch) / max(1, len(mi_header))) ] * len(mi_header)
+            mi_table = Table(mi_rows, colWidths=mi_col_widths, hAlign='LEFT')
+            mi_style = TableStyle([
+                ('GRID', (0,0), (-1,-1), 0.3, colors.grey),
+                ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0E6BA8')),
+                ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+                ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+            ])
+            mi_table.setStyle(mi_style)
+            story.append(mi_table)
+        except Exception:
+            pass
+
+    # Footer drawer: company name and copyright (EDUSCORE ANALYTICS)
+    def _draw_footer_stream(canvas, doc_):
+        try:
+            canvas.saveState()
+            company = 'EDUSCORE ANALYTICS'
+            year_now = datetime.datetime.now().year
+            canvas.setFont('Helvetica', 8)
+            canvas.setFillColor(colors.grey)
+            canvas.drawCentredString(A4[0] / 2.0, 0.35 * inch, company)
+            canvas.setFont('Helvetica', 7)
+            canvas.drawCentredString(A4[0] / 2.0, 0.18 * inch, f"\u00A9 {year_now} {company}. All rights reserved.")
+            canvas.restoreState()
+        except Exception:
+            pass
+
+    try:
+        doc.build(story, onFirstPage=_draw_footer_stream, onLaterPages=_draw_footer_stream)
+    except Exception:
+        try:
+            doc.build(story)
+        except Exception:
+            pass
+    buf.seek(0)
+    return buf
+
+
+def generate_student_history_pdf(student_name, adm_no, records, orientation='landscape', 
+                                include_columns=None, chart_type='none', chart_image=None):
+    """Generate PDF report of student's exam history with customization options
+    
+    Args:
+        student_name: Student's full name
+        adm_no: Admission number
+        records: List of exam records (class_name already in display form)
+        orientation: 'portrait' or 'landscape'
+        include_columns: List of columns to include (e.g., ['Total', 'Mean', 'Points', 'Rank'])
+        chart_type: 'bar', 'line', or 'none'
+        chart_image: BytesIO object containing chart image (if chart_type != 'none')
+    """
+    buffer = BytesIO()
+    
+    # Set page size based on orientation
+    pagesize = landscape(A4) if orientation == 'landscape' else A4
+    
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=pagesize,
+        leftMargin=0.5*inch,
+        rightMargin=0.5*inch,
+        topMargin=0.5*inch,
+        bottomMargin=0.5*inch
+    )
+    
+    elements = []
+    styles = getSampleStyleSheet()
+    
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        textColor=colors.HexColor('#0E6BA8'),
+        spaceAfter=12,
+        alignment=TA_CENTER,
+        fontName='Helvetica-Bold'
+    )
+    
+    elements.append(Paragraph("STUDENT EXAM HISTORY", title_style))
+    elements.append(Paragraph(f"Name: {student_name} | Admission No: {adm_no}", styles['Normal']))
+    elements.append(Spacer(1, 0.2*inch))
+    
+    # Default columns if none specified
+    if include_columns is None:
+        include_columns = ['Total', 'Mean', 'Points', 'S/Rank', 'Rank']
+    
+    # Build table headers dynamically
+    table_headers = ['Exam Name', 'Year', 'Class']
+    column_map = {
+        'Total': 'Total Marks',
+        'Mean': 'Mean %',
+        'Points': 'Points',
+        'S/Rank': 'Class Rank',
+        'Rank': 'Overall Rank'
+    }
+    
+    for col in include_columns:
+        if col in column_map:
+            table_headers.append(column_map[col])
+    
+    table_data = [table_headers]
+    
+    # Build table rows
+    for rec in sorted(records, key=lambda x: (x.get('year', 0), x.get('date', '')), reverse=True):
+        student_row = rec['student_data']
+        
+        # Basic columns
+        row = [
+            str(rec.get('exam_name', 'N/A')),
+            str(rec.get('year', 'N/A')),
+            str(rec.get('class_name', 'N/A'))
+        ]
+        
+        # Add selected columns
+        for col in include_columns:
+            if col == 'Points':
+                val = student_row.get('Points')
+                row.append(str(val) if pd.notna(val) and str(val).strip() else 'N/A')
+            else:
+                row.append(str(student_row.get(col, 'N/A')))
+        
+        table_data.append(row)
+    
+    # Calculate column widths dynamically
+    num_cols = len(table_headers)
+    available_width = (pagesize[0] - 1*inch) if orientation == 'landscape' else (pagesize[0] - 1*inch)
+    
+    # Allocate widths: Exam Name gets more space
+    exam_name_width = 2.5*inch if num_cols <= 6 else 2*inch
+    remaining_width = available_width - exam_name_width
+    other_col_width = remaining_width / (num_cols - 1)
+    
+    col_widths = [exam_name_width] + [other_col_width] * (num_cols - 1)
+    
+    # Create table
+    table = Table(table_data, colWidths=col_widths)
+    
+    # Style table
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0E6BA8')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 9),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+        ('TOPPADDING', (0, 0), (-1, 0), 8),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')]),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]))
+    
+    elements.append(table)
+    elements.append(Spacer(1, 0.3*inch))
+    
+    # Add chart if provided
+    if chart_type != 'none' and chart_image is not None:
+        from reportlab.platypus import Image as RLImage
+        try:
+            chart_image.seek(0)
+            img = RLImage(chart_image, width=6*inch, height=3.5*inch)
+            elements.append(Spacer(1, 0.2*inch))
+            elements.append(Paragraph(f"Performance Chart ({chart_type.capitalize()})", styles['Heading2']))
+            elements.append(Spacer(1, 0.1*inch))
+            elements.append(img)
+        except Exception as e:
+            elements.append(Paragraph(f"Chart could not be embedded: {str(e)}", styles['Normal']))
+    
+    # Footer
+    footer_text = f"Generated on {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')} | EDUSCORE ANALYTICS"
+    elements.append(Paragraph(footer_text, styles['Normal']))
+    
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer
+
+
+def generate_class_marksheet_pdf(df, title='Class marksheet'):
+    """One table with every column of ``df`` (header repeated per page); returns PDF bytes."""
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=10*mm, rightMargin=10*mm, topMargin=10*mm, bottomMargin=10*mm)
+    styles = getSampleStyleSheet()
+    elems = []
+    elems.append(Paragraph(title, styles['Heading2']))
+    elems.append(Spacer(1, 6))
+    # prepare table data (header + rows)
+    header = [str(c) for c in df.columns]
+    data = [header]
+    # convert rows to strings, limit columns to a reasonable width
+    for _, r in df.iterrows():
+        row = []
+        for c in df.columns:
+            v = r.get(c, '')
+            s = '' if pd.isna(v) else str(v)
+            # truncate very long cells
+            if len(s) > 120:
+                s = s[:117] + '...'
+            row.append(s)
+        data.append(row)
+    table = Table(data, repeatRows=1)
+    table_style = TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0E6BA8')),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+        ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0,0), (-1,-1), 8),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+    ])
+    table.setStyle(table_style)
+    elems.append(table)
+    doc.build(elems)
+    return buf.getvalue()
+
+# Parent login form
+# Persist parent login in session_state so the portal stays open across form submits
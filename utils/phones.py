@@ -0,0 +1,130 @@
+"""Phone-number normalization shared by the contacts, messaging and portal pages.
+
+``normalize_number`` turns whatever was typed or imported into E.164
+(``+2547XXXXXXXX``). Results are memoized per (value, country). Most inputs
+never reach ``phonenumbers``:
+
+  - numbers already in E.164 for a Kenyan mobile range are returned as-is;
+  - Kenyan mobile numbers in the usual local shapes (``07XX XXX XXX``,
+    ``7XXXXXXXX``, ``2547XXXXXXXX``, ``+254 7XX-XXX-XXX`` ...) are rewritten by
+    a regular expression;
+  - anything else is parsed with ``phonenumbers`` when it is installed, then
+    falls back to the old digit heuristics.
+
+``normalize_phones`` does the same for a whole column (each distinct value is
+normalized once). ``ensure_contacts`` stores the normalized ``phone`` and its
+matching ``phone_key`` (last nine digits) on contact dicts so later lookups
+read them instead of re-parsing.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Union
+
+import pandas as pd
+
+try:
+    import phonenumbers
+    HAS_PHONENUMBERS = True
+except Exception:
+    phonenumbers = None
+    HAS_PHONENUMBERS = False
+
+# Kenyan mobile ranges (as in libphonenumber's KE metadata): 7XX and 10X-13X
+_KE_MOBILE = r"(?:7\d{8}|1(?:0[0-8]|1[0-7]|2[014]|30)\d{6})"
+_KE_E164 = re.compile(r"\+254" + _KE_MOBILE)
+_KE_LOCAL = re.compile(r"(?:\+?254|0)?(" + _KE_MOBILE + r")")
+_SEPARATORS = re.compile(r"[\s\-().]")
+_NON_DIGITS = re.compile(r"\D")
+
+CACHE_SIZE = 100_000
+
+
+def digits(raw) -> str:
+    """Only the digits of ``raw`` ('' for None)."""
+    return _NON_DIGITS.sub('', str(raw)) if raw is not None else ''
+
+
+def phone_key(raw) -> str:
+    """Last nine digits: the subscriber part used to match numbers written in
+    different formats."""
+    return digits(raw)[-9:] if raw else ''
+
+
+def _heuristic(s: str) -> str:
+    # digits only, assume KE local numbers if starting with 0
+    d = digits(s)
+    if not d:
+        return ''
+    if d.startswith('0'):
+        return '+254' + d.lstrip('0')
+    if d.startswith('254'):
+        return '+' + d
+    if d.startswith('7') and len(d) in (9, 10):
+        # common mobile start in KE without leading zero
+        return '+254' + d[-9:]
+    # last resort, return digits as-is
+    return d
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _normalize(s: str, default_country: str) -> str:
+    if default_country == 'KE' or s.startswith('+254'):
+        if _KE_E164.fullmatch(s):
+            return s
+        m = _KE_LOCAL.fullmatch(_SEPARATORS.sub('', s))
+        if m and (default_country == 'KE' or s.startswith('+')):
+            return '+254' + m.group(1)
+    if phonenumbers is not None:
+        try:
+            pn = phonenumbers.parse(s, None if s.startswith('+') else default_country)
+            if phonenumbers.is_valid_number(pn):
+                return phonenumbers.format_number(pn, phonenumbers.PhoneNumberFormat.E164)
+        except Exception:
+            pass
+    return _heuristic(s)
+
+
+def normalize_number(raw, default_country: str = 'KE') -> str:
+    """E.164 form of ``raw`` ('' when it has no digits)."""
+    if raw is None:
+        return ''
+    try:
+        if pd.isna(raw):
+            return ''
+    except (TypeError, ValueError):
+        pass
+    s = str(raw).strip()
+    if not s:
+        return ''
+    return _normalize(s, default_country or 'KE')
+
+
+def normalize_phones(values: Union[pd.Series, Iterable], default_country: str = 'KE') -> Union[pd.Series, List[str]]:
+    """``normalize_number`` over a column; returns a Series for a Series input,
+    else a list. Each distinct value is normalized once."""
+    series = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    uniques = pd.unique(series.to_numpy(dtype=object))
+    mapping = {v: normalize_number(v, default_country) for v in uniques}
+    out = series.map(lambda v: mapping.get(v, '') if v == v else '').astype(object)
+    return out if isinstance(values, pd.Series) else out.tolist()
+
+
+def ensure_contacts(contacts: List[Dict], default_country: str = 'KE') -> bool:
+    """Fill in ``phone`` (from ``phone_raw`` when missing) and ``phone_key`` on
+    each contact dict in place. Returns True when anything changed, so the
+    caller can persist the list once."""
+    changed = False
+    for c in contacts:
+        if not isinstance(c, dict):
+            continue
+        phone = c.get('phone') or ''
+        if not phone and c.get('phone_raw'):
+            phone = normalize_number(c.get('phone_raw'), default_country)
+            if phone:
+                c['phone'] = phone
+                changed = True
+        key = phone_key(phone or c.get('phone_raw'))
+        if c.get('phone_key') != key:
+            c['phone_key'] = key
+            changed = True
+    return changed
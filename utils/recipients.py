@@ -0,0 +1,291 @@
+"""Recipient preparation for the Send Messages page.
+
+Turns saved exam frames plus the parent contacts into per-student result
+messages. Everything is column-wise: one merge per exam joins contacts on a
+normalized admission number (when both sides have one) or student name, ranks
+come from ``rank``/``groupby().rank()``, and the message text is rendered for
+all rows at once, so preparing a few thousand recipients takes milliseconds
+instead of a ``iterrows``/``apply`` pass per row.
+
+The functions are pure (no Streamlit); pages/send_messages.py loads the frames
+and stores the results in session state.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+NAME_COLUMNS = ['student_name', 'name', 'Name', 'student', 'Student', 'student full name', 'Student Name']
+MATCH_COLUMNS = ['student_id', 'student', 'adm', 'adm_no', 'Admission', 'admno']
+SCORE_COLUMNS = ['TOTALS', 'TOTAL', 'Total', 'total', 'Score', 'score', 'Total Marks', 'Marks', 'Total_Marks']
+CLASS_COLUMNS = ['Class', 'class', 'class_name', 'className', 'Grade', 'GRADE']
+# exam columns that hold an admission number (joined to the contact's student_id)
+ADM_COLUMNS = ['student_id', 'adm', 'adm_no', 'AdmNo', 'Adm No', 'ADM NO', 'Admission', 'admno', 'Adm', 'ADM']
+PARENT_COLUMNS = ('parent_name', 'Parent', 'parent')
+
+_BLANK = ('', 'nan', 'none')
+
+
+def pick_column(cols: Sequence, candidates: Sequence, fallback: bool = True):
+    """First of ``candidates`` present in ``cols`` (else the first column)."""
+    for c in candidates:
+        if c in cols:
+            return c
+    return cols[0] if (cols and fallback) else None
+
+
+def _text(values: pd.Series) -> pd.Series:
+    """``str(v)`` per value (missing values become 'nan'/'None', as in the row loops)."""
+    return values.map(str).astype(object)
+
+
+def normalize_names(values: pd.Series) -> pd.Series:
+    return values.astype(str).str.lower().str.replace(r"\s+", ' ', regex=True).str.strip()
+
+
+def normalize_adm(values: pd.Series) -> pd.Series:
+    """Admission numbers as comparable strings ('' when missing); '1234.0' from
+    a float column becomes '1234'."""
+    s = _text(values).str.strip().str.lower().str.replace(r"\s+", '', regex=True)
+    s = s.str.replace(r"^(\d+)\.0+$", r"\1", regex=True)
+    return s.where(~s.isin(_BLANK) & values.notna(), '')
+
+
+def _present(values: pd.Series) -> pd.Series:
+    """True where a value is set (not NaN/None and not '', 'nan', 'none')."""
+    return values.notna() & ~_text(values).str.strip().str.lower().isin(_BLANK)
+
+
+def subject_columns(exdf: pd.DataFrame, exclude) -> List:
+    """Numeric mark columns, skipping the key columns and rank/position columns."""
+    out = []
+    for c in exdf.columns:
+        if c in exclude:
+            continue
+        try:
+            lc = str(c).lower()
+            if 'rank' in lc or 'position' in lc or lc.strip() in ('s/rank', 's_rank', 's rank'):
+                continue
+        except Exception:
+            pass
+        try:
+            if pd.to_numeric(exdf[c], errors='coerce').notna().sum() > 0:
+                out.append(c)
+        except Exception:
+            continue
+    return out
+
+
+def _column(frame: pd.DataFrame, col, default=None) -> pd.Series:
+    if col is not None and col in frame.columns:
+        return frame[col]
+    return pd.Series(default, index=frame.index, dtype=object)
+
+
+def _join_contacts(t: pd.DataFrame, contacts: pd.DataFrame, name_col, adm_col) -> pd.DataFrame:
+    """Left-join exam rows to contacts in one merge: admission number first,
+    then normalized name (first contact wins on duplicates)."""
+    c = contacts.copy()
+    c['__name_norm'] = normalize_names(c['student_name'])
+    t['__name_norm'] = normalize_names(t[name_col]) if name_col in t.columns else t.index.astype(str)
+
+    pos = pd.Series(np.arange(len(c), dtype=float), index=c.index)
+    by_name = pd.Series(pos.values, index=c['__name_norm'].values)
+    by_name = by_name[~by_name.index.duplicated(keep='first')]
+    cid = t['__name_norm'].map(by_name)
+    if adm_col is not None and 'student_id' in c.columns:
+        c_adm = normalize_adm(c['student_id'])
+        by_adm = pd.Series(pos.values, index=c_adm.values)
+        by_adm = by_adm[(by_adm.index != '') & ~by_adm.index.duplicated(keep='first')]
+        if len(by_adm):
+            cid = normalize_adm(t[adm_col]).map(by_adm).fillna(cid)
+    t['__cid'] = cid.astype(float)
+    c['__cid'] = pos.values
+    merged = t.merge(c.drop(columns=['__name_norm']), on='__cid', how='left')
+    merged.index = t.index
+    return merged.drop(columns=['__cid'])
+
+
+def _class_mask(merged: pd.DataFrame, class_col, class_sel) -> pd.Series:
+    """Rows whose exam class (or, when blank, the contact's grade/stream)
+    matches one of the selected classes."""
+    sel = [s for s in (str(x).lower().replace('grade ', '').strip() for x in class_sel) if s]
+    exam_cv = _text(_column(merged, class_col, '')).str.lower()
+    has_cv = (exam_cv != '') & (exam_cv != 'nan')
+
+    def _lookup(values: pd.Series, test) -> pd.Series:
+        return values.map({v: test(v) for v in values.unique()}).astype(bool)
+
+    by_exam = _lookup(exam_cv, lambda v: any(s == v or s in v or v in s for s in sel))
+    by_grade = _lookup(_text(_column(merged, 'grade', '')).str.lower(), lambda v: any(s in v for s in sel))
+    by_stream = _lookup(_text(_column(merged, 'stream', '')).str.lower(), lambda v: any(s in v for s in sel))
+    return by_exam.where(has_cv, by_grade | by_stream)
+
+
+def _rank_text(ranks: List, sizes: List) -> List[str]:
+    return [(f"{r}/{n}" if n else str(r)) if r is not None else 'N/A' for r, n in zip(ranks, sizes)]
+
+
+def _ints(values: pd.Series) -> List[Optional[int]]:
+    num = pd.to_numeric(values, errors='coerce')
+    ok = np.isfinite(num.to_numpy(dtype=float, na_value=np.nan))
+    return [int(v) if k else None for v, k in zip(num.tolist(), ok)]
+
+
+def prepare_exam(exdf: pd.DataFrame, contacts: pd.DataFrame, exam_id, exam_name,
+                 class_sel: Optional[Sequence] = None, limit: int = 0) -> Tuple[List[Dict], List[Dict], Dict[str, int]]:
+    """Result messages for one exam.
+
+    Returns ``(prepared, unmatched, counters)``: prepared rows carry phone,
+    message, totals and ranks; unmatched rows give the reason
+    (``missing_phone``/``missing_total``); counters feed the page diagnostics.
+    """
+    counters = {'total_exam_rows_scanned': 0, 'valid_total_rows': 0, 'missing_total_rows': 0,
+                'merged_rows_total': 0, 'merged_rows_with_phone': 0, 'missing_phone_count': 0}
+    cols = list(exdf.columns)
+    match_col = pick_column(cols, MATCH_COLUMNS)
+    name_col = pick_column(cols, NAME_COLUMNS)
+    score_col = pick_column(cols, SCORE_COLUMNS)
+    class_col = pick_column(cols, CLASS_COLUMNS)
+    adm_col = pick_column(cols, ADM_COLUMNS, fallback=False)
+    numeric_subjects = subject_columns(exdf, {match_col, name_col, score_col, class_col})
+
+    # ranks over every row with a total (rows without one rank as NaN)
+    try:
+        tmp = exdf.copy()
+        tmp[score_col] = pd.to_numeric(tmp[score_col], errors='coerce')
+        tmp['overall_rank'] = tmp[score_col].rank(ascending=False, method='min')
+        if class_col in tmp.columns:
+            tmp['class_rank'] = tmp.groupby(class_col)[score_col].rank(ascending=False, method='min')
+        else:
+            tmp['class_rank'] = None
+    except Exception:
+        tmp = exdf.copy()
+        tmp['overall_rank'] = None
+        tmp['class_rank'] = None
+
+    # drop exam rows with missing/invalid totals
+    total_col = score_col if score_col in tmp.columns else ('Total' if 'Total' in tmp.columns else None)
+    if total_col is not None:
+        before = len(tmp)
+        tmp = tmp[pd.to_numeric(tmp[total_col], errors='coerce').notna()].copy()
+        counters['total_exam_rows_scanned'] += before
+        counters['valid_total_rows'] += len(tmp)
+        counters['missing_total_rows'] += before - len(tmp)
+
+    try:
+        merged = _join_contacts(tmp.copy(), contacts, name_col, adm_col)
+        counters['merged_rows_total'] += len(merged)
+        phone_src = 'phone' if 'phone' in merged.columns else 'phone_raw'
+        counters['merged_rows_with_phone'] += int(_present(_column(merged, phone_src)).sum())
+    except Exception:
+        merged = tmp.copy()
+
+    if class_sel:
+        try:
+            merged = merged[_class_mask(merged, class_col, class_sel)]
+        except Exception:
+            pass
+    try:
+        if limit and int(limit) > 0:
+            merged = merged.head(int(limit))
+    except Exception:
+        pass
+
+    overall_size = int(len(tmp))
+    class_counts = tmp.groupby(class_col).size().to_dict() if class_col in tmp.columns else {}
+
+    # per-row fields, column-wise
+    raw_phone = _column(merged, 'phone' if 'phone' in merged.columns else 'phone_raw')
+    phones = [str(p).strip() if ok else None for p, ok in zip(raw_phone.tolist(), _present(raw_phone))]
+    student = _column(merged, name_col)
+    if 'student_name' in merged.columns:
+        student = student.where(student.notna(), merged['student_name'])
+    students = student.where(student.notna(), '').tolist()
+    total = pd.to_numeric(_column(merged, score_col), errors='coerce')
+    if 'Total' in merged.columns:
+        total = total.fillna(pd.to_numeric(merged['Total'], errors='coerce'))
+    totals = _ints(total)
+    class_ranks = _ints(_column(merged, 'class_rank'))
+    overall_ranks = _ints(_column(merged, 'overall_rank'))
+    if class_col is not None and class_col in merged.columns:
+        class_sizes = [None if k is None else int(class_counts.get(k, 0)) for k in merged[class_col].tolist()]
+    else:
+        class_sizes = [None] * len(merged)
+    parent = _column(merged, 'parent_name', '')
+    parents = [str(v) for v in parent.where(parent.notna(), '').tolist()]
+
+    # "Subject: mark" pieces, skipping blank marks
+    pieces = []
+    for s in numeric_subjects:
+        if s not in merged.columns:
+            continue
+        col = merged[s]
+        pieces.append([f"{s}: {v}" if ok else None for v, ok in zip(col.tolist(), col.notna().tolist())])
+    subjects = [', '.join(p for p in row if isinstance(p, str)) for row in zip(*pieces)] if pieces else [''] * len(merged)
+
+    class_text = _rank_text(class_ranks, class_sizes)
+    overall_text = _rank_text(overall_ranks, [overall_size] * len(merged))
+
+    prepared, unmatched = [], []
+    for i, phone in enumerate(phones):
+        name = students[i]
+        if not phone:
+            counters['missing_phone_count'] += 1
+            unmatched.append({'exam_id': exam_id, 'exam_name': exam_name, 'student_name': name, 'reason': 'missing_phone'})
+            continue
+        if totals[i] is None:
+            counters['missing_total_rows'] += 1
+            unmatched.append({'exam_id': exam_id, 'exam_name': exam_name, 'student_name': name, 'reason': 'missing_total'})
+            continue
+        name = name or ''
+        message = (f"Dear {parents[i]}, Results for {name} — {exam_name}. {subjects[i]}. Total: {totals[i]}. "
+                   f"Class Rank: {class_text[i]}. Overall Rank: {overall_text[i]}.")
+        prepared.append({'phone': phone, 'message': message, 'student_name': name, 'exam_id': exam_id,
+                         'exam_name': exam_name, 'total': totals[i], 'class_rank': class_ranks[i],
+                         'class_size': class_sizes[i], 'overall_rank': overall_ranks[i], 'overall_size': overall_size})
+    return prepared, unmatched, counters
+
+
+def prepare_messages(exams: Iterable[Tuple], contacts: pd.DataFrame, class_sel: Optional[Sequence] = None,
+                     limit: int = 0) -> Tuple[List[Dict], List[Dict], Dict[str, int]]:
+    """``prepare_exam`` over ``(exam_id, exam_name, frame)`` tuples; returns
+    ``(prepared, unmatched, diagnostics)`` with the counters summed."""
+    prepared, unmatched = [], []
+    diagnostics = {'total_exam_rows_scanned': 0, 'valid_total_rows': 0, 'missing_total_rows': 0,
+                   'merged_rows_total': 0, 'merged_rows_with_phone': 0, 'missing_phone_count': 0}
+    for exam_id, exam_name, exdf in exams:
+        p, u, counters = prepare_exam(exdf, contacts, exam_id, exam_name, class_sel=class_sel, limit=limit)
+        prepared.extend(p)
+        unmatched.extend(u)
+        for k, v in counters.items():
+            diagnostics[k] += v
+    diagnostics['prepared_count'] = len(prepared)
+    return prepared, unmatched, diagnostics
+
+
+def recipient_pool(exams: Iterable[Tuple], contacts: List[Dict]) -> List[Dict]:
+    """Blank recipient rows (no message yet) for every student in the exams,
+    with the phone and parent name of the contact whose name matches."""
+    by_name: Dict[str, Dict] = {}
+    for c in contacts:
+        by_name.setdefault(str(c.get('student_name', '')).lower().strip(), c)
+    pool = []
+    for exam_id, exam_name, exdf in exams:
+        if exdf.empty:
+            continue
+        name_col = pick_column(list(exdf.columns), NAME_COLUMNS)
+        parent_col = next((pc for pc in PARENT_COLUMNS if pc in exdf.columns), None)
+        names = _text(exdf[name_col]).str.strip()
+        keys = names.str.lower().str.replace('\n', ' ', regex=False).str.strip()
+        exam_parents = _text(exdf[parent_col]).tolist() if parent_col else [''] * len(exdf)
+        for name, key, exam_parent in zip(names.tolist(), keys.tolist(), exam_parents):
+            found = by_name.get(key)
+            phone, parent = '', ''
+            if found:
+                phone = found.get('phone') or found.get('phone_raw') or ''
+                parent = found.get('parent_name') or ''
+            pool.append({'phone': phone, 'message': '', 'student_name': name, 'exam_id': exam_id, 'exam_name': exam_name,
+                         'total': None, 'class_rank': None, 'class_size': None, 'overall_rank': None,
+                         'overall_size': None, 'parent_name': parent or exam_parent or ''})
+    return pool
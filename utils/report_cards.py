@@ -0,0 +1,1841 @@
+"""Report-card PDF rendering, shared by pages/report_cards.py and its workers.
+
+``generate_professional_report_card_pdf`` renders the cards for a list of
+students as one ReportLab document (one page per student).
+``render_report_cards`` is the bulk entry point: it renders every student's
+card as its own small PDF, in chunks spread over a process pool, and joins
+them into one PDF or a ZIP, calling ``on_progress(done, total)`` as chunks
+finish. Every chunk is given the full exam frames, so class ranks and
+statistics match a single-document run. ``write_report_cards`` does the same
+into a file, writing ZIP entries as their cards come in so a whole school
+never sits in memory; ``iter_report_cards`` yields the cards themselves.
+
+  - ``shard_by`` only shapes the ZIP: ``'chunk'`` (runs of consecutive
+    students), ``'class'`` (one PDF per class) or ``'student'``.
+  - Each card is cached on disk under ``card_keys``: a hash of the student's
+    rows, the ranks and counts the card prints, the settings (plus the images
+    they point to), the grading config and TEMPLATE_VERSION. Regenerating
+    after fixing a mark re-renders only the cards whose inputs changed; the
+    rest are spliced in from the cache.
+  - Small runs, ``workers`` of 0/1 and a pool that cannot start render in this
+    process. Without ``pypdf`` (needed to split and join cards) there is no
+    cache and a single PDF is rendered as one document.
+  - The pool uses the ``spawn`` start method, so workers never inherit the
+    Streamlit server's threads; it is created on first use and reused.
+
+Environment variables:
+  - REPORT_CARD_WORKERS (default: CPU count, at most 8)
+  - REPORT_CARD_MIN_PARALLEL (default 24 students)
+  - REPORT_CARD_CACHE (default true), REPORT_CARD_CACHE_DIR (default a folder
+    in the temp dir), REPORT_CARD_CACHE_MAX_BYTES (default 512 MB; oldest
+    cards are dropped first)
+"""
+import os
+import re
+import json
+import math
+import atexit
+import hashlib
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing import util as _mp_util
+from io import BytesIO
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Flowable
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER
+from utils.grading import GradingScheme
+from utils.pdf_assets import ImageAssets, WATERMARK_DPI
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except Exception:
+    PdfReader = PdfWriter = None
+
+WORKERS = int(os.environ.get('REPORT_CARD_WORKERS', str(min(8, os.cpu_count() or 1))))
+MIN_PARALLEL = int(os.environ.get('REPORT_CARD_MIN_PARALLEL', '24'))
+CACHE_ENABLED = os.environ.get('REPORT_CARD_CACHE', 'true').lower() in ('1', 'true', 'yes')
+CACHE_DIR = os.environ.get('REPORT_CARD_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'eduscore_report_cards')
+CACHE_MAX_BYTES = int(os.environ.get('REPORT_CARD_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# Bump when a change to the card layout should invalidate cached cards
+TEMPLATE_VERSION = '2'
+
+
+# Helper: sanitize exam names to exclude class and year from display in the card
+def sanitize_exam_name(name, settings=None):
+    try:
+        s = str(name)
+        # Remove year patterns like 2020-2039
+        s = re.sub(r"\b20\d{2}\b", "", s)
+        # Remove common class labels e.g., Form 1, Grade 7, Class 8, Std 6
+        s = re.sub(r"\b(Form|Grade|Class|Std)\s*[A-Za-z0-9]+\b", "", s, flags=re.IGNORECASE)
+        # Remove duplicate spaces and separators
+        s = re.sub(r"\s*[-_/]+\s*", " ", s)
+        s = re.sub(r"\s+", " ", s).strip()
+        # If settings year provided and still present, strip it
+        if settings and isinstance(settings.get('year', None), (int, float, str)):
+            y = str(settings.get('year'))
+            s = re.sub(fr"\b{re.escape(y)}\b", "", s).strip()
+        return s
+    except Exception:
+        return name
+
+
+# Helper: generate teacher remark based on overall score and band texts
+def get_remark_from_bands(score, thresholds, texts, comment_bands=None):
+    """Return a remark for a numeric score using either custom comment ranges or simple thresholds.
+    comment_bands: list of dicts with keys label|min|max|text using same semantics as grading (max ≤ score ≤ min).
+    thresholds/texts fallback when ranges not provided."""
+    if score is None:
+        return None
+    return GradingScheme.remark(score, comment_bands, thresholds or {}, texts or {})
+
+
+def add_watermark_to_canvas(canvas_obj, page_num, watermark_settings, assets=None):
+    """Add watermark directly to canvas object.
+    assets: the run's utils.pdf_assets.ImageAssets, so an image watermark is decoded once."""
+    if not watermark_settings.get('enable_watermark', False):
+        return
+    
+    canvas_obj.saveState()
+    
+    try:
+        watermark_type = watermark_settings.get('watermark_type', 'text')
+        page_width, page_height = A4
+        
+        if watermark_type == 'text':
+            # Text watermark
+            text = watermark_settings.get('watermark_text', 'CONFIDENTIAL')
+            opacity = float(watermark_settings.get('watermark_opacity', 0.2))
+            angle = float(watermark_settings.get('watermark_angle', 45))
+            font_size = int(watermark_settings.get('watermark_font_size', 100))
+            color_hex = watermark_settings.get('watermark_color', '#999999')
+            
+            # Parse color
+            hex_color = color_hex.lstrip('#')
+            r = int(hex_color[0:2], 16) / 255.0
+            g = int(hex_color[2:4], 16) / 255.0
+            b = int(hex_color[4:6], 16) / 255.0
+            
+            # Apply transparency (if supported) and color
+            try:
+                canvas_obj.setFillAlpha(opacity)
+            except Exception:
+                pass
+            canvas_obj.setFillColorRGB(r, g, b)
+            canvas_obj.setFont("Helvetica-Bold", font_size)
+            
+            # Center and rotate
+            canvas_obj.translate(page_width / 2, page_height / 2)
+            canvas_obj.rotate(angle)
+            
+            # Draw text
+            text_width = canvas_obj.stringWidth(text, "Helvetica-Bold", font_size)
+            canvas_obj.drawString(-text_width / 2, -font_size / 3, text)
+            
+        else:
+            # Image watermark
+            watermark_image_path = watermark_settings.get('watermark_image_path', '')
+            image_size = float(watermark_settings.get('watermark_image_size', 300))
+            watermark_image = (assets or ImageAssets()).image(watermark_image_path, image_size, image_size,
+                                                             dpi=WATERMARK_DPI)
+            if watermark_image is not None:
+                opacity = float(watermark_settings.get('watermark_opacity', 0.3))
+                angle = float(watermark_settings.get('watermark_angle', 45))
+                
+                canvas_obj.setFillAlpha(opacity)
+                canvas_obj.setStrokeAlpha(opacity)
+                
+                canvas_obj.translate(page_width / 2, page_height / 2)
+                canvas_obj.rotate(angle)
+                
+                canvas_obj.drawImage(
+                    watermark_image,
+                    -image_size / 2,
+                    -image_size / 2,
+                    width=image_size,
+                    height=image_size,
+                    preserveAspectRatio=True,
+                    mask='auto'
+                )
+    except Exception as e:
+        pass  # Silently fail if watermark can't be drawn
+    
+    canvas_obj.restoreState()
+
+
+@contextmanager
+def _binary_streams():
+    """Build without ReportLab's ASCII85 stream wrapping: images are stored as
+    plain binary (about a fifth smaller) and pypdf does not have to decode them
+    in pure Python when cards are split and joined."""
+    previous = rl_config.useA85
+    rl_config.useA85 = 0
+    try:
+        yield
+    finally:
+        rl_config.useA85 = previous
+
+
+class _CardStart(Flowable):
+    """Zero-size marker that records the page each student's card starts on."""
+
+    def __init__(self, page_starts):
+        Flowable.__init__(self)
+        self.page_starts = page_starts
+
+    def wrap(self, availWidth, availHeight):
+        return 0, 0
+
+    def draw(self):
+        self.page_starts.append(self.canv.getPageNumber())
+
+
+def generate_professional_report_card_pdf(students_data, settings, multiple_exams_data=None, grading_config=None,
+                                          page_starts=None, assets=None):
+    """Generate a professional PDF report card (one page per student).
+    grading_config is the marksheet grading config (st.session_state.cfg on the page).
+    When page_starts is a list, the first page number of each card is appended to it.
+    assets (utils.pdf_assets.ImageAssets) may be shared between calls of one run."""
+    buffer = BytesIO()
+    assets = assets or ImageAssets()
+    
+    # Build watermark settings dict
+    watermark_settings = {
+        'enable_watermark': settings.get('enable_watermark', False),
+        'watermark_type': settings.get('watermark_type', 'text'),
+        'watermark_text': settings.get('watermark_text', 'CONFIDENTIAL'),
+        'watermark_opacity': settings.get('watermark_opacity', 0.1),
+        'watermark_angle': settings.get('watermark_angle', 45),
+        'watermark_font_size': settings.get('watermark_font_size', 100),
+        'watermark_color': settings.get('watermark_color', '#CCCCCC'),
+        'watermark_image_path': settings.get('watermark_image_path', ''),
+        'watermark_image_size': settings.get('watermark_image_size', 300),
+    }
+    
+    # Create document (watermark added via page callback later)
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        topMargin=0.2*inch,
+        bottomMargin=0.2*inch,
+        leftMargin=0.3*inch,
+        rightMargin=0.3*inch,
+    )
+    
+    story = []
+    styles = getSampleStyleSheet()
+    main_title_color = settings.get('main_title_color', settings.get('titles_color', '#0E6BA8'))
+    section_title_color = settings.get('section_title_color', main_title_color)
+    table_header_color = settings.get('table_header_color', main_title_color)
+    # Localize frequently used toggles from settings (avoid reliance on outer-scope variables)
+    include_teacher_column = settings.get('include_teacher_column', False)
+    include_comment_column = settings.get('include_comment_column', True)
+    auto_fill_teacher_names = settings.get('auto_fill_teacher_names', False)
+    auto_fill_subject_comments = settings.get('auto_fill_subject_comments', True)
+    include_multi_exam_avg = settings.get('include_multi_exam_avg', True)
+    rank_in_multi = settings.get('rank_in_multi', True)
+    include_subject_rank = settings.get('include_subject_rank', True)
+    comment_basis = settings.get('comment_basis', 'Base exam score')
+    title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=18, textColor=colors.HexColor(main_title_color), spaceAfter=2, alignment=TA_CENTER, fontName='Helvetica-Bold')
+    subtitle_style = ParagraphStyle('CustomSubtitle', parent=styles['Normal'], fontSize=9, textColor=colors.HexColor('#2c3e50'), spaceAfter=2, alignment=TA_CENTER, fontName='Helvetica-Oblique')
+    section_style = ParagraphStyle('SectionHeader', parent=styles['Heading2'], fontSize=11, textColor=colors.HexColor(section_title_color), spaceAfter=3, spaceBefore=3, alignment=TA_CENTER, fontName='Helvetica-Bold')
+
+    def detect_component_subjects(subject_columns):
+        """Automatically detect component subjects (papers) sharing a common base.
+        Example: 'Mathematics', 'Mathematics P1', 'Mathematics P2' => 'Mathematics P1/P2' are components.
+        Returns a set of subject names considered components.
+        """
+        tokens = [
+            'P1','P2','P3','Paper 1','Paper 2','Paper 3','Paper1','Paper2','Paper3',
+            'I','II','III','Theory','Practical'
+        ]
+        subjects = list(subject_columns)
+        bases = set(subjects)
+        components = set()
+        for base in bases:
+            base_lower = base.lower()
+            for s in subjects:
+                if s == base:
+                    continue
+                lower = s.lower()
+                # pattern base <sep> token
+                if lower.startswith(base_lower + ' ') or lower.startswith(base_lower + '-'):
+                    tail = lower[len(base_lower):].strip(' -')
+                    if any(t.lower() in tail.split() for t in tokens):
+                        components.add(s)
+                # compact patterns base+token or base-token
+                for t in tokens:
+                    t_low = t.lower().replace(' ', '')
+                    if lower == base_lower + ' ' + t_low or lower == base_lower + '-' + t_low or lower == base_lower + t_low:
+                        components.add(s)
+        return components
+
+    def convert_score_to_numeric(val, thresholds):
+        try:
+            if pd.isna(val):
+                return None
+        except Exception:
+            pass
+        try:
+            return float(val)
+        except Exception:
+            pass
+        try:
+            m = re.search(r"[-+]?[0-9]*\.?[0-9]+", str(val))
+            if m:
+                return float(m.group())
+        except Exception:
+            pass
+        v = str(val).strip().upper()
+        thr_ex = thresholds.get('excellent', 80)
+        thr_vg = thresholds.get('vgood', 70)
+        thr_g = thresholds.get('good', 60)
+        thr_av = thresholds.get('average', 50)
+        bands = {
+            'A': (thr_ex + 100) / 2,
+            'B': (thr_vg + thr_ex) / 2,
+            'C': (thr_g + thr_vg) / 2,
+            'D': (thr_av + thr_g) / 2,
+            'E': (0 + thr_av) / 2,
+        }
+        base = v.replace('+','').replace('-','')
+        if base in bands:
+            valnum = bands[base]
+            if v.endswith('+'):
+                valnum = min(100, valnum + 2)
+            elif v.endswith('-'):
+                valnum = max(0, valnum - 2)
+            return float(valnum)
+        return None
+
+    grading = GradingScheme.from_config(grading_config or {})
+
+    def get_points_from_percentage(pct, subject_name=None):
+        """Map a numeric percentage to points using grading system from marksheet page (grading_config).
+        Supports strict grading for selected subjects if configured there."""
+        try:
+            return grading.points(pct, subject_name or None)
+        except Exception:
+            return 0
+
+    for idx, student_data in enumerate(students_data):
+        # Section buffers
+        sections = {
+            'Header': [],
+            'Grading Key': [],
+            'Student Info': [],
+            'Academic Performance': [],
+            'Comments': [],
+            'Footer': [],
+        }
+
+        # Unpack
+        if len(student_data) == 4:
+            student_row, subject_cols, exam_df, exam_name = student_data
+        else:
+            student_row, subject_cols, exam_df = student_data
+            exam_name = settings.get('term', 'Exam')
+        student_name = str(student_row.get('Name', 'N/A'))
+        # Auto component subjects augmentation
+        auto_components = detect_component_subjects(subject_cols)
+        comp_from_settings = set(settings.get('component_subjects', []) or [])
+        effective_components = comp_from_settings.union(auto_components)
+        settings['effective_component_subjects'] = list(effective_components)
+
+        # Header
+        left_logo = None; right_logo = None
+        try:
+            left_logo = assets.flowable(settings.get('logo_path'), 0.7*inch, 0.7*inch)
+            right_logo = assets.flowable(settings.get('logo2_path'), 0.7*inch, 0.7*inch)
+        except Exception:
+            pass
+        center_block = [
+            Paragraph(settings['school_name'].upper(), title_style),
+            Paragraph(settings.get('motto', ''), subtitle_style),
+            Paragraph(f"Email: {settings.get('email', '')}", subtitle_style)
+        ]
+        header_table = Table([[left_logo if left_logo else '', center_block, right_logo if right_logo else '']], colWidths=[0.9*inch, 4.8*inch, 0.9*inch])
+        header_table.setStyle(TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('ALIGN', (0,0), (0,0), 'LEFT'),
+            ('ALIGN', (1,0), (1,0), 'CENTER'),
+            ('ALIGN', (2,0), (2,0), 'RIGHT'),
+        ]))
+        sections['Header'].extend([header_table, Spacer(1,0.03*inch), Paragraph("STUDENT REPORT CARD", section_style), Spacer(1,0.03*inch)])
+
+        # Grading/Info table (display-only) with support for simple colspan syntax {colspan=N}
+        pasted_text = settings.get('grading_table_text', '') or ''
+        structured_rows = settings.get('grading_table_rows', []) or []
+        raw_rows = []
+        if structured_rows:
+            raw_rows = structured_rows
+        elif pasted_text.strip():
+            for ln in pasted_text.splitlines():
+                ln = ln.rstrip()
+                if not ln:
+                    continue
+                delim = '\t' if '\t' in ln else ','
+                parts = [p.strip() for p in ln.split(delim)]
+                raw_rows.append(parts)
+        else:
+            raw_rows = [['Grading / Info','Detail'],['No table pasted','Threshold comments only']]
+
+        # Determine max columns after expanding colspans logically (placeholder cells inserted)
+        processed_rows = []
+        span_commands = []  # list of (row, col_start, col_end)
+        for r_idx, row in enumerate(raw_rows):
+            expanded = []
+            c_idx = 0
+            for cell in row:
+                m = re.search(r"\{colspan=(\d+)\}", cell, re.IGNORECASE)
+                if m:
+                    span = max(1, int(m.group(1)))
+                    text = re.sub(r"\{colspan=\d+\}", "", cell).strip()
+                    expanded.append(text)
+                    # add placeholders for remaining spanned columns
+                    for _ in range(span-1):
+                        expanded.append("")
+                    span_commands.append((r_idx, c_idx, c_idx+span-1))
+                    c_idx += span
+                else:
+                    expanded.append(cell)
+                    c_idx += 1
+            processed_rows.append(expanded)
+        max_cols = max(len(r) for r in processed_rows) if processed_rows else 2
+        # Normalize row lengths
+        for r in processed_rows:
+            if len(r) < max_cols:
+                r.extend([""]*(max_cols-len(r)))
+        # Width constraints: scale smaller, never exceed subjects table nominal width
+        total_width = 4.5*inch  # smaller than subjects table (6.6")
+        base_col_width = total_width / max_cols
+        # Minimum & maximum column width constraints
+        if base_col_width < 0.4*inch:
+            base_col_width = 0.4*inch
+        if base_col_width > 1.5*inch:
+            base_col_width = 1.5*inch
+        colWidths = [base_col_width]*max_cols
+        key_table = Table(processed_rows, colWidths=colWidths, hAlign='CENTER')
+        table_style = [
+            ('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),
+            ('GRID',(0,0),(-1,-1),0.5,colors.grey),
+            # Remove header background to allow watermark to show through
+            # ('BACKGROUND',(0,0),(-1,0),colors.whitesmoke),
+            ('ALIGN',(0,0),(-1,-1),'CENTER'),
+        ]
+        # Adaptive font size: smaller table, smaller fonts
+        header_font = 6 if max_cols <= 6 else 5
+        body_font = 5 if max_cols <= 6 else 4
+        table_style.append(('FONTSIZE',(0,0),(-1,0),header_font))
+        table_style.append(('FONTSIZE',(0,1),(-1,-1),body_font))
+        for (r, c0, c1) in span_commands:
+            if c1 > c0:
+                table_style.append(('SPAN', (c0,r), (c1,r)))
+        key_table.setStyle(TableStyle(table_style))
+        sections['Grading Key'].extend([key_table, Spacer(1,0.03*inch)])
+
+        # Student Info
+        try:
+            valid_mask = exam_df['Name'].astype(str).str.strip().ne("") & ~exam_df['Name'].astype(str).str.lower().isin(['mean','total','average'])
+            _overall_total = int(valid_mask.sum())
+        except Exception:
+            _overall_total = ''
+        student_info_data = [
+            ['Name:', str(student_row.get('Name','N/A')), 'Adm No:', str(student_row.get('Adm No','N/A'))],
+            ['Class:', str(student_row.get('Class','N/A')), 'Term:', f"{settings['term']} - {settings['year']}"]
+        ]
+        student_info_table = Table(student_info_data, colWidths=[1*inch,1.8*inch,1*inch,1.8*inch])
+        student_info_table.setStyle(TableStyle([
+            # Remove cell background fills for transparency over watermark
+            # ('BACKGROUND',(0,0),(0,-1),colors.HexColor('#E8F4F8')),
+            # ('BACKGROUND',(2,0),(2,-1),colors.HexColor('#E8F4F8')),
+            ('TEXTCOLOR',(0,0),(-1,-1),colors.HexColor('#2c3e50')),
+            ('ALIGN',(0,0),(-1,-1),'LEFT'),
+            ('FONTNAME',(0,0),(0,-1),'Helvetica-Bold'),
+            ('FONTNAME',(2,0),(2,-1),'Helvetica-Bold'),
+            ('FONTNAME',(1,0),(1,0),'Helvetica-Bold'),
+            ('FONTSIZE',(0,0),(-1,-1),7),
+            ('GRID',(0,0),(-1,-1),0.5,colors.grey),
+            ('VALIGN',(0,0),(-1,-1),'MIDDLE'),
+            ('TOPPADDING',(0,0),(-1,-1),3),
+            ('BOTTOMPADDING',(0,0),(-1,-1),3),
+        ]))
+        sections['Student Info'].extend([student_info_table, Spacer(1,0.03*inch)])
+
+        # Academic Performance (header first)
+        sections['Academic Performance'].extend([Paragraph("ACADEMIC PERFORMANCE", section_style), Spacer(1,0.03*inch)])
+
+        # (Legacy duplicated block removed)
+
+        # Build subjects table (reuse existing logic, appended to sections)
+        # ... (For brevity, reuse previously computed logic by re-executing existing block below)
+        # The original logic below remains unchanged; only final appends redirected.
+        # START existing subject table logic
+        # Thresholds for multi-exam path may need student_row; leveraging existing code after this patch.
+        # (We avoid duplicating entire original block here due to patch size constraints.)
+        # END placeholder comment
+        # NOTE: We will keep original implementation below; only final story appends are redirected earlier.
+        # Subjects table logic continues below without modification until computed subjects_table.
+        
+        # (Existing code continues without changes.)
+        
+        # After original subjects_table construction (later in function), we will replace direct story.append with sections['Academic Performance'].append
+        # and redirect comments/footer sections similarly. (Implemented further down in this function.)
+        
+        # The remainder of function (from original) executes; patch continues after subjects_table styling.
+        
+        # We break out after building subjects_table to compute overall mean and comments; those will be appended to sections instead of story.
+        
+        # NOTE: Section ordering application occurs after loop end.
+        
+        # (Allow original code beyond here to run; final assembly occurs at bottom.)
+        
+        # Begin subjects table construction
+        if multiple_exams_data and len(multiple_exams_data) > 0:
+            # Multi-exam table with columns for each exam
+            header_cols = ['Subject']
+            # Use sanitized exam names (exclude class/year)
+            header_cols += [sanitize_exam_name(exam['name'], settings) for exam in multiple_exams_data]
+            if include_multi_exam_avg:
+                header_cols += ['Avg']
+            if rank_in_multi:
+                header_cols += ['Rank']
+            if include_comment_column:
+                header_cols += ['Comment']
+            if include_teacher_column:
+                header_cols += ['Teacher']
+            subjects_data = [header_cols]
+
+            # Thresholds
+            thrs = settings.get('thresholds', {})
+            thr_ex = thrs.get('excellent', 80)
+            thr_vg = thrs.get('vgood', 70)
+            thr_g = thrs.get('good', 60)
+            thr_av = thrs.get('average', 50)
+            avg_decimals = settings.get('avg_decimal_places', 1)
+
+            base_exam_df = multiple_exams_data[0]['exam_df'] if multiple_exams_data else exam_df
+
+            for subject in subject_cols:
+                row = [subject[:15]]
+                
+                scores = []
+                latest_score_for_comment = None
+
+                for exam_data in multiple_exams_data:
+                    exam_df_temp = exam_data['exam_df']
+                    student_rows = exam_df_temp[exam_df_temp['Name'] == student_name]
+                    if not student_rows.empty:
+                        exam_student_row = student_rows.iloc[0]
+                        if subject in exam_student_row.index:
+                            score = exam_student_row[subject]
+                            row.append(str(score))
+                            latest_score_for_comment = score if comment_basis == 'Base exam score' and exam_data is multiple_exams_data[0] else latest_score_for_comment
+                            # Convert graded marks to numeric for averaging
+                            numeric_score = convert_score_to_numeric(score, thrs)
+                            if numeric_score is not None:
+                                scores.append(numeric_score)
+                        else:
+                            row.append('-')
+                    else:
+                        row.append('-')
+
+                avg_val = None
+                if include_multi_exam_avg and scores:
+                    avg_val = sum(scores) / len(scores)
+                    row.append(f"{avg_val:.{avg_decimals}f}")
+                elif include_multi_exam_avg:
+                    row.append('-')
+
+                if rank_in_multi:
+                    # Rank based on chosen ranking exam (fallback to first)
+                    try:
+                        # Determine ranking exam df
+                        rank_df = base_exam_df
+                        chosen_rank_name = settings.get('ranking_exam_name')
+                        if chosen_rank_name and multiple_exams_data:
+                            match = next((e for e in multiple_exams_data if e['name'] == chosen_rank_name), None)
+                            if match:
+                                rank_df = match['exam_df']
+                        # Convert possibly graded values to numeric for ranking
+                        subject_scores_series = rank_df[subject]
+                        numeric_scores = subject_scores_series.apply(lambda x: convert_score_to_numeric(x, thrs))
+                        numeric_scores = numeric_scores.dropna().astype(float)
+                        sorted_scores = numeric_scores.sort_values(ascending=False)
+                        base_student_row = rank_df[rank_df['Name'] == student_name]
+                        if not base_student_row.empty:
+                            base_raw = base_student_row.iloc[0][subject]
+                            base_score = convert_score_to_numeric(base_raw, thrs)
+                            position = list(sorted_scores.values).index(base_score) + 1
+                            row.append(f"{position}/{len(sorted_scores)}")
+                        else:
+                            row.append('-')
+                    except Exception:
+                        row.append('-')
+
+                # Comment will be appended; teacher column must be last
+
+                # Determine comment source value
+                comment_source = None
+                if comment_basis == 'Average across exams' and avg_val is not None:
+                    comment_source = avg_val
+                else:
+                    # fallback base exam score - convert if graded
+                    try:
+                        base_student_row = base_exam_df[base_exam_df['Name'] == student_name]
+                        if not base_student_row.empty and subject in base_student_row.columns:
+                            raw_score = base_student_row.iloc[0][subject]
+                            comment_source = convert_score_to_numeric(raw_score, thrs)
+                    except Exception:
+                        comment_source = None
+
+                comment = ''
+                # Check if subject should be excluded from comments first
+                comp_subjects = settings.get('effective_component_subjects', []) or []
+                no_comment_list = settings.get('no_comment_subjects', []) or []
+                should_skip_comment = subject in comp_subjects or subject in no_comment_list
+                
+                if auto_fill_subject_comments and not should_skip_comment:
+                    if comment_source is not None:
+                        if comment_source >= thr_ex:
+                            comment = 'Excellent'
+                        elif comment_source >= thr_vg:
+                            comment = 'V.Good'
+                        elif comment_source >= thr_g:
+                            comment = 'Good'
+                        elif comment_source >= thr_av:
+                            comment = 'Average'
+                        else:
+                            comment = 'Improve'
+                    else:
+                        comment = ''
+                if include_comment_column:
+                    # Apply custom comment ranges if provided (only if not excluded)
+                    if not should_skip_comment and settings.get('comment_mode') == 'Ranges' and settings.get('comment_bands'):
+                        comment = get_remark_from_bands(comment_source, settings.get('thresholds', {}), {}, settings.get('comment_bands')) or comment
+                    row.append(comment)
+                if include_teacher_column:
+                    tname = ''
+                    if auto_fill_teacher_names:
+                        if 'Teacher' in student_row.index:
+                            tname = str(student_row.get('Teacher', '')).strip()[:10]
+                        elif f'{subject}_Teacher' in student_row.index:
+                            tname = str(student_row.get(f'{subject}_Teacher', '')).strip()[:10]
+                    row.append(tname)
+                subjects_data.append(row)
+            
+            # Calculate num_exams early for use in summary rows
+            num_exams = len(multiple_exams_data)
+            
+            # Add summary rows showing Total, Mean, (optional Points), Class Rank, Overall Rank for each exam
+            # Row 0: Total for each exam (student total per exam)
+            total_row = ['Total']
+            avg_totals = []  # collect totals from exams for average calculation
+            for exam_data in multiple_exams_data:
+                df_tmp = exam_data['exam_df']
+                row_tmp = df_tmp[df_tmp['Name'] == student_name]
+                if not row_tmp.empty:
+                    total_val_e = row_tmp.iloc[0].get('Total', '-')
+                    total_row.append(str(total_val_e))
+                    # Try converting to numeric for avg column calc
+                    try:
+                        avg_totals.append(float(total_val_e))
+                    except:
+                        pass
+                else:
+                    total_row.append('-')
+            if include_multi_exam_avg:
+                # Calculate average of totals across exams
+                if avg_totals:
+                    avg_total = sum(avg_totals) / len(avg_totals)
+                    total_row.append(f"{avg_total:.{avg_decimals}f}")
+                else:
+                    total_row.append('-')
+            if rank_in_multi:
+                total_row.append('')
+            if include_comment_column:
+                total_row.append('')
+            if include_teacher_column:
+                total_row.append('')
+            if settings.get('include_total_row', True):
+                subjects_data.append(total_row)
+
+            # Row 1: Mean for each exam
+            mean_row = ['Mean']
+            avg_means = []  # collect means from exams for average calculation
+            for exam_data in multiple_exams_data:
+                df_tmp = exam_data['exam_df']
+                row_tmp = df_tmp[df_tmp['Name'] == student_name]
+                if not row_tmp.empty:
+                    mean_val = row_tmp.iloc[0].get('Mean', '-')
+                    mean_row.append(str(mean_val))
+                    # Try converting to numeric for avg column calc
+                    try:
+                        avg_means.append(float(mean_val))
+                    except:
+                        pass
+                else:
+                    mean_row.append('-')
+            if include_multi_exam_avg:
+                # Calculate average of means across exams
+                if avg_means:
+                    avg_mean = sum(avg_means) / len(avg_means)
+                    mean_row.append(f"{avg_mean:.{avg_decimals}f}")
+                else:
+                    mean_row.append('-')
+            if rank_in_multi:
+                mean_row.append('')
+            if include_comment_column:
+                mean_row.append('')
+            if include_teacher_column:
+                mean_row.append('')
+            if settings.get('include_mean_row', True):
+                subjects_data.append(mean_row)
+
+            # Optional Row: Points per exam (sum of subject points using grading system)
+            if settings.get('include_points_row', True):
+                points_row = ['Points']
+                for exam_data in multiple_exams_data:
+                    df_tmp = exam_data['exam_df']
+                    row_tmp = df_tmp[df_tmp['Name'] == student_name]
+                    if not row_tmp.empty:
+                        r0 = row_tmp.iloc[0]
+                        total_points = 0
+                        for subj in subject_cols:
+                            if subj in r0.index:
+                                val = r0.get(subj)
+                                nv = convert_score_to_numeric(val, thrs)
+                                if nv is not None:
+                                    total_points += get_points_from_percentage(nv, subj)
+                        points_row.append(str(total_points))
+                    else:
+                        points_row.append('-')
+                if include_multi_exam_avg:
+                    # Compute average points across exams
+                    try:
+                        numeric_pts = [float(x) for x in points_row[1:1+len(multiple_exams_data)] if str(x).replace('.','',1).isdigit()]
+                        if numeric_pts:
+                            points_row.append(f"{sum(numeric_pts)/len(numeric_pts):.{avg_decimals}f}")
+                        else:
+                            points_row.append('-')
+                    except Exception:
+                        points_row.append('-')
+                if rank_in_multi:
+                    points_row.append('')
+                if include_comment_column:
+                    points_row.append('')
+                if include_teacher_column:
+                    points_row.append('')
+                subjects_data.append(points_row)
+            
+            # Row 2: Class Rank for each exam
+            class_rank_row = ['Class Rank']
+            for exam_data in multiple_exams_data:
+                df_tmp = exam_data['exam_df']
+                row_tmp = df_tmp[df_tmp['Name'] == student_name]
+                if not row_tmp.empty:
+                    r = row_tmp.iloc[0]
+                    try:
+                        valid_mask_e = df_tmp['Name'].astype(str).str.strip().ne("") & ~df_tmp['Name'].astype(str).str.lower().isin(['mean','total','average'])
+                        student_class = str(r.get('Class','')).strip()
+                        if student_class and 'Class' in df_tmp.columns:
+                            class_mask_e = (df_tmp['Class'].astype(str).str.strip() == student_class) & valid_mask_e
+                            class_total_e = int(class_mask_e.sum())
+                        else:
+                            class_total_e = ''
+                    except Exception:
+                        class_total_e = ''
+                    class_rank_val = r.get('S/Rank', r.get('Rank', '-'))
+                    class_rank = f"{class_rank_val}/{class_total_e}" if class_total_e != '' else str(class_rank_val)
+                    class_rank_row.append(str(class_rank))
+                else:
+                    class_rank_row.append('-')
+            if include_multi_exam_avg:
+                # Calculate rank based on average mean across exams for student's class
+                if avg_means:
+                    try:
+                        student_class = str(student_row.get('Class','')).strip()
+                        # Collect all students' average means for ranking
+                        class_avg_means = {}
+                        valid_students = base_exam_df[
+                            base_exam_df['Name'].astype(str).str.strip().ne("") & 
+                            ~base_exam_df['Name'].astype(str).str.lower().isin(['mean','total','average'])
+                        ]
+                        if student_class and 'Class' in base_exam_df.columns:
+                            valid_students = valid_students[valid_students['Class'].astype(str).str.strip() == student_class]
+                        
+                        for _, vstud in valid_students.iterrows():
+                            vname = vstud['Name']
+                            vmeans = []
+                            for exam_data in multiple_exams_data:
+                                vdf = exam_data['exam_df']
+                                vrow = vdf[vdf['Name'] == vname]
+                                if not vrow.empty:
+                                    try:
+                                        vmeans.append(float(vrow.iloc[0].get('Mean', 0)))
+                                    except:
+                                        pass
+                            if vmeans:
+                                class_avg_means[vname] = sum(vmeans) / len(vmeans)
+                        
+                        # Sort and find position
+                        sorted_means = sorted(class_avg_means.values(), reverse=True)
+                        student_avg_mean = sum(avg_means) / len(avg_means)
+                        position = sorted_means.index(student_avg_mean) + 1
+                        class_rank_row.append(f"{position}/{len(sorted_means)}")
+                    except Exception:
+                        class_rank_row.append('-')
+                else:
+                    class_rank_row.append('-')
+            if rank_in_multi:
+                class_rank_row.append('')
+            if include_comment_column:
+                class_rank_row.append('')
+            if include_teacher_column:
+                class_rank_row.append('')
+            subjects_data.append(class_rank_row)
+            
+            # Row 3: Overall Rank for each exam
+            overall_rank_row = ['Overall Rank']
+            for exam_data in multiple_exams_data:
+                df_tmp = exam_data['exam_df']
+                row_tmp = df_tmp[df_tmp['Name'] == student_name]
+                if not row_tmp.empty:
+                    r = row_tmp.iloc[0]
+                    try:
+                        valid_mask_e = df_tmp['Name'].astype(str).str.strip().ne("") & ~df_tmp['Name'].astype(str).str.lower().isin(['mean','total','average'])
+                        overall_total_e = int(valid_mask_e.sum())
+                    except Exception:
+                        overall_total_e = ''
+                    overall_rank_val = r.get('Rank', '-')
+                    overall_rank = f"{overall_rank_val}/{overall_total_e}" if overall_total_e != '' else str(overall_rank_val)
+                    overall_rank_row.append(str(overall_rank))
+                else:
+                    overall_rank_row.append('-')
+            if include_multi_exam_avg:
+                # Calculate overall rank based on average mean across exams for all students
+                if avg_means:
+                    try:
+                        # Collect all students' average means for ranking
+                        overall_avg_means = {}
+                        valid_students = base_exam_df[
+                            base_exam_df['Name'].astype(str).str.strip().ne("") & 
+                            ~base_exam_df['Name'].astype(str).str.lower().isin(['mean','total','average'])
+                        ]
+                        
+                        for _, vstud in valid_students.iterrows():
+                            vname = vstud['Name']
+                            vmeans = []
+                            for exam_data in multiple_exams_data:
+                                vdf = exam_data['exam_df']
+                                vrow = vdf[vdf['Name'] == vname]
+                                if not vrow.empty:
+                                    try:
+                                        vmeans.append(float(vrow.iloc[0].get('Mean', 0)))
+                                    except:
+                                        pass
+                            if vmeans:
+                                overall_avg_means[vname] = sum(vmeans) / len(vmeans)
+                        
+                        # Sort and find position
+                        sorted_means = sorted(overall_avg_means.values(), reverse=True)
+                        student_avg_mean = sum(avg_means) / len(avg_means)
+                        position = sorted_means.index(student_avg_mean) + 1
+                        overall_rank_row.append(f"{position}/{len(sorted_means)}")
+                    except Exception:
+                        overall_rank_row.append('-')
+                else:
+                    overall_rank_row.append('-')
+            if rank_in_multi:
+                overall_rank_row.append('')
+            if include_comment_column:
+                overall_rank_row.append('')
+            if include_teacher_column:
+                overall_rank_row.append('')
+            subjects_data.append(overall_rank_row)
+            
+            # Calculate column widths dynamically (num_exams already defined above)
+            subject_col_width = 1.2*inch
+            teacher_col_width = 0.7*inch if include_teacher_column else 0
+            remaining_width = 5.5*inch - teacher_col_width
+            # Extra columns: Avg, Rank, Comment (optional), and Teacher (optional)
+            extra_cols = (1 if include_multi_exam_avg else 0) + (1 if rank_in_multi else 0) + (1 if include_comment_column else 0) + (1 if include_teacher_column else 0)
+            denom = max(1, num_exams + extra_cols)
+            exam_col_width = remaining_width / denom
+            # Minimum clamp to avoid zero width in extreme cases
+            if exam_col_width < 0.35*inch:
+                exam_col_width = 0.35*inch
+            col_widths = [subject_col_width]
+            col_widths.extend([exam_col_width] * num_exams)
+            if include_multi_exam_avg:
+                col_widths.append(exam_col_width)
+            if rank_in_multi:
+                col_widths.append(exam_col_width)
+            if include_comment_column:
+                col_widths.append(exam_col_width)
+            if include_teacher_column:
+                col_widths.append(teacher_col_width)
+            
+        else:
+            # Single exam table (compact) - teacher column at end before Comment
+            header = ['Subject', 'Score']
+            if include_subject_rank:
+                header.append('Rank')
+            if include_comment_column:
+                header.append('Comment')
+            if include_teacher_column:
+                header.append('Teacher')
+            subjects_data = [header]
+            
+            for subject in subject_cols:
+                if subject in student_row.index:
+                    score = student_row[subject]
+                    
+                    # Get teacher name if enabled
+                    teacher_name = 'N/A'
+                    if include_teacher_column:
+                        if 'Teacher' in student_row.index:
+                            teacher_name = str(student_row.get('Teacher', 'N/A'))[:10]
+                        elif f'{subject}_Teacher' in student_row.index:
+                            teacher_name = str(student_row.get(f'{subject}_Teacher', 'N/A'))[:10]
+                    
+                    # Calculate subject rank (optional)
+                    subject_rank = '-'
+                    if include_subject_rank:
+                        try:
+                            thrs = settings.get('thresholds', {})
+                            subject_scores_series = exam_df[subject]
+                            numeric_scores = subject_scores_series.apply(lambda x: convert_score_to_numeric(x, thrs))
+                            numeric_scores = numeric_scores.dropna().astype(float)
+                            sorted_scores = numeric_scores.sort_values(ascending=False)
+                            score_numeric = convert_score_to_numeric(score, thrs)
+                            if score_numeric is not None and len(sorted_scores) > 0:
+                                position = list(sorted_scores.values).index(score_numeric) + 1
+                                subject_rank = f"{position}/{len(sorted_scores)}"
+                        except Exception:
+                            pass
+                    
+                    # Generate comment based on score (handle graded marks)
+                    thrs = settings.get('thresholds', {})
+                    thr_ex = thrs.get('excellent', 80)
+                    thr_vg = thrs.get('vgood', 70)
+                    thr_g = thrs.get('good', 60)
+                    thr_av = thrs.get('average', 50)
+                    
+                    comment = ''
+                    # Check if subject should be excluded from comments first
+                    comp_subjects = settings.get('effective_component_subjects', []) or []
+                    no_comment_list = settings.get('no_comment_subjects', []) or []
+                    should_skip_comment = subject in comp_subjects or subject in no_comment_list
+                    
+                    if auto_fill_subject_comments and not should_skip_comment:
+                        score_numeric = convert_score_to_numeric(score, thrs)
+                        if score_numeric is not None:
+                            if score_numeric >= thr_ex:
+                                comment = "Excellent"
+                            elif score_numeric >= thr_vg:
+                                comment = "V.Good"
+                            elif score_numeric >= thr_g:
+                                comment = "Good"
+                            elif score_numeric >= thr_av:
+                                comment = "Average"
+                            else:
+                                comment = "Improve"
+                        else:
+                            comment = ""
+                        # Apply custom comment ranges if provided (only if not excluded)
+                        if settings.get('comment_mode') == 'Ranges' and settings.get('comment_bands') and score_numeric is not None:
+                            comment = get_remark_from_bands(score_numeric, thrs, {}, settings.get('comment_bands')) or comment
+                    
+                    # Build row with teacher at end before Comment
+                    base_row = [subject, str(score)]
+                    if include_subject_rank:
+                        base_row.append(str(subject_rank))
+                    if include_comment_column:
+                        base_row.append(comment)
+                    if include_teacher_column:
+                        tname = '' if not auto_fill_teacher_names else teacher_name
+                        base_row.append(tname)
+                    subjects_data.append(base_row)
+            
+            # Add single exam summary rows to subjects table respecting toggles
+            if settings.get('include_total_row', True):
+                total_label_row = ['Total']
+                total_label_row.append(str(student_row.get('Total', 'N/A')))
+                if include_subject_rank:
+                    total_label_row.append('')
+                if include_comment_column:
+                    total_label_row.append('')
+                if include_teacher_column:
+                    total_label_row.append('')
+                subjects_data.append(total_label_row)
+
+            if settings.get('include_mean_row_single_exam', True) and settings.get('include_mean_row', True):
+                mean_label_row = ['Mean']
+                mean_label_row.append(str(student_row.get('Mean', 'N/A')))
+                if include_subject_rank:
+                    mean_label_row.append('')
+                if include_comment_column:
+                    mean_label_row.append('')
+                if include_teacher_column:
+                    mean_label_row.append('')
+                subjects_data.append(mean_label_row)
+
+            if settings.get('include_points_row', True):
+                thrs = settings.get('thresholds', {})
+                total_points = 0
+                for subj in subject_cols:
+                    if subj in student_row.index:
+                        nv = convert_score_to_numeric(student_row.get(subj), thrs)
+                        if nv is not None:
+                            total_points += get_points_from_percentage(nv, subj)
+                points_row = ['Points', str(total_points)]
+                if include_subject_rank:
+                    points_row.append('')
+                if include_comment_column:
+                    points_row.append('')
+                if include_teacher_column:
+                    points_row.append('')
+                subjects_data.append(points_row)
+
+            if settings.get('include_grade_row', True):
+                grade_label_row = ['Grade']
+                grade_label_row.append(str(student_row.get('Mean Grade', 'N/A')))
+                if include_subject_rank:
+                    grade_label_row.append('')
+                if include_comment_column:
+                    grade_label_row.append('')
+                if include_teacher_column:
+                    grade_label_row.append('')
+                subjects_data.append(grade_label_row)
+            
+            # Determine column widths based on included columns to ensure Teacher column is always last
+            if include_subject_rank and include_teacher_column and include_comment_column:
+                col_widths = [2.2*inch, 0.9*inch, 1.0*inch, 0.8*inch, 1.2*inch]
+            elif include_subject_rank and include_teacher_column and not include_comment_column:
+                col_widths = [2.8*inch, 0.9*inch, 1.0*inch, 1.3*inch]
+            elif include_subject_rank and not include_teacher_column and include_comment_column:
+                col_widths = [2.4*inch, 0.9*inch, 1.0*inch, 1.7*inch]
+            elif include_subject_rank and not include_teacher_column and not include_comment_column:
+                col_widths = [3.4*inch, 0.9*inch, 1.2*inch]
+            elif not include_subject_rank and include_teacher_column and include_comment_column:
+                col_widths = [2.8*inch, 0.9*inch, 1.7*inch, 1.1*inch]
+            elif not include_subject_rank and include_teacher_column and not include_comment_column:
+                col_widths = [3.3*inch, 0.9*inch, 1.5*inch]
+            elif not include_subject_rank and not include_teacher_column and include_comment_column:
+                col_widths = [3.0*inch, 0.9*inch, 2.1*inch]
+            else:
+                col_widths = [3.6*inch, 0.9*inch]
+        
+        # Build final subjects table
+        subjects_table = Table(subjects_data, colWidths=col_widths)
+        header_color = colors.HexColor(table_header_color)
+        header_font = 9 if len(subjects_data[0]) <= 10 else 8
+        body_font = 8 if len(subjects_data[0]) <= 10 else 7
+        # Determine how many subject rows (for alternating background)
+        num_rows = len(subjects_data)
+        num_subject_rows = len(subject_cols)
+        base_style = [
+            ('TEXTCOLOR', (0, 0), (-1, 0), header_color),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), header_font),
+            ('FONTSIZE', (0, 1), (-1, -1), body_font),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('TOPPADDING', (0, 0), (-1, -1), 2),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+            # Remove alternating row backgrounds for full transparency
+            # ('ROWBACKGROUNDS', (0, 1), (-1, num_subject_rows), [colors.white, colors.HexColor('#F5F5F5')]),
+        ]
+        if num_subject_rows < num_rows - 1:
+            base_style.extend([
+                # Remove summary rows background fill for transparency
+                # ('BACKGROUND', (0, num_subject_rows + 1), (-1, -1), colors.HexColor('#E8F4F8')),
+                ('FONTNAME', (0, num_subject_rows + 1), (-1, -1), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, num_subject_rows + 1), (-1, -1), body_font),
+            ])
+        subjects_table.setStyle(TableStyle(base_style))
+        sections['Academic Performance'].extend([subjects_table, Spacer(1,0.03*inch)])
+
+        # Compute student's overall numeric total (single or multi-exam) for teacher remarks
+        def _compute_overall_total():
+            thrs = settings.get('thresholds', {})
+            # Single-exam
+            if not (multiple_exams_data and len(multiple_exams_data) > 0):
+                try:
+                    tot = student_row.get('Total', None)
+                    totn = convert_score_to_numeric(tot, thrs)
+                    if totn is not None:
+                        return float(totn)
+                except Exception:
+                    pass
+                # Fallback compute from subjects
+                vals = []
+                for s in subject_cols:
+                    if s in student_row.index:
+                        nv = convert_score_to_numeric(student_row.get(s), thrs)
+                        if nv is not None:
+                            vals.append(float(nv))
+                return sum(vals) if vals else None
+            # Multi-exam: average of per-exam totals
+            per_exam_totals = []
+            for exam_data in multiple_exams_data:
+                df_tmp = exam_data['exam_df']
+                row_tmp = df_tmp[df_tmp['Name'] == student_name]
+                thrs = settings.get('thresholds', {})
+                if not row_tmp.empty:
+                    tot = row_tmp.iloc[0].get('Total', None)
+                    totn = convert_score_to_numeric(tot, thrs)
+                    if totn is not None:
+                        per_exam_totals.append(float(totn))
+                        continue
+                # Fallback compute total for that exam
+                if not row_tmp.empty:
+                    r0 = row_tmp.iloc[0]
+                    vals = []
+                    for s in subject_cols:
+                        if s in r0.index:
+                            nv = convert_score_to_numeric(r0.get(s), thrs)
+                            if nv is not None:
+                                vals.append(float(nv))
+                    if vals:
+                        per_exam_totals.append(sum(vals))
+            return (sum(per_exam_totals)/len(per_exam_totals)) if per_exam_totals else None
+
+        overall_total_numeric = _compute_overall_total()
+
+        # Helper function to get teacher comment based on total marks ranges
+        def get_teacher_comment_from_total(total, ranges, texts):
+            """Get teacher comment based on total marks ranges."""
+            if total is None:
+                return ''
+            try:
+                total_val = float(total)
+                # Check ranges in descending order (excellent -> average -> improve)
+                if total_val >= ranges.get('excellent', 800):
+                    return texts.get('excellent', '')
+                elif total_val >= ranges.get('vgood', 700):
+                    return texts.get('vgood', '')
+                elif total_val >= ranges.get('good', 600):
+                    return texts.get('good', '')
+                elif total_val >= ranges.get('average', 500):
+                    return texts.get('average', '')
+                else:
+                    return texts.get('improve', '')
+            except Exception:
+                return ''
+
+        # Teacher Comments Section: horizontal table layout (label beside comment)
+        if settings.get('include_class_teacher', True):
+            teacher_comment = settings.get('teacher_comment','').strip()
+            auto_ct = settings.get('auto_class_teacher_remarks', True)
+            ct_ranges = {
+                'excellent': settings.get('ct_ex_min', 800),
+                'vgood': settings.get('ct_vg_min', 700),
+                'good': settings.get('ct_g_min', 600),
+                'average': settings.get('ct_av_min', 500),
+            }
+            ct_texts = settings.get('class_teacher_texts', {})
+            auto_text = get_teacher_comment_from_total(overall_total_numeric, ct_ranges, ct_texts) if auto_ct else ''
+            chosen_comment = teacher_comment or auto_text or ''
+            
+            # Build comment table: two rows -> row1 label+comment with underline, row2 empty label + signature below line
+            ct_label = "CLASS TEACHER COMMENT:"
+            ct_sig = f"Signature: _____________  Name: {settings.get('class_teacher','')}"
+            ct_comment_text = chosen_comment if chosen_comment else ''
+            
+            ct_table = Table([[ct_label, ct_comment_text], ['', ct_sig]], colWidths=[1.8*inch, 4.8*inch])
+            ct_table.setStyle(TableStyle([
+                ('FONTNAME', (0, 0), (0, 0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, -1), 7),
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+                ('ALIGN', (1, 0), (1, 1), 'LEFT'),
+                ('LINEBELOW', (1, 0), (1, 0), 0.7, colors.black),
+                ('TOPPADDING', (0, 0), (-1, 0), 2),
+                ('BOTTOMPADDING', (0, 0), (-1, 0), 2),
+                ('TOPPADDING', (0, 1), (-1, 1), 2),
+                ('BOTTOMPADDING', (0, 1), (-1, 1), 2),
+            ]))
+            sections['Comments'].append(ct_table)
+            sections['Comments'].append(Spacer(1, 0.03*inch))
+
+        if settings.get('include_head_teacher', True):
+            head_comment = settings.get('head_teacher_comment','').strip()
+            auto_ht = settings.get('auto_head_teacher_remarks', True)
+            ht_ranges = {
+                'excellent': settings.get('ht_ex_min', 800),
+                'vgood': settings.get('ht_vg_min', 700),
+                'good': settings.get('ht_g_min', 600),
+                'average': settings.get('ht_av_min', 500),
+            }
+            ht_texts = settings.get('head_teacher_texts', {})
+            auto_text_h = get_teacher_comment_from_total(overall_total_numeric, ht_ranges, ht_texts) if auto_ht else ''
+            chosen_head_comment = head_comment or auto_text_h or ''
+            
+            # Build comment table: two rows -> row1 label+comment with underline, row2 empty label + signature below line
+            ht_label = "HEAD TEACHER COMMENT:"
+            ht_sig = f"Signature: _____________  Name: {settings.get('head_teacher','')}"
+            ht_comment_text = chosen_head_comment if chosen_head_comment else ''
+            
+            ht_table = Table([[ht_label, ht_comment_text], ['', ht_sig]], colWidths=[1.8*inch, 4.8*inch])
+            ht_table.setStyle(TableStyle([
+                ('FONTNAME', (0, 0), (0, 0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, -1), 7),
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+                ('ALIGN', (1, 0), (1, 1), 'LEFT'),
+                ('LINEBELOW', (1, 0), (1, 0), 0.7, colors.black),
+                ('TOPPADDING', (0, 0), (-1, 0), 2),
+                ('BOTTOMPADDING', (0, 0), (-1, 0), 2),
+                ('TOPPADDING', (0, 1), (-1, 1), 2),
+                ('BOTTOMPADDING', (0, 1), (-1, 1), 2),
+            ]))
+            sections['Comments'].append(ht_table)
+            sections['Comments'].append(Spacer(1, 0.03*inch))
+        
+        # Multi-exam footnote removed per user request (no average explanatory note)
+
+        # Stamp (right-aligned) - image or rectangular placeholder
+        from reportlab.graphics.shapes import Drawing, Rect, String
+        stamp_image = assets.image(settings.get('stamp_path'), 1.2*inch, 0.9*inch)
+        if stamp_image is not None:
+            try:
+                stamp_flow = assets.flowable(stamp_image, 1.2*inch, 0.9*inch)
+            except Exception:
+                stamp_flow = None
+        else:
+            d = Drawing(86, 64)  # ~1.2in x 0.9in rectangle
+            d.add(Rect(0, 0, 86, 64, strokeColor=colors.grey, fillColor=None, strokeWidth=1))
+            d.add(String(43, 32, 'SCHOOL STAMP', textAnchor='middle', fontSize=7))
+            stamp_flow = d
+        if stamp_flow:
+            stamp_wrap = Table([['', stamp_flow]], colWidths=[5.2*inch, 1.2*inch])
+            stamp_wrap.setStyle(TableStyle([
+                ('ALIGN', (1,0), (1,0), 'RIGHT'),
+                ('VALIGN', (0,0), (-1,-1), 'MIDDLE')
+            ]))
+            sections['Footer'].append(stamp_wrap)
+        sections['Footer'].append(Spacer(1, 0.05*inch))
+
+        # Bottom section with dates after stamp
+        bottom_data = [
+            ['Opening Day:', settings.get('opening_date', 'N/A'), 'Closing Day:', settings.get('closing_date', 'N/A')],
+        ]
+        bottom_table = Table(bottom_data, colWidths=[1*inch, 2*inch, 1*inch, 2*inch])
+        bottom_table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (0, 0), 'Helvetica-Bold'),
+            ('FONTNAME', (2, 0), (2, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 6),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ]))
+        sections['Footer'].append(bottom_table)
+        sections['Footer'].append(Spacer(1,0.05*inch))
+        
+        # Footer (compact)        sections['Footer'].append(Spacer(1,0.05*inch))
+        
+        # Footer (compact)
+        footer_style = ParagraphStyle(
+            'Footer',
+            parent=styles['Normal'],
+            fontSize=5,
+            textColor=colors.grey,
+            alignment=TA_CENTER
+        )
+        footer_text = "EDUSCORE ANALYTICS | Developed by Munyua Kamau | © 2025"
+        footer_para = Paragraph(footer_text, footer_style)
+        sections['Footer'].append(footer_para)
+
+        # Determine order - Updated flow: Header → Student Info → Grading Key → Academic Performance → Comments → Footer
+        # Grading Key is placed directly after Student Info per request
+        default_order = ['Header', 'Student Info', 'Grading Key', 'Academic Performance', 'Comments', 'Footer']
+        order_positions = settings.get('section_order_positions', {}) or {}
+        try:
+            # Lock Header, Student Info, and Grading Key at top
+            fixed_sections = ['Header', 'Student Info', 'Grading Key']
+            # Allow customization of remaining middle sections only
+            middle_sections = ['Academic Performance', 'Comments']
+            middle_sorted = sorted(middle_sections, key=lambda x: order_positions.get(x, default_order.index(x)+1))
+            # Footer is always last
+            final_order = fixed_sections + middle_sorted + ['Footer']
+        except Exception:
+            final_order = ['Header', 'Student Info', 'Grading Key', 'Academic Performance', 'Comments', 'Footer']
+        if idx > 0:
+            story.append(PageBreak())
+        if page_starts is not None:
+            story.append(_CardStart(page_starts))
+        for sec_name in final_order:
+            story.extend(sections.get(sec_name, []))
+    
+    # Draw watermark on each page using ReportLab's page callbacks to ensure it appears
+    def _draw_on_page(canvas_obj, doc_obj):
+        try:
+            # Use canvas.getPageNumber() to pass to the watermark helper (if needed)
+            page_num = 0
+            try:
+                page_num = canvas_obj.getPageNumber()
+            except Exception:
+                page_num = 0
+            add_watermark_to_canvas(canvas_obj, page_num, watermark_settings, assets)
+        except Exception:
+            # Don't fail PDF generation if watermark drawing fails
+            pass
+
+    with _binary_streams():
+        doc.build(story, onFirstPage=_draw_on_page, onLaterPages=_draw_on_page)
+    buffer.seek(0)
+    return buffer
+
+
+# ---------------------------------------------------------------------------
+# Per-student card cache
+# ---------------------------------------------------------------------------
+
+_SUMMARY_NAMES = ('mean', 'total', 'average')
+_RANKED_COLUMNS = ('Total', 'Mean', 'Points')
+# paths in the settings whose file contents end up on the card
+_ASSET_KEYS = ('logo_path', 'logo2_path', 'stamp_path', 'watermark_image_path')
+
+
+def _digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _file_stamp(path):
+    try:
+        st_ = os.stat(path)
+        return [path, st_.st_size, st_.st_mtime_ns]
+    except Exception:
+        return [path, None, None]
+
+
+def _settings_digest(settings, multiple_exams_data, grading_config):
+    data = {k: v for k, v in (settings or {}).items() if k != 'effective_component_subjects'}
+    assets = [_file_stamp(settings.get(k)) for k in _ASSET_KEYS if (settings or {}).get(k)]
+    exams = [e.get('name') for e in (multiple_exams_data or [])]
+    return _digest([TEMPLATE_VERSION, data, assets, exams, grading_config or {}])
+
+
+def _row_values(row):
+    if row is None:
+        return None
+    return [[str(k), str(v)] for k, v in row.items()]
+
+
+class _FrameContext:
+    """What a card reads from the rest of a frame: counts of valid students
+    (overall and per class) and, for every ranked column, where a value sits
+    among the column's values."""
+
+    def __init__(self, df, subject_cols):
+        self.df = df
+        names = df['Name'].map(str) if 'Name' in df.columns else pd.Series([''] * len(df), index=df.index)
+        self.valid = names.str.strip().ne('') & ~names.str.lower().isin(_SUMMARY_NAMES)
+        self.n_valid = int(self.valid.sum())
+        self.class_counts = {}
+        if 'Class' in df.columns:
+            classes = df['Class'].map(lambda v: str(v).strip())
+            self.class_counts = classes[self.valid].value_counts().to_dict()
+        self.first_row = {}
+        for pos, name in enumerate(df['Name'].tolist() if 'Name' in df.columns else []):
+            self.first_row.setdefault(name, pos)
+        self.columns = {}
+        for col in df.columns:
+            if col in subject_cols or col in _RANKED_COLUMNS:
+                raw = df[col]
+                num = pd.to_numeric(raw, errors='coerce')
+                text = raw.map(lambda v: '' if v is None or v != v else str(v).strip())
+                if (num.isna() & text.ne('')).any():
+                    # graded/letter marks: rank positions depend on the whole column
+                    self.columns[col] = ('column', _digest(text.tolist()))
+                else:
+                    self.columns[col] = ('sorted', np.sort(num.dropna().to_numpy(dtype=float)))
+
+    def row_for(self, name):
+        pos = self.first_row.get(name)
+        return None if pos is None else self.df.iloc[pos]
+
+    def context(self, row):
+        if row is None:
+            return None
+        out = [self.n_valid, self.class_counts.get(str(row.get('Class', '')).strip())]
+        for col, (kind, data) in self.columns.items():
+            if kind == 'column':
+                out.append([col, data])
+                continue
+            try:
+                value = float(row.get(col))
+            except Exception:
+                value = float('nan')
+            if value != value:
+                out.append([col, None, len(data)])
+            else:
+                out.append([col, int(len(data) - np.searchsorted(data, value, side='right')), len(data)])
+        return out
+
+
+def _average_mean_positions(multiple_exams_data):
+    """``{name: ((greater in class, class size), (greater overall, size))}`` for
+    the average-of-means ranks printed on multi-exam cards."""
+    base = multiple_exams_data[0]['exam_df']
+    if 'Name' not in base.columns:
+        return {}
+    names = base['Name'].map(str)
+    valid = base[names.str.strip().ne('') & ~names.str.lower().isin(_SUMMARY_NAMES)]
+    sums, counts = {}, {}
+    for exam in multiple_exams_data:
+        df = exam['exam_df']
+        if 'Name' not in df.columns:
+            continue
+        first = df.drop_duplicates('Name')
+        means = pd.to_numeric(first['Mean'], errors='coerce') if 'Mean' in first.columns else pd.Series(0.0, index=first.index)
+        for name, mean in zip(first['Name'].tolist(), means.tolist()):
+            if mean == mean:
+                sums[name] = sums.get(name, 0.0) + mean
+                counts[name] = counts.get(name, 0) + 1
+    classes = valid['Class'].map(lambda v: str(v).strip()) if 'Class' in valid.columns else pd.Series('', index=valid.index)
+    avg_by_class, overall = {}, []
+    student_avgs = {}
+    for name, cls in zip(valid['Name'].tolist(), classes.tolist()):
+        if counts.get(name):
+            avg = sums[name] / counts[name]
+            student_avgs[name] = (avg, cls)
+            avg_by_class.setdefault(cls, []).append(avg)
+            overall.append(avg)
+    overall = np.sort(np.asarray(overall, dtype=float))
+    by_class = {c: np.sort(np.asarray(v, dtype=float)) for c, v in avg_by_class.items()}
+    out = {}
+    for name, (avg, cls) in student_avgs.items():
+        in_class = by_class.get(cls, overall)
+        out[name] = ((int(len(in_class) - np.searchsorted(in_class, avg, side='right')), len(in_class)),
+                     (int(len(overall) - np.searchsorted(overall, avg, side='right')), len(overall)))
+    return out
+
+
+def card_keys(students_data, settings, multiple_exams_data=None, grading_config=None):
+    """Cache key (sha256 hex) of each student's card, in input order."""
+    common = _settings_digest(settings, multiple_exams_data, grading_config)
+    frames = {}
+
+    def frame(df, subject_cols):
+        k = (id(df), tuple(subject_cols))
+        if k not in frames:
+            frames[k] = _FrameContext(df, subject_cols)
+        return frames[k]
+
+    multi = list(multiple_exams_data or [])
+    avg_positions = _average_mean_positions(multi) if multi else {}
+    keys = []
+    for student_data in students_data:
+        student_row, subject_cols, exam_df = student_data[0], list(student_data[1]), student_data[2]
+        exam_name = student_data[3] if len(student_data) > 3 else None
+        name = student_row.get('Name', 'N/A')
+        parts = [common, exam_name, subject_cols, _row_values(student_row),
+                 frame(exam_df, subject_cols).context(student_row)]
+        for exam in multi:
+            ctx = frame(exam['exam_df'], subject_cols)
+            row = ctx.row_for(name)
+            parts.append([_row_values(row), ctx.context(row)])
+        if multi:
+            parts.append(avg_positions.get(name))
+        keys.append(_digest(parts))
+    return keys
+
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, key[:2], f'{key}.pdf')
+
+
+def cache_get(key):
+    """Cached card bytes for ``key``, or None."""
+    path = _cache_path(key)
+    try:
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        os.utime(path, None)  # recently used cards survive pruning
+        return data
+    except Exception:
+        return None
+
+
+def cache_put(key, data):
+    path = _cache_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+def prune_cache(max_bytes=None):
+    """Drop the least recently used cards until the cache fits ``max_bytes``."""
+    limit = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries, size = [], 0
+    for root, _dirs, files in os.walk(CACHE_DIR):
+        for f in files:
+            path = os.path.join(root, f)
+            try:
+                st_ = os.stat(path)
+            except Exception:
+                continue
+            entries.append((st_.st_mtime, st_.st_size, path))
+            size += st_.st_size
+    entries.sort()
+    for _mtime, fsize, path in entries:
+        if size <= limit:
+            break
+        try:
+            os.remove(path)
+            size -= fsize
+        except Exception:
+            pass
+
+
+# ---------------------------------------------------------------------------
+# Bulk rendering across a process pool
+# ---------------------------------------------------------------------------
+
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_size = workers
+        return _pool
+
+
+def _drop_pool(wait=False):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+
+
+atexit.register(_drop_pool)
+# multiprocessing children (e.g. a modules.jobs worker rendering cards) skip
+# atexit but join their child processes on exit, so shut the pool down first.
+# It must finish before the pool's call-queue finalizer (priority 10) closes
+# the queue, or the workers never get their stop sentinels: hence the higher
+# priority and wait=True.
+_mp_util.Finalize(None, _drop_pool, kwargs={'wait': True}, exitpriority=100)
+
+
+def _student_class(student_data):
+    try:
+        return str(student_data[0].get('Class', '') or '').strip()
+    except Exception:
+        return ''
+
+
+def _safe_name(text):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(text)).strip('_') or 'report_cards'
+
+
+def plan_shards(students_data, shard_by='chunk', chunk_size=None, workers=None):
+    """Split ``students_data`` into ``[(name, [index, ...]), ...]`` (indexes into
+    the list, in order). ``name`` is the ZIP entry stem for the shard."""
+    students = list(students_data)
+    if shard_by == 'student':
+        out = []
+        for i, sd in enumerate(students):
+            row = sd[0]
+            label = f"{i + 1:04d}_{row.get('Adm No', '') or ''}_{row.get('Name', '') or ''}"
+            out.append((_safe_name(label), [i]))
+        return out
+    if shard_by == 'class':
+        groups = {}
+        for i, sd in enumerate(students):
+            groups.setdefault(_student_class(sd) or 'Unassigned', []).append(i)
+        return [(_safe_name(cls), idxs) for cls, idxs in groups.items()]
+    size = chunk_size or _chunk_size(len(students), workers)
+    return [(f'report_cards_{i + 1:04d}-{min(i + size, len(students)):04d}', list(range(i, min(i + size, len(students)))))
+            for i in range(0, len(students), size)]
+
+
+def _chunk_size(count, workers=None):
+    # a few chunks per worker keeps the pool busy when cards take uneven time
+    workers = max(1, workers or WORKERS)
+    return max(4, math.ceil(count / (workers * 4)))
+
+
+def _render_cards(students_data, settings, multiple_exams_data, grading_config):
+    """Process-pool task: render a chunk as one document and split it into
+    one PDF (bytes) per student."""
+    assets = ImageAssets()
+    starts = []
+    if PdfReader is not None:
+        buf = generate_professional_report_card_pdf(students_data, dict(settings), multiple_exams_data,
+                                                    grading_config=grading_config, page_starts=starts,
+                                                    assets=assets)
+        reader = PdfReader(buf)
+    if PdfReader is None or len(starts) != len(students_data):
+        # no pypdf to split with, or markers lost: render the cards one by one
+        return [generate_professional_report_card_pdf([sd], dict(settings), multiple_exams_data,
+                                                      grading_config=grading_config, assets=assets).getvalue()
+                for sd in students_data]
+    bounds = starts[1:] + [len(reader.pages) + 1]
+    out = []
+    for first, end in zip(starts, bounds):
+        writer = PdfWriter()
+        for page in range(first - 1, max(first, end - 1)):
+            writer.add_page(reader.pages[page])
+        data = BytesIO()
+        writer.write(data)
+        out.append(data.getvalue())
+    return out
+
+
+def _dedupe(writer):
+    try:
+        # logos, stamps and fonts are repeated in every card; the second pass
+        # merges images whose soft masks were only merged by the first
+        writer.compress_identical_objects()
+        writer.compress_identical_objects()
+    except Exception:
+        pass
+
+
+def _join_pdfs(parts):
+    writer = PdfWriter()
+    for data in parts:
+        writer.append(BytesIO(data))
+    _dedupe(writer)
+    out = BytesIO()
+    writer.write(out)
+    out.seek(0)
+    return out
+
+
+def _iter_tasks(task, groups, students, settings, multiple_exams_data, grading_config, workers):
+    """Run ``task`` over index groups, in the pool when worthwhile, yielding
+    ``(group number, result)`` as groups finish. Closing the generator early
+    (e.g. a cancelled job) cancels the groups that have not started."""
+    pending = set(range(len(groups)))
+    if workers > 1 and sum(len(g) for g in groups) >= MIN_PARALLEL and len(groups) > 1:
+        futures = {}
+        try:
+            pool = _get_pool(workers)
+            futures = {pool.submit(task, [students[j] for j in groups[i]], settings, multiple_exams_data,
+                                   grading_config): i for i in sorted(pending)}
+            for fut in as_completed(futures):
+                i = futures[fut]
+                result = fut.result()
+                pending.discard(i)
+                yield i, result
+        except Exception:
+            # broken or unavailable pool: finish the remaining groups here
+            _drop_pool()
+        finally:
+            for fut in futures:
+                fut.cancel()
+    for i in sorted(pending):
+        yield i, task([students[j] for j in groups[i]], settings, multiple_exams_data, grading_config)
+
+
+def iter_report_cards(students_data, settings, multiple_exams_data=None, grading_config=None, workers=None,
+                      chunk_size=None, on_progress=None, use_cache=None, stats=None):
+    """Yield ``(index, pdf bytes)`` for every student's card as it becomes
+    available: cached cards first, then rendered chunks in completion order.
+    ``on_progress(done, total)`` counts students; an exception it raises (such
+    as ``modules.jobs.Cancelled``) stops the run. ``stats``, when a dict,
+    receives ``cached`` and ``rendered`` card counts."""
+    students = list(students_data)
+    total = len(students)
+    workers = WORKERS if workers is None else int(workers)
+    use_cache = CACHE_ENABLED if use_cache is None else use_cache
+    if PdfWriter is None:
+        use_cache = False  # cached cards could not be joined or split
+    done = 0
+
+    def progress(count):
+        nonlocal done
+        done += count
+        if on_progress is not None:
+            on_progress(done, total)
+
+    keys = [None] * total
+    if use_cache:
+        try:
+            keys = card_keys(students, settings, multiple_exams_data, grading_config)
+        except Exception:
+            keys = [None] * total
+    missing = []
+    for i, key in enumerate(keys):
+        data = cache_get(key) if key else None
+        if data is None:
+            missing.append(i)
+        else:
+            progress(1)
+            yield i, data
+    if isinstance(stats, dict):
+        stats.update(cached=total - len(missing), rendered=len(missing))
+    size = chunk_size or _chunk_size(len(missing), workers)
+    groups = [missing[j:j + size] for j in range(0, len(missing), size)]
+    tasks = _iter_tasks(_render_cards, groups, students, settings, multiple_exams_data, grading_config, workers)
+    try:
+        for g, pdfs in tasks:
+            for j, data in zip(groups[g], pdfs):
+                if keys[j]:
+                    cache_put(keys[j], data)
+                yield j, data
+            progress(len(groups[g]))
+    finally:
+        tasks.close()
+    if use_cache and missing:
+        try:
+            prune_cache()
+        except Exception:
+            pass
+
+
+class _ZipNames:
+    def __init__(self):
+        self.seen = set()
+
+    def entry(self, name):
+        entry, n = f'{name}.pdf', 1
+        while entry in self.seen:
+            n += 1
+            entry = f'{name}_{n}.pdf'
+        self.seen.add(entry)
+        return entry
+
+
+def _write_zip(fh, cards, shards):
+    """Write ``cards`` ((index, bytes) in any order) into a ZIP on ``fh``,
+    one entry per shard, each written as soon as its cards are in; only cards
+    of unfinished shards are held in memory."""
+    owner = {j: s for s, (_name, idxs) in enumerate(shards) for j in idxs}
+    waiting = {}
+    names = _ZipNames()
+    with zipfile.ZipFile(fh, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for j, data in cards:
+            s = owner[j]
+            got = waiting.setdefault(s, {})
+            got[j] = data
+            name, idxs = shards[s]
+            if len(got) == len(idxs):
+                del waiting[s]
+                part = data if len(idxs) == 1 else _join_pdfs([got[k] for k in idxs]).getvalue()
+                zf.writestr(names.entry(name), part)
+
+
+def _write_pdf(fh, cards, total):
+    """Join ``cards`` ((index, bytes) in any order) into one PDF on ``fh``, in
+    index order."""
+    if total == 1:
+        for _j, data in cards:
+            fh.write(data)
+        return
+    writer = PdfWriter()
+    pending, nxt = {}, 0
+    for j, data in cards:
+        pending[j] = data
+        while nxt in pending:
+            writer.append(BytesIO(pending.pop(nxt)))
+            nxt += 1
+    _dedupe(writer)
+    writer.write(fh)
+
+
+def _write_report_cards(fh, students, settings, multiple_exams_data, grading_config, output, shard_by, workers,
+                        chunk_size, on_progress, use_cache, stats):
+    if PdfWriter is None:
+        if output != 'zip':
+            buf = generate_professional_report_card_pdf(students, settings, multiple_exams_data,
+                                                        grading_config=grading_config)
+            fh.write(buf.getvalue())
+            if on_progress is not None:
+                on_progress(len(students), len(students))
+            return
+        # without pypdf a shard is rendered as one document
+        shards = plan_shards(students, shard_by=shard_by, chunk_size=chunk_size, workers=workers)
+        names = _ZipNames()
+        done = 0
+        with zipfile.ZipFile(fh, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for s, parts in _iter_tasks(_render_shard, [idxs for _name, idxs in shards], students, settings,
+                                        multiple_exams_data, grading_config,
+                                        WORKERS if workers is None else int(workers)):
+                zf.writestr(names.entry(shards[s][0]), parts)
+                done += len(shards[s][1])
+                if on_progress is not None:
+                    on_progress(done, len(students))
+        return
+    cards = iter_report_cards(students, settings, multiple_exams_data, grading_config, workers=workers,
+                              chunk_size=chunk_size, on_progress=on_progress, use_cache=use_cache, stats=stats)
+    if output == 'zip':
+        _write_zip(fh, cards, plan_shards(students, shard_by=shard_by, chunk_size=chunk_size, workers=workers))
+    else:
+        _write_pdf(fh, cards, len(students))
+
+
+def _render_shard(students_data, settings, multiple_exams_data, grading_config):
+    """Process-pool task: one shard as PDF bytes (used when pypdf is missing)."""
+    buf = generate_professional_report_card_pdf(students_data, dict(settings), multiple_exams_data,
+                                                grading_config=grading_config)
+    return buf.getvalue()
+
+
+def render_report_cards(students_data, settings, multiple_exams_data=None, grading_config=None,
+                        output='pdf', shard_by='chunk', workers=None, chunk_size=None, on_progress=None,
+                        use_cache=None, stats=None):
+    """Render report cards for many students in parallel.
+
+    ``output`` is ``'pdf'`` (one document, cards in input order) or ``'zip'``
+    (one PDF per shard, see ``plan_shards``). Returns a ``BytesIO``; use
+    ``write_report_cards`` for large runs. ``on_progress(done, total)`` counts
+    students and is called in this process. ``stats``, when a dict, receives
+    ``cached`` and ``rendered`` card counts.
+    """
+    out = BytesIO()
+    _write_report_cards(out, list(students_data), settings, multiple_exams_data, grading_config, output, shard_by,
+                        workers, chunk_size, on_progress, use_cache, stats)
+    out.seek(0)
+    return out
+
+
+def write_report_cards(path, students_data, settings, multiple_exams_data=None, grading_config=None,
+                       output='zip', shard_by='student', workers=None, chunk_size=None, on_progress=None,
+                       use_cache=None, stats=None):
+    """Like ``render_report_cards`` but streams the result into the file at
+    ``path``: ZIP entries are written as their cards come in, so memory holds
+    only the chunks in flight. The file is written under a temporary name and
+    moved into place when complete. Returns ``path``."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.part'
+    try:
+        with open(tmp, 'wb') as fh:
+            _write_report_cards(fh, list(students_data), settings, multiple_exams_data, grading_config, output,
+                                shard_by, workers, chunk_size, on_progress, use_cache, stats)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+    return path
@@ -0,0 +1,134 @@
+"""Concurrent SMS dispatch with per-provider rate limiting.
+
+Bulk sends used to post one message at a time with a fixed sleep in between.
+``dispatch`` fans the sends out on a bounded thread pool instead and throttles
+them with a token bucket shared by every dispatch to the same provider, so two
+schools sending at once still respect the provider's request rate.
+
+Tuning (all optional):
+  - SMS_MAX_WORKERS (env) / ``max_workers`` in the messaging config: pool size.
+  - SMS_RATE_PER_SEC (env) / ``rate_limit_per_sec``: sustained requests per
+    second per provider (0 disables throttling).
+  - SMS_RATE_BURST (env) / ``rate_limit_burst``: bucket size.
+
+Progress callbacks run on the calling thread (so they may update Streamlit
+widgets) as ``on_progress(done, total, item, result)``.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+DEFAULT_WORKERS = int(os.environ.get('SMS_MAX_WORKERS', '8'))
+DEFAULT_RATE = float(os.environ.get('SMS_RATE_PER_SEC', '50'))
+DEFAULT_BURST = int(os.environ.get('SMS_RATE_BURST', '20'))
+
+
+class TokenBucket:
+    """Thread-safe token bucket. ``acquire`` reserves a token and sleeps outside
+    the lock until it is due, so waiting callers are served in arrival order."""
+
+    def __init__(self, rate: float, burst: int = DEFAULT_BURST):
+        self._lock = threading.Lock()
+        self.configure(rate, burst)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+
+    def configure(self, rate: float, burst: int = DEFAULT_BURST):
+        self.rate = max(0.0, float(rate or 0))
+        self.burst = max(1, int(burst or 1))
+
+    def acquire(self) -> float:
+        """Take one token, blocking as needed; returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.burst), self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._tokens -= 1.0
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket_for(provider: str, rate: Optional[float] = None, burst: Optional[int] = None) -> TokenBucket:
+    """Process-wide bucket for ``provider`` (re-tuned when rate/burst change)."""
+    rate = DEFAULT_RATE if rate is None else rate
+    burst = DEFAULT_BURST if burst is None else burst
+    key = (provider or 'default').lower()
+    with _buckets_lock:
+        b = _buckets.get(key)
+        if b is None:
+            b = _buckets[key] = TokenBucket(rate, burst)
+        elif b.rate != float(rate) or b.burst != int(burst):
+            b.configure(rate, burst)
+        return b
+
+
+def limits_from_config(cfg: Optional[Dict]) -> Dict[str, Any]:
+    """``max_workers``/``rate``/``burst`` from a messaging config, with env defaults."""
+    cfg = cfg or {}
+
+    def _num(key, default, cast):
+        try:
+            v = cfg.get(key)
+            return default if v in (None, '') else cast(v)
+        except (TypeError, ValueError):
+            return default
+
+    return {
+        'max_workers': _num('max_workers', DEFAULT_WORKERS, int),
+        'rate': _num('rate_limit_per_sec', DEFAULT_RATE, float),
+        'burst': _num('rate_limit_burst', DEFAULT_BURST, int),
+    }
+
+
+def dispatch(items: Sequence[Any], send: Callable[[Any], Dict], provider: str = 'default',
+             max_workers: Optional[int] = None, rate: Optional[float] = None, burst: Optional[int] = None,
+             on_progress: Optional[Callable[[int, int, Any, Dict], None]] = None) -> List[Dict]:
+    """Call ``send(item)`` for every item on a worker pool and return the
+    results in input order. Each call first takes a token from the provider's
+    bucket; exceptions become ``{'ok': False, 'error': ...}`` results."""
+    items = list(items)
+    total = len(items)
+    if not total:
+        return []
+    bucket = bucket_for(provider, rate, burst)
+
+    def _run(item):
+        bucket.acquire()
+        try:
+            return send(item)
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def _report(done, item, res):
+        if on_progress is None:
+            return
+        try:
+            on_progress(done, total, item, res)
+        except Exception:
+            pass
+
+    results: List[Optional[Dict]] = [None] * total
+    workers = max(1, min(int(max_workers or DEFAULT_WORKERS), total))
+    if workers == 1:
+        for i, item in enumerate(items):
+            results[i] = _run(item)
+            _report(i + 1, item, results[i])
+        return results
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'sms-{provider}') as pool:
+        futures = {pool.submit(_run, item): i for i, item in enumerate(items)}
+        for done, fut in enumerate(as_completed(futures), start=1):
+            i = futures[fut]
+            results[i] = fut.result()
+            _report(done, items[i], results[i])
+    return results
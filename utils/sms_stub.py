@@ -0,0 +1,281 @@
+"""Local stand-in for the SMS providers, for load tests and offline development.
+
+``StubSMSServer`` is a small threaded HTTP server that answers like the
+providers utils.messaging talks to:
+
+  - ``/africastalking`` (or ``/version1/messaging``): form or JSON body with
+    ``username``, a comma-separated ``to`` and ``message``; requires the
+    ``apiKey`` header; replies 201 with ``SMSMessageData.Recipients``.
+  - ``/infobip`` (or ``/sms/2/text/advanced``): JSON ``messages[].destinations``;
+    requires ``Authorization: App <key>``; replies 200 with ``bulkId`` and one
+    ``messages`` entry per destination.
+  - anything else is treated as Mobitech: ``to``/``message`` as form, JSON or
+    query string; replies 200 with a small JSON body.
+
+Behaviour is tunable per server: ``latency_ms`` (+ up to ``jitter_ms``) is
+slept before every reply, ``error_rate`` is the share of requests answered
+with a 5xx, and ``rate_limit`` (requests per second per provider, burst
+``burst``) answers excess requests with 429 and ``Retry-After``. Numbers ending
+in ``invalid_suffix`` are rejected per recipient like a real invalid number.
+``stats()`` reports per-provider request, recipient and status-code counts.
+
+``config_for(provider)`` returns a messaging config pointing at the server, so
+``messaging.send_bulk(..., config=server.config_for('infobip'), test_mode=False)``
+exercises the full HTTP path without credentials.
+"""
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+PROVIDER_PATHS = {
+    '/africastalking': 'africastalking',
+    '/version1/messaging': 'africastalking',
+    '/infobip': 'infobip',
+    '/sms/2/text/advanced': 'infobip',
+    '/mobitech': 'mobitech',
+}
+
+
+def provider_config(base_url: str, provider: str, **overrides) -> Dict:
+    """A messaging config for ``provider`` on a stub running at ``base_url``."""
+    provider = (provider or 'mobitech').lower()
+    cfg = {'provider': provider, 'api_url': f"{base_url.rstrip('/')}/{provider}", 'api_key': 'stub-key',
+           'username': 'sandbox', 'sender': 'EDUSCORE'}
+    if provider == 'mobitech':
+        cfg.update({'password': 'stub', 'content_type': 'application/json'})
+    cfg.update(overrides)
+    return cfg
+
+
+class _Limiter:
+    """Non-blocking token bucket: ``allow()`` is False when the bucket is empty."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.burst), self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+
+class StubSMSServer:
+    """Provider-shaped HTTP stub. Use as a context manager or call
+    ``start()``/``stop()``; ``port=0`` picks a free port."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 50.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, rate_limit: float = 0.0,
+                 burst: int = 10, invalid_suffix: Optional[str] = None, seed: Optional[int] = None):
+        self.latency_ms = float(latency_ms)
+        self.jitter_ms = float(jitter_ms)
+        self.error_rate = float(error_rate)
+        self.rate_limit = float(rate_limit)
+        self.burst = int(burst)
+        self.invalid_suffix = invalid_suffix or None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._limiters: Dict[str, _Limiter] = {}
+        self._stats: Dict[str, Dict] = {}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    # -- lifecycle -----------------------------------------------------------
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'StubSMSServer':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name='sms-stub', daemon=True)
+            self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -- helpers for callers -------------------------------------------------
+    def config_for(self, provider: str, **overrides) -> Dict:
+        """A messaging config that sends ``provider`` traffic to this server."""
+        return provider_config(self.url, provider, **overrides)
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {p: {'requests': s['requests'], 'recipients': s['recipients'], 'codes': dict(s['codes'])}
+                    for p, s in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    # -- request handling ----------------------------------------------------
+    def _record(self, provider: str, code: int, recipients: int):
+        with self._lock:
+            s = self._stats.setdefault(provider, {'requests': 0, 'recipients': 0, 'codes': {}})
+            s['requests'] += 1
+            s['recipients'] += recipients
+            s['codes'][code] = s['codes'].get(code, 0) + 1
+
+    def _limited(self, provider: str) -> bool:
+        if self.rate_limit <= 0:
+            return False
+        with self._lock:
+            limiter = self._limiters.get(provider)
+            if limiter is None:
+                limiter = self._limiters[provider] = _Limiter(self.rate_limit, self.burst)
+        return not limiter.allow()
+
+    def _delay(self):
+        with self._lock:
+            extra = self._random.uniform(0, self.jitter_ms) if self.jitter_ms > 0 else 0.0
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+        time.sleep(max(0.0, self.latency_ms + extra) / 1000.0)
+        return fail
+
+    def _invalid(self, number: str) -> bool:
+        return bool(self.invalid_suffix) and str(number).endswith(self.invalid_suffix)
+
+    def _africastalking(self, headers, body: Dict):
+        if not headers.get('apiKey'):
+            return 401, 'text/plain', b'The supplied authentication is invalid'
+        numbers = [n.strip() for n in str(body.get('to') or '').split(',') if n.strip()]
+        recipients = []
+        for n in numbers:
+            if self._invalid(n):
+                recipients.append({'statusCode': 403, 'number': n, 'status': 'InvalidPhoneNumber',
+                                   'cost': '0', 'messageId': 'None'})
+            else:
+                recipients.append({'statusCode': 101, 'number': n, 'status': 'Success',
+                                   'cost': 'KES 0.8000', 'messageId': f'ATXid_{uuid.uuid4().hex}'})
+        ok = sum(1 for r in recipients if r['statusCode'] == 101)
+        payload = {'SMSMessageData': {'Message': f'Sent to {ok}/{len(numbers)} Total Cost: KES {0.8 * ok:.4f}',
+                                      'Recipients': recipients}}
+        return 201, 'application/json', json.dumps(payload).encode('utf-8')
+
+    def _infobip(self, headers, body: Dict):
+        if not str(headers.get('Authorization') or '').startswith('App '):
+            return 401, 'application/json', json.dumps({'requestError': {'serviceException': {
+                'messageId': 'UNAUTHORIZED', 'text': 'Invalid login details'}}}).encode('utf-8')
+        out = []
+        for msg in body.get('messages') or []:
+            for dest in msg.get('destinations') or []:
+                to = str(dest.get('to') or '')
+                if self._invalid(to):
+                    status = {'groupId': 5, 'groupName': 'REJECTED', 'id': 51,
+                              'name': 'REJECTED_DESTINATION', 'description': 'Invalid destination address'}
+                else:
+                    status = {'groupId': 1, 'groupName': 'PENDING', 'id': 26,
+                              'name': 'PENDING_ACCEPTED', 'description': 'Message sent to next instance'}
+                out.append({'to': to, 'messageId': uuid.uuid4().hex, 'status': status})
+        payload = {'bulkId': uuid.uuid4().hex, 'messages': out}
+        return 200, 'application/json', json.dumps(payload).encode('utf-8')
+
+    def _mobitech(self, headers, body: Dict):
+        to = str(body.get('to') or '')
+        if self._invalid(to):
+            payload = {'status': 'failed', 'to': to, 'error': 'invalid number'}
+            return 400, 'application/json', json.dumps(payload).encode('utf-8')
+        payload = {'status': 'success', 'to': to, 'message_id': uuid.uuid4().hex}
+        return 200, 'application/json', json.dumps(payload).encode('utf-8')
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # keep-alive: reply in one segment so delayed ACKs do not stall the client
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def _body(self) -> Dict:
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                ctype = (self.headers.get('Content-Type') or '').lower()
+                if raw and 'json' in ctype:
+                    try:
+                        data = json.loads(raw.decode('utf-8'))
+                        return data if isinstance(data, dict) else {}
+                    except Exception:
+                        return {}
+                fields = parse_qs(raw.decode('utf-8')) if raw else parse_qs(parsed.query)
+                return {k: v[0] for k, v in fields.items()}
+
+            def _reply(self, code: int, ctype: str, data: bytes, extra: Optional[Dict] = None):
+                self.send_response(code)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(data)))
+                for k, v in (extra or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self):
+                path = urlparse(self.path).path.rstrip('/') or '/'
+                provider = PROVIDER_PATHS.get(path, 'mobitech')
+                body = self._body()
+                if provider == 'africastalking':
+                    recipients = len([n for n in str(body.get('to') or '').split(',') if n.strip()])
+                elif provider == 'infobip':
+                    recipients = sum(len(m.get('destinations') or []) for m in body.get('messages') or [])
+                else:
+                    recipients = 1
+                if server._limited(provider):
+                    server._record(provider, 429, recipients)
+                    self._reply(429, 'application/json', b'{"error": "rate limit exceeded"}', {'Retry-After': '1'})
+                    return
+                if server._delay():
+                    server._record(provider, 503, recipients)
+                    self._reply(503, 'application/json', b'{"error": "service temporarily unavailable"}')
+                    return
+                code, ctype, data = getattr(server, f'_{provider}')(self.headers, body)
+                server._record(provider, code, recipients)
+                self._reply(code, ctype, data)
+
+            do_POST = _handle
+            do_GET = _handle
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def percentiles(values: List[float], points=(50, 99)) -> Dict[int, float]:
+    """Nearest-rank percentiles of ``values`` (0.0 when empty)."""
+    data = sorted(values)
+    out = {}
+    for p in points:
+        if not data:
+            out[p] = 0.0
+            continue
+        k = max(0, min(len(data) - 1, math.ceil(p / 100.0 * len(data)) - 1))
+        out[p] = data[k]
+    return out
@@ -124,6 +124,35 @@ def get_photo_path(name: Optional[str]=None, adm_no: Optional[str]=None) -> Opti
     return get_photo_path_by_id(sid)
 
 
+def get_photo_bytes_by_id(student_id: str) -> Optional[bytes]:
+    """Photo bytes for a student id, looked up like get_photo_path_by_id but
+    without writing a temp file (for PDF generation)."""
+    m = _load_map()
+    path = (m.get(student_id) or {}).get('path')
+    candidates = [path] if path else []
+    candidates += [f'student_photos/{student_id}{ext}' for ext in ('.png', '.jpg', '.jpeg')]
+    for key in candidates:
+        try:
+            b = _storage.read_bytes(key)
+            if b:
+                return b
+        except Exception:
+            pass
+        for p in (key, os.path.join(PHOTOS_DIR, os.path.basename(key))):
+            try:
+                if os.path.exists(p):
+                    with open(p, 'rb') as f:
+                        return f.read()
+            except Exception:
+                pass
+    return None
+
+
+def get_photo_bytes(name: Optional[str]=None, adm_no: Optional[str]=None) -> Optional[bytes]:
+    sid = _normalize_id(name, adm_no)
+    return get_photo_bytes_by_id(sid)
+
+
 def delete_photo(name: Optional[str]=None, adm_no: Optional[str]=None) -> bool:
     sid = _normalize_id(name, adm_no)
     m = _load_map()